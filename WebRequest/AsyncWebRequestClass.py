@@ -0,0 +1,943 @@
+#!/usr/bin/python3
+
+# asyncio counterpart to WebGetRobust.
+#
+# The actual HTTP transport is a small HTTP/1.1 client on top of asyncio streams.
+# Everything else (header generation, cookies, auth, decompression, charset
+# decoding, WAF detection) is shared with the blocking implementation, by running
+# the requests through the same opener processors and content pipeline.
+#
+# Anything that's inherently blocking (chromium, WAF step-throughs) is pushed out
+# to an executor, so it never stalls the event loop.
+
+import io
+import ssl
+import time
+import copy
+import json
+import heapq
+import itertools
+import asyncio
+import collections
+import http.client
+import urllib.parse
+import urllib.error
+import urllib.request
+
+from . import Handlers
+from . import iri2uri
+from . import Exceptions
+from . import utility
+from . import RetryPolicy
+from . import DomainRoutes
+from . import FetchTiming
+from . import Tracing
+from . import WebRequestClass
+
+
+MAX_REDIRECTIONS = 10
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+
+class AsyncResponse(object):
+	'''
+	Response handle returned by the async client when `returnMultiple` is set.
+
+	This exposes the subset of the urllib response interface that the rest of
+	WebRequest (and the cookie jar) actually uses.
+	'''
+	def __init__(self, url:str, status:int, reason:str, headers:http.client.HTTPMessage):
+		self.url     = url
+		self.status  = status
+		self.code    = status
+		self.reason  = reason
+		self.msg     = reason
+		self.headers = headers
+
+	def info(self):
+		return self.headers
+
+	def geturl(self):
+		return self.url
+
+	def getcode(self):
+		return self.status
+
+	def __repr__(self):
+		return "<AsyncResponse %s for url %s>" % (self.status, self.url)
+
+
+class _StaleConnection(Exception):
+	pass
+
+
+class AsyncWebGetRobust(WebRequestClass.WebGetRobust):
+	'''
+	asyncio version of WebGetRobust.
+
+	The fetch calls (`getpage()`, `getSoup()`, `getJson()`, `getFileNameMimeUrl()`
+	and friends) take the same arguments as their WebGetRobust equivalents, but are
+	coroutines.
+
+	The chromium interfaces are also exposed as coroutines, and are run in `executor`
+	(the default loop executor, if not specified), as are WAF step-throughs.
+
+	The cookie jar, headers and WAF configuration are shared with the blocking
+	interface, so a instance can be used from both sync and async code.
+	'''
+
+	def __init__(self, *args, executor=None, max_idle_per_host:int=4, **kwargs):
+		super().__init__(*args, **kwargs)
+
+		self.executor          = executor
+		self.max_idle_per_host = max_idle_per_host
+
+		self._ssl_context = ssl.create_default_context()
+		self._async_idle  = collections.defaultdict(list)
+
+	######################################################################################################################################################
+	# Executor handoff
+	######################################################################################################################################################
+
+	async def _run_in_executor(self, func, *args, **kwargs):
+		# Run in a copy of the task's context, so anything traced in the executor is a child of the task's span.
+		loop = asyncio.get_event_loop()
+		return await loop.run_in_executor(self.executor, Tracing.context_call(func, *args, **kwargs))
+
+	async def _unwaf_func_async(self, funcname:str, requestedUrl:str, *args, **kwargs):
+		'''
+		Call coroutine `funcname`, handling a WAF exception automatically if it occurs.
+		The step-through itself is done in the executor.
+		'''
+		target_func = getattr(self, funcname)
+		deadline = kwargs.get("deadline")
+		timing   = kwargs.get("timing") or FetchTiming.FetchTiming(requestedUrl)
+
+		try:
+			return await target_func(requestedUrl, *args, **kwargs)
+
+		except Exceptions.CloudFlareWrapper:
+			if self.rules['auto_waf']:
+				self.log.warning("Cloudflare failure! Doing automatic step-through.")
+				if deadline is not None:
+					deadline.check(requestedUrl)
+				with timing.phase('waf_step'), self.tracer.span("waf_step_through", url=requestedUrl, waf="cloudflare") as span:
+					stepped = await self._run_in_executor(self.stepThroughCloudFlareWaf, requestedUrl)
+					span.set_attribute("stepped", bool(stepped))
+				if not stepped:
+					self._recordCircuit(requestedUrl, False)
+					raise Exceptions.FetchFailureError("Could not step through cloudflare!", requestedUrl)
+				if deadline is not None:
+					deadline.check(requestedUrl)
+				# Cloudflare cookie set, retrieve again
+				return await target_func(requestedUrl, *args, **kwargs)
+
+			else:
+				self.log.info("Cloudflare without step-through setting!")
+				raise
+
+		except Exceptions.SucuriWrapper:
+			if self.rules['auto_waf']:
+				self.log.warning("Sucuri failure! Doing automatic step-through.")
+				if deadline is not None:
+					deadline.check(requestedUrl)
+				with timing.phase('waf_step'), self.tracer.span("waf_step_through", url=requestedUrl, waf="sucuri") as span:
+					stepped = await self._run_in_executor(self.stepThroughSucuriWaf, requestedUrl)
+					span.set_attribute("stepped", bool(stepped))
+				if not stepped:
+					self._recordCircuit(requestedUrl, False)
+					raise Exceptions.FetchFailureError("Could not step through Sucuri WAF bullshit!", requestedUrl)
+				if deadline is not None:
+					deadline.check(requestedUrl)
+				return await target_func(requestedUrl, *args, **kwargs)
+			else:
+				self.log.info("Sucuri without step-through setting!")
+				raise
+
+	async def getItemChromium(self, *args, **kwargs):
+		return await self._run_in_executor(super().getItemChromium, *args, **kwargs)
+
+	async def getHeadTitleChromium(self, *args, **kwargs):
+		return await self._run_in_executor(super().getHeadTitleChromium, *args, **kwargs)
+
+	async def getHeadChromium(self, *args, **kwargs):
+		return await self._run_in_executor(super().getHeadChromium, *args, **kwargs)
+
+	async def chromiumGetRenderedItem(self, *args, **kwargs):
+		return await self._run_in_executor(super().chromiumGetRenderedItem, *args, **kwargs)
+
+	######################################################################################################################################################
+	# Public fetch interface
+	######################################################################################################################################################
+
+	async def getpage(self, requestedUrl:str, *args, **kwargs):
+		'''
+		Get page at `requestedUrl`, while automatically handling a WAF,
+		if one is encountered
+		'''
+		returnTiming = kwargs.pop("returnTiming", False)
+		with self._fetchTiming(requestedUrl, "getpage") as timing:
+			content = await self._getpageTimed(requestedUrl, timing, args, kwargs)
+			return self._withTiming(content, timing, returnTiming)
+
+	async def _getpageTimed(self, requestedUrl:str, timing:FetchTiming.FetchTiming, args:tuple, kwargs:dict):
+		kwargs = dict(kwargs)
+
+		memoKey = self._memoKey("page", requestedUrl, args, kwargs)
+		if memoKey is not None:
+			found, content = self.response_memo.get(memoKey)
+			if found:
+				timing.transport = FetchTiming.TRANSPORT_MEMO
+				return content
+
+		if self._routedTransport(requestedUrl, args, kwargs) == DomainRoutes.TRANSPORT_CHROMIUM:
+			timing.transport = FetchTiming.TRANSPORT_CHROMIUM
+			with timing.phase('download'):
+				content, _, _ = await self.getItemChromium(requestedUrl)
+		else:
+			self._deadlineFor(requestedUrl, kwargs)
+			kwargs["timing"] = timing
+			content = await self._unwaf_func_async("_getpage_async", requestedUrl, *args, **kwargs)
+
+		if memoKey is not None:
+			self.response_memo.put(memoKey, content, len(content))
+		return content
+
+	async def getSoup(self, requestedUrl:str, *args, **kwargs):
+		if 'returnMultiple' in kwargs and kwargs['returnMultiple']:
+			raise Exceptions.ArgumentError("getSoup cannot be called with 'returnMultiple' being true", requestedUrl)
+
+		if 'soup' in kwargs and kwargs['soup']:
+			raise Exceptions.ArgumentError("getSoup contradicts the 'soup' directive!", requestedUrl)
+
+		returnTiming = kwargs.pop("returnTiming", False)
+		with self._fetchTiming(requestedUrl, "getSoup") as timing:
+			memoKey = self._memoKey("soup", requestedUrl, args, kwargs)
+			if memoKey is not None:
+				found, soup = self.response_memo.get(memoKey)
+				if found:
+					timing.transport = FetchTiming.TRANSPORT_MEMO
+					return self._withTiming(soup, timing, returnTiming)
+
+			page = await self._getpageTimed(requestedUrl, timing, args, kwargs)
+			if isinstance(page, bytes):
+				raise Exceptions.ContentTypeError("Received content not decoded! Cannot parse!", requestedUrl)
+
+			with timing.phase('parse'):
+				soup = utility.as_soup(page)
+
+			if memoKey is not None:
+				self.response_memo.put(memoKey, soup, len(page))
+			return self._withTiming(soup, timing, returnTiming)
+
+	async def getJson(self, requestedUrl:str, *args, **kwargs):
+		if 'returnMultiple' in kwargs and kwargs['returnMultiple']:
+			raise Exceptions.ArgumentError("getJson cannot be called with 'returnMultiple' being true", requestedUrl)
+
+		returnTiming = kwargs.pop("returnTiming", False)
+		with self._fetchTiming(requestedUrl, "getJson") as timing:
+			memoKey = self._memoKey("json", requestedUrl, args, kwargs)
+			if memoKey is not None:
+				found, ret = self.response_memo.get(memoKey)
+				if found:
+					timing.transport = FetchTiming.TRANSPORT_MEMO
+					return self._withTiming(ret, timing, returnTiming)
+
+			attempts = 0
+			while 1:
+				try:
+					page = await self._getpageTimed(requestedUrl, timing, args, kwargs)
+					with timing.phase('parse'):
+						if isinstance(page, bytes):
+							page = page.decode(utility.determine_json_encoding(page))
+
+						page = page.strip()
+						ret = json.loads(page)
+
+					if memoKey is not None:
+						self.response_memo.put(memoKey, ret, len(page))
+					return self._withTiming(ret, timing, returnTiming)
+				except ValueError:
+					pageKey = self._memoKey("page", requestedUrl, args, kwargs)
+					if pageKey is not None:
+						self.response_memo.discard(pageKey)
+
+					if attempts < 1:
+						attempts += 1
+						self.log.error("JSON Parsing issue retrieving content from page! Retrying!")
+
+						self._scrambleUserAgent()
+
+						await asyncio.sleep(self.retryDelay)
+					else:
+						self.log.error("JSON Parsing issue, and retries exhausted!")
+						raise
+
+	async def getpages(self, urls, concurrency:int=8, **kwargs):
+		'''
+		Async generator version of `WebGetRobust.getpages()`.
+
+		Yields (url, result_or_exception) 2-tuples in completion order, with at most
+		`concurrency` fetches in flight at any time. `urls` can be any iterable, and
+		is consumed lazily. Retries are parked until they're due, the same as with
+		`WebGetRobust.getpages()`.
+		'''
+		if 'returnMultiple' in kwargs and kwargs['returnMultiple']:
+			raise Exceptions.ArgumentError("getpages cannot be called with 'returnMultiple' being true", None)
+
+		kwargs = dict(kwargs)
+		maxAttempts = self.retry_policy.attempts(kwargs.pop('retryQuantity', None), self.errorOutCount)
+		kwargs['retryQuantity'] = 1
+
+		urls = iter(urls)
+		pending = {}
+
+		delayed = []
+		seq = itertools.count()
+
+		try:
+			while True:
+				while delayed and delayed[0][0] <= time.monotonic() and len(pending) < concurrency:
+					_, _, url, attempt, started = heapq.heappop(delayed)
+					pending[asyncio.ensure_future(self._getpage_isolated(url, kwargs))] = (url, attempt, started)
+
+				while len(pending) < concurrency:
+					url = next(urls, None)
+					if url is None:
+						break
+					pending[asyncio.ensure_future(self._getpage_isolated(url, kwargs))] = (url, 1, time.monotonic())
+
+				if not pending:
+					if not delayed:
+						return
+					await asyncio.sleep(max(0, delayed[0][0] - time.monotonic()))
+					continue
+
+				timeout = max(0, delayed[0][0] - time.monotonic()) if delayed else None
+				done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+				for fut in done:
+					url, attempt, started = pending.pop(fut)
+					try:
+						result = fut.result()
+					except Exception as e:
+						delay = self._bulkRetryDelay(url, e, attempt, maxAttempts, started)
+						if delay is None:
+							yield url, e
+						else:
+							heapq.heappush(delayed, (time.monotonic() + delay, next(seq), url, attempt + 1, started))
+						continue
+
+					yield url, result
+		finally:
+			for fut in pending:
+				fut.cancel()
+
+	async def _getpage_isolated(self, url:str, kwargs:dict):
+		kwargs = copy.copy(kwargs)
+		if kwargs.get("addlHeaders"):
+			kwargs["addlHeaders"] = dict(kwargs["addlHeaders"])
+		return await self.getpage(url, **kwargs)
+
+	async def getSoupNoRedirects(self, requestedUrl:str, *args, **kwargs):
+		if 'returnMultiple' in kwargs:
+			raise Exceptions.ArgumentError("getSoup cannot be called with 'returnMultiple'", requestedUrl)
+
+		if 'soup' in kwargs and kwargs['soup']:
+			raise Exceptions.ArgumentError("getSoup contradicts the 'soup' directive!", requestedUrl)
+
+		kwargs['returnMultiple'] = True
+
+		page, handle = await self.getpage(requestedUrl, *args, **kwargs)
+
+		redirurl = handle.geturl()
+		if redirurl != requestedUrl:
+			self.log.error("Requested %s, redirected to %s. Raising error", requestedUrl, redirurl)
+
+			raise Exceptions.RedirectedError("Requested %s, redirected to %s" % (requestedUrl, redirurl), requestedUrl)
+
+		return utility.as_soup(page)
+
+	async def getFileAndName(self, *args, **kwargs):
+		pgctnt, hName, _, _ = await self.getFileNameMimeUrl(*args, **kwargs)
+		return pgctnt, hName
+
+	async def getFileNameMime(self, *args, **kwargs):
+		pgctnt, hName, mime, _ = await self.getFileNameMimeUrl(*args, **kwargs)
+		return pgctnt, hName, mime
+
+	async def getFileNameMimeUrl(self, requestedUrl:str, *args, **kwargs):
+		'''
+		Async version of `WebGetRobust.getFileNameMimeUrl()`. Returns a 4-tuple of
+		(pgctnt, hName, mime, resolved_url).
+		'''
+
+		if 'returnMultiple' in kwargs:
+			raise Exceptions.ArgumentError("getFileAndName cannot be called with 'returnMultiple'", requestedUrl)
+
+		if 'soup' in kwargs and kwargs['soup']:
+			raise Exceptions.ArgumentError("getFileAndName contradicts the 'soup' directive!", requestedUrl)
+
+		kwargs["returnMultiple"] = True
+
+		pgctnt, pghandle = await self.getpage(requestedUrl, *args, **kwargs)
+
+		hName, mime, requestedUrl = self._getFileNameMime(pghandle, requestedUrl)
+
+		return pgctnt, hName, mime, requestedUrl
+
+	async def getItem(self, itemUrl:str):
+		content, handle = await self.getpage(itemUrl, returnMultiple=True)
+
+		if not content or not handle:
+			raise urllib.error.URLError("Failed to retreive file from page '%s'!" % itemUrl)
+
+		fileN, mType = self._getItemFileNameMime(handle)
+		self.log.info("Retreived file of type '%s', name of '%s' with a size of %0.3f K", mType, fileN, len(content)/1000.0)
+		return content, fileN, mType
+
+	async def close(self):
+		'''
+		Close any idle keep-alive connections.
+		'''
+		idle, self._async_idle = self._async_idle, collections.defaultdict(list)
+		loop = asyncio.get_event_loop()
+		for conns in idle.values():
+			for _, writer, _, conn_loop in conns:
+				if conn_loop is loop:
+					writer.close()
+
+	######################################################################################################################################################
+	# Fetch machinery
+	######################################################################################################################################################
+
+	async def _getpage_async(self, requestedUrl:str, **kwargs):
+		self._pre_check(requestedUrl)
+
+		if self._verbose_log:
+			self.log.info("Fetching content at URL: %s", requestedUrl)
+
+		# strip trailing and leading spaces.
+		requestedUrl = requestedUrl.strip()
+
+		if 'soup' in kwargs and kwargs['soup']:
+			self.log.warning("'soup' kwarg is depreciated. Please use the `getSoup()` call instead.")
+			kwargs.pop('soup')
+			return await self.getSoup(requestedUrl, **kwargs)
+
+		addlHeaders    = kwargs.setdefault("addlHeaders",     None)
+		returnMultiple = kwargs.setdefault("returnMultiple",  False)
+		callBack       = kwargs.setdefault("callBack",        None)
+		postData       = kwargs.setdefault("postData",        None)
+		retryQuantity  = kwargs.setdefault("retryQuantity",   None)
+		nativeError    = kwargs.setdefault("nativeError",     False)
+		binaryForm     = kwargs.setdefault("binaryForm",      False)
+		hedge          = kwargs.setdefault("hedge",           False)
+
+		maxContent      = kwargs.setdefault("max_content_bytes",      self.max_content_bytes)
+		maxDecompressed = kwargs.setdefault("max_decompressed_bytes", self.max_decompressed_bytes)
+
+		deadline = self._deadlineFor(requestedUrl, kwargs)
+		timing   = kwargs.setdefault("timing", None) or FetchTiming.FetchTiming(requestedUrl)
+
+		if addlHeaders and 'Referer' in addlHeaders:
+			addlHeaders['Referer'] = iri2uri.iri2uri(addlHeaders['Referer'])
+
+		retryCount  = 0
+		err_content = None
+		err_reason  = None
+		err_code    = None
+		lastErr     = None
+
+		maxAttempts = self.retry_policy.attempts(retryQuantity, self.errorOutCount)
+		startTime   = time.monotonic()
+		needBackoff = False
+
+		while 1:
+			retryCount += 1
+
+			delay = 0
+			if needBackoff and not self.retry_policy.exhausted(retryCount, maxAttempts, startTime):
+				delay = self.retry_policy.next_delay(retryCount - 1, maxAttempts, startTime, self.retryDelay)
+
+			if deadline is not None:
+				deadline.check(requestedUrl)
+				if delay and delay >= deadline.remaining():
+					raise deadline.error(requestedUrl, "Fetch deadline would pass before the next retry")
+
+			if self.retry_policy.exhausted(retryCount, maxAttempts, startTime) or delay is None:
+				self.log.error("Failed to retrieve Website : %s. All Attempts Exhausted", requestedUrl)
+				break
+
+			if delay:
+				if self._verbose_log:
+					self.log.info("Waiting %0.2f seconds before retrying", delay)
+				await asyncio.sleep(delay)
+			needBackoff = False
+
+			pgreq = self._buildRequest(requestedUrl, postData, addlHeaders, binaryForm)
+
+			if self.http_cache is not None and self.http_cache.is_fresh(pgreq, self._cacheDefaultHeaders()):
+				slot_netloc = None
+			else:
+				if self.circuit_breaker is not None:
+					self.circuit_breaker.check(requestedUrl)
+				slot_netloc = await self._withDeadline(self.host_scheduler.acquire_async(requestedUrl), deadline, requestedUrl)
+
+			hostHealthy = None
+			timing.attempts += 1
+			timing.sent_bytes += FetchTiming.request_body_size(pgreq)
+			attemptSpan = self.tracer.start_span("request", url=requestedUrl, attempt=retryCount)
+			try:
+				if hedge and postData is None and slot_netloc is not None:
+					fetch = self._hedgedFetch(pgreq, lambda: self._buildRequest(requestedUrl, postData, addlHeaders, binaryForm), callBack, maxContent, timing)
+				else:
+					fetch = self._fetch(pgreq, callBack, onHeaders=self._latencyObserver(requestedUrl), maxContent=maxContent, timing=timing)
+				raw, pghandle = await self._withDeadline(fetch, deadline, requestedUrl)
+
+			except Exceptions.GarbageSiteWrapper as err:
+				attemptSpan.record_error(err)
+				raise
+
+			except Exceptions.FetchTimeoutError as err:
+				attemptSpan.record_error(err)
+				hostHealthy = False
+				raise
+
+			except Exceptions.ContentTooLargeError as err:
+				# Retrying isn't going to make it any smaller.
+				attemptSpan.record_error(err)
+				raise
+
+			except urllib.error.HTTPError as err:
+				if self._verbose_log:
+					self.log.warning("Error opening page: %s On Attempt %s. Error Code: %s", requestedUrl, retryCount, err)
+
+				if err.fp:
+					err_content = err.fp.read()
+					encoded = err.hdrs.get('Content-Encoding', None)
+					if encoded:
+						_, err_content = self._decompressContent(encoded, err_content, requestedUrl)
+
+				err_reason = err.reason
+				err_code   = err.code
+				lastErr    = err
+				timing.status = err.code
+				attemptSpan.set_attribute("status", err.code)
+				attemptSpan.record_error(err)
+
+				if err.code in (403, 429, 502, 503) and err_content:
+					self._check_waf(err_content, requestedUrl, err.hdrs.get("Content-Type"))
+
+				hostHealthy = err.code < 500
+
+				rule = self.retry_policy.action(err.code)
+				if rule == RetryPolicy.FAIL:
+					self.log.critical("Unrecoverable - %s response. Breaking", err.code)
+					break
+
+				if rule == RetryPolicy.THROTTLE:
+					self.host_scheduler.throttle(requestedUrl, err.hdrs.get('Retry-After', None))
+					continue
+
+				needBackoff = True
+				continue
+
+			except UnicodeEncodeError as err:
+				self.log.critical("Unrecoverable Unicode issue retrieving page - %s", requestedUrl)
+				err_reason  = "Unicode Decode Error"
+				err_code    = -1
+				err_content = repr(err)
+				lastErr     = err
+				attemptSpan.record_error(err)
+				break
+
+			except Exception as err:
+				if self._verbose_log:
+					self.log.warning("Error Retrieving Page %s! - %r - Trying again", requestedUrl, err)
+
+				err_reason  = "Unhandled general exception"
+				err_code    = -1
+				err_content = repr(err)
+				lastErr     = err
+				attemptSpan.record_error(err)
+
+				needBackoff = True
+				hostHealthy = False
+				continue
+
+			else:
+				hostHealthy = True
+				attemptSpan.set_attribute("status", pghandle.status)
+
+			finally:
+				self.tracer.end_span(attemptSpan)
+				if slot_netloc is not None:
+					self.host_scheduler.release(slot_netloc)
+					self._recordCircuit(requestedUrl, hostHealthy)
+
+			self.host_scheduler.success(requestedUrl)
+			if self._verbose_log:
+				self.log.info("URL fully retrieved.")
+			timing.status = pghandle.status
+			pgctnt = self._processContent(raw, pghandle.headers, pghandle.geturl(), maxDecompressed, timing=timing)
+
+			if returnMultiple:
+				return pgctnt, pghandle
+			return pgctnt
+
+		if lastErr and nativeError:
+			raise lastErr
+		raise Exceptions.FetchFailureError("Failed to retreive page", requestedUrl,
+			err_content=err_content, err_code=err_code, err_reason=err_reason)
+
+	async def _withDeadline(self, coro, deadline, url:str):
+		'''
+		Await `coro`, cancelling it and raising `FetchTimeoutError` if `deadline` passes first.
+		Redirects are followed inside `_fetch()`, so they're covered too.
+		'''
+		if deadline is None:
+			return await coro
+		try:
+			return await asyncio.wait_for(coro, deadline.clamp())
+		except asyncio.TimeoutError:
+			# Could just be a read timeout that happened to come in right at the end.
+			if deadline.expired():
+				raise deadline.error(url)
+			raise
+
+	def _latencyObserver(self, url:str, headersEvent:asyncio.Event=None):
+		'''
+		Returns a `onHeaders` callback for `_fetch()` that records the time to the first
+		response headers, and optionally sets `headersEvent`.
+		'''
+		start = time.monotonic()
+		observed = []
+
+		def onHeaders():
+			if not observed:
+				observed.append(True)
+				self.hedge_policy.observe(url, time.monotonic() - start)
+			if headersEvent is not None:
+				headersEvent.set()
+
+		return onHeaders
+
+	async def _hedgedFetch(self, pgreq, makeRequest, callBack=None, maxContent:int=None, timing:FetchTiming.FetchTiming=None):
+		'''
+		Equivalent of `WebGetRobust._hedgedOpen()`. Whichever request succeeds first
+		is used, and the other is cancelled.
+		'''
+		url = pgreq.get_full_url()
+		delay = self.hedge_policy.hedge_delay(url)
+		if delay is None:
+			return await self._fetch(pgreq, callBack, onHeaders=self._latencyObserver(url), maxContent=maxContent, timing=timing)
+
+		# As with `_hedgedOpen()`, only the primary request is timed.
+		gotHeaders = asyncio.Event()
+		primary = asyncio.ensure_future(self._fetch(pgreq, callBack, onHeaders=self._latencyObserver(url, gotHeaders), maxContent=maxContent, timing=timing))
+		hedge = None
+		try:
+			headersWait = asyncio.ensure_future(gotHeaders.wait())
+			try:
+				await asyncio.wait({primary, headersWait}, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+			finally:
+				headersWait.cancel()
+				await asyncio.wait({headersWait})
+
+			if gotHeaders.is_set() or primary.done() or not self.hedge_policy.try_hedge():
+				return await primary
+
+			self.log.info("No response from %s after %0.2f seconds. Hedging.", url, delay)
+			hedge = asyncio.ensure_future(self._fetch(makeRequest(), callBack, onHeaders=self._latencyObserver(url), maxContent=maxContent))
+
+			pending = {primary, hedge}
+			while pending:
+				done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+				winners = [fut for fut in (primary, hedge) if fut in done and fut.exception() is None]
+				if winners:
+					if winners[0] is hedge:
+						self.hedge_policy.hedge_won()
+					return winners[0].result()
+
+			# Both failed.
+			return primary.result()
+
+		finally:
+			abandoned = [fut for fut in (primary, hedge) if fut is not None and not fut.done()]
+			for fut in abandoned:
+				fut.cancel()
+			# Let the cancellations go through, so the connections get closed.
+			if abandoned:
+				await asyncio.wait(abandoned)
+
+	def _prepare_request(self, req:urllib.request.Request):
+		'''
+		Run the request through the opener's request pre-processors.
+		This is where the cookies, default headers, auth and Host get added.
+		'''
+		meth_name = req.type + "_request"
+		for processor in self.opener.process_request.get(req.type, []):
+			req = getattr(processor, meth_name)(req)
+		return req
+
+	async def _fetch(self, req:urllib.request.Request, callBack=None, onHeaders=None, maxContent:int=None, timing:FetchTiming.FetchTiming=None):
+		'''
+		Execute `req`, following redirects. Returns a 2-tuple of (raw_body, AsyncResponse).
+		Non-2xx responses are raised as `urllib.error.HTTPError`, the same as they are
+		with the urllib opener. `onHeaders()` is called whenever response headers
+		are received. Bodies larger then `maxContent` raise `ContentTooLargeError`.
+		Connection setup and transfer times are added to `timing`, if passed.
+		'''
+		if timing is None:
+			timing = FetchTiming.FetchTiming(req.get_full_url())
+
+		visited = {}
+
+		while True:
+			if req.type not in ("http", "https"):
+				raise urllib.error.URLError("unknown url type: %s" % req.type)
+
+			req = self._prepare_request(req)
+
+			# The cache handler's request processor has already looked up the entry.
+			entry = getattr(req, "_http_cache_entry", None)
+			if entry is not None and req._http_cache_fresh:
+				timing.transport = FetchTiming.TRANSPORT_CACHE
+				body, headers = self.http_cache.serve(entry)
+				return body, AsyncResponse(entry.url, 200, "OK", headers)
+
+			timing.transport = FetchTiming.TRANSPORT_ASYNC
+			status, reason, headers, body = await self._roundtrip(req, callBack, onHeaders, maxContent, timing)
+			resp = AsyncResponse(req.get_full_url(), status, reason, headers)
+
+			self.cj.extract_cookies(resp, req)
+
+			if status == 304 and entry is not None:
+				body, headers = self.http_cache.revalidate(entry, headers)
+				return body, AsyncResponse(entry.url, 200, "OK", headers)
+
+			if status in REDIRECT_CODES:
+				newurl = Handlers.get_redirect_url(req, None, status, reason, headers)
+				if newurl is not None:
+					visited[newurl] = visited.get(newurl, 0) + 1
+					if visited[newurl] > Handlers.HTTPRedirectHandler.max_repeats or len(visited) > MAX_REDIRECTIONS:
+						raise urllib.error.HTTPError(req.full_url, status,
+								Handlers.HTTPRedirectHandler.inf_msg + reason, headers, io.BytesIO(body))
+
+					req = Handlers.HTTPRedirectHandler().redirect_request(req, None, status, reason, headers, newurl)
+					continue
+
+			if not (200 <= status < 300):
+				raise urllib.error.HTTPError(req.full_url, status, reason, headers, io.BytesIO(body))
+
+			if self.http_cache is not None:
+				self.http_cache.store(req, status, headers, body, self._cacheDefaultHeaders())
+
+			return body, resp
+
+	def _conn_key(self, req):
+		parts = urllib.parse.urlsplit("//" + req.host)
+		port = parts.port
+		if port is None:
+			port = 443 if req.type == "https" else 80
+		return (req.type, parts.hostname, port)
+
+	async def _get_connection(self, key, timing:FetchTiming.FetchTiming=None):
+		'''
+		Returns a 3-tuple of (reader, writer, reused). The time taken to set up a new
+		connection is added to `timing`. `asyncio.open_connection()` does the TLS handshake
+		itself, so for https the handshake is part of `connect`.
+		'''
+		if timing is None:
+			timing = FetchTiming.FetchTiming(None)
+
+		idle = self._async_idle[key]
+		loop = asyncio.get_event_loop()
+		now = time.time()
+		while idle:
+			reader, writer, last_used, conn_loop = idle.pop()
+			# Streams are bound to the loop they were opened on, so connections
+			# left over from some other (possibly closed) loop are just dropped.
+			if conn_loop is not loop:
+				continue
+			if now - last_used > 30 or writer.transport.is_closing():
+				writer.close()
+				continue
+			return reader, writer, True
+
+		connectTimeout, _ = self._requestTimeouts()
+
+		scheme, host, port = key
+		ssl_args = {'ssl' : self._ssl_context, 'server_hostname' : host} if scheme == "https" else {}
+
+		if self.dns_cache is None:
+			with timing.phase('connect'):
+				reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port, **ssl_args), connectTimeout)
+			return reader, writer, False
+
+		with timing.phase('dns'):
+			addresses = await self.dns_cache.resolve_async(host, port)
+
+		err = None
+		for family, _, _, _, sockaddr in addresses:
+			try:
+				with timing.phase('connect'):
+					conn = asyncio.open_connection(sockaddr[0], sockaddr[1], family=family, **ssl_args)
+					reader, writer = await asyncio.wait_for(conn, connectTimeout)
+				return reader, writer, False
+			except OSError as e:
+				err = e
+
+		self.dns_cache.invalidate(host, port)
+		raise err if err is not None else OSError("getaddrinfo returns an empty list")
+
+	def _release_connection(self, key, reader, writer):
+		idle = self._async_idle[key]
+		if len(idle) < self.max_idle_per_host:
+			idle.append((reader, writer, time.time(), asyncio.get_event_loop()))
+		else:
+			writer.close()
+
+	async def _roundtrip(self, req:urllib.request.Request, callBack=None, onHeaders=None, maxContent:int=None, timing:FetchTiming.FetchTiming=None):
+		key = self._conn_key(req)
+		if timing is None:
+			timing = FetchTiming.FetchTiming(req.get_full_url())
+
+		headers = dict(req.unredirected_hdrs)
+		headers.update({k: v for k, v in req.headers.items() if k not in headers})
+		headers["Connection"] = "keep-alive"
+		headers = {name.title(): val for name, val in headers.items()}
+
+		method = req.get_method()
+		lines = ["%s %s HTTP/1.1" % (method, req.selector or "/")]
+		lines.extend("%s: %s" % (name, val) for name, val in headers.items())
+		request_head = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+		data = req.data
+		if isinstance(data, str):
+			data = data.encode("iso-8859-1")
+
+		_, readTimeout = self._requestTimeouts()
+
+		while True:
+			reader, writer, reused = await self._get_connection(key, timing)
+			try:
+				with timing.phase('ttfb'):
+					writer.write(request_head)
+					if data:
+						writer.write(data)
+					await asyncio.wait_for(writer.drain(), readTimeout)
+
+					status, reason, version, resp_headers = await self._read_head(reader)
+				if onHeaders:
+					onHeaders()
+				with timing.phase('download'):
+					body, read_to_eof = await self._read_body(reader, method, status, resp_headers, callBack,
+							maxContent=maxContent, url=req.get_full_url())
+
+			except (_StaleConnection, ConnectionResetError, BrokenPipeError):
+				writer.close()
+				if reused:
+					continue
+				raise http.client.RemoteDisconnected("Remote end closed connection without response")
+
+			except BaseException:
+				writer.close()
+				raise
+
+			break
+
+		conn_hdr = resp_headers.get("Connection", "").lower()
+		will_close = read_to_eof or "close" in conn_hdr or (version == "HTTP/1.0" and "keep-alive" not in conn_hdr)
+		if will_close:
+			writer.close()
+		else:
+			self._release_connection(key, reader, writer)
+
+		return status, reason, resp_headers, body
+
+	async def _read_head(self, reader):
+		_, readTimeout = self._requestTimeouts()
+		while True:
+			status_line = await asyncio.wait_for(reader.readline(), readTimeout)
+			if not status_line:
+				raise _StaleConnection()
+
+			try:
+				version, status, reason = (status_line.decode("iso-8859-1").strip().split(None, 2) + [""])[:3]
+				status = int(status)
+			except ValueError:
+				raise http.client.BadStatusLine(repr(status_line))
+
+			header_lines = []
+			while True:
+				line = await asyncio.wait_for(reader.readline(), readTimeout)
+				if line in (b"\r\n", b"\n", b""):
+					break
+				header_lines.append(line)
+
+			# Skip interim responses (100-continue, etc...)
+			if 100 <= status < 200:
+				continue
+
+			resp_headers = http.client.parse_headers(io.BytesIO(b"".join(header_lines) + b"\r\n"))
+			return status, reason, version, resp_headers
+
+	async def _read_body(self, reader, method:str, status:int, headers, callBack, chunkSize:int=2 ** 17, maxContent:int=None, url:str=None):
+		'''
+		Returns a 2-tuple of (body, read_to_eof). If the body was delimited by the
+		connection closing, the connection obviously can't be reused.
+
+		If `maxContent` is set, `ContentTooLargeError` is raised as soon as we know the
+		body is larger then that, before reading the rest of it.
+		'''
+		if method == "HEAD" or status in (204, 304):
+			return b"", False
+
+		_, readTimeout = self._requestTimeouts()
+		content = bytearray()
+
+		def checkSize(size):
+			if maxContent is not None and size > maxContent:
+				raise Exceptions.ContentTooLargeError("Content exceeded size limit", url,
+					limit=maxContent, size=size, headers=headers)
+
+		if "chunked" in headers.get("Transfer-Encoding", "").lower():
+			while True:
+				line = await asyncio.wait_for(reader.readline(), readTimeout)
+				size = int(line.split(b";", 1)[0].strip(), 16)
+				if size == 0:
+					# Discard any trailers
+					while line not in (b"\r\n", b"\n", b""):
+						line = await asyncio.wait_for(reader.readline(), readTimeout)
+					break
+
+				checkSize(len(content) + size)
+				content += await asyncio.wait_for(reader.readexactly(size), readTimeout)
+				await asyncio.wait_for(reader.readexactly(2), readTimeout)
+				if callBack:
+					callBack(len(content), chunkSize, None)
+
+			return bytes(content), False
+
+		length = headers.get("Content-Length")
+		if length is not None:
+			length = int(length)
+			checkSize(length)
+			while len(content) < length:
+				content += await asyncio.wait_for(reader.readexactly(min(chunkSize, length - len(content))), readTimeout)
+				if callBack:
+					callBack(len(content), chunkSize, length)
+			return bytes(content), False
+
+		while True:
+			chunk = await asyncio.wait_for(reader.read(chunkSize), readTimeout)
+			if not chunk:
+				break
+			content += chunk
+			checkSize(len(content))
+			if callBack:
+				callBack(len(content), chunkSize, None)
+
+		return bytes(content), True
@@ -9,8 +9,6 @@ import os.path
 import io
 import time
 
-import requests
-import python_anticaptcha
 
 from .. import Exceptions as exc
 from . import SocksProxy
@@ -40,6 +38,8 @@ class AntiCaptchaSolver(CaptchaSolverBase.CaptchaSolverBase):
 	@property
 	def client(self):
 		if self.__client is None:
+			# python_anticaptcha is slow to import, so it's only pulled in when a captcha actually needs solving.
+			import python_anticaptcha
 			self.__client = python_anticaptcha.AnticaptchaClient(self._get_api_key())
 
 		return self.__client
@@ -74,6 +74,7 @@ class AntiCaptchaSolver(CaptchaSolverBase.CaptchaSolverBase):
 		else:
 			raise ValueError("You must pass either a valid file path, or a bytes array containing the captcha image!")
 
+		import python_anticaptcha
 		try:
 			task = python_anticaptcha.ImageToTextTask(fp)
 			job = self.client.createTask(task)
@@ -106,6 +107,7 @@ class AntiCaptchaSolver(CaptchaSolverBase.CaptchaSolverBase):
 		self.log.info("Letting port forward stabilize.")
 		time.sleep(5)
 
+		import python_anticaptcha
 		try:
 			task = python_anticaptcha.NoCaptchaTask(
 					website_url    = page_url,
@@ -150,6 +152,7 @@ class AntiCaptchaSolver(CaptchaSolverBase.CaptchaSolverBase):
 		self.log.info("Letting port forward stabilize.")
 		time.sleep(5)
 
+		import python_anticaptcha
 		try:
 			task = python_anticaptcha.HCaptchaTask(
 					website_url    = page_url,
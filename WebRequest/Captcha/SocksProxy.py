@@ -13,7 +13,6 @@ from . import socks5
 # from . import pysoxy
 # import pproxy.verbose
 
-from . import PunchPort
 from .. import Exceptions as exc
 
 
@@ -109,6 +108,8 @@ class ProxyLauncher(object):
 
 	def _open_local_port(self, port, listen_from_ips):
 		self.log.info("Opening port on NAT device to forward port %s from remote IP %s.", port, listen_from_ips)
+		# PunchPort pulls in upnpclient, which is slow to import, and only needed here.
+		from . import PunchPort
 		self.hole_puncher = PunchPort.UpnpHolePunch()
 		self.hole_puncher.open_port(listen_from_ips, port, port)
 
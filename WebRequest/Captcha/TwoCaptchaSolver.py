@@ -9,8 +9,6 @@ import os.path
 import io
 import time
 
-import requests
-
 from .. import Exceptions as exc
 
 from . import SocksProxy
@@ -199,6 +197,7 @@ class TwoCaptchaSolver(CaptchaSolverBase.CaptchaSolverBase):
 
 		url = self._getUrlFor('input', {})
 
+		import requests
 		request = requests.post(url, files=files, data=payload)
 
 		if not request.ok:
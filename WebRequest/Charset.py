@@ -0,0 +1,238 @@
+#!/usr/bin/python3
+
+# Charset detection for text content that doesn't have a charset in its headers.
+#
+# Running `cchardet` (and a regex) over a multi-megabyte page is expensive, and
+# pointless, since the encoding is generally evident from the first few KB.
+# As such, everything here only looks at a bounded prefix of the content, and
+# a BOM or `<meta charset>` in the head is trusted (as long as the content
+# actually decodes with it). Sites also rarely change their encoding, so the
+# encoding that worked is remembered per (host, content-type), and pages after
+# the first skip detection entirely.
+
+import re
+import codecs
+import logging
+import collections
+
+from threading import Lock
+
+cchardet = False
+
+try:
+	import cchardet
+except ImportError:    # pragma: no cover
+	pass
+
+
+# How much of the content is looked at for detection.
+SAMPLE_SIZE = 2 ** 16
+
+# The UTF-32 BOMs start with the UTF-16 ones, so they have to be checked first.
+BOMS = (
+	(codecs.BOM_UTF32_LE, 'utf-32'),
+	(codecs.BOM_UTF32_BE, 'utf-32'),
+	(codecs.BOM_UTF8,     'utf-8-sig'),
+	(codecs.BOM_UTF16_LE, 'utf-16'),
+	(codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+# Catches both `<meta charset="...">` and `<meta http-equiv="Content-Type" content="text/html; charset=...">`,
+# as well as the xml declaration `encoding` attribute.
+DECLARED_CHARSET_RE = re.compile(rb"""(?:charset|<\?xml[^>]+encoding)\s*=\s*['"]?\s*([a-zA-Z0-9_\-:.]+)""", flags=re.IGNORECASE)
+
+# Encodings that only tell us the sample happened to be plain ASCII. Decode with
+# the superset instead, since there may well be non-ASCII content further on.
+ASCII_ALIASES = ('ascii', 'us-ascii')
+
+
+def sniff_bom(sample:bytes):
+	'''
+	Charset specified by the byte order mark at the start of `sample`, or None.
+	'''
+	for bom, charset in BOMS:
+		if sample.startswith(bom):
+			return charset
+	return None
+
+
+def sniff_declared(sample:bytes):
+	'''
+	Charset declared in the markup in `sample`, or None if there isn't one
+	(or it's not an encoding python knows about).
+	'''
+	match = DECLARED_CHARSET_RE.search(sample)
+	if not match:
+		return None
+	try:
+		return codecs.lookup(match.group(1).decode("ascii")).name
+	except (LookupError, UnicodeDecodeError):
+		return None
+
+
+def detect(sample:bytes):
+	'''
+	Run cchardet on `sample`. Returns a 2-tuple of (charset, confidence), or
+	(None, None) if cchardet isn't installed.
+	'''
+	if not cchardet:
+		return None, None
+	inferred = cchardet.detect(sample)
+	if not inferred:
+		return None, None
+	return inferred['encoding'], inferred['confidence']
+
+
+def _normalize(charset:str):
+	try:
+		name = codecs.lookup(charset).name
+	except LookupError:
+		return None
+	if name in ASCII_ALIASES:
+		return 'utf-8'
+	return name
+
+
+class CharsetMemo(object):
+	'''
+	Decodes text content, remembering which encoding worked for each
+	(netloc, content-type) pair.
+
+	Thread-safe. Keeps the last `max_entries` pairs. Only the first `sample_size`
+	bytes of the content are used to work out the encoding.
+	'''
+
+	def __init__(self, max_entries:int=4096, sample_size:int=SAMPLE_SIZE):
+		self.log = logging.getLogger("Main.WebRequest.Charset")
+
+		self.max_entries = max_entries
+		self.sample_size = sample_size
+
+		self._lock     = Lock()
+		self._charsets = collections.OrderedDict()
+
+		self.decodes       = 0
+		self.bom_hits      = 0
+		self.declared_hits = 0
+		self.memo_hits     = 0
+		self.detections    = 0
+		self.defaulted     = 0
+		self.binary        = 0
+		self.memo_misses   = 0
+		self.decode_errors = 0
+
+	@staticmethod
+	def _key(netloc:str, cType:str):
+		return (netloc or "", (cType or "").split(";")[0].strip().lower())
+
+	def get(self, netloc:str, cType:str):
+		with self._lock:
+			return self._charsets.get(self._key(netloc, cType))
+
+	def _remember(self, key, charset):
+		# Must be called with the lock held.
+		self._charsets[key] = charset
+		self._charsets.move_to_end(key)
+		while len(self._charsets) > self.max_entries:
+			self._charsets.popitem(last=False)
+
+	def _count(self, counter:str, key=None, charset:str=None, forget:bool=False):
+		with self._lock:
+			self.decodes += 1
+			setattr(self, counter, getattr(self, counter) + 1)
+			if forget:
+				self.memo_misses += 1
+				self._charsets.pop(key, None)
+			if charset:
+				self._remember(key, charset)
+
+	@staticmethod
+	def _try_decode(content:bytes, charset:str):
+		try:
+			return str(content, charset)
+		except (UnicodeDecodeError, LookupError):
+			return None
+
+	def decode(self, netloc:str, cType:str, content:bytes):
+		'''
+		Decode `content`, served by `netloc` with the content-type `cType`.
+
+		In order, this tries the BOM, the charset declared in the markup, the
+		memoized charset for the host/content-type, and finally cchardet.
+		If cchardet thinks the content is binary, it's returned as-is.
+		'''
+		key = self._key(netloc, cType)
+		sample = content[:self.sample_size]
+
+		bom = sniff_bom(sample)
+		if bom:
+			decoded = self._try_decode(content, bom)
+			if decoded is not None:
+				self._count('bom_hits')
+				return decoded
+
+		declared = sniff_declared(sample)
+		if declared:
+			decoded = self._try_decode(content, declared)
+			if decoded is not None:
+				self._count('declared_hits', key, declared)
+				return decoded
+
+		known = self.get(netloc, cType)
+		if known and known != declared:
+			decoded = self._try_decode(content, known)
+			if decoded is not None:
+				self._count('memo_hits', key)
+				return decoded
+
+		# Stale memo entries are dropped, whatever happens next.
+		forget = bool(known)
+
+		if not cchardet:
+			self.log.warning("Missing cchardet!")
+
+		charset, confidence = detect(sample)
+		if cchardet and confidence is None:
+			# If we couldn't infer a charset, just short circuit and return the content.
+			# It's probably binary.
+			self._count('binary', key, forget=forget)
+			return content
+
+		if charset and confidence > 0.8:
+			charset = _normalize(charset)
+			self.log.info("Cchardet inferred encoding: %s", charset)
+		else:
+			charset = None
+
+		counter = 'detections'
+		if not charset:
+			self.log.warning("Could not find encoding information on page - Using default charset. Shit may break!")
+			charset = "utf-8"
+			counter = 'defaulted'
+
+		# The sample may not be representative of the rest of the content (e.g. the
+		# non-ASCII content starts after it), so try utf-8 before giving up.
+		for candidate in (charset, 'utf-8'):
+			decoded = self._try_decode(content, candidate)
+			if decoded is not None:
+				self._count(counter, key, candidate, forget=forget)
+				return decoded
+
+		self.log.error("Encoding Error! Stripping invalid chars.")
+		self._count('decode_errors', key, forget=forget)
+		return content.decode('utf-8', errors='ignore')
+
+	def stats(self):
+		with self._lock:
+			return {
+				'decodes'       : self.decodes,
+				'bom_hits'      : self.bom_hits,
+				'declared_hits' : self.declared_hits,
+				'memo_hits'     : self.memo_hits,
+				'detections'    : self.detections,
+				'defaulted'     : self.defaulted,
+				'binary'        : self.binary,
+				'memo_misses'   : self.memo_misses,
+				'decode_errors' : self.decode_errors,
+				'entries'       : len(self._charsets),
+			}
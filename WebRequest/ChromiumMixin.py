@@ -11,9 +11,8 @@ import multiprocessing
 import gc
 import contextlib
 
-import bs4
-
-import ChromeController
+# ChromeController (and bs4) are imported when chromium is actually used, since
+# they're slow to import.
 
 # Share the same chrome instance across multiple threads
 class ChromiumBorg(object):
@@ -26,6 +25,7 @@ class ChromiumBorg(object):
 	_cr_binary    = None
 
 	def _init_chromium_instance(self, chrome_binary):
+		import ChromeController
 		# Current runners are configured to use 10 threads.
 		self.__cr = ChromeController.TabPooledChromium(binary=chrome_binary, tab_pool_max_size=10, *self._args, **self._kwargs)
 		self.__initialized = True
@@ -62,6 +62,7 @@ class ChromiumSingle(object):
 
 
 	def _init_chromium_instance(self):
+		import ChromeController
 		# Current runners are configured to use 10 threads.
 		self.__cr = ChromeController.TabPooledChromium(binary=self.__bin_name, tab_pool_max_size=5, *self._args, **self._kwargs)
 		self.__initialized = True
@@ -166,21 +167,29 @@ class WebGetCrMixin(object):
 
 	def _syncIntoChromium(self, cr):
 		self.log.info("Syncing cookies into chromium")
-		cr.clear_cookies()
-		# Headers are a list of 2-tuples. We need a dict
-		hdict = dict(self.browserHeaders)
-		cr.update_headers(hdict)
-		for cookie in self.cj:
-			# Something, somewhere is setting cookies without a value,
-			# and that confuses chromium a LOT. Anways, just don't forward
-			# those particular cookies.
-			if cookie and cookie.value:
-				cr.set_cookie(cookie)
+		with self.tracer.span("chromium_cookie_sync_in") as span:
+			cr.clear_cookies()
+			# Headers are a list of 2-tuples. We need a dict
+			hdict = dict(self.browserHeaders)
+			cr.update_headers(hdict)
+			synced = 0
+			for cookie in self.cj:
+				# Something, somewhere is setting cookies without a value,
+				# and that confuses chromium a LOT. Anways, just don't forward
+				# those particular cookies.
+				if cookie and cookie.value:
+					cr.set_cookie(cookie)
+					synced += 1
+			span.set_attribute("cookies", synced)
 
 	def _syncOutOfChromium(self, cr):
 		self.log.info("Syncing cookies out from chromium")
-		for cookie in cr.get_cookies():
-			self.cj.set_cookie(cookie)
+		with self.tracer.span("chromium_cookie_sync_out") as span:
+			synced = 0
+			for cookie in cr.get_cookies():
+				self.cj.set_cookie(cookie)
+				synced += 1
+			span.set_attribute("cookies", synced)
 
 	def comprehensiveGetItemChromium(self, url, referrer=None, extra_tid=False, title_timeout=None, need_rendered=False):
 
@@ -194,7 +203,7 @@ class WebGetCrMixin(object):
 		ret = {}
 
 
-		with self._chrome_context(itemUrl=url, extra_tid=extra_tid) as cr:
+		with self.tracer.span("chromium_fetch", url=url), self._chrome_context(itemUrl=url, extra_tid=extra_tid) as cr:
 			# print("Starting nav (%s)" % need_rendered)
 
 			cr.Emulation_setScriptExecutionDisabled(False)
@@ -223,8 +232,9 @@ class WebGetCrMixin(object):
 				raw_content = ret['raw_content']
 				if isinstance(raw_content, str):
 					raw_content = raw_content.encode("UTF-8")
-				self._check_waf(raw_content, url)
+				self._check_waf(raw_content, url, ret['raw_mimetype'])
 
+			import bs4
 			raw_url = cr.get_current_url()
 			fileN = urllib.parse.unquote(urllib.parse.urlparse(raw_url)[2].split("/")[-1])
 			fileN = bs4.UnicodeDammit(fileN).unicode_markup
@@ -357,21 +367,25 @@ class WebGetCrMixin(object):
 		if extra_tid is True:
 			extra_tid = threading.get_ident()
 
-		with self._chrome_context(itemUrl=url, extra_tid=extra_tid) as cr:
+		with self.tracer.span("chromium_step_through", url=url) as span, self._chrome_context(itemUrl=url, extra_tid=extra_tid) as cr:
 			cr.Emulation_setScriptExecutionDisabled(False)
 			self._syncIntoChromium(cr)
-			cr.blocking_navigate(url)
+			with self.tracer.span("chromium_navigate", url=url):
+				cr.blocking_navigate(url)
 
-			for _ in range(self.wrapper_step_through_timeout):
+			for poll in range(self.wrapper_step_through_timeout):
 				time.sleep(1)
 				current_title, _ = cr.get_page_url_title()
 				if titleContains and titleContains in current_title:
+					span.set_attribute("polls", poll + 1)
 					self._syncOutOfChromium(cr)
 					return True
 				if titleNotContains and current_title and titleNotContains not in current_title:
+					span.set_attribute("polls", poll + 1)
 					self._syncOutOfChromium(cr)
 					return True
 
+			span.set_attribute("title", current_title)
 			self._syncOutOfChromium(cr)
 			cr.Emulation_setScriptExecutionDisabled(True)
 
@@ -0,0 +1,247 @@
+#!/usr/bin/python3
+
+# Per-host circuit breaker.
+#
+# When a host fails enough times in a row (timeouts, connection errors, 5xx
+# responses, WAFs we can't get through), the circuit for it "opens", and any
+# further requests to it fail immediately with a `CircuitOpenError`, rather then
+# each one burning the full timeout and retry delays. Once the cooldown is over,
+# the circuit goes "half-open", and a single probe request is let through. If
+# that succeeds the circuit closes again, otherwise it re-opens with a longer
+# cooldown.
+#
+# Closed circuits for hosts we haven't talked to in a while are forgotten, so
+# the state doesn't grow with every host a long crawl ever touched.
+
+import time
+import logging
+import urllib.parse
+
+from threading import Lock
+
+from . import Exceptions
+
+
+CLOSED    = "closed"
+OPEN      = "open"
+HALF_OPEN = "half-open"
+
+
+class _CircuitState(object):
+	def __init__(self, cooldown):
+		self.state                = CLOSED
+		self.consecutive_failures = 0
+		self.cooldown             = cooldown
+		self.open_until           = 0.0
+		self.probe_started        = None
+		self.last_used            = time.monotonic()
+
+		self.successes            = 0
+		self.failures             = 0
+		self.opened               = 0
+		self.rejected             = 0
+
+
+class CircuitBreaker(object):
+	'''
+	Thread-safe, per-netloc circuit breaker. Pass the same instance to multiple
+	WebGetRobust instances to share host state between them.
+
+	Params:
+		``failure_threshold`` - Number of consecutive failures before the circuit opens.
+		``cooldown`` - How long (in seconds) the circuit stays open before a probe request
+			is allowed.
+		``max_cooldown`` - Each failed probe doubles the cooldown, up to this limit.
+		``probe_timeout`` - If a probe hasn't reported back after this many seconds (e.g.
+			the caller went away), another request is allowed to probe.
+		``idle_timeout`` - Closed circuits for hosts that haven't seen a request in this many
+			seconds are dropped (along with their counters in `stats()`). `None` keeps them
+			forever.
+
+	State changes are logged, and passed to any callables registered with
+	`add_listener()`, as `listener(netloc, old_state, new_state)`.
+	'''
+
+	def __init__(self,
+			failure_threshold : int   = 5,
+			cooldown          : float = 30,
+			max_cooldown      : float = 600,
+			probe_timeout     : float = 120,
+			idle_timeout      : float = 600,
+			):
+		self.log = logging.getLogger("Main.WebRequest.CircuitBreaker")
+
+		self.failure_threshold = max(1, failure_threshold)
+		self.cooldown          = cooldown
+		self.max_cooldown      = max(cooldown, max_cooldown)
+		self.probe_timeout     = probe_timeout
+		self.idle_timeout      = idle_timeout
+
+		self._lock       = Lock()
+		self._hosts      = {}
+		self._listeners  = []
+		self._last_sweep = time.monotonic()
+
+	@staticmethod
+	def _netloc(url_or_netloc):
+		if "://" in url_or_netloc:
+			return urllib.parse.urlsplit(url_or_netloc).netloc.lower()
+		return url_or_netloc.lower()
+
+	def _state(self, netloc):
+		state = self._hosts.get(netloc)
+		if state is None:
+			state = _CircuitState(self.cooldown)
+			self._hosts[netloc] = state
+		return state
+
+	def _evict_idle(self, now):
+		# Must be called with the lock held. Open and half-open circuits are kept, as
+		# they're what makes requests fail fast.
+		if self.idle_timeout is None or now - self._last_sweep < self.idle_timeout / 4:
+			return
+		self._last_sweep = now
+
+		idle = [
+				netloc
+				for netloc, state in self._hosts.items()
+				if state.state == CLOSED and now - state.last_used >= self.idle_timeout
+			]
+		for netloc in idle:
+			del self._hosts[netloc]
+		if idle:
+			self.log.debug("Dropped %s idle hosts", len(idle))
+
+	def add_listener(self, listener):
+		self._listeners.append(listener)
+
+	def remove_listener(self, listener):
+		self._listeners.remove(listener)
+
+	def _notify(self, netloc, old, new):
+		if old == new:
+			return
+		if new == OPEN:
+			self.log.warning("Circuit for %s is now %s", netloc, new)
+		else:
+			self.log.info("Circuit for %s is now %s", netloc, new)
+		for listener in list(self._listeners):
+			try:
+				listener(netloc, old, new)
+			except Exception:
+				self.log.exception("Circuit breaker listener failed!")
+
+	def check(self, url:str):
+		'''
+		Called before a request to the host for `url`. Raises `CircuitOpenError` if the
+		circuit is open (or half-open, with a probe already under way).
+		Otherwise, the caller has to report the outcome with `record()`.
+		'''
+		netloc = self._netloc(url)
+		with self._lock:
+			now = time.monotonic()
+			self._evict_idle(now)
+			state = self._state(netloc)
+			state.last_used = now
+			old = state.state
+
+			if state.state == OPEN and now >= state.open_until:
+				state.state = HALF_OPEN
+				state.probe_started = None
+
+			if state.state == HALF_OPEN:
+				if state.probe_started is None or now - state.probe_started > self.probe_timeout:
+					state.probe_started = now
+				else:
+					state.rejected += 1
+					raise Exceptions.CircuitOpenError("Circuit open (probe in progress)", url, retry_in=0)
+
+			elif state.state == OPEN:
+				state.rejected += 1
+				raise Exceptions.CircuitOpenError("Circuit open", url, retry_in=state.open_until - now)
+
+			new = state.state
+
+		self._notify(netloc, old, new)
+
+	def record(self, url:str, ok):
+		'''
+		Report the outcome of a request let through by `check()`. `ok` is True if the
+		host responded properly, False if it's failing, or None if the request told us
+		nothing either way (e.g. we hit a WAF, and are going to step through it).
+		'''
+		netloc = self._netloc(url)
+		with self._lock:
+			state = self._state(netloc)
+			old = state.state
+			probe = state.state == HALF_OPEN and state.probe_started is not None
+			state.probe_started = None
+
+			if ok:
+				state.successes += 1
+				state.consecutive_failures = 0
+				state.state    = CLOSED
+				state.cooldown = self.cooldown
+
+			elif ok is not None:
+				state.failures += 1
+				state.consecutive_failures += 1
+				if probe:
+					state.cooldown = min(self.max_cooldown, state.cooldown * 2)
+				if probe or state.consecutive_failures >= self.failure_threshold:
+					if state.state != OPEN:
+						state.opened += 1
+					state.state = OPEN
+					state.open_until = time.monotonic() + state.cooldown
+
+			new = state.state
+
+		self._notify(netloc, old, new)
+
+	def state(self, url:str):
+		'''
+		Current state of the circuit for the host for `url` (`CLOSED`, `OPEN` or `HALF_OPEN`).
+		'''
+		netloc = self._netloc(url)
+		with self._lock:
+			state = self._hosts.get(netloc)
+			if state is None:
+				return CLOSED
+			if state.state == OPEN and time.monotonic() >= state.open_until:
+				return HALF_OPEN
+			return state.state
+
+	def reset(self, url:str=None):
+		'''
+		Close the circuit for the host for `url`, or for all hosts.
+		'''
+		with self._lock:
+			if url is None:
+				changed = [(netloc, state.state) for netloc, state in self._hosts.items()]
+				self._hosts.clear()
+			else:
+				netloc = self._netloc(url)
+				state = self._hosts.pop(netloc, None)
+				changed = [(netloc, state.state)] if state else []
+
+		for netloc, old in changed:
+			self._notify(netloc, old, CLOSED)
+
+	def stats(self):
+		'''
+		Per-host state and counters, as a dict of netloc -> dict.
+		'''
+		now = time.monotonic()
+		with self._lock:
+			return {
+				netloc : {
+					'state'                : state.state,
+					'consecutive_failures' : state.consecutive_failures,
+					'successes'            : state.successes,
+					'failures'             : state.failures,
+					'opened'               : state.opened,
+					'rejected'             : state.rejected,
+					'retry_in'             : max(0.0, state.open_until - now) if state.state == OPEN else 0.0,
+				}
+				for netloc, state in self._hosts.items()
+			}
@@ -6,11 +6,6 @@ import collections
 import sys
 import datetime
 
-import cloudscraper
-import requests
-import requests.structures
-from python_anticaptcha import AnticaptchaClient, NoCaptchaTask
-
 from .Captcha import SocksProxy
 from .Captcha import AntiCaptchaSolver
 from .Captcha import TwoCaptchaSolver
@@ -53,11 +48,30 @@ from .Captcha import TwoCaptchaSolver
 # proxyCaptchaSolver()
 
 
-class CloudScraperWrapper(cloudscraper.CloudScraper):
-	def __init__(self, wg, *args, **kwargs):
-		super(CloudScraperWrapper, self).__init__(*args, **kwargs)
+# cloudscraper (and requests, which it sits on) take ~80 ms to import, and are only needed
+# when a cloudflare challenge actually turns up, so the wrapper class is built on first use.
+_CloudScraperWrapper = None
+
+def _get_cloudscraper_wrapper():
+	global _CloudScraperWrapper
+	if _CloudScraperWrapper is None:
+		import cloudscraper
+
+		class CloudScraperWrapper(cloudscraper.CloudScraper):
+			def __init__(self, wg, *args, **kwargs):
+				super(CloudScraperWrapper, self).__init__(*args, **kwargs)
+
+				self.wg = wg
+
+		_CloudScraperWrapper = CloudScraperWrapper
+	return _CloudScraperWrapper
+
+def __getattr__(name):
+	# Keeps `CloudscraperMixin.CloudScraperWrapper` working for anything that used it directly.
+	if name == "CloudScraperWrapper":
+		return _get_cloudscraper_wrapper()
+	raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
-		self.wg = wg
 
 
 		# ------------------------------------------------------------------------------- #
@@ -145,6 +159,7 @@ class WebGetCloudscraperMixin(object):
 			self.addCookie(cookie)
 
 	def _no_recaptcha_fetch(self, url):
+		CloudScraperWrapper = _get_cloudscraper_wrapper()
 		normal_scraper = CloudScraperWrapper(
 				wg = self,
 			)
@@ -224,6 +239,7 @@ class WebGetCloudscraperMixin(object):
 				time.sleep(5)
 
 			self.log.info("Attempting to access site using CloudScraper with Captcha Handling.")
+			CloudScraperWrapper = _get_cloudscraper_wrapper()
 			normal_scraper = CloudScraperWrapper(
 				wg        = self,
 				recaptcha = recaptcha_params,
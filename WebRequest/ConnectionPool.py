@@ -0,0 +1,295 @@
+#!/usr/bin/python3
+
+# Keep-alive connection pooling for the urllib opener.
+#
+# Stock urllib forces `Connection: close` on every request, and tears down
+# the socket once the response has been received. When we're hammering the
+# same handful of hosts, the TCP (and TLS) setup ends up dominating the
+# request time, so instead we keep the idle connections around, keyed by
+# scheme/host/port, and hand them back out for later requests.
+
+import time
+import socket
+import logging
+import collections
+import http.client
+import urllib.request
+import urllib.error
+
+from threading import Lock
+
+from . import FetchTiming
+
+
+# Errors that indicate the server silently dropped a idle keep-alive
+# connection out from under us. If we see one of these on a reused
+# connection, the request is retried on another (or a fresh) connection.
+STALE_CONNECTION_ERRORS = (
+	http.client.RemoteDisconnected,
+	http.client.BadStatusLine,
+	ConnectionResetError,
+	ConnectionAbortedError,
+	BrokenPipeError,
+)
+
+
+class PooledHTTPResponse(http.client.HTTPResponse):
+	'''
+	HTTPResponse that hands it's connection back to the pool once the
+	body has been fully consumed.
+
+	If the response is closed before the body has been read out, the
+	connection state is unknown (there's still data on the wire), so
+	the connection is discarded instead.
+	'''
+
+	_pool_release  = None
+	_pool_discard  = False
+
+	def close(self):
+		if self.fp is not None:
+			self._pool_discard = True
+		super().close()
+
+	def _close_conn(self):
+		super()._close_conn()
+		release, self._pool_release = self._pool_release, None
+		if release:
+			release(reusable=not (self._pool_discard or self.will_close))
+
+
+class _PooledConnection(object):
+	def __init__(self, key, conn):
+		self.key       = key
+		self.conn      = conn
+		self.requests  = 0
+		self.last_used = time.time()
+
+
+class ConnectionPool(object):
+	'''
+	Thread-safe pool of idle HTTP(S) connections.
+
+	Params:
+		``max_idle_per_host`` - Maximum number of idle sockets kept around for each
+			scheme/host/port. Connections released when the pool for a host is full
+			are closed.
+		``idle_timeout`` - Idle connections older then this (in seconds) are closed
+			rather then reused, since most servers will have dropped them anyways.
+		``max_requests_per_connection`` - Connections are retired after serving this
+			many requests. `None` means no limit.
+
+	The `hits`, `misses`, `stale` and `discarded` counters are available via `stats()`.
+	'''
+
+	def __init__(self,
+			max_idle_per_host           : int   = 4,
+			idle_timeout                : float = 30,
+			max_requests_per_connection : int   = 100,
+			):
+		self.log = logging.getLogger("Main.WebRequest.ConnectionPool")
+
+		self.max_idle_per_host           = max_idle_per_host
+		self.idle_timeout                = idle_timeout
+		self.max_requests_per_connection = max_requests_per_connection
+
+		self._lock = Lock()
+		self._idle = collections.defaultdict(collections.deque)
+
+		self.hits      = 0
+		self.misses    = 0
+		self.stale     = 0
+		self.discarded = 0
+
+	def acquire(self, key, factory):
+		'''
+		Get a connection for `key`, either from the idle pool, or by calling `factory()`
+		to open a new one.
+
+		Returns a 2-tuple of (pooled_connection, reused).
+		'''
+		now = time.time()
+		with self._lock:
+			idle = self._idle[key]
+			while idle:
+				pconn = idle.pop()
+				if now - pconn.last_used > self.idle_timeout:
+					self.discarded += 1
+					pconn.conn.close()
+					continue
+
+				self.hits += 1
+				return pconn, True
+
+			self.misses += 1
+
+		return _PooledConnection(key, factory()), False
+
+	def release(self, pconn, reusable=True):
+		'''
+		Return a connection to the pool. Connections that cannot be reused, that have
+		hit the per-connection request limit, or that would overflow the idle pool are
+		closed instead.
+		'''
+		pconn.last_used = time.time()
+
+		if reusable and pconn.conn.sock is not None:
+			if self.max_requests_per_connection is None or pconn.requests < self.max_requests_per_connection:
+				with self._lock:
+					idle = self._idle[pconn.key]
+					if len(idle) < self.max_idle_per_host:
+						idle.append(pconn)
+						return
+
+		with self._lock:
+			self.discarded += 1
+		pconn.conn.close()
+
+	def mark_stale(self, pconn):
+		with self._lock:
+			self.stale += 1
+		pconn.conn.close()
+
+	def idle_count(self, key=None):
+		with self._lock:
+			if key is not None:
+				return len(self._idle.get(key, ()))
+			return sum(len(tmp) for tmp in self._idle.values())
+
+	def stats(self):
+		with self._lock:
+			return {
+				'hits'      : self.hits,
+				'misses'    : self.misses,
+				'stale'     : self.stale,
+				'discarded' : self.discarded,
+				'idle'      : sum(len(tmp) for tmp in self._idle.values()),
+			}
+
+	def close(self):
+		'''
+		Close all the idle connections in the pool.
+		'''
+		with self._lock:
+			idle, self._idle = self._idle, collections.defaultdict(collections.deque)
+
+		for conns in idle.values():
+			for pconn in conns:
+				pconn.conn.close()
+
+
+class _PooledHandlerMixin(object):
+
+	def _pooled_open(self, http_class, req, **http_conn_args):
+		'''
+		Equivalent of `AbstractHTTPHandler.do_open()`, except the connection is
+		pulled from (and eventually returned to) the connection pool, and
+		`Connection: keep-alive` is sent instead of `Connection: close`.
+		'''
+		host = req.host
+		if not host:
+			raise urllib.error.URLError('no host given')
+
+		headers = dict(req.unredirected_hdrs)
+		headers.update({k: v for k, v in req.headers.items() if k not in headers})
+		headers["Connection"] = "keep-alive"
+		headers = {name.title(): val for name, val in headers.items()}
+
+		tunnel_headers = {}
+		if req._tunnel_host:
+			proxy_auth_hdr = "Proxy-Authorization"
+			if proxy_auth_hdr in headers:
+				# Proxy-Authorization should not be sent to origin server.
+				tunnel_headers[proxy_auth_hdr] = headers.pop(proxy_auth_hdr)
+
+		key = (http_class.__name__, host.lower(), req._tunnel_host)
+
+		# `req.timeout` is the connect timeout. Once there's a connection, the
+		# read timeout (if one was set on the request) applies.
+		read_timeout = getattr(req, "read_timeout", None)
+		if read_timeout is None:
+			read_timeout = req.timeout
+		if read_timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+			read_timeout = socket.getdefaulttimeout()
+
+		timing = getattr(req, "timing", None)
+
+		def factory():
+			conn = http_class(host, timeout=req.timeout, **http_conn_args)
+			if self.dns_cache is not None:
+				self.dns_cache.attach(conn, timing)
+			if timing is not None:
+				FetchTiming.attach_timing(conn, timing)
+			conn.set_debuglevel(self._debuglevel)
+			conn.response_class = PooledHTTPResponse
+			if req._tunnel_host:
+				conn.set_tunnel(req._tunnel_host, headers=tunnel_headers)
+			return conn
+
+		while True:
+			pconn, reused = self.pool.acquire(key, factory)
+			conn = pconn.conn
+			if reused:
+				conn.timeout = req.timeout
+				try:
+					conn.sock.settimeout(read_timeout)
+				except OSError:
+					self.pool.mark_stale(pconn)
+					continue
+
+			try:
+				try:
+					conn.request(req.get_method(), req.selector, req.data, headers,
+								encode_chunked=req.has_header('Transfer-encoding'))
+				except STALE_CONNECTION_ERRORS:
+					raise
+				except OSError as err: # timeout error
+					raise urllib.error.URLError(err)
+				if not reused and conn.sock is not None:
+					conn.sock.settimeout(read_timeout)
+				resp = conn.getresponse()
+
+			except STALE_CONNECTION_ERRORS:
+				if reused:
+					self.pool.mark_stale(pconn)
+					continue
+				conn.close()
+				raise
+
+			except:
+				conn.close()
+				raise
+
+			break
+
+		pconn.requests += 1
+		resp._pool_release = lambda reusable: self.pool.release(pconn, reusable=reusable)
+
+		# The response may have already been fully consumed (e.g. for a
+		# HEAD, or a zero-length body), in which case we can release now.
+		if resp.isclosed():
+			resp._pool_release(reusable=not resp.will_close)
+
+		resp.url = req.get_full_url()
+		resp.msg = resp.reason
+		return resp
+
+
+class PooledHTTPHandler(_PooledHandlerMixin, urllib.request.HTTPHandler):
+	def __init__(self, pool:ConnectionPool, debuglevel=0, dns_cache=None):
+		super().__init__(debuglevel=debuglevel)
+		self.pool      = pool
+		self.dns_cache = dns_cache
+
+	def http_open(self, req):
+		return self._pooled_open(http.client.HTTPConnection, req)
+
+
+class PooledHTTPSHandler(_PooledHandlerMixin, urllib.request.HTTPSHandler):
+	def __init__(self, pool:ConnectionPool, debuglevel=0, context=None, dns_cache=None):
+		super().__init__(debuglevel=debuglevel, context=context)
+		self.pool      = pool
+		self.dns_cache = dns_cache
+
+	def https_open(self, req):
+		return self._pooled_open(http.client.HTTPSConnection, req, context=self._context)
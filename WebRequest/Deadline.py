@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+
+# Wall-clock deadlines for a whole fetch.
+#
+# The socket timeouts only bound how long any *one* operation can take, so
+# a server that drips out a byte every few seconds (or a host that keeps on
+# failing, with retries and backoff) can hold a worker more or less
+# indefinitely. A `Deadline` is created when a fetch starts, and is shared by
+# all the retries, redirects and WAF step-throughs of the fetch. Every socket
+# timeout is cut down to what's left of it, and once it passes, the fetch is
+# abandoned with a `FetchTimeoutError`.
+
+import time
+
+from . import Exceptions
+
+
+class Deadline(object):
+	'''
+	Time budget of `seconds` for the fetch of `url`, starting now.
+	'''
+
+	__slots__ = ('seconds', 'url', 'started', 'expires')
+
+	def __init__(self, seconds:float, url:str=None):
+		self.seconds = seconds
+		self.url     = url
+		self.started = time.monotonic()
+		self.expires = self.started + seconds
+
+	def remaining(self):
+		return max(0.0, self.expires - time.monotonic())
+
+	def elapsed(self):
+		return time.monotonic() - self.started
+
+	def expired(self):
+		return time.monotonic() >= self.expires
+
+	def error(self, url:str=None, message:str="Fetch deadline exceeded"):
+		return Exceptions.FetchTimeoutError(message, url or self.url, timeout=self.seconds, elapsed=self.elapsed())
+
+	def check(self, url:str=None):
+		'''
+		Raise `FetchTimeoutError` if the deadline has passed.
+		'''
+		if self.expired():
+			raise self.error(url)
+
+	def clamp(self, timeout:float=None):
+		'''
+		`timeout`, cut down to the time remaining. Raises `FetchTimeoutError`
+		if there's no time left (a socket timeout of 0 would make it non-blocking).
+		'''
+		remaining = self.expires - time.monotonic()
+		if remaining <= 0:
+			raise self.error()
+		if timeout is None:
+			return remaining
+		return min(timeout, remaining)
+
+	def __repr__(self):
+		return "<Deadline %0.1f of %0.1f seconds left for %s>" % (self.remaining(), self.seconds, self.url)
+
+
+def attach_read_timeout(conn, read_timeout:float):
+	'''
+	Make a `http.client` connection switch it's socket over to `read_timeout` once it's
+	connected, so the connect and read timeouts can differ (`http.client` only has the one).
+	'''
+	create = conn._create_connection
+
+	def create_connection(*args, **kwargs):
+		sock = create(*args, **kwargs)
+		sock.settimeout(read_timeout)
+		return sock
+
+	conn._create_connection = create_connection
+	return conn
+
+
+def response_socket(resp):
+	'''
+	The socket under a `http.client.HTTPResponse`, or None if there isn't one (e.g.
+	responses served from the cache, or ones that have been read out). There's no
+	public way to get at it, so this digs through the response's buffered `SocketIO`.
+	'''
+	try:
+		return resp.fp.raw._sock
+	except AttributeError:
+		return None
@@ -0,0 +1,386 @@
+#!/usr/bin/python3
+
+# Incremental decoders for the HTTP `Content-Encoding`s we support.
+#
+# Each decoder takes the body in arbitrary sized chunks via `decompress()`,
+# and returns whatever decompressed data is available so far. `flush()` must
+# be called once the body is exhausted.
+#
+# Brotli and zstd support depends on the optional `brotli` (or `brotlicffi`)
+# and `zstandard` packages. Python 3.14+ has zstd in the standard library.
+
+import zlib
+import collections
+
+from threading import Lock
+
+try:
+	import brotli
+	HAVE_BROTLI = True
+except ImportError:    # pragma: no cover
+	try:
+		import brotlicffi as brotli
+		HAVE_BROTLI = True
+	except ImportError:
+		HAVE_BROTLI = False
+
+try:
+	import zstandard
+	_new_zstd_decompressor = lambda: zstandard.ZstdDecompressor().decompressobj()
+	HAVE_ZSTD = True
+except ImportError:    # pragma: no cover
+	try:
+		from compression import zstd
+		_new_zstd_decompressor = zstd.ZstdDecompressor
+		HAVE_ZSTD = True
+	except ImportError:
+		HAVE_ZSTD = False
+
+from . import Exceptions
+
+
+class IdentityDecoder(object):
+	name = "none"
+
+	def decompress(self, data:bytes):
+		return data
+
+	def flush(self):
+		return b""
+
+
+class GzipDecoder(object):
+	'''
+	Handles concatenated gzip members (which is legal, and which some servers
+	actually emit), by starting a new decompressor whenever one hits the end of
+	a member with data left over.
+	'''
+	name = "gzip"
+
+	def __init__(self):
+		self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+	def decompress(self, data:bytes):
+		out = []
+		while data:
+			out.append(self._obj.decompress(data))
+			if not self._obj.eof:
+				break
+			data = self._obj.unused_data
+			if data:
+				self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+		return b"".join(out)
+
+	def flush(self):
+		return self._obj.flush()
+
+
+def sniff_deflate_wbits(header:bytes):
+	'''
+	`Content-Encoding: deflate` is *supposed* to be a zlib stream, but lots of
+	servers send a raw deflate stream instead (and a few send gzip).
+	Look at the first two bytes to figure out which one we actually have.
+	'''
+	if len(header) >= 2:
+		if header[0] == 0x1f and header[1] == 0x8b:
+			return 16 + zlib.MAX_WBITS
+
+		# zlib header: CM == 8 (deflate), CINFO <= 7, and the FCHECK bits make
+		# the first two bytes a multiple of 31.
+		if (header[0] & 0x0f) == 8 and (header[0] >> 4) <= 7 and ((header[0] << 8) | header[1]) % 31 == 0:
+			return zlib.MAX_WBITS
+
+	return -zlib.MAX_WBITS
+
+
+# Every wbits value worth trying for a `deflate` body, most likely first.
+DEFLATE_WBITS_OPTIONS = [
+	-zlib.MAX_WBITS,       # deflate
+	 zlib.MAX_WBITS,       # zlib
+	 zlib.MAX_WBITS | 16,  # gzip
+	 zlib.MAX_WBITS | 32,  # "automatic header detection"
+
+	 0,  # Try to guess from header
+
+	 # Try all the raw window options.
+	 -8, -9, -10, -11, -12, -13, -14, -15,
+
+	 # Stream with zlib headers
+	  8,  9,  10,  11,  12,  13,  14,  15,
+
+	 # With gzip header+trailer
+	  8+16,  9+16,  10+16,  11+16,  12+16,  13+16,  14+16,  15+16,
+	 # Automatic detection
+	  8+32,  9+32,  10+32,  11+32,  12+32,  13+32,  14+32,  15+32,
+]
+
+
+def deflate_candidates(known:int, sniffed:int):
+	'''
+	The `wbits` to try for a `deflate` body, in order: what worked for the host last
+	time, what the header looks like, then everything else.
+	'''
+	candidates = []
+	for wbits in [known, sniffed] + DEFLATE_WBITS_OPTIONS:
+		if wbits is not None and wbits not in candidates:
+			candidates.append(wbits)
+	return candidates
+
+
+class DeflateWbitsMemo(object):
+	'''
+	Remembers which `wbits` worked for the `deflate` responses from each host, since
+	a server that sends (say) raw deflate streams will generally always do so.
+
+	Thread-safe. Keeps the last `max_hosts` hosts.
+	'''
+
+	def __init__(self, max_hosts:int=4096):
+		self.max_hosts = max_hosts
+
+		self._lock  = Lock()
+		self._wbits = collections.OrderedDict()
+
+		self.decodes           = 0
+		self.memo_hits         = 0
+		self.sniff_hits        = 0
+		self.fallbacks         = 0
+		self.fallback_attempts = 0
+		self.failures          = 0
+
+	def get(self, netloc:str):
+		with self._lock:
+			return self._wbits.get(netloc)
+
+	def decompress(self, netloc:str, data:bytes):
+		'''
+		Decompress the whole `deflate` body `data`. Tries the `wbits` that worked for
+		`netloc` last time, then whatever the header bytes say, and only then
+		falls back to trying everything.
+		'''
+		known = self.get(netloc) if netloc else None
+		sniffed = sniff_deflate_wbits(data[:2])
+
+		candidates = deflate_candidates(known, sniffed)
+
+		err = None
+		for attempt, wbits in enumerate(candidates):
+			try:
+				ret = zlib.decompress(data, wbits)
+			except zlib.error as e:
+				err = e
+				continue
+
+			self.record(netloc, wbits, attempt, known, sniffed)
+			return ret
+
+		self.record_failure(len(candidates))
+		raise err
+
+	def record_failure(self, attempts:int):
+		with self._lock:
+			self.decodes           += 1
+			self.failures          += 1
+			self.fallbacks         += 1
+			self.fallback_attempts += attempts
+
+	def record(self, netloc, wbits, attempt, known, sniffed):
+		'''
+		Note that `wbits` worked for `netloc`, on the `attempt`'th try.
+		'''
+		with self._lock:
+			self.decodes += 1
+			if wbits == known:
+				self.memo_hits += 1
+			elif wbits == sniffed:
+				self.sniff_hits += 1
+			else:
+				self.fallbacks += 1
+
+			# Each failed attempt is a full pass over the body.
+			self.fallback_attempts += attempt
+
+			if netloc:
+				self._wbits[netloc] = wbits
+				self._wbits.move_to_end(netloc)
+				while len(self._wbits) > self.max_hosts:
+					self._wbits.popitem(last=False)
+
+	def stats(self):
+		with self._lock:
+			return {
+				'decodes'           : self.decodes,
+				'memo_hits'         : self.memo_hits,
+				'sniff_hits'        : self.sniff_hits,
+				'fallbacks'         : self.fallbacks,
+				'fallback_attempts' : self.fallback_attempts,
+				'failures'          : self.failures,
+				'hosts'             : len(self._wbits),
+			}
+
+
+class DeflateDecoder(object):
+	'''
+	Incremental version of `DeflateWbitsMemo.decompress()`.
+
+	The input is kept until the stream has produced some output (or ended), so if
+	the `wbits` it started with turn out to be wrong, the other candidates can be
+	tried on it from the start. If `memo` is passed, the `wbits` that worked for
+	`netloc` last time are tried first, and whatever works is recorded in it.
+	'''
+	name = "deflate"
+
+	def __init__(self, wbits:int=None, memo:DeflateWbitsMemo=None, netloc:str=None):
+		if wbits is None and memo is not None and netloc:
+			wbits = memo.get(netloc)
+
+		self._memo       = memo
+		self._netloc     = netloc
+		self._known      = wbits
+		self._sniffed    = None
+		self._candidates = None
+		self._attempt    = 0
+		self._obj        = None
+		self._pending    = b""
+		self._confirmed  = False
+
+	def decompress(self, data:bytes):
+		if self._confirmed:
+			try:
+				return self._obj.decompress(data)
+			except zlib.error as err:
+				raise Exceptions.ContentTypeError("Invalid deflate stream: %s" % (err, ), None)
+
+		# Need at least two bytes to sniff the stream type.
+		self._pending += data
+		if len(self._pending) < 2:
+			return b""
+		return self._feed(data, final=False)
+
+	def flush(self):
+		if self._confirmed:
+			return self._obj.flush()
+		if not self._pending:
+			return b""
+		return self._feed(b"", final=True)
+
+	def _feed(self, data:bytes, final:bool):
+		if self._candidates is None:
+			self._sniffed    = sniff_deflate_wbits(self._pending[:2])
+			self._candidates = deflate_candidates(self._known, self._sniffed)
+
+		while True:
+			try:
+				if self._obj is None:
+					# New candidate, so start from the top.
+					self._obj = zlib.decompressobj(self._candidates[self._attempt])
+					data = self._pending
+				out = self._obj.decompress(data)
+				if final:
+					out += self._obj.flush()
+					if not self._obj.eof:
+						raise zlib.error("incomplete or truncated stream")
+			except zlib.error as err:
+				self._obj = None
+				self._attempt += 1
+				if self._attempt >= len(self._candidates):
+					if self._memo is not None:
+						self._memo.record_failure(len(self._candidates))
+					raise Exceptions.ContentTypeError("Invalid deflate stream: %s" % (err, ), None)
+				continue
+
+			if out or self._obj.eof:
+				self._confirmed = True
+				self._pending   = b""
+				if self._memo is not None:
+					self._memo.record(self._netloc, self._candidates[self._attempt], self._attempt, self._known, self._sniffed)
+			return out
+
+
+class BrotliDecoder(object):
+	name = "br"
+
+	def __init__(self):
+		if not HAVE_BROTLI:
+			raise Exceptions.ContentTypeError("Response is brotli compressed, but the `brotli` package isn't installed!", None)
+		self._obj = brotli.Decompressor()
+		# `brotli` calls it `process()`, `brotlicffi` calls it `decompress()`.
+		self._process = getattr(self._obj, "process", None) or self._obj.decompress
+
+	def decompress(self, data:bytes):
+		if not data:
+			return b""
+		try:
+			return self._process(data)
+		except brotli.error as err:
+			raise Exceptions.ContentTypeError("Invalid brotli stream: %s" % (err, ), None)
+
+	def flush(self):
+		return b""
+
+
+class ZstdDecoder(object):
+	'''
+	Like gzip, a zstd body can be made of multiple frames.
+	'''
+	name = "zstd"
+
+	def __init__(self):
+		if not HAVE_ZSTD:
+			raise Exceptions.ContentTypeError("Response is zstd compressed, but the `zstandard` package isn't installed!", None)
+		self._obj = _new_zstd_decompressor()
+
+	def decompress(self, data:bytes):
+		out = []
+		while data:
+			try:
+				out.append(self._obj.decompress(data))
+			except Exception as err:
+				raise Exceptions.ContentTypeError("Invalid zstd stream: %s" % (err, ), None)
+			if not self._obj.eof:
+				break
+			data = self._obj.unused_data
+			if data:
+				self._obj = _new_zstd_decompressor()
+		return b"".join(out)
+
+	def flush(self):
+		return b""
+
+
+DECODERS = {
+	None       : IdentityDecoder,
+	''         : IdentityDecoder,
+	'identity' : IdentityDecoder,
+	'gzip'     : GzipDecoder,
+	'x-gzip'   : GzipDecoder,
+	'deflate'  : DeflateDecoder,
+	'br'       : BrotliDecoder,
+	'zstd'     : ZstdDecoder,
+}
+
+
+def available_encodings():
+	'''
+	The compressed `Content-Encoding`s that can actually be decoded with the
+	packages that are installed.
+	'''
+	ret = ['gzip', 'deflate']
+	if HAVE_BROTLI:
+		ret.append('br')
+	if HAVE_ZSTD:
+		ret.append('zstd')
+	return ret
+
+
+def get_decompressor(coding:str):
+	'''
+	Get a incremental decoder for the `Content-Encoding` `coding`.
+	'''
+	if coding is not None:
+		coding = coding.strip().lower()
+
+	if coding not in DECODERS:
+		raise Exceptions.ContentTypeError("Unsupported content encoding: '%s'" % (coding, ), None)
+
+	return DECODERS[coding]()
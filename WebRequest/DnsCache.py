@@ -0,0 +1,297 @@
+#!/usr/bin/python3
+
+# Caching resolver for the connections the opener (and the async client) make.
+#
+# Successful lookups are cached for `ttl` seconds, and failed ones for
+# `negative_ttl` seconds, so a crawl doesn't pay for `getaddrinfo()` on every
+# new connection, or keep hammering the resolver for a dead domain.
+
+import time
+import socket
+import asyncio
+import logging
+import functools
+import collections
+import http.client
+import urllib.parse
+import urllib.request
+import concurrent.futures
+
+from threading import Lock
+
+from . import Deadline
+from . import FetchTiming
+
+
+class DnsCache(object):
+	'''
+	Thread-safe DNS cache.
+
+	Params:
+		``ttl`` - How long (in seconds) successful lookups are cached for.
+		``negative_ttl`` - How long failed lookups are cached for.
+		``max_entries`` - Maximum number of cached lookups. The oldest are dropped first.
+		``resolver`` - The actual lookup function. Takes the same arguments as
+			`socket.getaddrinfo()`.
+
+	The system resolver doesn't tell us the record TTLs, so all entries get the
+	same lifetime. Lookups are cached per host, regardless of the port they were
+	for, with the port filled in to the returned addresses.
+	'''
+
+	def __init__(self,
+			ttl          : float = 300,
+			negative_ttl : float = 30,
+			max_entries  : int   = 4096,
+			resolver             = socket.getaddrinfo,
+			):
+		self.log = logging.getLogger("Main.WebRequest.DnsCache")
+
+		self.ttl          = ttl
+		self.negative_ttl = negative_ttl
+		self.max_entries  = max_entries
+		self.resolver     = resolver
+
+		self._lock    = Lock()
+		self._entries = collections.OrderedDict()
+
+		self.hits              = 0
+		self.negative_hits     = 0
+		self.misses            = 0
+		self.failures          = 0
+		self.total_lookup_time = 0.0
+		self.max_lookup_time   = 0.0
+
+	@staticmethod
+	def _key(host):
+		return host.lower()
+
+	@staticmethod
+	def _with_port(addresses, port):
+		# The `sockaddr` is (host, port) for IPv4, and (host, port, flowinfo, scope_id) for IPv6.
+		return [
+				(family, socktype, proto, canonname, (sockaddr[0], port) + tuple(sockaddr[2:]))
+				for family, socktype, proto, canonname, sockaddr in addresses
+			]
+
+	def _cached(self, host):
+		'''
+		Returns a 2-tuple of (found, result), where result is either the address
+		list or the exception from the failed lookup.
+		'''
+		key = self._key(host)
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is None:
+				return False, None
+
+			expires, result = entry
+			if expires < time.monotonic():
+				del self._entries[key]
+				return False, None
+
+			if isinstance(result, Exception):
+				self.negative_hits += 1
+			else:
+				self.hits += 1
+			return True, result
+
+	def _lookup(self, host):
+		start = time.monotonic()
+		try:
+			result = self.resolver(host, None, 0, socket.SOCK_STREAM)
+			expires = time.monotonic() + self.ttl
+		except socket.gaierror as err:
+			result = err
+			expires = time.monotonic() + self.negative_ttl
+
+		elapsed = time.monotonic() - start
+		if elapsed > 0.5:
+			self.log.warning("Resolving %s took %0.2f seconds", host, elapsed)
+
+		with self._lock:
+			self.misses += 1
+			if isinstance(result, Exception):
+				self.failures += 1
+			self.total_lookup_time += elapsed
+			self.max_lookup_time    = max(self.max_lookup_time, elapsed)
+
+			self._entries[self._key(host)] = (expires, result)
+			self._entries.move_to_end(self._key(host))
+			while len(self._entries) > self.max_entries:
+				self._entries.popitem(last=False)
+
+		return result
+
+	def resolve(self, host:str, port:int):
+		'''
+		Resolve `host`, returning a list of `getaddrinfo()` 5-tuples. Raises `socket.gaierror`
+		if the lookup fails (or failed recently).
+		'''
+		found, result = self._cached(host)
+		if not found:
+			result = self._lookup(host)
+
+		if isinstance(result, Exception):
+			raise result
+		return self._with_port(result, port)
+
+	async def resolve_async(self, host:str, port:int):
+		'''
+		Equivalent of `resolve()`, for use from a event loop. Cache misses are resolved
+		in the default executor.
+		'''
+		found, result = self._cached(host)
+		if not found:
+			result = await asyncio.get_event_loop().run_in_executor(None, self._lookup, host)
+
+		if isinstance(result, Exception):
+			raise result
+		return self._with_port(result, port)
+
+	def invalidate(self, host:str, port:int=None):
+		'''
+		Drop the cached lookup for `host`. Lookups aren't per-port, so `port` is only accepted
+		so callers can pass the address they failed to connect to.
+		'''
+		with self._lock:
+			self._entries.pop(self._key(host), None)
+
+	def prefetch(self, hosts, concurrency:int=8, wait:bool=True):
+		'''
+		Resolve `hosts` (hostnames, or URLs) ahead of time, e.g. before starting a crawl.
+
+		If `wait` is true, returns a dict of host -> None for hosts that resolved, or the
+		exception for those that didn't. Otherwise, the lookups are done in the background,
+		and this returns the `concurrent.futures.Future` for each host as a dict.
+		'''
+		targets = set()
+		for host in hosts:
+			if "://" in host:
+				host = urllib.parse.urlsplit(host).hostname
+			targets.add(host)
+
+		executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(targets))))
+		futures = {
+				host : executor.submit(self.resolve, host, 0)
+				for host in targets
+			}
+		executor.shutdown(wait=False)
+
+		if not wait:
+			return futures
+
+		ret = {}
+		for host, future in futures.items():
+			try:
+				future.result()
+				ret[host] = None
+			except socket.gaierror as err:
+				ret[host] = err
+		return ret
+
+	def create_connection(self, address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None, timing=None):
+		'''
+		Drop-in replacement for `socket.create_connection()` that uses the cache. If
+		`timing` (a `FetchTiming`) is passed, the time taken by the lookup is added to it.
+		'''
+		host, port = address
+		err = None
+		if timing is not None:
+			with timing.phase('dns'):
+				addresses = self.resolve(host, port)
+		else:
+			addresses = self.resolve(host, port)
+
+		for af, socktype, proto, _, sockaddr in addresses:
+			sock = None
+			try:
+				sock = socket.socket(af, socktype, proto)
+				if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+					sock.settimeout(timeout)
+				if source_address:
+					sock.bind(source_address)
+				sock.connect(sockaddr)
+				return sock
+
+			except OSError as e:
+				err = e
+				if sock is not None:
+					sock.close()
+
+		# None of the addresses worked. The host may have moved, so look it up
+		# again next time.
+		self.invalidate(host, port)
+		if err is not None:
+			raise err
+		raise OSError("getaddrinfo returns an empty list")
+
+	def attach(self, conn:http.client.HTTPConnection, timing=None):
+		'''
+		Make a `http.client` connection resolve it's host through the cache, optionally
+		recording the lookup time in `timing`.
+		'''
+		if timing is None:
+			conn._create_connection = self.create_connection
+		else:
+			conn._create_connection = functools.partial(self.create_connection, timing=timing)
+		return conn
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+
+	def stats(self):
+		with self._lock:
+			lookups = self.hits + self.negative_hits + self.misses
+			return {
+				'lookups'           : lookups,
+				'hits'              : self.hits,
+				'negative_hits'     : self.negative_hits,
+				'misses'            : self.misses,
+				'failures'          : self.failures,
+				'entries'           : len(self._entries),
+				'total_lookup_time' : self.total_lookup_time,
+				'max_lookup_time'   : self.max_lookup_time,
+				'mean_lookup_time'  : self.total_lookup_time / self.misses if self.misses else 0.0,
+			}
+
+
+class _ResolvingHandlerMixin(object):
+	def _factory(self, http_class, req):
+		# `do_open()` only passes the one timeout (used for the connect), so the
+		# read timeout is applied once the socket is connected.
+		read_timeout = getattr(req, "read_timeout", None)
+		timing       = getattr(req, "timing", None)
+		def make_connection(host, **kwargs):
+			conn = self.dns_cache.attach(http_class(host, **kwargs), timing)
+			if read_timeout is not None:
+				Deadline.attach_read_timeout(conn, read_timeout)
+			if timing is not None:
+				FetchTiming.attach_timing(conn, timing)
+			return conn
+		return make_connection
+
+
+class ResolvingHTTPHandler(_ResolvingHandlerMixin, urllib.request.HTTPHandler):
+	'''
+	Plain (non-pooled) HTTP handler that resolves through a `DnsCache`.
+	'''
+	def __init__(self, dns_cache:DnsCache, debuglevel=0):
+		super().__init__(debuglevel=debuglevel)
+		self.dns_cache = dns_cache
+
+	def http_open(self, req):
+		return self.do_open(self._factory(http.client.HTTPConnection, req), req)
+
+
+class ResolvingHTTPSHandler(_ResolvingHandlerMixin, urllib.request.HTTPSHandler):
+	'''
+	Plain (non-pooled) HTTPS handler that resolves through a `DnsCache`.
+	'''
+	def __init__(self, dns_cache:DnsCache, debuglevel=0, context=None):
+		super().__init__(debuglevel=debuglevel, context=context)
+		self.dns_cache = dns_cache
+
+	def https_open(self, req):
+		return self.do_open(self._factory(http.client.HTTPSConnection, req), req, context=self._context)
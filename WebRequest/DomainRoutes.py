@@ -0,0 +1,272 @@
+#!/usr/bin/python3
+
+# Per-domain routing table.
+#
+# Maps domains to a `DomainPolicy` (which WAF the site is behind, how it
+# should be fetched, how hard it can be hit, and which cookies have to be present
+# before a request is made). Entries apply to the domain and all of its
+# subdomains, with the most specific entry winning, so the table is kept as a
+# trie of reversed domain labels (`com` -> `example` -> `www`), and a lookup
+# is one dict access per label of the hostname.
+#
+# The table can be loaded from a dict or a JSON file, and reloaded while in use.
+# A reload builds a new trie and swaps it in, so lookups never see a half-loaded
+# table.
+
+import os
+import json
+import time
+import logging
+import urllib.parse
+
+from threading import Lock
+
+from . import Domain_Constants
+
+
+WAF_SUCURI     = "sucuri"
+WAF_CLOUDFLARE = "cloudflare"
+
+TRANSPORT_URLLIB   = "urllib"
+TRANSPORT_CHROMIUM = "chromium"
+
+WAF_TYPES  = (WAF_SUCURI, WAF_CLOUDFLARE)
+TRANSPORTS = (TRANSPORT_URLLIB, TRANSPORT_CHROMIUM)
+
+# Cookies that show we've already gotten through a WAF, used when a policy doesn't
+# specify its own. There's no cloudflare entry, since we've got no way of telling
+# whether a clearance cookie is still any good.
+DEFAULT_WAF_COOKIES = {
+	WAF_SUCURI : ("sucuri_cloudproxy_uuid_", ),
+}
+
+
+class DomainPolicy(object):
+	'''
+	How requests to a domain should be handled.
+
+	Params:
+		``waf`` - WAF the site is wrapped in (`WAF_SUCURI` or `WAF_CLOUDFLARE`), if any.
+		``transport`` - How `getpage()` should fetch content (`TRANSPORT_URLLIB` or
+			`TRANSPORT_CHROMIUM`). None means the default (urllib).
+		``rate_limit`` - Maximum requests per second to each host under the domain.
+		``max_in_flight`` - Maximum concurrent requests to each host under the domain.
+		``cookies`` - Names (or name prefixes) of cookies that have to be present before
+			a request is made. If they're missing, and the site has a `waf`, the WAF
+			step-through is done pre-emptively. Defaults to the usual cookies for the `waf`.
+	'''
+
+	__slots__ = ('waf', 'transport', 'rate_limit', 'max_in_flight', 'cookies')
+
+	def __init__(self,
+			waf           : str   = None,
+			transport     : str   = None,
+			rate_limit    : float = None,
+			max_in_flight : int   = None,
+			cookies       : list  = None,
+			):
+		if waf is not None and waf not in WAF_TYPES:
+			raise ValueError("Unknown WAF type %r (must be one of %s)" % (waf, ", ".join(WAF_TYPES)))
+		if transport is not None and transport not in TRANSPORTS:
+			raise ValueError("Unknown transport %r (must be one of %s)" % (transport, ", ".join(TRANSPORTS)))
+
+		self.waf           = waf
+		self.transport     = transport
+		self.rate_limit    = rate_limit
+		self.max_in_flight = max_in_flight
+
+		if cookies is None:
+			cookies = DEFAULT_WAF_COOKIES.get(waf, ())
+		self.cookies = tuple(cookies)
+
+	@classmethod
+	def from_dict(cls, conf:dict):
+		return cls(**conf)
+
+	def to_dict(self):
+		return {key : getattr(self, key) for key in self.__slots__}
+
+	def __eq__(self, other):
+		return isinstance(other, DomainPolicy) and self.to_dict() == other.to_dict()
+
+	def __repr__(self):
+		return "<DomainPolicy %s>" % ", ".join("%s=%r" % (key, val) for key, val in self.to_dict().items() if val)
+
+
+def _labels(domain:str):
+	return [label for label in reversed(domain.strip().strip(".").lower().split(".")) if label]
+
+
+def _build(routes:dict):
+	root = {}
+	for domain, policy in routes.items():
+		if not isinstance(policy, DomainPolicy):
+			policy = DomainPolicy.from_dict(policy)
+		labels = _labels(domain)
+		if not labels:
+			raise ValueError("Invalid domain %r in routing table" % (domain, ))
+		node = root
+		for label in labels:
+			node = node.setdefault(label, {})
+		# Labels are never None, so the policy can't collide with a child.
+		node[None] = policy
+	return root
+
+
+class DomainRoutes(object):
+	'''
+	Thread-safe domain -> `DomainPolicy` routing table.
+
+	Params:
+		``routes`` - Dict of domain -> `DomainPolicy` (or a dict of `DomainPolicy` kwargs).
+		``path`` - JSON file to load the routes from, in the same format as `routes`.
+			Entries from the file take precedence.
+		``reload_interval`` - If set, the file is checked for changes at most this often
+			(in seconds), from `lookup()`, and reloaded if it changed.
+
+	An entry for `example.com` applies to `example.com` and all its subdomains, unless
+	there's a more specific entry (e.g. for `www.example.com`).
+	'''
+
+	def __init__(self, routes:dict=None, path:str=None, reload_interval:float=None):
+		self.log = logging.getLogger("Main.WebRequest.DomainRoutes")
+
+		self.path            = path
+		self.reload_interval = reload_interval
+
+		self._lock       = Lock()
+		self._routes     = dict(routes or {})
+		self._root       = {}
+		self._mtime      = None
+		self._last_check = 0.0
+
+		self.lookups = 0
+		self.hits    = 0
+		self.reloads = 0
+
+		self.reload()
+
+	@classmethod
+	def default(cls):
+		'''
+		Routing table with the sites listed in `Domain_Constants`.
+		'''
+		routes = {}
+		for netloc in Domain_Constants.CF_GARBAGE_SITE_NETLOCS:
+			routes[netloc] = DomainPolicy(waf=WAF_CLOUDFLARE)
+		for netloc in Domain_Constants.SUCURI_GARBAGE_SITE_NETLOCS:
+			routes[netloc] = DomainPolicy(waf=WAF_SUCURI)
+		return cls(routes)
+
+	def _read_file(self):
+		with open(self.path, "r") as fp:
+			return json.load(fp)
+
+	def reload(self, routes:dict=None):
+		'''
+		Rebuild the table, from `routes` (which replaces the routes passed to the
+		constructor) if given, and the file (if there is one). If loading fails, the
+		exception propagates, and the current table is left in place.
+		'''
+		with self._lock:
+			base = self._routes if routes is None else dict(routes)
+
+		merged = dict(base)
+		mtime = None
+		if self.path:
+			mtime = os.stat(self.path).st_mtime_ns
+			merged.update(self._read_file())
+
+		root = _build(merged)
+
+		with self._lock:
+			self._routes     = base
+			self._root       = root
+			self._mtime      = mtime
+			self._last_check = time.monotonic()
+			self.reloads    += 1
+
+		self.log.info("Loaded %s domain routes", len(merged))
+
+	def _check_file(self):
+		now = time.monotonic()
+		with self._lock:
+			if now - self._last_check < self.reload_interval:
+				return
+			self._last_check = now
+			known = self._mtime
+
+		try:
+			if os.stat(self.path).st_mtime_ns != known:
+				self.reload()
+		except (OSError, ValueError, TypeError):
+			# Probably caught the file mid-write. Keep the old table, and try again next time.
+			self.log.exception("Failed to reload domain routes from %s", self.path)
+
+	def set(self, domain:str, policy):
+		'''
+		Add or replace the entry for `domain`.
+		'''
+		with self._lock:
+			routes = dict(self._routes)
+		routes[domain] = policy
+		self.reload(routes)
+
+	def remove(self, domain:str):
+		with self._lock:
+			routes = dict(self._routes)
+		routes.pop(domain, None)
+		self.reload(routes)
+
+	def lookup(self, url_or_netloc:str):
+		'''
+		Policy for the most specific entry covering the host of `url_or_netloc`,
+		or None if there isn't one.
+		'''
+		if self.path and self.reload_interval is not None:
+			self._check_file()
+
+		if "://" in url_or_netloc:
+			host = urllib.parse.urlsplit(url_or_netloc).hostname or ""
+		else:
+			host = url_or_netloc.rsplit(":", 1)[0] if url_or_netloc.count(":") == 1 else url_or_netloc
+
+		# Grab the current trie. A concurrent reload swaps in a whole new one, so
+		# there's no need to hold the lock while walking it.
+		node = self._root
+		found = node.get(None)
+		for label in _labels(host):
+			node = node.get(label)
+			if node is None:
+				break
+			found = node.get(None, found)
+
+		with self._lock:
+			self.lookups += 1
+			if found is not None:
+				self.hits += 1
+
+		return found
+
+	def routes(self):
+		'''
+		All the entries in the table, as a dict of domain -> `DomainPolicy`.
+		'''
+		ret = {}
+		def walk(node, labels):
+			for key, child in node.items():
+				if key is None:
+					ret[".".join(reversed(labels))] = child
+				else:
+					walk(child, labels + [key])
+		walk(self._root, [])
+		return ret
+
+	def stats(self):
+		with self._lock:
+			return {
+				'lookups' : self.lookups,
+				'hits'    : self.hits,
+				'reloads' : self.reloads,
+				'domains' : len(self.routes()),
+			}
@@ -35,9 +35,46 @@ class FetchFailureError(WebGetException):
 				"{%s}" % self.err_content
 			)
 
+class CircuitOpenError(FetchFailureError):
+	'''
+	The circuit breaker for the host is open, so the request wasn't even attempted.
+	`retry_in` is roughly how long until the host will be tried again.
+	'''
+	def __init__(self, message, url, retry_in=None):
+		super().__init__(message, url=url, err_reason="Circuit open")
+		self.retry_in = retry_in
+
+	def __repr__(self):
+		return '<CircuitOpenError %s for url: %s (retry in %0.1f seconds)>' % (self.message, self.url, self.retry_in or 0)
+
+class FetchTimeoutError(FetchFailureError):
+	'''
+	The total time allowed for the fetch (`total_timeout`) ran out, including any
+	retries, redirects and WAF step-throughs. `timeout` is the total, and `elapsed`
+	is how long the fetch had actually been going when it was given up on.
+	'''
+	def __init__(self, message, url, timeout=None, elapsed=None):
+		super().__init__(message, url=url, err_reason="Timed out")
+		self.timeout = timeout
+		self.elapsed = elapsed
+
+	def __repr__(self):
+		return '<FetchTimeoutError %s for url: %s (%0.1f of %0.1f seconds)>' % (self.message, self.url, self.elapsed or 0, self.timeout or 0)
+
 class RedirectedError(WebGetException):
 	pass
 
+class ContentTooLargeError(WebGetException):
+	def __init__(self, message, url, limit=None, size=None, headers=None):
+		super().__init__(message, url=url)
+
+		self.limit   = limit
+		self.size    = size
+		self.headers = headers
+
+	def __repr__(self):
+		return '<ContentTooLargeError %s (%s > %s bytes) for url %s>' % (self.message, self.size, self.limit, self.url, )
+
 
 # Specialized exceptions for garbage site
 # "protection" bullshit
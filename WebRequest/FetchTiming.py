@@ -0,0 +1,170 @@
+#!/usr/bin/python3
+
+# Per-phase timing of a fetch.
+#
+# Each fetch gets a `FetchTiming` record, which is threaded down through the
+# request (the same way as the `Deadline`), so the connection machinery can
+# note how long name resolution, connecting and the TLS handshake took, and the
+# content pipeline can note how long decompression, WAF checking, decoding and
+# parsing took. Phases are accumulated, so retries and redirects add up.
+#
+# The record is handed to any registered timing listeners once the fetch is
+# done, and can also be returned to the caller (`returnTiming=True`).
+
+import time
+import http.client
+import contextlib
+
+
+# The phases, in the order they happen. Phases that weren't measured (e.g. `tls`
+# for plain http, or `dns` when going through a socks proxy, where the lookup is
+# part of `connect`) are absent from `phases`.
+PHASES = (
+	'dns',           # Name resolution (through the DNS cache).
+	'connect',       # TCP connect (including the lookup, if it can't be separated).
+	'tls',           # TLS handshake.
+	'ttfb',          # From sending the request to getting the response headers.
+	'download',      # Reading the body.
+	'decompress',    # Content-Encoding decompression.
+	'waf_check',     # Checking the content for WAF interstitials.
+	'decode',        # Charset detection and decoding.
+	'parse',         # Parsing (`getSoup()` and `getJson()` only).
+	'waf_step',      # WAF step-throughs.
+)
+
+TRANSPORT_URLLIB   = "urllib"
+TRANSPORT_ASYNC    = "asyncio"
+TRANSPORT_CACHE    = "cache"
+TRANSPORT_MEMO     = "memo"
+TRANSPORT_CHROMIUM = "chromium"
+
+
+class FetchTiming(object):
+	'''
+	Timing record for the fetch of `url`.
+
+	Attributes:
+		``phases`` - dict of phase name -> seconds. See `PHASES`.
+		``total`` - Wall-clock time for the whole fetch (set when it's finished).
+		``attempts`` - Number of requests made. `retries` is this, less one.
+		``sent_bytes`` - Size of the request bodies sent (e.g. POST data), over all attempts.
+		``wire_bytes`` - Size of the body as received.
+		``content_bytes`` - Size of the body after decompression.
+		``transport`` - What handled the fetch (one of the `TRANSPORT_*` values).
+		``status`` - HTTP status of the final response, if there was one.
+		``error`` - The exception the fetch failed with, if it failed.
+	'''
+
+	__slots__ = ('url', 'phases', 'started', 'total', 'attempts', 'sent_bytes', 'wire_bytes', 'content_bytes', 'transport', 'status', 'error')
+
+	def __init__(self, url:str, transport:str=None):
+		self.url           = url
+		self.phases        = {}
+		self.started       = time.monotonic()
+		self.total         = None
+		self.attempts      = 0
+		self.sent_bytes    = 0
+		self.wire_bytes    = 0
+		self.content_bytes = 0
+		self.transport     = transport
+		self.status        = None
+		self.error         = None
+
+	@property
+	def retries(self):
+		return max(0, self.attempts - 1)
+
+	def add(self, phase:str, seconds:float):
+		self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+	def get(self, phase:str):
+		return self.phases.get(phase, 0.0)
+
+	@contextlib.contextmanager
+	def phase(self, phase:str):
+		'''
+		Context manager that adds the time spent in the block to `phase`.
+		'''
+		start = time.monotonic()
+		try:
+			yield self
+		finally:
+			self.add(phase, time.monotonic() - start)
+
+	def setup_time(self):
+		'''
+		Time spent setting up connections (lookups, connecting and handshakes).
+		'''
+		return self.get('dns') + self.get('connect') + self.get('tls')
+
+	def finish(self):
+		if self.total is None:
+			self.total = time.monotonic() - self.started
+
+	def as_dict(self):
+		return {
+			'url'           : self.url,
+			'transport'     : self.transport,
+			'status'        : self.status,
+			'error'         : repr(self.error) if self.error is not None else None,
+			'total'         : self.total,
+			'attempts'      : self.attempts,
+			'retries'       : self.retries,
+			'sent_bytes'    : self.sent_bytes,
+			'wire_bytes'    : self.wire_bytes,
+			'content_bytes' : self.content_bytes,
+			'phases'        : {phase : self.phases[phase] for phase in sorted(self.phases, key=_phase_order)},
+		}
+
+	def __repr__(self):
+		phases = ", ".join("%s=%0.3f" % (phase, self.phases[phase]) for phase in sorted(self.phases, key=_phase_order))
+		return "<FetchTiming %s via %s: %0.3f seconds (%s)>" % (self.url, self.transport, self.total or 0, phases)
+
+
+def _phase_order(phase):
+	return PHASES.index(phase) if phase in PHASES else len(PHASES)
+
+
+def request_body_size(req):
+	'''
+	Size of the body of the `urllib.request.Request` `req`, or 0 if it doesn't have one
+	(or it's a file or iterable, which we can't size without consuming it).
+	'''
+	data = req.data
+	if isinstance(data, str):
+		return len(data.encode("iso-8859-1"))
+	if isinstance(data, (bytes, bytearray, memoryview)):
+		return len(data)
+	return 0
+
+
+def attach_timing(conn, timing:FetchTiming):
+	'''
+	Make a new `http.client` connection record how long it took to connect, and (for
+	https) how long the TLS handshake took, in `timing`. If the connection resolves
+	it's host through the DNS cache, the cache records the lookup itself.
+	'''
+	create  = conn._create_connection
+	connect = conn.connect
+
+	def create_connection(*args, **kwargs):
+		dns = timing.get('dns')
+		start = time.monotonic()
+		try:
+			return create(*args, **kwargs)
+		finally:
+			timing.add('connect', time.monotonic() - start - (timing.get('dns') - dns))
+
+	def timed_connect():
+		setup = timing.setup_time()
+		start = time.monotonic()
+		try:
+			return connect()
+		finally:
+			# Whatever `connect()` spent outside of making the TCP connection is the handshake.
+			if isinstance(conn, http.client.HTTPSConnection):
+				timing.add('tls', time.monotonic() - start - (timing.setup_time() - setup))
+
+	conn._create_connection = create_connection
+	conn.connect = timed_connect
+	return conn
@@ -18,7 +18,6 @@ import traceback
 
 import logging
 import zlib
-import bs4
 import re
 import string
 import gzip
@@ -29,6 +28,8 @@ import base64
 
 import random
 
+from . import Deadline
+
 class HeadRequest(urllib.request.Request):
 	def get_method(self):
 		# Apparently HEAD is now being blocked. Because douche.
@@ -57,6 +58,47 @@ class HTTPRedirectBlockerErrorHandler(urllib.request.HTTPErrorProcessor):    # p
 
 	https_response = http_response
 
+def get_redirect_url(req, fp, code, msg, headers):
+	'''
+	Resolve the target of a redirect response against the request URL.
+	Returns None if the response doesn't actually specify where to go.
+	'''
+	# Some servers (incorrectly) return multiple Location headers
+	# (so probably same goes for URI).  Use first header.
+	if "location" in headers:
+		newurl = headers["location"]
+	elif "uri" in headers:
+		newurl = headers["uri"]
+	else:
+		return None
+
+	# fix a possible malformed URL
+	urlparts = urllib.parse.urlparse(newurl)
+
+	# For security reasons we don't allow redirection to anything other
+	# than http, https or ftp.
+
+	if urlparts.scheme not in ('http', 'https', 'ftp', ''):
+		raise urllib.error.HTTPError(
+			newurl, code,
+			"%s - Redirection to url '%s' is not allowed" % (msg, newurl),
+			headers, fp)
+
+	if not urlparts.path:
+		urlparts = list(urlparts)
+		urlparts[2] = "/"
+
+	newurl = urllib.parse.urlunparse(urlparts)
+
+	# http.client.parse_headers() decodes as ISO-8859-1.  Recover the
+	# original bytes and percent-encode non-ASCII bytes, and any special
+	# characters such as the space.
+	newurl = urllib.parse.quote(
+		newurl, encoding="iso-8859-1", safe=string.punctuation)
+	newurl = urllib.parse.urljoin(req.full_url, newurl)
+
+	return newurl
+
 # Custom redirect handler to work around
 # issue https://bugs.python.org/issue17214
 class HTTPRedirectHandler(urllib.request.HTTPRedirectHandler):
@@ -65,40 +107,10 @@ class HTTPRedirectHandler(urllib.request.HTTPRedirectHandler):
 	# have already seen.  Do this by adding a handler-specific
 	# attribute to the Request object.
 	def http_error_302(self, req, fp, code, msg, headers):
-		# Some servers (incorrectly) return multiple Location headers
-		# (so probably same goes for URI).  Use first header.
-		if "location" in headers:
-			newurl = headers["location"]
-		elif "uri" in headers:
-			newurl = headers["uri"]
-		else:
+		newurl = get_redirect_url(req, fp, code, msg, headers)
+		if newurl is None:
 			return
 
-		# fix a possible malformed URL
-		urlparts = urllib.parse.urlparse(newurl)
-
-		# For security reasons we don't allow redirection to anything other
-		# than http, https or ftp.
-
-		if urlparts.scheme not in ('http', 'https', 'ftp', ''):
-			raise urllib.error.HTTPError(
-				newurl, code,
-				"%s - Redirection to url '%s' is not allowed" % (msg, newurl),
-				headers, fp)
-
-		if not urlparts.path:
-			urlparts = list(urlparts)
-			urlparts[2] = "/"
-
-		newurl = urllib.parse.urlunparse(urlparts)
-
-		# http.client.parse_headers() decodes as ISO-8859-1.  Recover the
-		# original bytes and percent-encode non-ASCII bytes, and any special
-		# characters such as the space.
-		newurl = urllib.parse.quote(
-			newurl, encoding="iso-8859-1", safe=string.punctuation)
-		newurl = urllib.parse.urljoin(req.full_url, newurl)
-
 		# XXX Probably want to forget about the state of the current
 		# request, although that might interact poorly with other
 		# handlers that also use handler-specific request attributes
@@ -123,7 +135,18 @@ class HTTPRedirectHandler(urllib.request.HTTPRedirectHandler):
 		fp.read()
 		fp.close()
 
-		return self.parent.open(new, timeout=req.timeout)
+		# Carry the read timeout, timing record and the deadline for the fetch over to the new request,
+		# so following redirects can't run past the deadline.
+		timeout  = req.timeout
+		deadline = getattr(req, "deadline", None)
+		new.read_timeout = getattr(req, "read_timeout", None)
+		new.deadline     = deadline
+		new.timing       = getattr(req, "timing", None)
+		if deadline is not None:
+			timeout = deadline.clamp(timeout)
+			new.read_timeout = deadline.clamp(new.read_timeout)
+
+		return self.parent.open(new, timeout=timeout)
 
 class PreemptiveBasicAuthHandler(urllib.request.HTTPBasicAuthHandler):
 	'''Preemptive basic auth.
@@ -0,0 +1,133 @@
+#!/usr/bin/python3
+
+# Request hedging, to cut down on tail latency.
+#
+# If a request hasn't gotten response headers back after a while, a second,
+# identical request is fired off, and whichever one finishes first is used.
+# The "while" is either a fixed delay, or the 95th percentile time-to-headers
+# we've seen for the host. To keep this from turning into a load multiplier,
+# hedges are limited to a fraction of the total number of requests.
+
+import math
+import logging
+import collections
+import urllib.parse
+
+from threading import Lock
+
+
+class HedgePolicy(object):
+	'''
+	Thread-safe hedging policy. Pass the same policy to multiple instances to
+	share the budget and the per-host latency stats between them.
+
+	Params:
+		``delay`` - Fixed delay (in seconds) before a request is hedged. If None, the host's
+			learned `percentile` time-to-headers is used, and requests to a host are only
+			hedged once there are at least `min_samples` measurements for it.
+		``percentile`` - Percentile of the time-to-headers used as the hedge delay.
+		``budget`` - Hedges are limited to this fraction of the hedge-enabled requests.
+		``min_samples`` - Minimum number of measurements for a learned delay.
+		``min_delay`` - Floor on the hedge delay.
+		``window`` - Number of time-to-headers measurements kept for each host.
+		``max_hosts`` - Maximum number of hosts measurements are kept for. The least
+			recently used hosts are dropped first.
+	'''
+
+	def __init__(self,
+			delay       : float = None,
+			percentile  : float = 0.95,
+			budget      : float = 0.05,
+			min_samples : int   = 20,
+			min_delay   : float = 0.05,
+			window      : int   = 200,
+			max_hosts   : int   = 1024,
+			):
+		self.log = logging.getLogger("Main.WebRequest.HedgePolicy")
+
+		self.delay       = delay
+		self.percentile  = percentile
+		self.budget      = budget
+		self.min_samples = min_samples
+		self.min_delay   = min_delay
+		self.window      = window
+		self.max_hosts   = max_hosts
+
+		self._lock      = Lock()
+		self._latencies = collections.OrderedDict()
+
+		self.requests      = 0
+		self.hedges        = 0
+		self.hedge_wins    = 0
+		self.budget_denied = 0
+
+	@staticmethod
+	def _netloc(url):
+		return urllib.parse.urlsplit(url).netloc.lower()
+
+	def observe(self, url:str, latency:float):
+		'''
+		Record the time it took to get response headers from the host for `url`.
+		'''
+		netloc = self._netloc(url)
+		with self._lock:
+			samples = self._latencies.get(netloc)
+			if samples is None:
+				samples = collections.deque(maxlen=self.window)
+				self._latencies[netloc] = samples
+				while len(self._latencies) > self.max_hosts:
+					self._latencies.popitem(last=False)
+			else:
+				self._latencies.move_to_end(netloc)
+			samples.append(latency)
+
+	def _learned(self, samples):
+		# Must be called with the lock held.
+		if not samples or len(samples) < self.min_samples:
+			return None
+		ordered = sorted(samples)
+		return ordered[max(0, math.ceil(self.percentile * len(ordered)) - 1)]
+
+	def hedge_delay(self, url:str):
+		'''
+		Called at the start of a hedge-enabled request. Returns how long to wait for the
+		response headers before hedging, or None if the request can't be hedged (yet).
+		'''
+		with self._lock:
+			self.requests += 1
+			if self.delay is not None:
+				delay = self.delay
+			else:
+				delay = self._learned(self._latencies.get(self._netloc(url)))
+
+		if delay is None:
+			return None
+		return max(self.min_delay, delay)
+
+	def try_hedge(self):
+		'''
+		Take a hedge out of the budget. Returns False if the budget is used up.
+		'''
+		with self._lock:
+			if self.hedges + 1 > self.budget * self.requests:
+				self.budget_denied += 1
+				return False
+			self.hedges += 1
+			return True
+
+	def hedge_won(self):
+		with self._lock:
+			self.hedge_wins += 1
+
+	def stats(self):
+		with self._lock:
+			return {
+				'requests'      : self.requests,
+				'hedges'        : self.hedges,
+				'hedge_wins'    : self.hedge_wins,
+				'budget_denied' : self.budget_denied,
+				'hedge_delays'  : {
+					netloc : self._learned(samples)
+					for netloc, samples in self._latencies.items()
+				},
+			}
@@ -0,0 +1,379 @@
+#!/usr/bin/python3
+
+# Per-host politeness scheduling.
+#
+# Each netloc gets a token bucket (requests/second, with a burst allowance) and
+# a cap on the number of concurrent requests. When a host starts returning
+# 429/503, we either respect the `Retry-After` it sends, or back off the rate
+# for that host, and then slowly ramp back up as requests start succeeding.
+#
+# Hosts that haven't been used for a while (and have nothing pending against
+# them) are forgotten, so a long crawl over many hosts doesn't keep the state
+# for every host it ever touched.
+
+import time
+import asyncio
+import email.utils
+import datetime
+import contextlib
+import logging
+import urllib.parse
+
+from threading import Condition
+
+
+def parse_retry_after(value):
+	'''
+	Parse a `Retry-After` header value, which can be either a number of seconds,
+	or a HTTP-date. Returns the delay in seconds, or None if the value is missing
+	or garbage.
+	'''
+	if value is None:
+		return None
+
+	value = value.strip()
+	if not value:
+		return None
+
+	try:
+		return max(0.0, float(value))
+	except ValueError:
+		pass
+
+	try:
+		then = email.utils.parsedate_to_datetime(value)
+	except (TypeError, ValueError, IndexError):
+		return None
+
+	if then is None:
+		return None
+	if then.tzinfo is None:
+		then = then.replace(tzinfo=datetime.timezone.utc)
+
+	return max(0.0, (then - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+class _HostState(object):
+	def __init__(self, rate, burst, max_in_flight):
+		self.rate          = rate
+		self.base_rate     = rate
+		self.burst         = burst
+		self.max_in_flight = max_in_flight
+
+		self.tokens        = burst
+		self.last_refill   = time.monotonic()
+		self.blocked_until = 0.0
+		self.in_flight     = 0
+		self.last_used     = self.last_refill
+
+		self.requests      = 0
+		self.throttled     = 0
+		self.total_wait    = 0.0
+		self.max_wait      = 0.0
+
+	def refill(self, now):
+		if self.rate:
+			self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+		self.last_refill = now
+
+	def delay(self, now):
+		'''
+		How long until a request is allowed, or None if it has to wait for a
+		in-flight request to finish.
+		'''
+		if self.max_in_flight and self.in_flight >= self.max_in_flight:
+			return None
+
+		if now < self.blocked_until:
+			return self.blocked_until - now
+
+		if self.rate:
+			self.refill(now)
+			if self.tokens < 1:
+				return (1 - self.tokens) / self.rate
+
+		return 0
+
+	def idle(self, now, idle_timeout):
+		'''
+		True if the host hasn't been used for `idle_timeout` seconds, and dropping it's
+		state wouldn't change anything (nothing in flight, not blocked or backed off,
+		and a full bucket).
+		'''
+		if self.in_flight or now - self.last_used < idle_timeout:
+			return False
+		if now < self.blocked_until or self.rate != self.base_rate:
+			return False
+		if self.rate:
+			self.refill(now)
+			return self.tokens >= self.burst
+		return True
+
+
+class HostScheduler(object):
+	'''
+	Thread-safe, per-netloc request scheduler.
+
+	Params:
+		``rate`` - Default maximum requests per second for each host. `None` means unlimited.
+		``burst`` - Number of requests that can be made back-to-back before the rate limit
+			kicks in.
+		``max_in_flight`` - Default maximum number of concurrent requests for each host.
+			`None` means unlimited.
+		``min_rate`` - When a host returns 429/503 without a `Retry-After`, it's rate is
+			halved, down to this floor.
+		``max_retry_after`` - Cap on how long a `Retry-After` can hold off requests to a
+			host, in seconds, so a misbehaving server can't stall a worker indefinitely.
+			A fetch with a deadline never waits past it, but one without one (no
+			`total_timeout`) can block for up to this long.
+		``idle_timeout`` - Hosts that haven't been used for this many seconds, with nothing
+			in flight and no throttling in effect, are dropped (along with their counters in
+			`stats()`). `None` keeps them forever.
+
+	Per-host settings can be overridden with `set_host_limits()`.
+	'''
+
+	def __init__(self,
+			rate            : float = None,
+			burst           : int   = 1,
+			max_in_flight   : int   = None,
+			min_rate        : float = 0.05,
+			max_retry_after : float = 120,
+			idle_timeout    : float = 600,
+			):
+		self.log = logging.getLogger("Main.WebRequest.HostScheduler")
+
+		self.rate            = rate
+		self.burst           = max(1, burst)
+		self.max_in_flight   = max_in_flight
+		self.min_rate        = min_rate
+		self.max_retry_after = max_retry_after
+		self.idle_timeout    = idle_timeout
+
+		self._overrides  = {}
+		self._hosts      = {}
+		self._cond       = Condition()
+		self._last_sweep = time.monotonic()
+
+	@staticmethod
+	def _netloc(url_or_netloc):
+		if "://" in url_or_netloc:
+			return urllib.parse.urlsplit(url_or_netloc).netloc.lower()
+		return url_or_netloc.lower()
+
+	def _state(self, netloc):
+		state = self._hosts.get(netloc)
+		if state is None:
+			rate, max_in_flight, _ = self._overrides.get(netloc, (self.rate, self.max_in_flight, False))
+			state = _HostState(rate, self.burst, max_in_flight)
+			self._hosts[netloc] = state
+		return state
+
+	def _evict_idle(self, now):
+		# Must be called with the lock held. Only sweeps every so often, so it's
+		# not a walk over all the hosts on every request.
+		if self.idle_timeout is None or now - self._last_sweep < self.idle_timeout / 4:
+			return
+		self._last_sweep = now
+
+		idle = [netloc for netloc, state in self._hosts.items() if state.idle(now, self.idle_timeout)]
+		for netloc in idle:
+			del self._hosts[netloc]
+			override = self._overrides.get(netloc)
+			if override is not None and override[2]:
+				del self._overrides[netloc]
+		if idle:
+			self.log.debug("Dropped %s idle hosts", len(idle))
+
+	def set_host_limits(self, netloc:str, rate:float=None, max_in_flight:int=None, evictable:bool=False):
+		'''
+		Override the rate and in-flight limits for a specific netloc.
+
+		If `evictable` is true, the override is dropped along with the host's state once
+		it goes idle, for limits the caller re-applies on each request (like the ones
+		from the routing table).
+		'''
+		netloc = self._netloc(netloc)
+		with self._cond:
+			self._overrides[netloc] = (rate, max_in_flight, evictable)
+			state = self._hosts.get(netloc)
+			if state:
+				state.rate          = rate
+				state.base_rate     = rate
+				state.max_in_flight = max_in_flight
+			self._cond.notify_all()
+
+	def clear_host_limits(self, netloc:str):
+		'''
+		Drop the override for `netloc`, putting it back on the default limits.
+		'''
+		netloc = self._netloc(netloc)
+		with self._cond:
+			if self._overrides.pop(netloc, None) is None:
+				return
+			state = self._hosts.get(netloc)
+			if state:
+				state.rate          = self.rate
+				state.base_rate     = self.rate
+				state.max_in_flight = self.max_in_flight
+			self._cond.notify_all()
+
+	def host_limits(self, netloc:str):
+		'''
+		The override for `netloc`, as a 3-tuple (rate, max_in_flight, evictable), or None
+		if it's on the default limits.
+		'''
+		with self._cond:
+			return self._overrides.get(self._netloc(netloc))
+
+	def _take(self, state, netloc, start):
+		# Must be called with the lock held.
+		if state.rate:
+			state.tokens -= 1
+		state.in_flight += 1
+
+		now = time.monotonic()
+		waited = now - start
+		state.last_used   = now
+		state.requests   += 1
+		state.total_wait += waited
+		state.max_wait    = max(state.max_wait, waited)
+
+		if waited > 0.5:
+			self.log.info("Waited %0.2f seconds for a request slot for %s", waited, netloc)
+
+	def acquire(self, url:str, timeout:float=None):
+		'''
+		Block until a request to the host for `url` is allowed. Returns the netloc,
+		which has to be passed to `release()` once the request is complete.
+
+		If `timeout` is set, and the request isn't allowed within `timeout` seconds,
+		returns None instead (in which case there's nothing to release).
+		'''
+		netloc = self._netloc(url)
+		start = time.monotonic()
+		with self._cond:
+			self._evict_idle(start)
+			while True:
+				# Looked up each time around, in case it was evicted while we waited.
+				state = self._state(netloc)
+				now = time.monotonic()
+				delay = state.delay(now)
+				if delay == 0:
+					break
+				if timeout is not None:
+					left = start + timeout - now
+					if left <= 0:
+						return None
+					delay = left if delay is None else min(delay, left)
+				self._cond.wait(delay)
+
+			self._take(state, netloc, start)
+
+		return netloc
+
+	async def acquire_async(self, url:str):
+		'''
+		Equivalent of `acquire()` for use from a event loop. Waits without blocking
+		the loop.
+		'''
+		netloc = self._netloc(url)
+		start = time.monotonic()
+		while True:
+			with self._cond:
+				now = time.monotonic()
+				self._evict_idle(now)
+				state = self._state(netloc)
+				delay = state.delay(now)
+				if delay == 0:
+					self._take(state, netloc, start)
+					return netloc
+
+			# No way to wait on the condition from the loop, so if we're waiting for
+			# a in-flight request to finish, we just poll.
+			await asyncio.sleep(delay if delay is not None else 0.05)
+
+	def release(self, netloc:str):
+		with self._cond:
+			state = self._state(netloc)
+			state.in_flight = max(0, state.in_flight - 1)
+			state.last_used = time.monotonic()
+			self._cond.notify_all()
+
+	@contextlib.contextmanager
+	def slot(self, url:str):
+		netloc = self.acquire(url)
+		try:
+			yield netloc
+		finally:
+			self.release(netloc)
+
+	def ready_in(self, url:str):
+		'''
+		Roughly how long (in seconds) until a request to the host for `url` would be
+		allowed. Requests that are only waiting on in-flight requests count as ready.
+		'''
+		netloc = self._netloc(url)
+		with self._cond:
+			delay = self._state(netloc).delay(time.monotonic())
+		return delay or 0
+
+	def throttle(self, url:str, retry_after=None):
+		'''
+		Called when a host responds with 429/503. If the response specified a
+		`Retry-After` (either the raw header value or seconds), all requests to the
+		host are held until then. Otherwise, the request rate for the host is halved.
+		'''
+		netloc = self._netloc(url)
+		if isinstance(retry_after, str):
+			retry_after = parse_retry_after(retry_after)
+
+		with self._cond:
+			state = self._state(netloc)
+			state.throttled += 1
+			now = time.monotonic()
+			if retry_after is not None:
+				retry_after = min(retry_after, self.max_retry_after)
+				state.blocked_until = max(state.blocked_until, now + retry_after)
+				self.log.warning("Host %s asked us to back off for %0.1f seconds", netloc, retry_after)
+			else:
+				# If there isn't a rate limit in place, start from a fairly
+				# conservative one.
+				current = state.rate if state.rate else 1.0
+				state.rate = max(self.min_rate, current / 2)
+				state.tokens = min(state.tokens, 0)
+				state.last_refill = now
+				self.log.warning("Host %s is throttling us. Reducing request rate to %0.2f/sec", netloc, state.rate)
+
+	def success(self, url:str):
+		'''
+		Called on a successful response. Slowly ramps the request rate for a
+		throttled host back up to it's configured value.
+		'''
+		netloc = self._netloc(url)
+		with self._cond:
+			state = self._state(netloc)
+			if state.rate != state.base_rate:
+				if state.base_rate is None:
+					new_rate = state.rate * 1.1
+					state.rate = None if new_rate > 10 else new_rate
+				else:
+					state.rate = min(state.base_rate, state.rate * 1.1)
+
+	def stats(self):
+		'''
+		Per-host counters, as a dict of netloc -> dict.
+		'''
+		with self._cond:
+			return {
+				netloc : {
+					'requests'   : state.requests,
+					'throttled'  : state.throttled,
+					'in_flight'  : state.in_flight,
+					'rate'       : state.rate,
+					'total_wait' : state.total_wait,
+					'max_wait'   : state.max_wait,
+					'mean_wait'  : state.total_wait / state.requests if state.requests else 0.0,
+				}
+				for netloc, state in self._hosts.items()
+			}
@@ -0,0 +1,588 @@
+#!/usr/bin/python3
+
+# A (private) on-disk HTTP cache, loosely following RFC 7234.
+#
+# Bodies are stored decompressed, along with the response headers (minus the
+# `Content-Encoding`, hop-by-hop headers and cookies). Entries that are still
+# fresh (per `Cache-Control: max-age`, `Expires` or the Last-Modified heuristic)
+# are served without touching the network. Stale entries with a validator are
+# revalidated with `If-None-Match`/`If-Modified-Since`, and served from the
+# cache if the server responds with a 304.
+#
+# The cache is size-bounded, and evicts the least recently used entries first.
+
+import os
+import io
+import json
+import time
+import hashlib
+import logging
+import calendar
+import collections
+import email.utils
+import http.client
+import urllib.request
+import urllib.response
+
+from threading import Lock
+
+from . import Decompressors
+
+
+# Headers that describe the connection or the transfer, rather then the content.
+UNSTORED_HEADERS = {
+	'connection',
+	'keep-alive',
+	'proxy-authenticate',
+	'proxy-authorization',
+	'te',
+	'trailer',
+	'transfer-encoding',
+	'upgrade',
+	'set-cookie',
+	'set-cookie2',
+	'content-encoding',
+	'content-length',
+}
+
+
+def parse_cache_control(value):
+	'''
+	Parse a `Cache-Control` header into a dict of directive -> value (None for
+	directives without a value).
+	'''
+	ret = {}
+	if not value:
+		return ret
+	for directive in value.split(","):
+		directive = directive.strip()
+		if not directive:
+			continue
+		if "=" in directive:
+			name, val = directive.split("=", 1)
+			ret[name.strip().lower()] = val.strip().strip('"')
+		else:
+			ret[directive.lower()] = None
+	return ret
+
+
+def _parse_date(value):
+	if not value:
+		return None
+	try:
+		parsed = email.utils.parsedate(value)
+	except (TypeError, ValueError):
+		return None
+	if parsed is None:
+		return None
+	return calendar.timegm(parsed)
+
+
+def _parse_int(value):
+	try:
+		return int(value)
+	except (TypeError, ValueError):
+		return None
+
+
+class _CacheEntry(object):
+	def __init__(self, key, url, headers, fresh_until, vary, size):
+		self.key         = key
+		self.url         = url
+		self.headers     = headers
+		self.fresh_until = fresh_until
+		self.vary        = vary
+		self.size        = size
+
+	def get_header(self, name):
+		name = name.lower()
+		for key, val in self.headers:
+			if key.lower() == name:
+				return val
+		return None
+
+	def to_json(self):
+		return {
+			'url'         : self.url,
+			'headers'     : self.headers,
+			'fresh_until' : self.fresh_until,
+			'vary'        : self.vary,
+			'size'        : self.size,
+		}
+
+	@classmethod
+	def from_json(cls, key, data):
+		return cls(key, data['url'], [tuple(tmp) for tmp in data['headers']], data['fresh_until'], data['vary'], data['size'])
+
+
+class HttpCache(object):
+	'''
+	Thread-safe on-disk HTTP response cache.
+
+	Params:
+		``cache_dir`` - Directory to store the cache in. Created if it doesn't exist.
+		``max_size`` - Maximum total size of the cached bodies, in bytes.
+		``max_entry_size`` - Responses larger then this are not cached. Defaults to 1/8th
+			of `max_size`.
+		``max_heuristic_ttl`` - Cap (in seconds) on the freshness lifetime we'll guess for
+			responses that have a `Last-Modified` header, but no explicit expiry.
+
+	Only `GET` requests with `200` responses are cached.
+	'''
+
+	def __init__(self,
+			cache_dir         : str,
+			max_size          : int = 256 * 1024 * 1024,
+			max_entry_size    : int = None,
+			max_heuristic_ttl : int = 24 * 60 * 60,
+			):
+		self.log = logging.getLogger("Main.WebRequest.HttpCache")
+
+		self.cache_dir         = cache_dir
+		self.max_size          = max_size
+		self.max_entry_size    = max_entry_size if max_entry_size is not None else max_size // 8
+		self.max_heuristic_ttl = max_heuristic_ttl
+
+		self._lock       = Lock()
+		self._index      = collections.OrderedDict()
+		self._total_size = 0
+
+		self.hits          = 0
+		self.misses        = 0
+		self.revalidations = 0
+		self.stores        = 0
+		self.evictions     = 0
+
+		os.makedirs(cache_dir, exist_ok=True)
+		self._load_index()
+
+	######################################################################################################################################################
+	# Storage
+	######################################################################################################################################################
+
+	@staticmethod
+	def _key(url):
+		return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+	def _path(self, key, ext):
+		return os.path.join(self.cache_dir, key + ext)
+
+	def _load_index(self):
+		entries = []
+		for fname in os.listdir(self.cache_dir):
+			if not fname.endswith(".body"):
+				continue
+			key = fname[:-len(".body")]
+			try:
+				stat = os.stat(self._path(key, ".body"))
+				if not os.path.exists(self._path(key, ".json")):
+					raise FileNotFoundError
+			except OSError:
+				self._remove_files(key)
+				continue
+			entries.append((stat.st_mtime, key, stat.st_size))
+
+		# Body mtime is bumped on each hit, so it's our access time.
+		for _, key, size in sorted(entries):
+			self._index[key] = size
+			self._total_size += size
+
+		self._evict()
+
+	def _remove_files(self, key):
+		for ext in (".body", ".json"):
+			try:
+				os.remove(self._path(key, ext))
+			except FileNotFoundError:
+				pass
+
+	def _write(self, path, data:bytes):
+		tmp = path + ".tmp"
+		with open(tmp, "wb") as fp:
+			fp.write(data)
+		os.replace(tmp, path)
+
+	def _read_entry(self, key):
+		# Must be called with the lock held.
+		if key not in self._index:
+			return None
+		try:
+			with open(self._path(key, ".json")) as fp:
+				return _CacheEntry.from_json(key, json.load(fp))
+		except (OSError, ValueError, KeyError):
+			self._drop(key)
+			return None
+
+	def _drop(self, key):
+		# Must be called with the lock held.
+		size = self._index.pop(key, None)
+		if size is not None:
+			self._total_size -= size
+		self._remove_files(key)
+
+	def _evict(self):
+		# Must be called with the lock held.
+		while self._total_size > self.max_size and self._index:
+			key = next(iter(self._index))
+			self._drop(key)
+			self.evictions += 1
+
+	######################################################################################################################################################
+	# Freshness
+	######################################################################################################################################################
+
+	def _freshness(self, headers, now):
+		'''
+		Return the time until which a response with `headers` is fresh.
+		'''
+		cc = parse_cache_control(headers.get('Cache-Control'))
+		if 'no-cache' in cc:
+			return 0
+
+		date = _parse_date(headers.get('Date')) or now
+		age = max(0, _parse_int(headers.get('Age')) or 0, now - date)
+
+		max_age = _parse_int(cc.get('max-age'))
+		if max_age is not None:
+			return now + max_age - age
+
+		if headers.get('Expires') is not None:
+			expires = _parse_date(headers.get('Expires'))
+			# Invalid Expires values mean "already expired"
+			if expires is None:
+				return 0
+			return now + (expires - date) - age
+
+		last_modified = _parse_date(headers.get('Last-Modified'))
+		if last_modified is not None and last_modified < date:
+			return now + min((date - last_modified) / 10, self.max_heuristic_ttl) - age
+
+		return 0
+
+	@staticmethod
+	def _request_header(req, name, default_headers):
+		val = req.get_header(name.capitalize())
+		if val is None:
+			val = default_headers.get(name.lower())
+		return val
+
+	def _cacheable_request(self, req):
+		if req.get_method() != "GET" or req.data is not None:
+			return False
+		if req.has_header('Range') or req.has_header('Authorization'):
+			return False
+		cc = parse_cache_control(req.get_header('Cache-control'))
+		return 'no-store' not in cc
+
+	def _usable_entry(self, req, default_headers):
+		# Must be called with the lock held.
+		entry = self._read_entry(self._key(req.full_url))
+		if entry is None:
+			return None
+		for name, val in entry.vary.items():
+			if self._request_header(req, name, default_headers) != val:
+				return None
+		return entry
+
+	######################################################################################################################################################
+	# Interface used by the transports
+	######################################################################################################################################################
+
+	def is_fresh(self, req, default_headers:dict=None):
+		'''
+		Will `req` be served from the cache without a network request?
+		'''
+		if not self._cacheable_request(req):
+			return False
+		cc = parse_cache_control(req.get_header('Cache-control'))
+		if 'no-cache' in cc:
+			return False
+		with self._lock:
+			entry = self._usable_entry(req, default_headers or {})
+			return entry is not None and entry.fresh_until > time.time()
+
+	def prepare(self, req, default_headers:dict=None):
+		'''
+		Look up the cache entry for `req`. If there's a fresh one, it's attached to the request
+		as `req._http_cache_entry` (with `req._http_cache_fresh` set), and should be served
+		with `serve()`. If there's a stale entry with a validator, the conditional headers are
+		added to the request, and a 304 response should be passed to `revalidate()`.
+
+		`default_headers` are the headers the transport will add to the request, if it doesn't
+		already have them, keyed by lower-case name (used to match the cached response's `Vary`).
+		'''
+		req._http_cache_entry = None
+		req._http_cache_fresh = False
+		if not self._cacheable_request(req):
+			return req
+
+		cc = parse_cache_control(req.get_header('Cache-control'))
+
+		with self._lock:
+			entry = self._usable_entry(req, default_headers or {})
+			if entry is not None and entry.fresh_until > time.time() and 'no-cache' not in cc:
+				req._http_cache_entry = entry
+				req._http_cache_fresh = True
+				return req
+
+			self.misses += 1
+
+		if entry is not None:
+			etag          = entry.get_header('ETag')
+			last_modified = entry.get_header('Last-Modified')
+			if etag and not req.has_header('If-none-match'):
+				req.add_unredirected_header('If-None-Match', etag)
+			if last_modified and not req.has_header('If-modified-since'):
+				req.add_unredirected_header('If-Modified-Since', last_modified)
+			if etag or last_modified:
+				req._http_cache_entry = entry
+
+		return req
+
+	def _load(self, entry):
+		# Must be called with the lock held.
+		with open(self._path(entry.key, ".body"), "rb") as fp:
+			body = fp.read()
+
+		self._index.move_to_end(entry.key)
+		os.utime(self._path(entry.key, ".body"))
+
+		headers = http.client.HTTPMessage()
+		for key, val in entry.headers:
+			headers[key] = val
+		headers['Content-Length'] = str(len(body))
+		return body, headers
+
+	def serve(self, entry):
+		'''
+		Return a 2-tuple of (body, headers) for a fresh cache entry.
+		'''
+		with self._lock:
+			self.hits += 1
+			self.log.info("Cache hit for %s", entry.url)
+			return self._load(entry)
+
+	def revalidate(self, entry, headers):
+		'''
+		Update a entry with the headers from a 304 response. Returns a 2-tuple of (body, headers).
+		'''
+		now = time.time()
+		updated = [(key, val) for key, val in headers.items() if key.lower() not in UNSTORED_HEADERS]
+		replaced = {key.lower() for key, _ in updated}
+		merged = [(key, val) for key, val in entry.headers if key.lower() not in replaced] + updated
+
+		msg = http.client.HTTPMessage()
+		for key, val in merged:
+			msg[key] = val
+
+		entry.headers     = merged
+		entry.fresh_until = self._freshness(msg, now)
+
+		with self._lock:
+			self.revalidations += 1
+			self.log.info("Cache entry for %s revalidated", entry.url)
+			try:
+				self._write(self._path(entry.key, ".json"), json.dumps(entry.to_json()).encode("utf-8"))
+				return self._load(entry)
+			except OSError:
+				# Evicted from under us. Should be vanishingly rare.
+				self._drop(entry.key)
+				raise
+
+	def storable(self, req, status:int, headers):
+		'''
+		Can a response with `status` and `headers` to `req` be cached?
+		'''
+		if status != 200 or not self._cacheable_request(req):
+			return False
+
+		cc = parse_cache_control(headers.get('Cache-Control'))
+		if 'no-store' in cc or headers.get('Vary', '').strip() == "*":
+			return False
+
+		length = _parse_int(headers.get('Content-Length'))
+		if length is not None and length > self.max_entry_size:
+			return False
+
+		if headers.get('ETag') or headers.get('Last-Modified'):
+			return True
+		return self._freshness(headers, time.time()) > time.time()
+
+	def store(self, req, status:int, headers, raw:bytes, default_headers:dict=None):
+		'''
+		Store the response to `req`. `raw` is the body as received (e.g. still compressed).
+		'''
+		if not self.storable(req, status, headers):
+			return
+
+		length = _parse_int(headers.get('Content-Length'))
+		if length is not None and length != len(raw):
+			self.log.warning("Truncated response for %s not cached", req.full_url)
+			return
+
+		try:
+			decoder = Decompressors.get_decompressor(headers.get('Content-Encoding'))
+			body = decoder.decompress(raw) + decoder.flush()
+		except Exception as err:
+			self.log.warning("Could not decompress response for %s, so it won't be cached: %s", req.full_url, err)
+			return
+
+		if len(body) > self.max_entry_size:
+			return
+
+		vary = {}
+		for name in headers.get('Vary', '').split(","):
+			name = name.strip()
+			if name:
+				vary[name] = self._request_header(req, name, default_headers or {})
+
+		key = self._key(req.full_url)
+		entry = _CacheEntry(
+				key         = key,
+				url         = req.full_url,
+				headers     = [(key, val) for key, val in headers.items() if key.lower() not in UNSTORED_HEADERS],
+				fresh_until = self._freshness(headers, time.time()),
+				vary        = vary,
+				size        = len(body),
+			)
+
+		with self._lock:
+			self._drop(key)
+			self._write(self._path(key, ".body"), body)
+			self._write(self._path(key, ".json"), json.dumps(entry.to_json()).encode("utf-8"))
+			self._index[key] = len(body)
+			self._total_size += len(body)
+			self.stores += 1
+			self._evict()
+
+	def clear(self):
+		with self._lock:
+			for key in list(self._index):
+				self._drop(key)
+
+	def stats(self):
+		with self._lock:
+			return {
+				'hits'          : self.hits,
+				'misses'        : self.misses,
+				'revalidations' : self.revalidations,
+				'stores'        : self.stores,
+				'evictions'     : self.evictions,
+				'entries'       : len(self._index),
+				'size'          : self._total_size,
+			}
+
+
+class _CachingReader(object):
+	'''
+	Wraps a response body, and passes the content to the cache once it's been read
+	completely. If the content is never read to the end, nothing gets stored.
+
+	All the ways of reading the body (`read()`, `read1()`, `readinto()` and `readline()`)
+	are captured, since the incremental readers use `read1()`.
+	'''
+	def __init__(self, fp, limit:int, on_complete):
+		self.fp          = fp
+		self.limit       = limit
+		self.on_complete = on_complete
+		self.parts       = []
+		self.size        = 0
+
+	def _capture(self, data, eof:bool):
+		if self.parts is None:
+			return
+
+		if data:
+			self.size += len(data)
+			if self.size > self.limit:
+				self.parts = None
+				return
+			self.parts.append(bytes(data))
+
+		if eof:
+			content, self.parts = b"".join(self.parts), None
+			self.on_complete(content)
+
+	def read(self, amt=None):
+		data = self.fp.read() if amt is None or amt < 0 else self.fp.read(amt)
+		self._capture(data, amt is None or amt < 0 or (amt > 0 and not data))
+		return data
+
+	def read1(self, n=-1):
+		data = self.fp.read1(n)
+		self._capture(data, n != 0 and not data)
+		return data
+
+	def readinto(self, b):
+		count = self.fp.readinto(b)
+		self._capture(memoryview(b)[:count], len(b) > 0 and not count)
+		return count
+
+	def readline(self, limit=-1):
+		data = self.fp.readline(limit)
+		self._capture(data, limit != 0 and not data)
+		return data
+
+	def __getattr__(self, name):
+		return getattr(self.fp, name)
+
+
+class CacheHandler(urllib.request.BaseHandler):
+	'''
+	urllib handler that plugs a `HttpCache` into a opener.
+	'''
+
+	# Has to run before the actual HTTP handlers, so fresh responses can be served without
+	# opening a connection.
+	handler_order = 100
+
+	def __init__(self, cache:HttpCache):
+		self.cache = cache
+
+	def _default_headers(self):
+		return {key.lower() : val for key, val in getattr(self.parent, "addheaders", [])}
+
+	def _response(self, entry, body, headers):
+		resp = urllib.response.addinfourl(io.BytesIO(body), headers, entry.url, 200)
+		resp.msg = "OK"
+		resp.from_cache = True
+		return resp
+
+	def http_request(self, req):
+		return self.cache.prepare(req, self._default_headers())
+
+	def http_open(self, req):
+		if getattr(req, "_http_cache_fresh", False):
+			entry = req._http_cache_entry
+			return self._response(entry, *self.cache.serve(entry))
+		return None
+
+	def http_response(self, req, response):
+		if getattr(response, "from_cache", False) or not self.cache.storable(req, response.code, response.headers):
+			return response
+
+		default_headers = self._default_headers()
+		def on_complete(raw):
+			self.cache.store(req, response.code, response.headers, raw, default_headers)
+
+		wrapped = urllib.response.addinfourl(
+				_CachingReader(response, self.cache.max_entry_size, on_complete),
+				response.headers,
+				response.geturl(),
+				response.code,
+			)
+		wrapped.msg = response.msg
+		return wrapped
+
+	def http_error_304(self, req, fp, code, msg, hdrs):
+		entry = getattr(req, "_http_cache_entry", None)
+		if entry is None:
+			return None
+
+		fp.read()
+		fp.close()
+		return self._response(entry, *self.cache.revalidate(entry, hdrs))
+
+	https_request  = http_request
+	https_open     = http_open
+	https_response = http_response
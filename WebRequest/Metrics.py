@@ -0,0 +1,225 @@
+#!/usr/bin/python3
+
+# In-process metrics, in the Prometheus text exposition format.
+#
+# A `MetricsRegistry` is just a set of labelled counters and histograms. The
+# fetch counts, latencies, retries and byte counts all come from the
+# `FetchTiming` record of each fetch (the registry is registered as a timing
+# listener), and the WAF, chromium and cookie code paths feed it directly.
+#
+# Nothing is recorded unless a registry is passed to the WebGetRobust instance,
+# so when metrics are off, it costs a `is not None` check here and there.
+
+import time
+import logging
+import threading
+import contextlib
+import urllib.parse
+import http.server
+
+from threading import Lock
+
+
+# Prometheus' default buckets, with some longer ones, since some sites are *slow*.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+COUNTER   = "counter"
+HISTOGRAM = "histogram"
+
+# name -> (type, help)
+METRICS = {
+	'requests_total'                        : (COUNTER,   "Fetches, by host, final status and transport."),
+	'request_duration_seconds'              : (HISTOGRAM, "Total time taken by fetches, including retries."),
+	'phase_duration_seconds'                : (HISTOGRAM, "Time taken by each phase of the fetches."),
+	'retries_total'                         : (COUNTER,   "Requests that were retries of a failed request, by host."),
+	'sent_bytes_total'                      : (COUNTER,   "Request body bytes sent (e.g. POST data), including retries."),
+	'received_bytes_total'                  : (COUNTER,   "Response body bytes, as received (i.e. compressed)."),
+	'decoded_bytes_total'                   : (COUNTER,   "Response body bytes, after decompression."),
+	'waf_detections_total'                  : (COUNTER,   "Responses that were WAF interstitials, by type."),
+	'chromium_step_through_total'           : (COUNTER,   "Chromium WAF step-throughs, by result."),
+	'chromium_step_through_duration_seconds': (HISTOGRAM, "Time taken by chromium WAF step-throughs."),
+	'cookie_save_duration_seconds'          : (HISTOGRAM, "Time taken to save the cookie jar."),
+}
+
+
+def _escape(value):
+	return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels, extra=None):
+	if extra:
+		labels = labels + (extra, )
+	if not labels:
+		return ""
+	return "{" + ",".join('%s="%s"' % (name, _escape(value)) for name, value in labels) + "}"
+
+
+def _format_value(value):
+	if value == float("inf"):
+		return "+Inf"
+	if isinstance(value, float) and value.is_integer():
+		return str(int(value))
+	return repr(value)
+
+
+class MetricsRegistry(object):
+	'''
+	Thread-safe registry of counters and histograms. Pass the same registry to
+	multiple instances to aggregate their metrics.
+
+	Params:
+		``namespace`` - Prefix for the metric names.
+		``buckets`` - Upper bounds of the histogram buckets, in seconds.
+
+	Cache hit rates fall out of the `transport` label of `requests_total` (fetches
+	served by the HTTP cache are `cache`, and by the response memo, `memo`).
+	'''
+
+	def __init__(self, namespace:str="webrequest", buckets=DEFAULT_BUCKETS):
+		self.log = logging.getLogger("Main.WebRequest.Metrics")
+
+		self.namespace = namespace
+		self.buckets   = tuple(sorted(buckets))
+
+		self._lock       = Lock()
+		self._counters   = {}
+		self._histograms = {}
+
+	@staticmethod
+	def _key(labels):
+		return tuple(sorted(labels.items()))
+
+	def inc(self, name:str, value:float=1, **labels):
+		'''
+		Add `value` to the counter `name`.
+		'''
+		key = self._key(labels)
+		with self._lock:
+			series = self._counters.setdefault(name, {})
+			series[key] = series.get(key, 0) + value
+
+	def observe(self, name:str, value:float, **labels):
+		'''
+		Record `value` in the histogram `name`.
+		'''
+		key = self._key(labels)
+		with self._lock:
+			series = self._histograms.setdefault(name, {})
+			hist = series.get(key)
+			if hist is None:
+				# Per-bucket counts, then the sum and the count.
+				hist = [0] * (len(self.buckets) + 2)
+				series[key] = hist
+			for idx, bound in enumerate(self.buckets):
+				if value <= bound:
+					hist[idx] += 1
+					break
+			hist[-2] += value
+			hist[-1] += 1
+
+	@contextlib.contextmanager
+	def time(self, name:str, **labels):
+		'''
+		Context manager that records the time spent in the block in the histogram `name`.
+		'''
+		start = time.monotonic()
+		try:
+			yield
+		finally:
+			self.observe(name, time.monotonic() - start, **labels)
+
+	def observe_fetch(self, timing):
+		'''
+		Timing listener that records a completed fetch (a `FetchTiming`).
+		'''
+		host = urllib.parse.urlsplit(timing.url).netloc.lower() if timing.url else ""
+		if timing.status is not None:
+			status = str(timing.status)
+		else:
+			status = "error" if timing.error is not None else "none"
+		transport = timing.transport or "none"
+
+		self.inc('requests_total', host=host, status=status, transport=transport)
+		self.observe('request_duration_seconds', timing.total or 0, transport=transport)
+		for phase, seconds in timing.phases.items():
+			self.observe('phase_duration_seconds', seconds, phase=phase)
+		if timing.retries:
+			self.inc('retries_total', timing.retries, host=host)
+		if timing.sent_bytes:
+			self.inc('sent_bytes_total', timing.sent_bytes)
+		if timing.wire_bytes:
+			self.inc('received_bytes_total', timing.wire_bytes)
+		if timing.content_bytes:
+			self.inc('decoded_bytes_total', timing.content_bytes)
+
+	def get(self, name:str, **labels):
+		'''
+		The current value of counter `name`, or for a histogram, a 2-tuple of (count, sum).
+		'''
+		key = self._key(labels)
+		with self._lock:
+			if name in self._histograms:
+				hist = self._histograms[name].get(key)
+				return (hist[-1], hist[-2]) if hist else (0, 0)
+			return self._counters.get(name, {}).get(key, 0)
+
+	def clear(self):
+		with self._lock:
+			self._counters.clear()
+			self._histograms.clear()
+
+	def render_metrics(self):
+		'''
+		All the metrics, in the Prometheus text exposition format.
+		'''
+		with self._lock:
+			counters   = {name : dict(series) for name, series in self._counters.items()}
+			histograms = {name : {key : list(hist) for key, hist in series.items()} for name, series in self._histograms.items()}
+
+		lines = []
+		for name in sorted(set(counters) | set(histograms)):
+			full = "%s_%s" % (self.namespace, name) if self.namespace else name
+			mtype, mhelp = METRICS.get(name, (HISTOGRAM if name in histograms else COUNTER, None))
+			if mhelp:
+				lines.append("# HELP %s %s" % (full, mhelp))
+			lines.append("# TYPE %s %s" % (full, mtype))
+
+			for key, value in sorted(counters.get(name, {}).items()):
+				lines.append("%s%s %s" % (full, _format_labels(key), _format_value(value)))
+
+			for key, hist in sorted(histograms.get(name, {}).items()):
+				cumulative = 0
+				for bound, count in zip(self.buckets, hist):
+					cumulative += count
+					lines.append("%s_bucket%s %s" % (full, _format_labels(key, ("le", _format_value(float(bound)))), cumulative))
+				lines.append("%s_bucket%s %s" % (full, _format_labels(key, ("le", "+Inf")), hist[-1]))
+				lines.append("%s_sum%s %s" % (full, _format_labels(key), _format_value(hist[-2])))
+				lines.append("%s_count%s %s" % (full, _format_labels(key), hist[-1]))
+
+		return "\n".join(lines) + "\n"
+
+	def serve_metrics(self, port:int, host:str=""):
+		'''
+		Serve `render_metrics()` over HTTP on `port`, for a Prometheus server to scrape,
+		from a daemon thread. Returns the `http.server` instance (call `shutdown()` on it
+		to stop serving).
+		'''
+		registry = self
+
+		class MetricsHandler(http.server.BaseHTTPRequestHandler):
+			def do_GET(self):
+				body = registry.render_metrics().encode("utf-8")
+				self.send_response(200)
+				self.send_header('Content-Type', "text/plain; version=0.0.4; charset=utf-8")
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			def log_message(self, format, *args):
+				return
+
+		server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+		thread = threading.Thread(target=server.serve_forever, name="WebRequest-metrics", daemon=True)
+		thread.start()
+		self.log.info("Serving metrics on port %s", server.server_address[1])
+		return server
@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+
+# In-process memo of recent responses, for when the same URLs get fetched over
+# and over within a short period.
+#
+# Entries expire after a fixed TTL, and the total size of the memoized content
+# is capped, with the least recently used entries going first.
+
+import time
+import logging
+import collections
+
+from threading import Lock
+
+
+class ResponseMemo(object):
+	'''
+	Thread-safe TTL + LRU memo of fetched content.
+
+	Params:
+		``ttl`` - How long (in seconds) a response is reused for.
+		``max_bytes`` - Budget for the total size of the memoized content.
+		``cache_parsed`` - Also memoize the parsed result of `getJson()` and `getSoup()`.
+			Note that in this case repeat calls return the *same object*, so callers
+			must not modify it.
+
+	Only successful responses are memoized. Calls with `returnMultiple` or
+	`binaryForm` always go to the network.
+	'''
+
+	def __init__(self,
+			ttl          : float = 60,
+			max_bytes    : int   = 32 * 1024 * 1024,
+			cache_parsed : bool  = False,
+			):
+		self.log = logging.getLogger("Main.WebRequest.ResponseMemo")
+
+		self.ttl          = ttl
+		self.max_bytes    = max_bytes
+		self.cache_parsed = cache_parsed
+
+		self._lock    = Lock()
+		self._entries = collections.OrderedDict()
+		self._size    = 0
+
+		self.hits      = 0
+		self.misses    = 0
+		self.expired   = 0
+		self.evictions = 0
+
+	@staticmethod
+	def make_key(kind:str, requestedUrl:str, kwargs:dict):
+		'''
+		Build the memo key for a fetch of `requestedUrl` with the `getpage()` `kwargs`.
+		Returns None if the call can't be memoized.
+		'''
+		for bypass in ('returnMultiple', 'binaryForm', 'streamResponse', 'soup'):
+			if kwargs.get(bypass):
+				return None
+
+		postData = kwargs.get("postData")
+		if isinstance(postData, dict):
+			postData = repr(sorted(postData.items()))
+
+		addlHeaders = kwargs.get("addlHeaders")
+		if addlHeaders:
+			addlHeaders = repr(sorted(addlHeaders.items()))
+
+		# A body memoized by a call without a size limit mustn't be handed to one with
+		# a limit it would have failed, so the limits are part of the key.
+		limits = (kwargs.get("max_content_bytes"), kwargs.get("max_decompressed_bytes"))
+
+		method = "GET" if postData is None else "POST"
+		return (kind, method, requestedUrl.strip(), postData, addlHeaders, limits)
+
+	def _drop(self, key):
+		# Must be called with the lock held.
+		_, _, size = self._entries.pop(key)
+		self._size -= size
+
+	def get(self, key):
+		'''
+		Returns a 2-tuple of (found, value).
+		'''
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is None:
+				self.misses += 1
+				return False, None
+
+			expires, value, _ = entry
+			if expires < time.monotonic():
+				self._drop(key)
+				self.expired += 1
+				self.misses  += 1
+				return False, None
+
+			self._entries.move_to_end(key)
+			self.hits += 1
+			return True, value
+
+	def put(self, key, value, size:int):
+		if size > self.max_bytes:
+			return
+
+		with self._lock:
+			if key in self._entries:
+				self._drop(key)
+
+			self._entries[key] = (time.monotonic() + self.ttl, value, size)
+			self._size += size
+
+			while self._size > self.max_bytes:
+				self._drop(next(iter(self._entries)))
+				self.evictions += 1
+
+	def discard(self, key):
+		with self._lock:
+			if key in self._entries:
+				self._drop(key)
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+			self._size = 0
+
+	def stats(self):
+		with self._lock:
+			return {
+				'hits'      : self.hits,
+				'misses'    : self.misses,
+				'expired'   : self.expired,
+				'evictions' : self.evictions,
+				'entries'   : len(self._entries),
+				'size'      : self._size,
+			}
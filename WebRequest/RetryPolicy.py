@@ -0,0 +1,107 @@
+#!/usr/bin/python3
+
+# Retry policy for failed fetches.
+#
+# Decides whether a failure is worth retrying (per HTTP status), and how long
+# to wait before doing so, using exponential backoff with "full jitter"
+# (a random delay between zero and the exponential cap), so a bunch of
+# workers that failed at the same time don't all come back at the same time.
+
+import time
+import random
+
+
+# What to do with a particular HTTP status
+RETRY    = "retry"       # Retry after a backoff delay.
+FAIL     = "fail"        # Give up immediately.
+THROTTLE = "throttle"    # The host is rate-limiting us. Let the HostScheduler decide when to retry.
+
+
+DEFAULT_STATUS_RULES = {
+	404 : FAIL,
+	410 : FAIL,
+	416 : FAIL,
+	429 : THROTTLE,
+	503 : THROTTLE,
+}
+
+
+class RetryPolicy(object):
+	'''
+	Params:
+		``max_attempts`` - Total number of attempts (including the first). If None, the
+			`errorOutCount` of the WebGetRobust instance is used. A `retryQuantity` passed
+			to a fetch call overrides both.
+		``base_delay`` - Backoff delay before the first retry, in seconds. Doubles with each
+			subsequent retry. If None, the `retryDelay` of the WebGetRobust instance is used.
+		``max_delay`` - Cap on the backoff delay for a single retry.
+		``max_elapsed`` - If set, no retry is started once this many seconds have passed
+			since the first attempt (or if the backoff would take us past it).
+		``jitter`` - Use full jitter (a random delay between 0 and the backoff cap). If false,
+			the backoff cap is used as-is.
+		``status_rules`` - Dict of HTTP status -> `RETRY`, `FAIL` or `THROTTLE`, merged over
+			`DEFAULT_STATUS_RULES`. Statuses without a rule are retried.
+	'''
+
+	def __init__(self,
+			max_attempts : int   = None,
+			base_delay   : float = None,
+			max_delay    : float = 60,
+			max_elapsed  : float = None,
+			jitter       : bool  = True,
+			status_rules : dict  = None,
+			):
+		self.max_attempts = max_attempts
+		self.base_delay   = base_delay
+		self.max_delay    = max_delay
+		self.max_elapsed  = max_elapsed
+		self.jitter       = jitter
+
+		self.status_rules = dict(DEFAULT_STATUS_RULES)
+		if status_rules:
+			self.status_rules.update(status_rules)
+
+	def action(self, status:int):
+		'''
+		What to do about a response with HTTP status `status`.
+		'''
+		return self.status_rules.get(status, RETRY)
+
+	def attempts(self, retryQuantity:int, default:int):
+		'''
+		The number of attempts allowed for a call.
+		'''
+		return retryQuantity or self.max_attempts or default
+
+	def backoff(self, attempt:int, default_base:float):
+		'''
+		Delay before retry number `attempt` (starting from 1).
+		'''
+		base = self.base_delay if self.base_delay is not None else default_base
+		cap = min(self.max_delay, base * (2 ** (attempt - 1)))
+		if self.jitter:
+			return random.uniform(0, cap)
+		return cap
+
+	def exhausted(self, attempt:int, max_attempts:int, started:float):
+		'''
+		Is attempt number `attempt` (starting from 1) out of bounds?
+		'''
+		if attempt > max_attempts:
+			return True
+		if attempt > 1 and self.max_elapsed is not None and time.monotonic() - started >= self.max_elapsed:
+			return True
+		return False
+
+	def next_delay(self, attempt:int, max_attempts:int, started:float, default_base:float):
+		'''
+		How long to wait after attempt number `attempt` failed, or None if there
+		shouldn't be another attempt (so there's no point waiting).
+		'''
+		if attempt >= max_attempts:
+			return None
+
+		delay = self.backoff(attempt, default_base)
+		if self.max_elapsed is not None and time.monotonic() - started + delay >= self.max_elapsed:
+			return None
+		return delay
@@ -5,13 +5,9 @@ import random
 import socket
 import urllib.parse
 import http.cookiejar
-import bs4
-import selenium.webdriver
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
+
+# Selenium takes the better part of 100 ms to import, and this mixin is part of every
+# WebGetRobust, so it's only imported when a driver is actually needed.
 
 from . import SeleniumCommon
 
@@ -25,6 +21,10 @@ class WebGetSeleniumChromiumMixin(object):
 		if self.selenium_chromium_driver:
 			self.selenium_chromium_driver.quit()
 
+		import selenium.webdriver
+		from selenium.webdriver.chrome.options import Options
+		from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
+
 		wgSettings = dict(self.browserHeaders)
 
 		chrome_options = Options()
@@ -93,6 +93,7 @@ class WebGetSeleniumChromiumMixin(object):
 			self.selenium_chromium_driver.get(itemUrl)
 		time.sleep(3)
 
+		import bs4
 		fileN = urllib.parse.unquote(urllib.parse.urlparse(self.selenium_chromium_driver.current_url)[2].split("/")[-1])
 		fileN = bs4.UnicodeDammit(fileN).unicode_markup
 
@@ -186,6 +187,10 @@ class WebGetSeleniumChromiumMixin(object):
 		self._syncIntoSeleniumChromiumWebDriver()
 
 
+		from selenium.webdriver.support.ui import WebDriverWait
+		from selenium.webdriver.support import expected_conditions as EC
+		from selenium.common.exceptions import TimeoutException
+
 		self.selenium_chromium_driver.get(url)
 
 		if titleContains:
@@ -6,12 +6,6 @@ import random
 import socket
 import urllib.parse
 import http.cookiejar
-import bs4
-import selenium.webdriver
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException
-from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
 
 
 
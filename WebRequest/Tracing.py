@@ -0,0 +1,297 @@
+#!/usr/bin/python3
+
+# Tracing hooks.
+#
+# A fetch can fan out a long way (urllib retries, a WAF step-through in chromium,
+# cookie syncing into and out of the browser, then another round of requests), so
+# the interesting code paths open spans on the instance's tracer, which ends up as
+# a tree of what happened and how long it took.
+#
+# The default `NullTracer` does nothing (and allocates nothing). To send the spans
+# somewhere, subclass `Tracer` and override `on_start()`/`on_end()`. `MemoryTracer`
+# just keeps them, which is mostly useful for tests and poking around.
+#
+# The current span is tracked with a context variable, so spans opened in other
+# threads are their own roots, but spans opened by a asyncio task (or something
+# the async client runs in it's executor) are children of the task's span.
+# Python 3.6 doesn't have `contextvars`, so there the current span is tracked
+# per-thread instead, and spans don't follow a task into the executor.
+
+import time
+import logging
+import threading
+import itertools
+import functools
+import contextlib
+
+from threading import Lock
+
+try:
+	import contextvars
+except ImportError:    # pragma: no cover
+	contextvars = None
+
+
+class _ThreadLocalVar(object):
+	'''
+	Minimal stand-in for `contextvars.ContextVar`, for Python 3.6.
+	'''
+
+	def __init__(self, name:str, default=None):
+		self.name     = name
+		self._default = default
+		self._local   = threading.local()
+
+	def get(self):
+		return getattr(self._local, "value", self._default)
+
+	def set(self, value):
+		token = (threading.get_ident(), self.get())
+		self._local.value = value
+		return token
+
+	def reset(self, token):
+		ident, value = token
+		if ident != threading.get_ident():
+			raise ValueError("Token was created in a different thread")
+		self._local.value = value
+
+
+if contextvars is not None:
+	_CURRENT_SPAN = contextvars.ContextVar("WebRequest-span", default=None)
+else:    # pragma: no cover
+	_CURRENT_SPAN = _ThreadLocalVar("WebRequest-span", default=None)
+
+_SPAN_IDS = itertools.count(1)
+
+
+def current_span():
+	'''
+	The innermost open span in the current context, or None.
+	'''
+	return _CURRENT_SPAN.get()
+
+
+def context_call(func, *args, **kwargs):
+	'''
+	Bind `func` to it's arguments, to run in a copy of the current context (so spans
+	opened in it are children of the current span), wherever it ends up being called.
+	Without `contextvars`, this is just `functools.partial()`.
+	'''
+	if contextvars is None:    # pragma: no cover
+		return functools.partial(func, *args, **kwargs)
+	return functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+
+
+class Span(object):
+	'''
+	A timed operation.
+
+	Attributes:
+		``name`` - What the operation is (e.g. `getpage`, `request`, `chromium_step_through`).
+		``attributes`` - dict of extra information about the operation (url, status, etc...).
+		``parent`` - The span this one was opened in, or None for a root span.
+		``span_id`` - Process-unique id of the span.
+		``start``/``end`` - `time.monotonic()` at the start and end of the span.
+		``error`` - The exception the operation failed with, if it failed.
+	'''
+
+	__slots__ = ('name', 'attributes', 'parent', 'span_id', 'start', 'end', 'error', '_token')
+
+	def __init__(self, name:str, parent=None, attributes:dict=None):
+		self.name       = name
+		self.attributes = attributes if attributes is not None else {}
+		self.parent     = parent
+		self.span_id    = next(_SPAN_IDS)
+		self.start      = time.monotonic()
+		self.end        = None
+		self.error      = None
+		self._token     = None
+
+	def set_attribute(self, key:str, value):
+		self.attributes[key] = value
+
+	def record_error(self, err:Exception):
+		self.error = err
+
+	@property
+	def duration(self):
+		if self.end is None:
+			return None
+		return self.end - self.start
+
+	def __repr__(self):
+		duration = "%0.3f seconds" % self.duration if self.end is not None else "open"
+		error    = ", failed: %r" % (self.error, ) if self.error is not None else ""
+		return "<Span %s #%s (%s%s) %r>" % (self.name, self.span_id, duration, error, self.attributes)
+
+
+class _NullSpan(object):
+	'''
+	What the `NullTracer` hands out. Accepts everything, and keeps nothing.
+	'''
+	__slots__ = ()
+
+	name       = None
+	attributes = {}
+	parent     = None
+	error      = None
+
+	def set_attribute(self, key:str, value):
+		pass
+
+	def record_error(self, err:Exception):
+		pass
+
+
+class _NullContext(object):
+	'''
+	Reusable context manager that yields `NULL_SPAN` (`contextlib.nullcontext()` is Python 3.7+).
+	'''
+	__slots__ = ()
+
+	def __enter__(self):
+		return NULL_SPAN
+
+	def __exit__(self, *exc_info):
+		return False
+
+
+NULL_SPAN = _NullSpan()
+_NULL_CONTEXT = _NullContext()
+
+
+class Tracer(object):
+	'''
+	Base tracer. Subclasses hook `on_start()` and `on_end()` to export the spans.
+
+	Spans can either be used as a context manager (`with tracer.span(name, **attributes)`),
+	or for places where that doesn't fit, opened with `start_span()` and closed with
+	`end_span()` (which *must* be called, in the same thread/task).
+	'''
+
+	def __init__(self):
+		self.log = logging.getLogger("Main.WebRequest.Tracing")
+
+	def on_start(self, span:Span):
+		'''
+		Called when `span` is opened.
+		'''
+		pass
+
+	def on_end(self, span:Span):
+		'''
+		Called when `span` is finished.
+		'''
+		pass
+
+	def start_span(self, name:str, **attributes):
+		'''
+		Open a span called `name`, as a child of the current span, and make it the current span.
+		'''
+		span = Span(name, _CURRENT_SPAN.get(), attributes)
+		span._token = _CURRENT_SPAN.set(span)
+		self._hook(self.on_start, span)
+		return span
+
+	def end_span(self, span:Span, error:Exception=None):
+		'''
+		Finish `span`, and make it's parent the current span again.
+		'''
+		span.end = time.monotonic()
+		if error is not None:
+			span.error = error
+		try:
+			_CURRENT_SPAN.reset(span._token)
+		except ValueError:
+			# Ended in a different context than it was started in.
+			# There's nothing to restore there.
+			pass
+		self._hook(self.on_end, span)
+
+	@contextlib.contextmanager
+	def span(self, name:str, **attributes):
+		'''
+		Context manager for a span called `name`. Exceptions leaving the block are recorded on the span.
+		'''
+		span = self.start_span(name, **attributes)
+		error = None
+		try:
+			yield span
+		except BaseException as err:
+			error = err
+			raise
+		finally:
+			self.end_span(span, error)
+
+	def _hook(self, hook, span:Span):
+		# A broken tracing backend shouldn't break fetching.
+		try:
+			hook(span)
+		except Exception:
+			self.log.exception("Tracer hook %r failed!", hook)
+
+
+class NullTracer(Tracer):
+	'''
+	The default tracer, which doesn't trace anything.
+	'''
+
+	def start_span(self, name:str, **attributes):
+		return NULL_SPAN
+
+	def end_span(self, span:Span, error:Exception=None):
+		pass
+
+	def span(self, name:str, **attributes):
+		return _NULL_CONTEXT
+
+
+class MemoryTracer(Tracer):
+	'''
+	Tracer that keeps the finished spans in `spans` (in the order they finished).
+	'''
+
+	def __init__(self):
+		super().__init__()
+		self._lock = Lock()
+		self.spans = []
+
+	def on_end(self, span:Span):
+		with self._lock:
+			self.spans.append(span)
+
+	def clear(self):
+		with self._lock:
+			self.spans = []
+
+	def find(self, name:str):
+		'''
+		All the finished spans called `name`, in the order they were started.
+		'''
+		with self._lock:
+			return sorted((span for span in self.spans if span.name == name), key=lambda span: span.span_id)
+
+	def roots(self):
+		with self._lock:
+			return sorted((span for span in self.spans if span.parent is None), key=lambda span: span.span_id)
+
+	def children(self, parent:Span):
+		with self._lock:
+			return sorted((span for span in self.spans if span.parent is parent), key=lambda span: span.span_id)
+
+	def render_tree(self):
+		'''
+		The finished spans as an indented tree, one per line, for eyeballing.
+		'''
+		lines = []
+		def walk(span, depth):
+			attrs = " ".join("%s=%s" % (key, value) for key, value in span.attributes.items())
+			error = " error=%r" % (span.error, ) if span.error is not None else ""
+			lines.append("%s%s %0.3fs %s%s" % ("  " * depth, span.name, span.duration, attrs, error))
+			for child in self.children(span):
+				walk(child, depth + 1)
+
+		for root in self.roots():
+			walk(root, 0)
+		return "\n".join(lines)
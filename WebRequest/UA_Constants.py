@@ -2,6 +2,8 @@
 import random
 random.seed()
 
+from . import Decompressors
+
 
 # Due to general internet people douchebaggyness, I've basically said to hell with it and decided to spoof a whole assortment of browsers
 # It should keep people from blocking this scraper *too* easily
@@ -131,21 +133,32 @@ ACCEPT = [
 
 ACCEPT_POSTFIX = ["*/*;q=0.8", "*/*;q=0.5", "*/*;q=0.8", "*/*", "*/*;q=0.1"]
 
-ENCODINGS = [['gzip'], ['gzip', 'deflate'], ['gzip', 'deflate', 'sdch']]
+ENCODINGS = [['gzip'], ['gzip', 'deflate']]
+
+# What current browsers send. Only used if asked for, and only for the
+# encodings we can actually decode.
+MODERN_ENCODINGS = [['gzip', 'deflate', 'br'], ['gzip', 'deflate', 'br', 'zstd']]
 
 
-def getUserAgent():
+def getUserAgent(modern_encodings:bool=False):
 	'''
 	Generate a randomized user agent by permuting a large set of possible values.
 	The returned user agent should look like a valid, in-use brower, with a specified preferred language of english.
 
+	If `modern_encodings` is true, the Accept-Encoding header includes `br` and `zstd`
+	(if the packages to decode them are installed).
+
 	Return value is a list of tuples, where each tuple is one of the user-agent headers.
 
 	Currently can provide approximately 147 * 17 * 5 * 5 * 2 * 3 * 2 values, or ~749K possible
 	unique user-agents.
 	'''
 
-	coding = random.choice(ENCODINGS)
+	if modern_encodings:
+		available = Decompressors.available_encodings()
+		coding = [enc for enc in random.choice(MODERN_ENCODINGS) if enc in available]
+	else:
+		coding = list(random.choice(ENCODINGS))
 	random.shuffle(coding)
 	coding = random.choice((", ", ",")).join(coding)
 
@@ -30,24 +30,21 @@ import gzip
 import io
 import socket
 import json
+import copy
+import heapq
+import hashlib
+import itertools
+import contextlib
+import concurrent.futures
 
 from threading import Lock
 
-import bs4
-try:
-	import socks
-	from sockshandler import SocksiPyHandler
-	HAVE_SOCKS = True
-except ImportError:
-	HAVE_SOCKS = False
+import importlib.util
 
-
-cchardet = False
-
-try:
-	import cchardet
-except ImportError:    # pragma: no cover
-	pass
+# The heavy optional backends (bs4, socks, chromium, selenium, cloudscraper and the
+# captcha solvers) are imported when they're first used, rather then here, since
+# they add a lot to the startup time of processes that never touch them.
+HAVE_SOCKS = importlib.util.find_spec("socks") is not None and importlib.util.find_spec("sockshandler") is not None
 
 
 from . import HeaderParseMonkeyPatch
@@ -55,9 +52,25 @@ from . import HeaderParseMonkeyPatch
 from . import Handlers
 from . import iri2uri
 from . import UA_Constants
-from . import Domain_Constants
 from . import Exceptions
 from . import utility
+from . import ConnectionPool
+from . import HostScheduler
+from . import Decompressors
+from . import Charset
+from . import HttpCache
+from . import ResponseMemo
+from . import DnsCache
+from . import RetryPolicy
+from . import CircuitBreaker
+from . import HedgePolicy
+from . import WafDetector
+from . import DomainRoutes
+from . import Deadline
+from . import FetchTiming
+from . import Metrics
+from . import Tracing
+from . import FetchLog
 from . import CloudscraperMixin
 from . import ChromiumMixin
 
@@ -83,6 +96,12 @@ class WebGetRobust(
 	opener = None
 
 	timeout = 30
+	# Seperate limits on connecting, and on waiting for data once connected (None
+	# means `timeout`), and on the total time for a fetch, including retries,
+	# redirects and WAF step-through (None means no limit).
+	connect_timeout = 10
+	read_timeout = None
+	total_timeout = None
 	errorOutCount = 1
 	retryDelay = 3
 	# retryDelay = 0.1
@@ -93,14 +112,37 @@ class WebGetRobust(
 	# creds is a list of 3-tuples that gets inserted into the password manager.
 	# it is structured [(top_level_url1, username1, password1), (top_level_url2, username2, password2)]
 	def __init__(self,
-			creds         : dict                        = None,
-			logPath       : str                         = "Main.WebRequest",
-			cookie_lock   : Lock                        = None,
-			cloudflare    : bool                        = True,
-			auto_waf      : bool                        = True,
-			use_socks     : bool                        = False,
-			alt_cookiejar : http.cookiejar.LWPCookieJar = None,
-			custom_ua     : dict                        = None,
+			creds                  : dict                          = None,
+			logPath                : str                           = "Main.WebRequest",
+			cookie_lock            : Lock                          = None,
+			cloudflare             : bool                          = True,
+			auto_waf               : bool                          = True,
+			use_socks              : bool                          = False,
+			alt_cookiejar          : http.cookiejar.LWPCookieJar   = None,
+			custom_ua              : dict                          = None,
+			use_pool               : bool                          = True,
+			conn_pool              : ConnectionPool.ConnectionPool = None,
+			host_scheduler         : HostScheduler.HostScheduler   = None,
+			http_cache             : HttpCache.HttpCache           = None,
+			response_memo          : ResponseMemo.ResponseMemo     = None,
+			dns_cache              : DnsCache.DnsCache             = None,
+			retry_policy           : RetryPolicy.RetryPolicy       = None,
+			circuit_breaker        : CircuitBreaker.CircuitBreaker = None,
+			hedge_policy           : HedgePolicy.HedgePolicy       = None,
+			waf_detector           : WafDetector.WafDetector       = None,
+			domain_routes          : DomainRoutes.DomainRoutes     = None,
+			modern_encodings       : bool                          = False,
+			max_content_bytes      : int                           = None,
+			max_decompressed_bytes : int                           = None,
+			connect_timeout        : float                         = None,
+			read_timeout           : float                         = None,
+			total_timeout          : float                         = None,
+			timing_listeners       : list                          = None,
+			metrics                : Metrics.MetricsRegistry       = None,
+			tracer                 : Tracing.Tracer                = None,
+			log_mode               : str                           = FetchLog.LOG_VERBOSE,
+			log_sample_rate        : float                         = 0.01,
+			log_slow_threshold     : float                         = None,
 			*args,
 			**kwargs
 			):
@@ -121,9 +163,100 @@ class WebGetRobust(
 			self.cookie_lock = COOKIEWRITELOCK
 
 		self.use_socks = use_socks
-		# Override the global default socket timeout, so hung connections will actually time out properly.
-		socket.setdefaulttimeout(5)
 
+		# Per-host rate limiting. By default, there are no limits, but
+		# Retry-After and 429/503 responses are still respected.
+		# Pass the same scheduler to multiple instances to share limits between them.
+		self.host_scheduler = host_scheduler if host_scheduler is not None else HostScheduler.HostScheduler()
+
+		# Keep-alive connection pooling. The socks handler has it's own connection
+		# classes, so pooling is only used for direct connections.
+		# Multiple instances can share a pool by passing the same `conn_pool`.
+		self.connection_pool = None
+		self._owns_connection_pool = False
+		if use_pool and not use_socks:
+			if conn_pool is None:
+				conn_pool = ConnectionPool.ConnectionPool()
+				self._owns_connection_pool = True
+			self.connection_pool = conn_pool
+
+		# Optional on-disk HTTP cache. Off unless a `HttpCache` is passed in.
+		self.http_cache = http_cache
+
+		# How failed requests are retried. The default policy uses `retryDelay` as the
+		# base backoff delay, and `errorOutCount` as the number of attempts.
+		self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy.RetryPolicy()
+
+		# Optional per-host circuit breaker, so requests to a dead host fail fast.
+		# Pass the same breaker to multiple instances to share host state between them.
+		self.circuit_breaker = circuit_breaker
+
+		# Hedging of slow requests, for calls with `hedge=True`. Response times are
+		# tracked either way, so the per-host hedge delays can be learned.
+		self.hedge_policy = hedge_policy if hedge_policy is not None else HedgePolicy.HedgePolicy()
+		self._hedge_executor = None
+		self._hedge_lock = Lock()
+
+		# Signature table for spotting WAF interstitials. Add signatures to it for other vendors.
+		self.waf_detector = waf_detector if waf_detector is not None else WafDetector.WafDetector()
+
+		# Per-domain policies (WAF, transport, rate limits, required cookies). Defaults to
+		# the sites in `Domain_Constants`. A policy's rate limits are pushed to the host
+		# scheduler per-netloc, so a reload of the table gets picked up.
+		self.domain_routes = domain_routes if domain_routes is not None else DomainRoutes.DomainRoutes.default()
+
+		# Optional in-memory memo of recent responses (and parsed json/soup).
+		self.response_memo = response_memo
+
+		# Cached name resolution for our connections. Socks connections are
+		# resolved by the proxy, so there's nothing to cache there.
+		self.dns_cache = None
+		if not use_socks:
+			self.dns_cache = dns_cache if dns_cache is not None else DnsCache.DnsCache()
+
+		# Timeouts are set on each request's sockets, rather then overriding the
+		# process-wide default, which would change every other library in the process too.
+		# `total_timeout` can also be overridden per-call.
+		if connect_timeout is not None:
+			self.connect_timeout = connect_timeout
+		if read_timeout is not None:
+			self.read_timeout = read_timeout
+		if total_timeout is not None:
+			self.total_timeout = total_timeout
+
+		# Callables that are passed the `FetchTiming` record of every fetch once it's done.
+		self.timing_listeners = list(timing_listeners) if timing_listeners else []
+
+		# Optional metrics registry. The fetch metrics come from the timing records.
+		self.metrics = metrics
+		if metrics is not None:
+			self.timing_listeners.append(metrics.observe_fetch)
+
+		# Spans for the fetches, WAF step-throughs and chromium. Doesn't trace anything by default.
+		self.tracer = tracer if tracer is not None else Tracing.NullTracer()
+
+		# In the "perf" logging mode, the step-by-step logging of each request is
+		# replaced by a single (sampled) summary record per fetch.
+		if log_mode not in FetchLog.LOG_MODES:
+			raise ValueError("Invalid log mode: %r. Must be one of %s" % (log_mode, FetchLog.LOG_MODES))
+		self.log_mode = log_mode
+		self._verbose_log = log_mode == FetchLog.LOG_VERBOSE
+		if not self._verbose_log:
+			self.timing_listeners.append(FetchLog.FetchLogger(self.log, log_sample_rate, log_slow_threshold))
+
+		# Advertise brotli/zstd support (when the packages for them are installed).
+		self.modern_encodings = modern_encodings
+
+		# Default limits on the size of a response, on the wire and once decompressed.
+		# Can be overridden per-call with the kwargs of the same names.
+		self.max_content_bytes      = max_content_bytes
+		self.max_decompressed_bytes = max_decompressed_bytes
+
+		# Per-host memo of the zlib `wbits` that works for their "deflate" responses.
+		self.deflate_wbits = Decompressors.DeflateWbitsMemo()
+
+		# Per-host/content-type memo of the charset of pages without one in their headers.
+		self.charset_memo = Charset.CharsetMemo()
 
 		if custom_ua:
 			self.log.info("User agent overridden!")
@@ -131,10 +264,14 @@ class WebGetRobust(
 		else:
 			# Due to general internet people douchebaggyness, I've basically said to hell with it and decided to spoof a whole assortment of browsers
 			# It should keep people from blocking this scraper *too* easily
-			self.browserHeaders = UA_Constants.getUserAgent()
+			self.browserHeaders = UA_Constants.getUserAgent(modern_encodings=modern_encodings)
 
 		self.data = urllib.parse.urlencode(self.browserHeaders)
 
+		# Serializes changes to the browser headers, since a instance can be shared
+		# across multiple threads (e.g. via `getpages()`).
+		self._header_lock = Lock()
+
 		if creds:
 			print("Have credentials, installing password manager into urllib handler.")
 			passManager = urllib.request.HTTPPasswordMgrWithDefaultRealm()
@@ -156,14 +293,27 @@ class WebGetRobust(
 		'''
 		target_func = getattr(self, funcname)
 
+		# The step-through can't be interrupted, but there's no point starting it (or
+		# retrying afterwards) if the deadline for the fetch has already passed.
+		deadline = kwargs.get("deadline")
+		timing   = kwargs.get("timing") or FetchTiming.FetchTiming(requestedUrl)
+
 		try:
 			return target_func(requestedUrl, *args, **kwargs)
 
 		except Exceptions.CloudFlareWrapper:
 			if self.rules['auto_waf']:
 				self.log.warning("Cloudflare failure! Doing automatic step-through.")
-				if not self.stepThroughCloudFlareWaf(requestedUrl):
+				if deadline is not None:
+					deadline.check(requestedUrl)
+				with timing.phase('waf_step'), self.tracer.span("waf_step_through", url=requestedUrl, waf="cloudflare") as span:
+					stepped = self.stepThroughCloudFlareWaf(requestedUrl)
+					span.set_attribute("stepped", bool(stepped))
+				if not stepped:
+					self._recordCircuit(requestedUrl, False)
 					raise Exceptions.FetchFailureError("Could not step through cloudflare!", requestedUrl)
+				if deadline is not None:
+					deadline.check(requestedUrl)
 				# Cloudflare cookie set, retrieve again
 				return target_func(requestedUrl, *args, **kwargs)
 
@@ -175,8 +325,16 @@ class WebGetRobust(
 			# print("Sucuri!")
 			if self.rules['auto_waf']:
 				self.log.warning("Sucuri failure! Doing automatic step-through.")
-				if not self.stepThroughSucuriWaf(requestedUrl):
+				if deadline is not None:
+					deadline.check(requestedUrl)
+				with timing.phase('waf_step'), self.tracer.span("waf_step_through", url=requestedUrl, waf="sucuri") as span:
+					stepped = self.stepThroughSucuriWaf(requestedUrl)
+					span.set_attribute("stepped", bool(stepped))
+				if not stepped:
+					self._recordCircuit(requestedUrl, False)
 					raise Exceptions.FetchFailureError("Could not step through Sucuri WAF bullshit!", requestedUrl)
+				if deadline is not None:
+					deadline.check(requestedUrl)
 				return target_func(requestedUrl, *args, **kwargs)
 			else:
 				self.log.info("Sucuri without step-through setting!")
@@ -185,14 +343,166 @@ class WebGetRobust(
 
 
 
+	def _recordCircuit(self, requestedUrl:str, ok):
+		if self.circuit_breaker is not None:
+			self.circuit_breaker.record(requestedUrl, ok)
+
+	def _deadlineFor(self, requestedUrl:str, kwargs:dict):
+		'''
+		The `Deadline` for a fetch, or None if there's no total timeout. It's created (from
+		the `total_timeout` kwarg, or the instance default) the first time this is called for
+		the fetch, and stashed in `kwargs`, so all the retries, redirects and WAF step-throughs
+		share it.
+		'''
+		total = kwargs.pop("total_timeout", None)
+		if kwargs.get("deadline") is None:
+			if total is None:
+				total = self.total_timeout
+			kwargs["deadline"] = Deadline.Deadline(total, requestedUrl) if total is not None else None
+		return kwargs["deadline"]
+
+	def _requestTimeouts(self, deadline:Deadline.Deadline=None):
+		'''
+		2-tuple of the (connect, read) timeouts for a request, cut down to whatever's
+		left of `deadline`.
+		'''
+		connect = self.connect_timeout if self.connect_timeout is not None else self.timeout
+		read    = self.read_timeout    if self.read_timeout    is not None else self.timeout
+		if deadline is not None:
+			connect = deadline.clamp(connect)
+			read    = deadline.clamp(read)
+		return connect, read
+
 	def getpage(self, requestedUrl:str, *args, **kwargs):
 		'''
 		Get page at `requestedUrl`, while automatically handling a WAF,
 		if one is encountered
 
+		If `returnTiming` is true, the `FetchTiming` record for the fetch is
+		returned along with the content, as `(content, timing)` (or
+		`(content, handle, timing)` if `returnMultiple` is also set).
+		'''
+		returnTiming = kwargs.pop("returnTiming", False)
+		with self._fetchTiming(requestedUrl, "getpage") as timing:
+			content = self._getpageTimed(requestedUrl, timing, args, kwargs)
+			return self._withTiming(content, timing, returnTiming)
+
+	def _getpageTimed(self, requestedUrl:str, timing:FetchTiming.FetchTiming, args:tuple, kwargs:dict):
+		# The deadline and timing record get stashed in the kwargs, so don't touch the caller's copy.
+		kwargs = dict(kwargs)
+
+		memoKey = self._memoKey("page", requestedUrl, args, kwargs)
+		if memoKey is not None:
+			found, content = self.response_memo.get(memoKey)
+			if found:
+				timing.transport = FetchTiming.TRANSPORT_MEMO
+				return content
+
+		if self._routedTransport(requestedUrl, args, kwargs) == DomainRoutes.TRANSPORT_CHROMIUM:
+			timing.transport = FetchTiming.TRANSPORT_CHROMIUM
+			with timing.phase('download'):
+				content, _, _ = self.getItemChromium(requestedUrl)
+		else:
+			self._deadlineFor(requestedUrl, kwargs)
+			kwargs["timing"] = timing
+			content = self._unwaf_func("_getpage", requestedUrl, *args, **kwargs)
+
+		if memoKey is not None:
+			self.response_memo.put(memoKey, content, len(content))
+		return content
+
+	@contextlib.contextmanager
+	def _fetchTiming(self, requestedUrl:str, spanName:str, streamed:bool=False):
+		'''
+		Context manager for the `FetchTiming` record of a fetch. Once the block exits, the
+		record is finished off, and handed to the timing listeners.
+
+		If `streamed` is true and the block exits cleanly, the body is still to be read, so
+		the record is left open, to be finished with `_finishTiming()` once it has been.
+
+		The block is also the `spanName` span, which everything the fetch does is traced under.
+		'''
+		timing   = FetchTiming.FetchTiming(requestedUrl)
+		span     = self.tracer.start_span(spanName, url=requestedUrl)
+		finished = True
+		try:
+			yield timing
+			finished = not streamed
+		except Exception as err:
+			timing.error = err
+			raise
+		finally:
+			span.set_attribute("transport", timing.transport)
+			span.set_attribute("status",    timing.status)
+			span.set_attribute("attempts",  timing.attempts)
+			self.tracer.end_span(span, timing.error)
+			if finished:
+				self._finishTiming(timing)
+
+	def _finishTiming(self, timing:FetchTiming.FetchTiming):
+		timing.finish()
+		for listener in self.timing_listeners:
+			try:
+				listener(timing)
+			except Exception:
+				self.log.exception("Timing listener %r failed!", listener)
+
+	def _timedStream(self, stream, timing:FetchTiming.FetchTiming):
+		# Finish off the timing record of a streamed fetch once the stream is done with.
+		try:
+			yield from stream
+		except Exception as err:
+			timing.error = err
+			raise
+		finally:
+			self._finishTiming(timing)
+
+	@staticmethod
+	def _withTiming(result, timing:FetchTiming.FetchTiming, returnTiming:bool):
+		if not returnTiming:
+			return result
+		if isinstance(result, tuple):
+			return result + (timing, )
+		return result, timing
+
+	def addTimingListener(self, listener):
 		'''
+		Register `listener`, which is called with the `FetchTiming` record of each fetch
+		once it's complete (successful or not).
+		'''
+		self.timing_listeners.append(listener)
+
+	def removeTimingListener(self, listener):
+		self.timing_listeners.remove(listener)
 
-		return self._unwaf_func("_getpage", requestedUrl, *args, **kwargs)
+	def _routedTransport(self, requestedUrl:str, args:tuple, kwargs:dict):
+		'''
+		The transport the routing table wants `requestedUrl` fetched with, or None.
+		Only plain fetches (no extra arguments) can be rerouted, since the other
+		transports don't support them.
+		'''
+		if args or kwargs:
+			return None
+		policy = self.domain_routes.lookup(requestedUrl)
+		if policy is None:
+			return None
+		return policy.transport
+
+	def _memoKey(self, kind:str, requestedUrl:str, args:tuple, kwargs:dict):
+		'''
+		Key for the response memo, or None if there is no memo, or the call can't
+		be memoized.
+		'''
+		if self.response_memo is None or args:
+			return None
+		if kind != "page" and not self.response_memo.cache_parsed:
+			return None
+		# The memo can be shared between instances, so key on the size limits that
+		# actually apply, not just the ones passed in.
+		kwargs = dict(kwargs)
+		kwargs.setdefault("max_content_bytes",      self.max_content_bytes)
+		kwargs.setdefault("max_decompressed_bytes", self.max_decompressed_bytes)
+		return self.response_memo.make_key(kind, requestedUrl, kwargs)
 
 	def chunkReport(self, bytesSoFar, totalSize):   # noqa
 		if totalSize:
@@ -202,27 +512,161 @@ class WebGetRobust(
 		else:
 			self.log.info("Downloaded %d bytes", bytesSoFar)
 
+	@staticmethod
+	def _contentLength(headers):
+		contentLengthHeader = headers.get('Content-Length')
+		try:
+			return int(contentLengthHeader.strip())
+		except (AttributeError, ValueError):
+			return None
+
 	def __chunkRead(self, response, chunkSize:int=2 ** 18, reportHook=None):    # noqa
-		contentLengthHeader = response.info().getheader('Content-Length')
-		if contentLengthHeader:
-			totalSize = contentLengthHeader.strip()
-			totalSize = int(totalSize)
-		else:
-			totalSize = None
+		totalSize = self._contentLength(response.headers)
 		bytesSoFar = 0
-		pgContent = ""
+		pgContent = []
 		while 1:
 			chunk = response.read(chunkSize)
-			pgContent += chunk
-			bytesSoFar += len(chunk)
-
 			if not chunk:
 				break
 
+			pgContent.append(chunk)
+			bytesSoFar += len(chunk)
+
 			if reportHook:
 				reportHook(bytesSoFar, chunkSize, totalSize)
 
-		return pgContent
+		return b"".join(pgContent)
+
+	def getpage_stream(self, requestedUrl:str, *args, chunkSize:int=2 ** 16, max_bytes:int=None, **kwargs):
+		'''
+		Fetch `requestedUrl`, and return a generator that yields the (decompressed)
+		content in chunks as it comes off the wire, rather then buffering the whole
+		thing in memory.
+
+		The request itself (including retries and WAF step-through) is done before this
+		returns, so errors opening the page are raised here. Errors reading the body are
+		raised from the generator.
+
+		The content is yielded as raw bytes, irrespective of the content type.
+
+		Params:
+			``chunkSize`` - Size of the reads from the socket.
+			``max_bytes`` - If set, raise `ContentTooLargeError` once the decompressed
+				content exceeds this size. Defaults to the `max_decompressed_bytes` limit.
+			``callBack`` - Progress hook. Called as `callBack(bytesSoFar, chunkSize, totalSize)`
+				after each read, where the sizes are for the raw (compressed) content, and
+				`totalSize` is None if the server didn't send a Content-Length.
+
+		Everything else is passed through to `getpage()`, with the exception of
+		`returnMultiple`.
+
+		The `getpage_stream` span only covers opening the page, but the timing record
+		covers reading the body too, and is handed to the timing listeners once the
+		generator is exhausted (or closed).
+		'''
+		for bad_kwarg in ('returnMultiple', 'soup'):
+			if bad_kwarg in kwargs:
+				raise Exceptions.ArgumentError("getpage_stream cannot be called with '%s'" % bad_kwarg, requestedUrl)
+
+		callBack = kwargs.pop('callBack', None)
+		if max_bytes is None:
+			max_bytes = kwargs.get('max_decompressed_bytes', self.max_decompressed_bytes)
+		maxContent = kwargs.get('max_content_bytes', self.max_content_bytes)
+
+		with self._fetchTiming(requestedUrl, "getpage_stream", streamed=True) as timing:
+			# The deadline only covers opening the page. How long the caller takes to
+			# consume the generator is up to them.
+			self._deadlineFor(requestedUrl, kwargs)
+			kwargs["timing"] = timing
+			pghandle, decoder, first = self._unwaf_func("_openStream", requestedUrl, chunkSize, *args, **kwargs)
+
+		stream = self._streamContent(pghandle, decoder, first, chunkSize, max_bytes, callBack, requestedUrl, maxContent, timing)
+		return self._timedStream(stream, timing)
+
+	def _openStream(self, requestedUrl:str, chunkSize:int, *args, **kwargs):
+		'''
+		Open the page, and read the first chunk so it can be checked for WAF garbage
+		before anything is handed to the caller.
+		'''
+		pghandle = self._getpage(requestedUrl, *args, streamResponse=True, **kwargs)
+
+		try:
+			decoder = self._newDecoder(pghandle.headers.get('Content-Encoding'), requestedUrl)
+			raw = pghandle.read(chunkSize)
+			first = decoder.decompress(raw)
+
+			# WAF interstitials are small, so the first chunk is enough to spot them.
+			self._check_waf(first, requestedUrl, pghandle.headers.get("Content-Type"))
+		except Exception:
+			pghandle.close()
+			raise
+
+		return pghandle, decoder, (raw, first)
+
+	def _newDecoder(self, coding:str, pageUrl:str):
+		'''
+		Incremental decoder for `coding`. For deflate, if we know what works for the host,
+		use that rather then guessing from the header.
+
+		Like `_decompressContent()`, encodings we've never heard of (servers send all sorts
+		of garbage in `Content-Encoding`) are treated as uncompressed.
+		'''
+		normalized = coding.strip().lower() if coding else coding
+		if normalized not in Decompressors.DECODERS and normalized != "sdch":
+			self.log.warning("Unknown content encoding '%s' for %s. Treating it as uncompressed.", coding, pageUrl)
+			return Decompressors.IdentityDecoder()
+
+		decoder = Decompressors.get_decompressor(coding)
+		if isinstance(decoder, Decompressors.DeflateDecoder):
+			netloc = urllib.parse.urlsplit(pageUrl).netloc.lower() if pageUrl else None
+			decoder = Decompressors.DeflateDecoder(memo=self.deflate_wbits, netloc=netloc)
+		return decoder
+
+	def _streamContent(self, pghandle, decoder, first, chunkSize:int, max_bytes:int, callBack, requestedUrl:str, maxContent:int=None, timing=None):
+		totalSize = self._contentLength(pghandle.headers)
+		raw, chunk = first
+		bytesSoFar = 0
+		bytesOut = 0
+
+		try:
+			while True:
+				if raw:
+					bytesSoFar += len(raw)
+					if timing is not None:
+						timing.wire_bytes += len(raw)
+					if maxContent is not None and bytesSoFar > maxContent:
+						raise Exceptions.ContentTooLargeError("Content exceeded size limit", requestedUrl,
+							limit=maxContent, size=bytesSoFar, headers=pghandle.headers)
+					if callBack:
+						callBack(bytesSoFar, chunkSize, totalSize)
+				else:
+					chunk += decoder.flush()
+
+				if chunk:
+					bytesOut += len(chunk)
+					if timing is not None:
+						timing.content_bytes += len(chunk)
+					if max_bytes is not None and bytesOut > max_bytes:
+						raise Exceptions.ContentTooLargeError("Content exceeded size limit", requestedUrl,
+							limit=max_bytes, size=bytesOut, headers=pghandle.headers)
+					yield chunk
+
+				if not raw:
+					break
+
+				raw = pghandle.read(chunkSize)
+				chunk = decoder.decompress(raw)
+
+			# `read(amt)` doesn't complain if the connection is closed before the
+			# full content was received, so check ourselves.
+			if totalSize is not None and bytesSoFar < totalSize:
+				raise Exceptions.FetchFailureError("Connection closed after %s of %s bytes" % (bytesSoFar, totalSize), requestedUrl,
+					err_reason="Incomplete read")
+
+			self.log.info("Streamed %0.3fK (%0.3fK on the wire) from %s", bytesOut / 1000.0, bytesSoFar / 1000.0, requestedUrl)
+
+		finally:
+			pghandle.close()
 
 	def getSoup(self, requestedUrl:str, *args, **kwargs):
 		if 'returnMultiple' in kwargs and kwargs['returnMultiple']:
@@ -231,51 +675,194 @@ class WebGetRobust(
 		if 'soup' in kwargs and kwargs['soup']:
 			raise Exceptions.ArgumentError("getSoup contradicts the 'soup' directive!", requestedUrl)
 
-		page = self.getpage(requestedUrl, *args, **kwargs)
-		if isinstance(page, bytes):
-			raise Exceptions.ContentTypeError("Received content not decoded! Cannot parse!", requestedUrl)
+		returnTiming = kwargs.pop("returnTiming", False)
+		with self._fetchTiming(requestedUrl, "getSoup") as timing:
+			memoKey = self._memoKey("soup", requestedUrl, args, kwargs)
+			if memoKey is not None:
+				found, soup = self.response_memo.get(memoKey)
+				if found:
+					timing.transport = FetchTiming.TRANSPORT_MEMO
+					return self._withTiming(soup, timing, returnTiming)
 
-		soup = utility.as_soup(page)
-		return soup
+			page = self._getpageTimed(requestedUrl, timing, args, kwargs)
+			if isinstance(page, bytes):
+				raise Exceptions.ContentTypeError("Received content not decoded! Cannot parse!", requestedUrl)
+
+			with timing.phase('parse'):
+				soup = utility.as_soup(page)
+
+			if memoKey is not None:
+				self.response_memo.put(memoKey, soup, len(page))
+			return self._withTiming(soup, timing, returnTiming)
 
 	def getJson(self, requestedUrl:str, *args, **kwargs):
 		if 'returnMultiple' in kwargs and kwargs['returnMultiple']:
 			raise Exceptions.ArgumentError("getSoup cannot be called with 'returnMultiple' being true", requestedUrl)
 
-		attempts = 0
-		while 1:
-			try:
-				page = self.getpage(requestedUrl, *args, **kwargs)
-				if isinstance(page, bytes):
-					page = page.decode(utility.determine_json_encoding(page))
-					# raise ValueError("Received content not decoded! Cannot parse!")
-
-				page = page.strip()
-				ret = json.loads(page)
-				return ret
-			except ValueError:
-				if attempts < 1:
-					attempts += 1
-					self.log.error("JSON Parsing issue retrieving content from page!")
-					for line in traceback.format_exc().split("\n"):
-						self.log.error("%s", line.rstrip())
-					self.log.error("Retrying!")
-
-					# Scramble our current UA
-					self.browserHeaders = UA_Constants.getUserAgent()
-					if self.alt_cookiejar:
-						self.cj.init_agent(new_headers=self.browserHeaders)
-
-					time.sleep(self.retryDelay)
-				else:
-					self.log.error("JSON Parsing issue, and retries exhausted!")
-					# self.log.error("Page content:")
-					# self.log.error(page)
-					# with open("Error-ctnt-{}.json".format(time.time()), "w") as tmp_err_fp:
-					# 	tmp_err_fp.write(page)
-					raise
+		returnTiming = kwargs.pop("returnTiming", False)
+		with self._fetchTiming(requestedUrl, "getJson") as timing:
+			memoKey = self._memoKey("json", requestedUrl, args, kwargs)
+			if memoKey is not None:
+				found, ret = self.response_memo.get(memoKey)
+				if found:
+					timing.transport = FetchTiming.TRANSPORT_MEMO
+					return self._withTiming(ret, timing, returnTiming)
+
+			attempts = 0
+			while 1:
+				try:
+					page = self._getpageTimed(requestedUrl, timing, args, kwargs)
+					with timing.phase('parse'):
+						if isinstance(page, bytes):
+							page = page.decode(utility.determine_json_encoding(page))
+							# raise ValueError("Received content not decoded! Cannot parse!")
+
+						page = page.strip()
+						ret = json.loads(page)
+
+					if memoKey is not None:
+						self.response_memo.put(memoKey, ret, len(page))
+					return self._withTiming(ret, timing, returnTiming)
+				except ValueError:
+					# Don't let the retry get the same broken content out of the memo.
+					pageKey = self._memoKey("page", requestedUrl, args, kwargs)
+					if pageKey is not None:
+						self.response_memo.discard(pageKey)
+
+					if attempts < 1:
+						attempts += 1
+						self.log.error("JSON Parsing issue retrieving content from page!")
+						for line in traceback.format_exc().split("\n"):
+							self.log.error("%s", line.rstrip())
+						self.log.error("Retrying!")
+
+						self._scrambleUserAgent()
+
+						time.sleep(self.retryDelay)
+					else:
+						self.log.error("JSON Parsing issue, and retries exhausted!")
+						# self.log.error("Page content:")
+						# self.log.error(page)
+						# with open("Error-ctnt-{}.json".format(time.time()), "w") as tmp_err_fp:
+						# 	tmp_err_fp.write(page)
+						raise
+
+
+
+	def _scrambleUserAgent(self):
+		'''
+		Swap out our current UA for a new random one.
+		'''
+		with self._header_lock:
+			self.browserHeaders = UA_Constants.getUserAgent(modern_encodings=self.modern_encodings)
+			if self.alt_cookiejar:
+				self.cj.init_agent(new_headers=self.browserHeaders)
+
+	def getpages(self, urls, concurrency:int=8, **kwargs):
+		'''
+		Fetch each url in `urls` (via `getpage()`, so WAFs are handled), using up to
+		`concurrency` worker threads.
 
+		This is a generator that yields a 2-tuple of (url, result) for each url, in the
+		order the fetches complete. If a fetch fails, result is the exception that was
+		raised, rather then the exception propagating out of the generator.
 
+		`urls` is consumed lazily, and at most `concurrency` fetches are ever in flight,
+		so memory use is bounded irrespective of the number of urls.
+
+		Any other kwargs (`addlHeaders`, `postData`, `binaryForm`, `retryQuantity`, etc...)
+		are passed through to each `getpage()` call. All the fetches share the same cookie
+		jar.
+
+		Failed fetches are retried as per the `retry_policy`, but rather then a worker
+		sleeping through the backoff delay, the url is parked until it's due, and the
+		worker moves on to the next url.
+		'''
+
+		if 'returnMultiple' in kwargs and kwargs['returnMultiple']:
+			raise Exceptions.ArgumentError("getpages cannot be called with 'returnMultiple' being true", None)
+
+		kwargs = dict(kwargs)
+		maxAttempts = self.retry_policy.attempts(kwargs.pop('retryQuantity', None), self.errorOutCount)
+		kwargs['retryQuantity'] = 1
+
+		urls = iter(urls)
+		pending = {}
+
+		# Heap of (due_time, seq, url, attempt, start_time) for fetches waiting to be retried.
+		delayed = []
+		seq = itertools.count()
+
+		executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+		try:
+			while True:
+				while delayed and delayed[0][0] <= time.monotonic() and len(pending) < concurrency:
+					_, _, url, attempt, started = heapq.heappop(delayed)
+					pending[executor.submit(self._getpage_isolated, url, kwargs)] = (url, attempt, started)
+
+				while len(pending) < concurrency:
+					url = next(urls, None)
+					if url is None:
+						break
+					pending[executor.submit(self._getpage_isolated, url, kwargs)] = (url, 1, time.monotonic())
+
+				if not pending:
+					if not delayed:
+						return
+					time.sleep(max(0, delayed[0][0] - time.monotonic()))
+					continue
+
+				timeout = max(0, delayed[0][0] - time.monotonic()) if delayed else None
+				done, _ = concurrent.futures.wait(pending, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+				for fut in done:
+					url, attempt, started = pending.pop(fut)
+					try:
+						result = fut.result()
+					except Exception as e:
+						delay = self._bulkRetryDelay(url, e, attempt, maxAttempts, started)
+						if delay is None:
+							yield url, e
+						else:
+							heapq.heappush(delayed, (time.monotonic() + delay, next(seq), url, attempt + 1, started))
+						continue
+
+					yield url, result
+		finally:
+			for fut in pending:
+				fut.cancel()
+			executor.shutdown(wait=False)
+
+	def _bulkRetryDelay(self, url:str, err:Exception, attempt:int, maxAttempts:int, startTime:float):
+		'''
+		For the bulk fetch calls, how long to park a failed fetch before it's retried,
+		or None if it shouldn't be.
+		'''
+		if not isinstance(err, Exceptions.FetchFailureError) or isinstance(err, Exceptions.CircuitOpenError):
+			return None
+
+		rule = self.retry_policy.action(err.err_code)
+		if rule == RetryPolicy.FAIL or self.retry_policy.exhausted(attempt + 1, maxAttempts, startTime):
+			return None
+
+		if rule == RetryPolicy.THROTTLE:
+			# The scheduler knows when the host will let us back in.
+			delay = self.host_scheduler.ready_in(url)
+		else:
+			delay = self.retry_policy.next_delay(attempt, maxAttempts, startTime, self.retryDelay)
+
+		if delay is not None:
+			self.log.info("Fetch of %s failed (attempt %s). Retrying in %0.2f seconds", url, attempt, delay)
+		return delay
+
+	def _getpage_isolated(self, url:str, kwargs:dict):
+		'''
+		`_getpage()` modifies it's kwargs (and the addlHeaders dict) in place, so
+		concurrent calls each need their own copy.
+		'''
+		kwargs = copy.copy(kwargs)
+		if kwargs.get("addlHeaders"):
+			kwargs["addlHeaders"] = dict(kwargs["addlHeaders"])
+		return self.getpage(url, **kwargs)
 
 	def getSoupNoRedirects(self, *args, **kwargs):
 		if 'returnMultiple' in kwargs:
@@ -352,6 +939,16 @@ class WebGetRobust(
 
 		pgctnt, pghandle = self.getpage(requestedUrl, *args, **kwargs)
 
+		hName, mime, requestedUrl = self._getFileNameMime(pghandle, requestedUrl)
+
+		return pgctnt, hName, mime, requestedUrl
+
+	def _getFileNameMime(self, pghandle, requestedUrl:str):
+		'''
+		Resolve the filename and mimetype for a response handle, as a 3-tuple
+		(hName, mime, resolved_url).
+		'''
+
 		info = pghandle.info()
 		if not 'Content-Disposition' in info:
 			hName = ''
@@ -372,7 +969,7 @@ class WebGetRobust(
 		if "/" in hName:
 			hName = hName.split("/")[-1]
 
-		return pgctnt, hName, mime, requestedUrl
+		return hName, mime, requestedUrl
 
 
 
@@ -382,11 +979,164 @@ class WebGetRobust(
 		if not content or not handle:
 			raise urllib.error.URLError("Failed to retreive file from page '%s'!" % itemUrl)
 
+		fileN, mType = self._getItemFileNameMime(handle)
+
+		self.log.info("Retreived file of type '%s', name of '%s' with a size of %0.3f K", mType, fileN, len(content)/1000.0)
+		return content, fileN, mType
+
+	def download_to(self, requestedUrl:str, path:str, *args, resume:bool=True, chunkSize:int=2 ** 17, max_bytes:int=None, **kwargs):
+		'''
+		Download the content at `requestedUrl` straight to disk, without holding it in memory.
+
+		If `path` is a existing directory, the file is saved in it under the name
+		`getFileNameMimeUrl()` would return. Otherwise, `path` is the destination file.
+
+		The content is written to a temporary `.part` file, which is renamed into place
+		once the download completes. If a download is interrupted, the partial file is
+		kept, and the next call for the same url resumes it with a `Range` request
+		(with a `If-Range` validator, so if the file changed on the server in the meantime,
+		we just get the whole thing again).
+
+		Returns a 5-tuple (file_path, hName, mime, resolved_url, sha256_hexdigest).
+
+		`callBack` and any other kwargs are handled as in `getpage_stream()`.
+		'''
+		for bad_kwarg in ('returnMultiple', 'soup'):
+			if bad_kwarg in kwargs:
+				raise Exceptions.ArgumentError("download_to cannot be called with '%s'" % bad_kwarg, requestedUrl)
+
+		with self._fetchTiming(requestedUrl, "download_to") as timing:
+			return self._downloadTo(requestedUrl, path, timing, resume, chunkSize, max_bytes, args, kwargs)
+
+	def _downloadTo(self, requestedUrl:str, path:str, timing:FetchTiming.FetchTiming, resume:bool, chunkSize:int, max_bytes:int, args:tuple, kwargs:dict):
+		if os.path.isdir(path):
+			tmpPath = os.path.join(path, ".%s.part" % hashlib.sha1(requestedUrl.encode("utf-8")).hexdigest())
+		else:
+			tmpPath = path + ".part"
+		metaPath = tmpPath + ".json"
+
+		offset, validator = self._partialDownloadState(tmpPath, metaPath, requestedUrl) if resume else (0, None)
+
+		callBack = kwargs.pop('callBack', None)
+		origHeaders = kwargs.pop('addlHeaders', None)
+		addlHeaders = dict(origHeaders or {})
+		if offset:
+			self.log.info("Resuming download of %s from byte %s", requestedUrl, offset)
+			addlHeaders['Range'] = "bytes=%d-" % offset
+			addlHeaders['If-Range'] = validator
+
+		try:
+			self._deadlineFor(requestedUrl, kwargs)
+			kwargs["timing"] = timing
+			pghandle, decoder, first = self._unwaf_func("_openStream", requestedUrl, chunkSize, *args, addlHeaders=addlHeaders or None, **kwargs)
+		except Exceptions.FetchFailureError as err:
+			if not (offset and err.err_code == 416):
+				raise
+			# Probably the partial file is actually complete. We can't tell, so start again.
+			self.log.warning("Server rejected resume range. Restarting download.")
+			self._removeFiles(tmpPath, metaPath)
+			return self._downloadTo(requestedUrl, path, timing, False, chunkSize, max_bytes, args, dict(kwargs, callBack=callBack, addlHeaders=origHeaders))
+
+		headers = pghandle.headers
+		encoded = headers.get('Content-Encoding', 'identity').strip().lower() not in ('', 'identity')
+
+		if offset and pghandle.status == 206 and (encoded or self._contentRangeStart(headers) != offset):
+			self.log.warning("Unusable partial response. Restarting download.")
+			pghandle.close()
+			self._removeFiles(tmpPath, metaPath)
+			return self._downloadTo(requestedUrl, path, timing, False, chunkSize, max_bytes, args, dict(kwargs, callBack=callBack, addlHeaders=origHeaders))
+
+		if offset and pghandle.status != 206:
+			self.log.info("Server returned the whole file. Restarting download.")
+			offset = 0
+
+		# Save what we need to resume the download if it gets interrupted.
+		etag = headers.get('ETag')
+		validator = etag if etag and not etag.startswith("W/") else headers.get('Last-Modified')
+		with open(metaPath, "w") as fp:
+			json.dump({'url' : requestedUrl, 'validator' : validator, 'encoded' : encoded}, fp)
+
+		hasher = hashlib.sha256()
+		written = offset
+		try:
+			with open(tmpPath, "r+b" if offset else "wb") as fp:
+				if offset:
+					# Hash the content we already have.
+					while True:
+						chunk = fp.read(chunkSize)
+						if not chunk:
+							break
+						hasher.update(chunk)
+
+				for chunk in self._streamContent(pghandle, decoder, first, chunkSize, None, callBack, requestedUrl, timing=timing):
+					written += len(chunk)
+					if max_bytes is not None and written > max_bytes:
+						raise Exceptions.ContentTooLargeError("Content exceeded size limit", requestedUrl,
+							limit=max_bytes, size=written, headers=headers)
+					hasher.update(chunk)
+					fp.write(chunk)
+
+		except Exceptions.ContentTooLargeError:
+			self._removeFiles(tmpPath, metaPath)
+			raise
+
+		hName, mime, resolvedUrl = self._getFileNameMime(pghandle, requestedUrl)
+
+		filePath = path
+		if os.path.isdir(path):
+			hName = os.path.basename(hName)
+			if hName in ('', '.', '..'):
+				hName = "index"
+			filePath = os.path.join(path, hName)
+
+		os.replace(tmpPath, filePath)
+		self._removeFiles(metaPath)
+
+		self.log.info("Downloaded %s to %s (%0.3fK, sha256: %s)", requestedUrl, filePath, written / 1000.0, hasher.hexdigest())
+		return filePath, hName, mime, resolvedUrl, hasher.hexdigest()
+
+	@staticmethod
+	def _partialDownloadState(tmpPath:str, metaPath:str, requestedUrl:str):
+		'''
+		Return (offset, validator) for a resumable partial download, or (0, None) if
+		there isn't one.
+		'''
+		try:
+			with open(metaPath) as fp:
+				meta = json.load(fp)
+			size = os.path.getsize(tmpPath)
+		except (OSError, ValueError):
+			return 0, None
+
+		# We write decompressed content, and there's no way to restart a compressed stream
+		# part way through.
+		if meta.get('url') != requestedUrl or meta.get('encoded') or not meta.get('validator') or not size:
+			return 0, None
+
+		return size, meta['validator']
+
+	@staticmethod
+	def _contentRangeStart(headers):
+		# `Content-Range: bytes 100-199/200`
+		contentRange = headers.get('Content-Range', '')
+		match = re.match(r"\s*bytes\s+(\d+)-", contentRange)
+		return int(match.group(1)) if match else None
+
+	@staticmethod
+	def _removeFiles(*paths):
+		for path in paths:
+			try:
+				os.remove(path)
+			except FileNotFoundError:
+				pass
+
+	def _getItemFileNameMime(self, handle):
 		handle_info = handle.info()
 
 		if handle_info['Content-Disposition'] and 'filename=' in handle_info['Content-Disposition'].lower():
 			fileN = handle_info['Content-Disposition'].split("=", 1)[-1]
 		else:
+			import bs4
 			fileN = urllib.parse.unquote(urllib.parse.urlparse(handle.geturl())[2].split("/")[-1])
 			fileN = bs4.UnicodeDammit(fileN).unicode_markup
 		mType = handle_info['Content-Type']
@@ -403,15 +1153,14 @@ class WebGetRobust(
 		if mType and '%2F' in  mType:
 			mType = mType.replace('%2F', '/')
 
-		self.log.info("Retreived file of type '%s', name of '%s' with a size of %0.3f K", mType, fileN, len(content)/1000.0)
-		return content, fileN, mType
+		return fileN, mType
 
 	def getHead(self, url:str, addlHeaders:dict=None):
 		self.log.warning("TODO: Fixme this neds to be migrated to use the normal fetch interface, so it is WAF-aware.")
 		for x in range(9999):
 			try:
 				self.log.info("Doing HTTP HEAD request for '%s'", url)
-				pgreq = self.__buildRequest(url, None, addlHeaders, None, req_class=Handlers.HeadRequest)
+				pgreq = self._buildRequest(url, None, addlHeaders, None, req_class=Handlers.HeadRequest)
 				pghandle = self.opener.open(pgreq, timeout=self.timeout)
 				returl = pghandle.geturl()
 				if returl != url:
@@ -473,18 +1222,72 @@ class WebGetRobust(
 		# raise RuntimeError
 		pass
 
-	def __pre_check(self, requestedUrl:str):
+	def __check_route_cookies(self, components, policy:DomainRoutes.DomainPolicy):
 		'''
-		Allow the pre-emptive fetching of sites with a full browser if they're known
-		to be dick hosters.
+		Check we have the cookies the routing table says the site needs. If we don't,
+		and the site is behind a WAF, do the step-through pre-emptively.
+		'''
+		host = (components.hostname or "").lower()
+
+		missing = []
+		for required in policy.cookies:
+			for cookie in self.cj:
+				domain = cookie.domain.lower().lstrip(".")
+				if cookie.name.startswith(required) and (host == domain or host.endswith("." + domain)):
+					break
+			else:
+				missing.append(required)
+
+		if not missing:
+			return
+
+		if policy.waf == DomainRoutes.WAF_SUCURI:
+			self.log.info("Missing cloudproxy cookie for known sucuri wrapped site. Doing a pre-emptive chromium fetch.")
+			raise Exceptions.SucuriWrapper("WAF Shit", str(components))
+		if policy.waf == DomainRoutes.WAF_CLOUDFLARE:
+			self.log.info("Missing cookies %s for known cloudflare wrapped site. Doing a pre-emptive chromium fetch.", missing)
+			raise Exceptions.CloudFlareWrapper("WAF Shit", str(components))
+
+		self.log.warning("Missing cookies %s for %s, and no way to get them!", missing, host)
+
+	def _applyRouteLimits(self, netloc:str, policy:DomainRoutes.DomainPolicy):
+		'''
+		Push the rate limits from the routing table for `netloc` to the host scheduler.
+		If the entry changed (or went away) since, the limits are updated (or reset).
+
+		The limits are set as evictable, so the scheduler forgets them along with the
+		host once it goes idle. They're just applied again on the next request.
+		'''
+		sched = self.host_scheduler
+		current = sched.host_limits(netloc)
+
+		if policy is None or (policy.rate_limit is None and policy.max_in_flight is None):
+			# Only undo limits we set, not ones set on the scheduler directly.
+			if current is not None and current[2]:
+				sched.clear_host_limits(netloc)
+			return
+
+		wanted = (
+				policy.rate_limit    if policy.rate_limit    is not None else sched.rate,
+				policy.max_in_flight if policy.max_in_flight is not None else sched.max_in_flight,
+				True,
+			)
+		if current != wanted:
+			sched.set_host_limits(netloc, rate=wanted[0], max_in_flight=wanted[1], evictable=True)
+
+	def _pre_check(self, requestedUrl:str):
+		'''
+		Apply the routing table policy for the site, which includes the pre-emptive fetching
+		of sites with a full browser if they're known to be dick hosters.
 		'''
 		components = urllib.parse.urlsplit(requestedUrl)
 
 		netloc_l = components.netloc.lower()
-		if netloc_l in Domain_Constants.SUCURI_GARBAGE_SITE_NETLOCS:
-			self.__check_suc_cookie(components)
-		elif netloc_l in Domain_Constants.CF_GARBAGE_SITE_NETLOCS:
-			self.__check_cf_cookie(components)
+		policy = self.domain_routes.lookup(netloc_l)
+		self._applyRouteLimits(netloc_l, policy)
+
+		if policy is not None:
+			self.__check_route_cookies(components, policy)
 
 		# Testing
 		elif components.path == '/sucuri_shit_2':
@@ -498,9 +1301,10 @@ class WebGetRobust(
 
 
 	def _getpage(self, requestedUrl:str, **kwargs):
-		self.__pre_check(requestedUrl)
+		self._pre_check(requestedUrl)
 
-		self.log.info("Fetching content at URL: %s", requestedUrl)
+		if self._verbose_log:
+			self.log.info("Fetching content at URL: %s", requestedUrl)
 
 		# strip trailing and leading spaces.
 		requestedUrl = requestedUrl.strip()
@@ -519,6 +1323,18 @@ class WebGetRobust(
 		retryQuantity  = kwargs.setdefault("retryQuantity",   None)
 		nativeError    = kwargs.setdefault("nativeError",     False)
 		binaryForm     = kwargs.setdefault("binaryForm",      False)
+		streamResponse = kwargs.setdefault("streamResponse",  False)
+		hedge          = kwargs.setdefault("hedge",           False)
+
+		# Size limits. Per-call values override the instance-wide ones.
+		maxContent      = kwargs.setdefault("max_content_bytes",      self.max_content_bytes)
+		maxDecompressed = kwargs.setdefault("max_decompressed_bytes", self.max_decompressed_bytes)
+
+		# Wall-clock limit for the whole fetch (None if there isn't one).
+		deadline = self._deadlineFor(requestedUrl, kwargs)
+
+		# Where the time goes. Calls that don't go through `getpage()` just get a throwaway record.
+		timing = kwargs.setdefault("timing", None) or FetchTiming.FetchTiming(requestedUrl)
 
 		# Conditionally encode the referrer if needed, because otherwise
 		# urllib will barf on unicode referrer values.
@@ -531,123 +1347,209 @@ class WebGetRobust(
 		err_reason = None
 		err_code = None
 
+		maxAttempts = self.retry_policy.attempts(retryQuantity, self.errorOutCount)
+		startTime   = time.monotonic()
+		needBackoff = False
+
 		while 1:
 
 			pgctnt = None
 			pghandle = None
 
-			pgreq = self.__buildRequest(requestedUrl, postData, addlHeaders, binaryForm)
+			pgreq = self._buildRequest(requestedUrl, postData, addlHeaders, binaryForm)
 
 			errored = False
 			lastErr = ""
 
 			retryCount = retryCount + 1
 
-			if (retryQuantity and retryCount > retryQuantity) or (not retryQuantity and retryCount > self.errorOutCount):
-				self.log.error("Failed to retrieve Website : %s at %s All Attempts Exhausted", pgreq.get_full_url(), time.ctime(time.time()))
+			# Back off before retrying, but only if there's actually going to be
+			# another attempt. This is done outside the host scheduler slot, so other
+			# requests to the host can proceed in the meantime.
+			delay = 0
+			if needBackoff and not self.retry_policy.exhausted(retryCount, maxAttempts, startTime):
+				delay = self.retry_policy.next_delay(retryCount - 1, maxAttempts, startTime, self.retryDelay)
+
+			if deadline is not None:
+				deadline.check(requestedUrl)
+				if delay and delay >= deadline.remaining():
+					raise deadline.error(requestedUrl, "Fetch deadline would pass before the next retry")
+
+			if self.retry_policy.exhausted(retryCount, maxAttempts, startTime) or delay is None:
+				self.log.error("Failed to retrieve Website : %s All Attempts Exhausted", pgreq.get_full_url())
 				pgctnt = None
 				try:
-					self.log.critical("Critical Failure to retrieve page! %s at %s, attempt %s", pgreq.get_full_url(), time.ctime(time.time()), retryCount)
+					self.log.critical("Critical Failure to retrieve page! %s, attempt %s", pgreq.get_full_url(), retryCount)
 					self.log.critical("Error: %s", lastErr)
 					self.log.critical("Exiting")
 				except:
 					self.log.critical("And the URL could not be printed due to an encoding error")
 				break
 
-			#print "execution", retryCount
+			if delay:
+				if self._verbose_log:
+					self.log.info("Waiting %0.2f seconds before retrying", delay)
+				time.sleep(delay)
+			needBackoff = False
+
+			# Wait for the per-host scheduler to allow the request. The slot is
+			# held until the content has been received (or the attempt failed).
+			# Responses that will come straight out of the cache don't need one.
+			# Requests to a host that's been failing consistently fail immediately.
+			if self.http_cache is not None and self.http_cache.is_fresh(pgreq, self._cacheDefaultHeaders()):
+				slot_netloc = None
+			else:
+				if self.circuit_breaker is not None:
+					self.circuit_breaker.check(requestedUrl)
+				slot_netloc = self.host_scheduler.acquire(requestedUrl, timeout=deadline.remaining() if deadline is not None else None)
+				if slot_netloc is None:
+					raise deadline.error(requestedUrl, "Fetch deadline passed waiting for a request slot")
+
+			# Whether the attempt says the host is working (True), failing (False), or
+			# neither (None), for the circuit breaker.
+			hostHealthy = None
+			timing.attempts += 1
+			timing.sent_bytes += FetchTiming.request_body_size(pgreq)
+			timing.transport = FetchTiming.TRANSPORT_URLLIB
+			attemptSpan = self.tracer.start_span("request", url=requestedUrl, attempt=retryCount)
 			try:
-				# print("Getpage!", requestedUrl, kwargs)
-				pghandle = self.opener.open(pgreq, timeout=self.timeout)					# Get Webpage
-				# print("Gotpage")
-
-			except Exceptions.GarbageSiteWrapper as err:
-				# print("garbage site:")
-				raise err
-
-			except urllib.error.HTTPError as err:								# Lotta logging
-				self.log.warning("Error opening page: %s at %s On Attempt %s.", pgreq.get_full_url(), time.ctime(time.time()), retryCount)
-				self.log.warning("Error Code: %s", err)
-
-				if err.fp:
-					err_content = err.fp.read()
-					encoded = err.hdrs.get('Content-Encoding', None)
-					if encoded:
-						_, err_content = self.__decompressContent(encoded, err_content)
-
-				err_reason = err.reason
-				err_code   = err.code
-				lastErr    = err
+				#print "execution", retryCount
 				try:
+					# print("Getpage!", requestedUrl, kwargs)
+					if hedge and postData is None and slot_netloc is not None:
+						pghandle = self._hedgedOpen(pgreq, lambda: self._buildRequest(requestedUrl, postData, addlHeaders, binaryForm), deadline, timing)
+					else:
+						pghandle = self._timedOpen(pgreq, deadline, timing)					# Get Webpage
+					# print("Gotpage")
+
+				except Exceptions.GarbageSiteWrapper as err:
+					# print("garbage site:")
+					raise err
+
+				except Exceptions.FetchTimeoutError:
+					raise
 
-					self.log.warning("Original URL: %s", requestedUrl)
+				except urllib.error.HTTPError as err:								# Lotta logging
+					if self._verbose_log:
+						self.log.warning("Error opening page: %s On Attempt %s.", pgreq.get_full_url(), retryCount)
+						self.log.warning("Error Code: %s", err)
+
+					if err.fp:
+						err_content = err.fp.read()
+						encoded = err.hdrs.get('Content-Encoding', None)
+						if encoded:
+							_, err_content = self._decompressContent(encoded, err_content, requestedUrl)
+
+					err_reason = err.reason
+					err_code   = err.code
+					lastErr    = err
+					timing.status = err.code
+					attemptSpan.set_attribute("status", err.code)
+					attemptSpan.record_error(err)
 					errored = True
-				except:
-					self.log.warning("And the URL could not be printed due to an encoding error")
+					if self._verbose_log:
+						self.log.warning("Original URL: %s", requestedUrl)
+
+					# So I've been seeing 502s causing CF to bounce too.
+					# As such, poke through those via chromium too.
+					if err.code in (403, 429, 502, 503) and err_content:
+						self._check_waf(err_content, requestedUrl, err.hdrs.get("Content-Type"))
+
+					hostHealthy = err.code < 500
+
+					rule = self.retry_policy.action(err.code)
+					if rule == RetryPolicy.FAIL:
+						#print "Unrecoverable - Page not found. Breaking"
+						self.log.critical("Unrecoverable - %s response. Breaking", err.code)
+						break
+
+					if rule == RetryPolicy.THROTTLE:
+						# Rather then sleeping for a fixed interval, let the scheduler hold
+						# off any further requests to the host (respecting Retry-After, if present).
+						self.host_scheduler.throttle(requestedUrl, err.hdrs.get('Retry-After', None))
+						continue
+
+					needBackoff = True
+
+				except UnicodeEncodeError:
+					err_content = traceback.format_exc()
+					self.log.critical("Unrecoverable Unicode issue retrieving page - %s", requestedUrl)
+					for line in err_content.split("\n"):
+						self.log.critical("%s", line.rstrip())
+					self.log.critical("Parameters:")
+					self.log.critical("	requestedUrl: '%s'", requestedUrl)
+					self.log.critical("	postData:     '%s'", postData)
+					self.log.critical("	addlHeaders:  '%s'", addlHeaders)
+					self.log.critical("	binaryForm:   '%s'", binaryForm)
+
+					err_reason = "Unicode Decode Error"
+					err_code   = -1
 
-				if err.code == 404:
-					#print "Unrecoverable - Page not found. Breaking"
-					self.log.critical("Unrecoverable - Page not found. Breaking")
 					break
 
-				time.sleep(self.retryDelay)
-
-				if (err.code == 403 or err.code == 429 or err.code == 503) and err_content:
-
-					self._check_waf(err_content, requestedUrl)
-
-				# So I've been seeing this causing CF to bounce too.
-				# As such, poke through those via chromium too.
-				if err.code == 502:
-					if err_content:
-						self._check_waf(err_content, requestedUrl)
-
-			except UnicodeEncodeError:
-				self.log.critical("Unrecoverable Unicode issue retrieving page - %s", requestedUrl)
-				for line in traceback.format_exc().split("\n"):
-					self.log.critical("%s", line.rstrip())
-				self.log.critical("Parameters:")
-				self.log.critical("	requestedUrl: '%s'", requestedUrl)
-				self.log.critical("	postData:     '%s'", postData)
-				self.log.critical("	addlHeaders:  '%s'", addlHeaders)
-				self.log.critical("	binaryForm:   '%s'", binaryForm)
-
-				err_reason = "Unicode Decode Error"
-				err_code   = -1
-				err_content = traceback.format_exc()
-
-				break
-
-			except Exception as e:
-				errored = True
-				#traceback.print_exc()
-				lastErr = sys.exc_info()
-				self.log.warning("Retreival failed. Traceback:")
-				self.log.warning(str(lastErr))
-				self.log.warning(traceback.format_exc())
-
-				self.log.warning("Error Retrieving Page! - Trying again - Waiting %s seconds", self.retryDelay)
-
-				try:
-					self.log.critical("Error on page - %s", requestedUrl)
-				except:
-					self.log.critical("And the URL could not be printed due to an encoding error")
-
-				time.sleep(self.retryDelay)
+				except Exception as e:
+					if deadline is not None and deadline.expired():
+						# Probably a socket timeout that was cut short by the deadline.
+						hostHealthy = False
+						raise deadline.error(requestedUrl)
 
-				err_reason = "Unhandled general exception"
-				err_code   = -1
-				err_content = traceback.format_exc()
-
-				continue
-
-			if pghandle != None:
-				self.log.info("Request for URL: %s succeeded at %s On Attempt %s. Recieving...", pgreq.get_full_url(), time.ctime(time.time()), retryCount)
-				pgctnt = self.__retreiveContent(pgreq, pghandle, callBack)
-
-				# if __retreiveContent did not return false, it managed to fetch valid results, so break
-				if pgctnt != False:
+					errored = True
+					attemptSpan.record_error(e)
+					#traceback.print_exc()
+					lastErr = sys.exc_info()
+
+					# Formatted once, since it's also the content of the error if this was the last attempt.
+					err_content = traceback.format_exc()
+					if self._verbose_log:
+						self.log.warning("Retreival failed. Traceback:")
+						self.log.warning("%s", err_content)
+						self.log.warning("Error Retrieving Page! - Trying again")
+						self.log.critical("Error on page - %s", requestedUrl)
+
+					needBackoff = True
+					hostHealthy = False
+
+					err_reason = "Unhandled general exception"
+					err_code   = -1
+
+					continue
+
+				if pghandle != None:
+					timing.status    = pghandle.getcode()
+					attemptSpan.set_attribute("status", timing.status)
+					timing.transport = FetchTiming.TRANSPORT_CACHE if getattr(pghandle, "from_cache", False) else FetchTiming.TRANSPORT_URLLIB
+					self._checkContentLength(pghandle, requestedUrl, maxContent)
+
+				if pghandle != None and streamResponse:
+					# The caller is going to read the content itself.
+					if self._verbose_log:
+						self.log.info("Request for URL: %s succeeded On Attempt %s. Streaming...", pgreq.get_full_url(), retryCount)
+					self.host_scheduler.success(requestedUrl)
+					hostHealthy = True
 					break
 
+				if pghandle != None:
+					if self._verbose_log:
+						self.log.info("Request for URL: %s succeeded On Attempt %s. Recieving...", pgreq.get_full_url(), retryCount)
+					pgctnt = self.__retreiveContent(pgreq, pghandle, callBack, maxContent, maxDecompressed, deadline, timing)
+
+					# if __retreiveContent did not return false, it managed to fetch valid results, so break
+					if pgctnt != False:
+						self.host_scheduler.success(requestedUrl)
+						hostHealthy = True
+						break
+
+					needBackoff = True
+					hostHealthy = False
+			except BaseException as err:
+				attemptSpan.record_error(err)
+				raise
+			finally:
+				self.tracer.end_span(attemptSpan)
+				if slot_netloc is not None:
+					self.host_scheduler.release(slot_netloc)
+					self._recordCircuit(requestedUrl, hostHealthy)
+
 		if errored and pghandle != None:
 			print(("Later attempt succeeded %s" % pgreq.get_full_url()))
 		elif (errored or not pgctnt) and pghandle is None:
@@ -657,70 +1559,104 @@ class WebGetRobust(
 			raise Exceptions.FetchFailureError("Failed to retreive page", requestedUrl,
 				err_content=err_content, err_code=err_code, err_reason=err_reason)
 
+		if streamResponse:
+			return pghandle
+
 		if returnMultiple:
 
 			return pgctnt, pghandle
 		else:
 			return pgctnt
 
+	def _timedOpen(self, pgreq, deadline:Deadline.Deadline=None, timing:FetchTiming.FetchTiming=None):
+		'''
+		Open `pgreq`, recording how long it took to get the response headers.
+		'''
+		connect, read = self._requestTimeouts(deadline)
+		if self.use_socks:
+			# The socks handler only knows about the one timeout, which also
+			# applies to the reads, so it gets the (usually longer) read timeout.
+			connect = read
+
+		# The handlers pick these up to switch the socket over to the read timeout once
+		# it's connected, and redirects are given what's left of the deadline.
+		pgreq.read_timeout = read
+		pgreq.deadline     = deadline
+		pgreq.timing       = timing
+
+		setup = timing.setup_time() if timing is not None else 0
+		start = time.monotonic()
+		pghandle = self.opener.open(pgreq, timeout=connect)
+		elapsed = time.monotonic() - start
+		if not getattr(pghandle, "from_cache", False):
+			self.hedge_policy.observe(pgreq.get_full_url(), elapsed)
+		if timing is not None:
+			# The connection setup (if there was any) is accounted for separately.
+			timing.add('ttfb', elapsed - (timing.setup_time() - setup))
+		return pghandle
+
+	def _getHedgeExecutor(self):
+		with self._hedge_lock:
+			if self._hedge_executor is None:
+				self._hedge_executor = concurrent.futures.ThreadPoolExecutor(max_workers=32, thread_name_prefix="WebRequest-hedge")
+			return self._hedge_executor
+
+	@staticmethod
+	def _closeAbandoned(fut):
+		if not fut.cancelled() and fut.exception() is None:
+			fut.result().close()
+
+	def _hedgedOpen(self, pgreq, makeRequest, deadline:Deadline.Deadline=None, timing:FetchTiming.FetchTiming=None):
+		'''
+		Open `pgreq`, and if the response headers haven't come back within the hedge
+		delay, fire off a second identical request (built by `makeRequest()`). Whichever
+		succeeds first is returned, and the other is closed once it completes (there's no
+		way to interrupt a blocking urllib call).
+		'''
+		url = pgreq.get_full_url()
+		delay = self.hedge_policy.hedge_delay(url)
+		if delay is None:
+			return self._timedOpen(pgreq, deadline, timing)
+
+		# Only the primary request is timed, since the two would be racing to update the record.
+		executor = self._getHedgeExecutor()
+		primary = executor.submit(self._timedOpen, pgreq, deadline, timing)
+		done, _ = concurrent.futures.wait([primary], timeout=delay)
+		if done or not self.hedge_policy.try_hedge():
+			return primary.result()
+
+		self.log.info("No response from %s after %0.2f seconds. Hedging.", url, delay)
+		hedge = executor.submit(self._timedOpen, makeRequest(), deadline)
+
+		pending = {primary, hedge}
+		while pending:
+			done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+			winners = [fut for fut in (primary, hedge) if fut in done and fut.exception() is None]
+			if winners:
+				winner = winners[0]
+				for fut in (primary, hedge):
+					if fut is not winner:
+						fut.cancel()
+						fut.add_done_callback(self._closeAbandoned)
+				if winner is hedge:
+					self.hedge_policy.hedge_won()
+				return winner.result()
+
+		# Both failed.
+		return primary.result()
+
 	######################################################################################################################################################
 	######################################################################################################################################################
 
-	def __decode_text_content(self, pageContent:[str, bytes], cType:str):
-
-		# this *should* probably be done using a parser.
-		# However, it seems to be grossly overkill to shove the whole page (which can be quite large) through a parser just to pull out a tag that
-		# should be right near the page beginning anyways.
-		# As such, it's a regular expression for the moment
-
-		# Regex is of bytes type, since we can't convert a string to unicode until we know the encoding the
-		# bytes string is using, and we need the regex to get that encoding
-		coding = re.search(b"charset=[\'\"]?([a-zA-Z0-9\-]*)[\'\"]?", pageContent, flags=re.IGNORECASE)
-
-		cType = b""
-		charset = None
-		try:
-			if coding:
-				cType = coding.group(1)
-				codecs.lookup(cType.decode("ascii"))
-				charset = cType.decode("ascii")
-
-		except LookupError:
-
-			# I'm actually not sure what I was thinking when I wrote this if statement. I don't think it'll ever trigger.
-			if (b";" in cType) and (b"=" in cType): 		# the server is reporting an encoding. Now we use it to decode the
-
-				dummy_docType, charset = cType.split(b";")
-				charset = charset.split(b"=")[-1]
-
-		if cchardet:
-			inferred = cchardet.detect(pageContent)
-			if inferred and inferred['confidence'] is None:
-				# If we couldn't infer a charset, just short circuit and return the content.
-				# It's probably binary.
-				return pageContent
+	def __decode_text_content(self, pageContent:[str, bytes], cType:str, pageUrl:str=None):
 
-			elif inferred and inferred['confidence'] is not None and inferred['confidence'] > 0.8:
-				charset = inferred['encoding']
-				self.log.info("Cchardet inferred encoding: %s", charset)
+		# Work out the encoding from the BOM, a <meta charset> or cchardet, looking only at
+		# the start of the page (which can be quite large), and remember what worked for the
+		# site so later pages can skip all that. See `Charset.CharsetMemo` for the details.
+		netloc = urllib.parse.urlsplit(pageUrl).netloc.lower() if pageUrl else None
+		return self.charset_memo.decode(netloc, cType, pageContent)
 
-		else:
-			self.log.warning("Missing cchardet!")
-
-		if not charset:
-			self.log.warning("Could not find encoding information on page - Using default charset. Shit may break!")
-			charset = "utf-8"
-
-		try:
-			pageContent = str(pageContent, charset)
-
-		except UnicodeDecodeError:
-			self.log.error("Encoding Error! Stripping invalid chars.")
-			pageContent = pageContent.decode('utf-8', errors='ignore')
-
-		return pageContent
-
-	def __buildRequest(self, pgreq, postData:dict, addlHeaders:dict, binaryForm, req_class = None):
+	def _buildRequest(self, pgreq, postData:dict, addlHeaders:dict, binaryForm, req_class = None):
 		if req_class is None:
 			req_class = urllib.request.Request
 
@@ -730,20 +1666,19 @@ class WebGetRobust(
 			params = {}
 			headers = {}
 			if postData != None:
-				self.log.info("Making a post-request! Params: '%s'", postData)
+				if self._verbose_log:
+					self.log.info("Making a post-request! Params: '%s'", postData)
 				if isinstance(postData, str):
 					params['data'] = postData.encode("utf-8")
 				elif isinstance(postData, dict):
-					for key, parameter in postData.items():
-						self.log.info("	Item: '%s' -> '%s'", key, parameter)
 					params['data'] = urllib.parse.urlencode(postData).encode("utf-8")
 			if addlHeaders != None:
-				self.log.info("Have additional GET parameters!")
-				for key, parameter in addlHeaders.items():
-					self.log.info("	Item: '%s' -> '%s'", key, parameter)
+				if self._verbose_log:
+					self.log.info("Have additional headers: %s", addlHeaders)
 				headers = addlHeaders
 			if binaryForm:
-				self.log.info("Binary form submission!")
+				if self._verbose_log:
+					self.log.info("Binary form submission!")
 				if 'data' in params:
 					raise Exceptions.ArgumentError("You cannot make a binary form post and a plain post request at the same time!", pgreq)
 
@@ -757,62 +1692,42 @@ class WebGetRobust(
 			self.log.critical("Invalid header or url")
 			raise
 
-	def __decompressContent(self, coding:str, pgctnt:bytes):
+	def _decompressContent(self, coding:str, pgctnt:bytes, pageUrl:str=None):
 		"""
 		This is really obnoxious
 		"""
 		#preLen = len(pgctnt)
+		if coding:
+			coding = coding.strip().lower()
+
 		if coding == 'deflate':
+			# What "deflate" actually means varies by server, so the `wbits` that
+			# worked is remembered per-host.
 			compType = "deflate"
-			bits_opts = [
-				-zlib.MAX_WBITS,       # deflate
-				 zlib.MAX_WBITS,       # zlib
-				 zlib.MAX_WBITS | 16,  # gzip
-				 zlib.MAX_WBITS | 32,  # "automatic header detection"
-
-				 0,  # Try to guess from header
-
-				 # Try all the raw window options.
-				 -8, -9, -10, -11, -12, -13, -14, -15,
+			netloc = urllib.parse.urlsplit(pageUrl).netloc.lower() if pageUrl else None
+			pgctnt = self.deflate_wbits.decompress(netloc, pgctnt)
 
-				 # Stream with zlib headers
-				  8,  9,  10,  11,  12,  13,  14,  15,
-
-				 # With gzip header+trailer
-				  8+16,  9+16,  10+16,  11+16,  12+16,  13+16,  14+16,  15+16,
-				 # Automatic detection
-				  8+32,  9+32,  10+32,  11+32,  12+32,  13+32,  14+32,  15+32,
-
-			]
-
-			err = None
-
-			for wbits_val in bits_opts:
-				try:
-					pgctnt = zlib.decompress(pgctnt, wbits_val)
-					return compType, pgctnt
-				except zlib.error as e:
-					err = e
-
-			# We can't get here without err having thrown.
-			raise err
-
-		elif coding == 'gzip':
+		elif coding in ('gzip', 'x-gzip'):
 			compType = "gzip"
 
 			buf = io.BytesIO(pgctnt)
 			f = gzip.GzipFile(fileobj=buf)
 			pgctnt = f.read()
 
+		elif coding in ('br', 'zstd'):
+			compType = coding
+			decoder = Decompressors.get_decompressor(coding)
+			pgctnt = decoder.decompress(pgctnt) + decoder.flush()
+
 		elif coding == "sdch":
-			raise Exceptions.ContentTypeError("Wait, someone other then google actually supports SDCH compression (%s)?" % pgreq)
+			raise Exceptions.ContentTypeError("Wait, someone other then google actually supports SDCH compression?", None)
 
 		else:
 			compType = "none"
 
 		return compType, pgctnt
 
-	def __decodeTextContent(self, pgctnt:bytes, cType:str):
+	def _decodeTextContent(self, pgctnt:bytes, cType:str, pageUrl:str=None):
 
 		if cType:
 			if (";" in cType) and ("=" in cType):
@@ -846,7 +1761,7 @@ class WebGetRobust(
 					'application/xml' in cType or      \
 					'application/atom+xml' in cType or \
 					cType.startswith("text/"):				# If this is a html/text page, we want to decode it using the local encoding
-					pgctnt = self.__decode_text_content(pgctnt, cType)
+					pgctnt = self.__decode_text_content(pgctnt, cType, pageUrl)
 
 				elif "text" in cType:
 					self.log.critical("Unknown content type!")
@@ -858,53 +1773,105 @@ class WebGetRobust(
 
 		return pgctnt
 
-	def __retreiveContent(self, pgreq, pghandle, callBack):
-		try:
-			# If we have a progress callback, call it for chunked read.
-			# Otherwise, just read in the entire content.
-			if callBack:
-				pgctnt = self.__chunkRead(pghandle, 2 ** 17, reportHook=callBack)
-			else:
-				pgctnt = pghandle.read()
+	def _processContent(self, pgctnt:bytes, headers, pageUrl:str, maxDecompressed:int=None, decompressed:bytes=None, timing:FetchTiming.FetchTiming=None):
+		'''
+		Take the raw body of a response, and decompress it, check it for WAF garbage,
+		and decode it (if it's text), as specified by the response `headers`.
 
+		If the caller already decompressed the content, it's passed as `decompressed`.
+		Otherwise, if `maxDecompressed` is set, decompression is aborted as soon as the
+		output exceeds it. The time each step takes is added to `timing`, if passed.
 
-			if pgctnt is None:
-				return False
+		This is shared by everything that pulls content off the wire, irrespective
+		of the transport.
+		'''
+		if timing is None:
+			timing = FetchTiming.FetchTiming(pageUrl)
+
+		preDecompSize = len(pgctnt)/1000.0
+		timing.wire_bytes += len(pgctnt)
 
-			self.log.info("URL fully retrieved.")
+		encoded = headers.get('Content-Encoding')
+		with timing.phase('decompress'):
+			if decompressed is None and maxDecompressed is not None:
+				decoder = self._newDecoder(encoded, pageUrl)
+				decompressed = self._decompressLimited(decoder, pgctnt, 0, maxDecompressed, pageUrl, headers, flush=True)
 
-			preDecompSize = len(pgctnt)/1000.0
+			if decompressed is not None:
+				compType = encoded.strip().lower() if encoded and encoded.strip().lower() != 'identity' else 'none'
+				pgctnt = decompressed
+			else:
+				compType, pgctnt = self._decompressContent(encoded, pgctnt, pageUrl)
 
-			encoded = pghandle.headers.get('Content-Encoding')
-			compType, pgctnt = self.__decompressContent(encoded, pgctnt)
+		timing.content_bytes += len(pgctnt)
 
 
+		# self.log.info("Page content type = %s", type(pgctnt))
+		cType = headers.get("Content-Type")
+		if self._verbose_log:
 			decompSize = len(pgctnt)/1000.0
-			# self.log.info("Page content type = %s", type(pgctnt))
-			cType = pghandle.headers.get("Content-Type")
 			if compType == 'none':
 				self.log.info("Compression type = %s. Content Size = %0.3fK. File type: %s.", compType, decompSize, cType)
 			else:
 				self.log.info("Compression type = %s. Content Size compressed = %0.3fK. Decompressed = %0.3fK. File type: %s.", compType, preDecompSize, decompSize, cType)
 
-			self._check_waf(pgctnt, pgreq.get_full_url())
+		with timing.phase('waf_check'):
+			self._check_waf(pgctnt, pageUrl, cType)
 
-			pgctnt = self.__decodeTextContent(pgctnt, cType)
+		with timing.phase('decode'):
+			pgctnt = self._decodeTextContent(pgctnt, cType, pageUrl)
 
-			return pgctnt
+		return pgctnt
+
+	def __retreiveContent(self, pgreq, pghandle, callBack, maxContent:int=None, maxDecompressed:int=None, deadline:Deadline.Deadline=None, timing:FetchTiming.FetchTiming=None):
+		try:
+			decompressed = None
+
+			# If there are size limits or a deadline, read (and decompress) incrementally, so
+			# we can bail out as soon as we go over.
+			# Otherwise, if we have a progress callback, call it for chunked read.
+			# Otherwise, just read in the entire content.
+			decompressTime = timing.get('decompress') if timing is not None else 0
+			start = time.monotonic()
+			if maxContent is not None or maxDecompressed is not None or deadline is not None:
+				pgctnt, decompressed = self._readLimited(pghandle, pgreq.get_full_url(), callBack, maxContent, maxDecompressed, deadline=deadline, timing=timing)
+			elif callBack:
+				pgctnt = self.__chunkRead(pghandle, 2 ** 17, reportHook=callBack)
+			else:
+				pgctnt = pghandle.read()
 
+			if timing is not None:
+				# Any decompression done while reading is accounted for separately.
+				timing.add('download', time.monotonic() - start - (timing.get('decompress') - decompressTime))
 
+
+			if pgctnt is None:
+				return False
+
+			if self._verbose_log:
+				self.log.info("URL fully retrieved.")
+
+			return self._processContent(pgctnt, pghandle.headers, pgreq.get_full_url(), decompressed=decompressed, timing=timing)
+
+
+		except (Exceptions.ContentTooLargeError, Exceptions.FetchTimeoutError):
+			# Retrying isn't going to make it any smaller (or give us more time).
+			pghandle.close()
+			raise
 		except Exceptions.GarbageSiteWrapper as err:
 			raise err
 		except Exception:
+			if deadline is not None and deadline.expired():
+				pghandle.close()
+				raise deadline.error(pgreq.get_full_url())
 
 			self.log.error("Exception!")
 			self.log.error(str(sys.exc_info()))
 			traceback.print_exc()
-			self.log.error("Error Retrieving Page! - Transfer failed. Waiting %s seconds before retrying", self.retryDelay)
+			self.log.error("Error Retrieving Page! - Transfer failed.")
 
 			try:
-				self.log.critical("Critical Failure to retrieve page! %s at %s", pgreq.get_full_url(), time.ctime(time.time()))
+				self.log.critical("Critical Failure to retrieve page! %s", pgreq.get_full_url())
 				self.log.critical("Exiting")
 			except:
 				self.log.critical("And the URL could not be printed due to an encoding error")
@@ -919,21 +1886,123 @@ class WebGetRobust(
 		# postData expects a dict
 		# addlHeaders also expects a dict
 
-	def _check_waf(self, pageContent:bytes, pageUrl:str):
-		assert isinstance(pageContent, bytes), "Item pageContent must be of type bytes, received %s" % (type(pageContent), )
-		assert isinstance(pageUrl, str), "Item pageUrl must be of type str, received %s" % (type(pageUrl), )
+	def _checkContentLength(self, pghandle, requestedUrl:str, maxContent:int):
+		'''
+		Refuse responses that say up front that they're too large, before reading any
+		of the body.
+		'''
+		if maxContent is None:
+			return
+
+		length = self._contentLength(pghandle.headers)
+		if length is not None and length > maxContent:
+			pghandle.close()
+			raise Exceptions.ContentTooLargeError("Content-Length exceeds size limit", requestedUrl,
+				limit=maxContent, size=length, headers=pghandle.headers)
+
+	def _decompressLimited(self, decoder, data:bytes, outSize:int, limit:int, pageUrl:str, headers, flush:bool=False):
+		'''
+		Feed `data` through `decoder` a small slice at a time, so a decompression bomb is
+		caught after inflating a bounded amount, rather then after inflating the whole
+		thing. `outSize` is the amount of output produced so far.
+		'''
+		out = []
+		step = 2 ** 11
+		for idx in range(0, len(data), step):
+			chunk = decoder.decompress(data[idx:idx + step])
+			outSize += len(chunk)
+			if outSize > limit:
+				raise Exceptions.ContentTooLargeError("Decompressed content exceeded size limit", pageUrl,
+					limit=limit, size=outSize, headers=headers)
+			out.append(chunk)
+
+		if flush:
+			chunk = decoder.flush()
+			outSize += len(chunk)
+			if outSize > limit:
+				raise Exceptions.ContentTooLargeError("Decompressed content exceeded size limit", pageUrl,
+					limit=limit, size=outSize, headers=headers)
+			out.append(chunk)
+
+		return b"".join(out)
+
+	def _readLimited(self, pghandle, pageUrl:str, callBack, maxContent:int, maxDecompressed:int, chunkSize:int=2 ** 16, deadline:Deadline.Deadline=None, timing:FetchTiming.FetchTiming=None):
+		'''
+		Read the body of `pghandle` in chunks, raising `ContentTooLargeError` as soon as the
+		raw content exceeds `maxContent`, or the decompressed content exceeds `maxDecompressed`,
+		and `FetchTimeoutError` if `deadline` passes.
+
+		Returns a 2-tuple of (raw, decompressed), where decompressed is None if there's no
+		limit on it (in which case the content hasn't been decompressed yet).
+		'''
+		totalSize = self._contentLength(pghandle.headers)
+		decoder = self._newDecoder(pghandle.headers.get('Content-Encoding'), pageUrl) if maxDecompressed is not None else None
+		if timing is None:
+			timing = FetchTiming.FetchTiming(pageUrl)
+
+		read = pghandle.read
+		if deadline is not None:
+			# A full `read(n)` keeps going until it has n bytes, which could take forever if the
+			# server is sending a byte at a time, so use the single-recv `read1()`, with the socket
+			# timeout cut down to what's left before each one.
+			read = getattr(pghandle, "read1", read)
+			_, readTimeout = self._requestTimeouts()
+
+		raw = []
+		decompressed = []
+		rawSize = 0
+		outSize = 0
+		while True:
+			if deadline is not None:
+				sock = Deadline.response_socket(pghandle)
+				if sock is not None:
+					sock.settimeout(deadline.clamp(readTimeout))
+				else:
+					deadline.check(pageUrl)
 
-		if b"sucuri_cloudproxy_js=" in pageContent:
-			raise Exceptions.SucuriWrapper("WAF Shit", pageUrl)
+			chunk = read(chunkSize)
+			if not chunk:
+				break
+
+			rawSize += len(chunk)
+			if maxContent is not None and rawSize > maxContent:
+				raise Exceptions.ContentTooLargeError("Content exceeded size limit", pageUrl,
+					limit=maxContent, size=rawSize, headers=pghandle.headers)
+
+			raw.append(chunk)
+			if callBack:
+				callBack(rawSize, chunkSize, totalSize)
 
-		if b'This process is automatic. Your browser will redirect to your requested content shortly.' in pageContent:
-			raise Exceptions.CloudFlareWrapper("WAF Shit", pageUrl)
+			if decoder is not None:
+				with timing.phase('decompress'):
+					out = self._decompressLimited(decoder, chunk, outSize, maxDecompressed, pageUrl, pghandle.headers)
+				outSize += len(out)
+				decompressed.append(out)
 
-		if b'is currently offline. However, because the site uses Cloudflare\'s Always Online' in pageContent:
-			raise Exceptions.CloudFlareWrapper("WAF Shit", pageUrl)
+		if deadline is not None:
+			# `read1()` doesn't notice when it's reached the end of a fixed-length body, so
+			# finish the response off, which hands the connection back to the pool.
+			pghandle.read()
+
+		if decoder is None:
+			return b"".join(raw), None
+
+		with timing.phase('decompress'):
+			decompressed.append(self._decompressLimited(decoder, b"", outSize, maxDecompressed, pageUrl, pghandle.headers, flush=True))
+		return b"".join(raw), b"".join(decompressed)
+
+	def _check_waf(self, pageContent:bytes, pageUrl:str, cType:str=None):
+		assert isinstance(pageContent, bytes), "Item pageContent must be of type bytes, received %s" % (type(pageContent), )
+		assert isinstance(pageUrl, str), "Item pageUrl must be of type str, received %s" % (type(pageUrl), )
 
-		if b'Completing the CAPTCHA proves you are a human and gives you temporary access to the web property.' in pageContent:
-			raise Exceptions.CloudFlareWrapper("Captcha-Wrapped WAF Shit", pageUrl)
+		# Non-HTML content is skipped, and only the start of the page is checked.
+		# See `WafDetector` for the signature table.
+		try:
+			self.waf_detector.check(pageContent, pageUrl, cType)
+		except Exceptions.GarbageSiteWrapper as err:
+			if self.metrics is not None:
+				self.metrics.inc('waf_detections_total', type=type(err).__name__)
+			raise
 
 	######################################################################################################################################################
 	######################################################################################################################################################
@@ -969,7 +2038,21 @@ class WebGetRobust(
 					print("Using Socks handler")
 					if not HAVE_SOCKS:
 						raise RuntimeError("SOCKS Use specified, and no socks installed!")
+					import socks
+					from sockshandler import SocksiPyHandler
 					args = (SocksiPyHandler(socks.SOCKS5, "127.0.0.1", 9050), ) + args
+				elif self.connection_pool is not None:
+					args += (
+							ConnectionPool.PooledHTTPHandler(self.connection_pool, dns_cache=self.dns_cache),
+							ConnectionPool.PooledHTTPSHandler(self.connection_pool, dns_cache=self.dns_cache),
+						)
+				elif self.dns_cache is not None:
+					args += (
+							DnsCache.ResolvingHTTPHandler(self.dns_cache),
+							DnsCache.ResolvingHTTPSHandler(self.dns_cache),
+						)
+				if self.http_cache is not None:
+					args += (HttpCache.CacheHandler(self.http_cache), )
 
 				self.opener = urllib.request.build_opener(*args)
 				#self.opener.addheaders = [('User-Agent', 'Mozilla/4.0 (compatible; MSIE 5.5; Windows NT)')]
@@ -1031,6 +2114,14 @@ class WebGetRobust(
 		self.addCookie(cookie)
 
 	def saveCookies(self, halting:bool=False):
+		# This gets called from the destructor, which can run on a partially constructed instance.
+		metrics = getattr(self, "metrics", None)
+		if metrics is None:
+			return self._saveCookies(halting)
+		with metrics.time('cookie_save_duration_seconds'):
+			return self._saveCookies(halting)
+
+	def _saveCookies(self, halting:bool=False):
 
 		if self.cookie_lock:
 			locked = self.cookie_lock.acquire(timeout=5)
@@ -1111,11 +2202,122 @@ class WebGetRobust(
 	######################################################################################################################################################
 	######################################################################################################################################################
 
+	def getPoolStats(self):
+		'''
+		Return the keep-alive connection pool counters (hits, misses, stale
+		connections, discarded connections and the current idle count), or
+		None if connection pooling is disabled.
+		'''
+		if self.connection_pool is None:
+			return None
+		return self.connection_pool.stats()
+
+	def getHttpCacheStats(self):
+		'''
+		Return the HTTP cache counters (hits, misses, revalidations, stores, evictions,
+		and the current entry count and size), or None if there is no cache.
+		'''
+		if self.http_cache is None:
+			return None
+		return self.http_cache.stats()
+
+	def prefetchDns(self, urls, wait:bool=True):
+		'''
+		Resolve the hosts for `urls` ahead of time, so the lookups are already cached
+		when the actual requests are made. See `DnsCache.prefetch()`.
+		'''
+		if self.dns_cache is None:
+			return None
+		return self.dns_cache.prefetch(urls, wait=wait)
+
+	def getDnsCacheStats(self):
+		'''
+		Return the DNS cache counters (hits, misses, negative hits, failures, and
+		the total/max/mean time spent in actual lookups), or None if there is no cache.
+		'''
+		if self.dns_cache is None:
+			return None
+		return self.dns_cache.stats()
+
+	def getResponseMemoStats(self):
+		'''
+		Return the in-memory response memo counters (hits, misses, expired entries,
+		evictions, and the current entry count and size), or None if there is no memo.
+		'''
+		if self.response_memo is None:
+			return None
+		return self.response_memo.stats()
+
+	def _cacheDefaultHeaders(self):
+		return {key.lower() : val for key, val in self.opener.addheaders}
+
+	def getDeflateStats(self):
+		'''
+		Counters for the decoding of `deflate` responses, including how many times
+		we had to fall back to guessing the stream format.
+		'''
+		return self.deflate_wbits.stats()
+
+	def getCharsetStats(self):
+		'''
+		Counters for how the charset of pages without one in their headers was worked
+		out (BOM, declared in the markup, memoized for the site, or detected).
+		'''
+		return self.charset_memo.stats()
+
+	def getRouteStats(self):
+		'''
+		Routing table lookups, hits, and reloads.
+		'''
+		return self.domain_routes.stats()
+
+	def getWafStats(self):
+		'''
+		How many responses were checked for WAF interstitials (or skipped, as they
+		weren't HTML), and how many times each signature matched.
+		'''
+		return self.waf_detector.stats()
+
+	def getHedgeStats(self):
+		'''
+		Hedging counters, and the learned hedge delay for each host.
+		'''
+		return self.hedge_policy.stats()
+
+	def getCircuitBreakerStats(self):
+		'''
+		Per-host circuit breaker state, or None if there's no breaker.
+		'''
+		if self.circuit_breaker is None:
+			return None
+		return self.circuit_breaker.stats()
+
+	def renderMetrics(self):
+		'''
+		The metrics registry contents, in the Prometheus text format, or None if there's no registry.
+		'''
+		if self.metrics is None:
+			return None
+		return self.metrics.render_metrics()
+
+	def getHostSchedulerStats(self):
+		'''
+		Return the per-host scheduler counters (request count, number of times throttled,
+		current rate, and time spent waiting for a request slot), as a dict keyed by netloc.
+		'''
+		return self.host_scheduler.stats()
+
 	def __del__(self):
 		# print "WGH Destructor called!"
 		# print("WebRequest __del__")
 		self.saveCookies(halting=True)
 
+		if getattr(self, "_owns_connection_pool", False):
+			self.connection_pool.close()
+
+		if getattr(self, "_hedge_executor", None) is not None:
+			self._hedge_executor.shutdown(wait=False)
+
 		sup = super()
 		if hasattr(sup, '__del__'):
 			sup.__del__()
@@ -1139,7 +2341,17 @@ class WebGetRobust(
 
 	def stepThroughJsWaf(self, *args, **kwargs):
 		# Shim to the underlying web browser of choice
-		return self.stepThroughJsWaf_bare_chromium(*args, **kwargs)
+		if self.metrics is None:
+			return self.stepThroughJsWaf_bare_chromium(*args, **kwargs)
+
+		result = "error"
+		try:
+			with self.metrics.time('chromium_step_through_duration_seconds'):
+				ok = self.stepThroughJsWaf_bare_chromium(*args, **kwargs)
+			result = "success" if ok else "failure"
+			return ok
+		finally:
+			self.metrics.inc('chromium_step_through_total', result=result)
 
 
 	# Compat for old code.
@@ -1,14 +1,36 @@
 
 from .WebRequestClass import WebGetRobust
 from .WebRequestClass import PlainWafWebGetRobust
+from .AsyncWebRequestClass import AsyncWebGetRobust
 
 from .utility import as_soup
 
+from .ConnectionPool import ConnectionPool
+from .HttpCache import HttpCache
+from .ResponseMemo import ResponseMemo
+from .DnsCache import DnsCache
+from .RetryPolicy import RetryPolicy
+from .CircuitBreaker import CircuitBreaker
+from .HedgePolicy import HedgePolicy
+from .WafDetector import WafDetector
+from .DomainRoutes import DomainRoutes
+from .DomainRoutes import DomainPolicy
+from .Deadline import Deadline
+from .FetchTiming import FetchTiming
+from .Metrics import MetricsRegistry
+from .Tracing import Tracer
+from .Tracing import NullTracer
+from .Tracing import MemoryTracer
+from .FetchLog import FetchLogger
+
 from .Exceptions import WebGetException
 from .Exceptions import ContentTypeError
 from .Exceptions import ArgumentError
 from .Exceptions import FetchFailureError
+from .Exceptions import CircuitOpenError
+from .Exceptions import FetchTimeoutError
 from .Exceptions import RedirectedError
+from .Exceptions import ContentTooLargeError
 from .Exceptions import GarbageSiteWrapper
 from .Exceptions import CloudFlareWrapper
 from .Exceptions import SucuriWrapper
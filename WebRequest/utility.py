@@ -1,5 +1,4 @@
 
-import bs4
 from . import Exceptions
 
 def as_soup(in_str):
@@ -22,6 +21,8 @@ def as_soup(in_str):
 	else:
 		raise Exceptions.ContentTypeError("as_soup call can only accept either bytes or string. Passed type %s" % type(in_str), None)
 
+	# bs4 is slow to import, so don't pay for it until something wants soup.
+	import bs4
 	return bs4.BeautifulSoup(in_str, "lxml")
 
 
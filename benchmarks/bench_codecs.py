@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+
+# Compare the Content-Encodings we support: bytes on the wire, time to
+# decode, and end-to-end fetch time against the local testing server.
+#
+# Run with `python -m benchmarks.bench_codecs` from the repository root.
+
+import argparse
+import json
+import time
+import urllib.request
+
+import WebRequest
+from WebRequest import Decompressors
+from tests import testing_server
+
+
+PATHS = {
+	'identity' : "/large-file",
+	'gzip'     : "/compressed/large-gzip",
+	'deflate'  : "/compressed/large-deflate",
+	'br'       : "/compressed/large-br",
+	'zstd'     : "/compressed/large-zstd",
+}
+
+
+def best_of(func, rounds):
+	best = None
+	for _ in range(rounds):
+		start = time.perf_counter()
+		func()
+		elapsed = time.perf_counter() - start
+		best = elapsed if best is None else min(best, elapsed)
+	return best
+
+
+def run(rounds=10):
+	wg = WebRequest.WebGetRobust()
+	port, server, thread = testing_server.start_server(None, wg, skip_header_checks=True)
+
+	results = []
+	try:
+		for codec in ['identity'] + Decompressors.available_encodings():
+			url = "http://localhost:{}{}".format(port, PATHS[codec])
+
+			# Plain urllib, so we get the body exactly as it came off the wire.
+			with urllib.request.urlopen(url) as resp:
+				raw = resp.read()
+
+			def decode():
+				decoder = Decompressors.get_decompressor(codec)
+				return decoder.decompress(raw) + decoder.flush()
+
+			assert decode() == testing_server.LARGE_CONTENT
+
+			results.append({
+				'codec'       : codec,
+				'wire_bytes'  : len(raw),
+				'ratio'       : len(testing_server.LARGE_CONTENT) / len(raw),
+				'decode_time' : best_of(decode, rounds),
+				'fetch_time'  : best_of(lambda: wg.getpage(url), rounds),
+			})
+	finally:
+		server.shutdown()
+		thread.join()
+
+	return results
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Content-Encoding benchmark")
+	parser.add_argument("--rounds", type=int, default=10)
+	parser.add_argument("--json", help="Also write the results to this file")
+	args = parser.parse_args()
+
+	results = run(rounds=args.rounds)
+
+	print("Decoded size: %s bytes" % len(testing_server.LARGE_CONTENT))
+	print("%-10s %12s %8s %12s %12s" % ("Codec", "Wire bytes", "Ratio", "Decode (ms)", "Fetch (ms)"))
+	for row in results:
+		print("%-10s %12s %8.1f %12.2f %12.2f" % (row['codec'], row['wire_bytes'], row['ratio'], row['decode_time'] * 1000, row['fetch_time'] * 1000))
+
+	if args.json:
+		with open(args.json, "w") as fp:
+			json.dump(results, fp, indent=4)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,229 @@
+#!/usr/bin/python3
+
+# Fetch throughput and latency against the local testing server.
+#
+# Drives a WebGetRobust instance from a pool of threads, for each of the
+# scenarios below at each concurrency level, and reports requests/sec,
+# p50/p95/p99 latency, CPU time per request and peak RSS.
+#
+# The (threaded) testing server runs in a child process, so the CPU and memory
+# numbers are the client's alone. Nothing leaves the machine. Peak RSS is the
+# peak for the process so far, so runs with bigger bodies or more threads
+# raise it for everything after them.
+#
+# Results can be written as JSON (`--json`), and a previous run passed back in
+# with `--compare`, to see what a change did.
+#
+# Run with `python -m benchmarks.bench_fetch` from the repository root.
+
+import io
+import sys
+import math
+import json
+import time
+import logging
+import argparse
+import platform
+import resource
+import contextlib
+import subprocess
+import multiprocessing
+import concurrent.futures
+
+import WebRequest
+from tests import testing_server
+
+
+# name -> (path, fetch method)
+SCENARIOS = {
+	'small-html'        : ("/",                             "getpage"),
+	'large-gzip'        : ("/compressed/large-gzip",        "getpage"),
+	'large-deflate'     : ("/compressed/large-deflate",     "getpage"),
+	'deflate-raw'       : ("/compressed/deflate",           "getpage"),
+	'deflate-ambiguous' : ("/compressed/deflate-ambiguous", "getpage"),
+	'redirect'          : ("/redirect/from-1",              "getpage"),
+	'json'              : ("/json/valid",                   "getJson"),
+}
+
+CONCURRENCY = (1, 4, 16, 64, 256)
+
+
+def _serve(conn):
+	# Child process: run the testing server until the parent says to stop.
+	with contextlib.redirect_stdout(io.StringIO()):
+		wg = WebRequest.WebGetRobust()
+		port, server, thread = testing_server.start_server(None, wg, skip_header_checks=True, threaded=True)
+	# The default listen backlog (5) is far too short for the higher concurrency levels.
+	server.socket.listen(1024)
+	conn.send(port)
+	try:
+		conn.recv()
+	except EOFError:
+		pass
+	server.shutdown()
+	thread.join()
+
+
+@contextlib.contextmanager
+def server_process():
+	'''
+	Context manager that runs the testing server in a child process, yielding it's port.
+	'''
+	parent, child = multiprocessing.Pipe()
+	proc = multiprocessing.Process(target=_serve, args=(child, ), daemon=True)
+	proc.start()
+	try:
+		yield parent.recv()
+	finally:
+		parent.send(None)
+		proc.join(5)
+		if proc.is_alive():
+			proc.terminate()
+
+
+def percentile(ordered, pct):
+	# Nearest-rank percentile of the already sorted `ordered`.
+	if not ordered:
+		return None
+	rank = max(1, math.ceil(pct / 100 * len(ordered)))
+	return ordered[rank - 1]
+
+
+def peak_rss_kb():
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# Linux reports it in kilobytes, macOS in bytes.
+	return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def run_scenario(wg, url, method, requests, concurrency):
+	fetch = getattr(wg, method)
+
+	def timed(_):
+		start = time.perf_counter()
+		try:
+			fetch(url)
+		except WebRequest.WebGetException:
+			return None
+		return time.perf_counter() - start
+
+	with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+		# Warm up the threads, connections and the per-host memos.
+		list(executor.map(timed, range(concurrency)))
+
+		cpuStart  = time.process_time()
+		wallStart = time.perf_counter()
+		latencies = list(executor.map(timed, range(requests)))
+		wall      = time.perf_counter() - wallStart
+		cpu       = time.process_time() - cpuStart
+
+	ordered = sorted(latency for latency in latencies if latency is not None)
+	return {
+		'requests'        : requests,
+		'errors'          : requests - len(ordered),
+		'requests_sec'    : requests / wall,
+		'p50'             : percentile(ordered, 50),
+		'p95'             : percentile(ordered, 95),
+		'p99'             : percentile(ordered, 99),
+		'cpu_per_request' : cpu / requests,
+		'peak_rss_kb'     : peak_rss_kb(),
+	}
+
+
+def run(scenarios=tuple(SCENARIOS), concurrency=CONCURRENCY, requests=200, log_mode="verbose"):
+	results = []
+	with server_process() as port:
+		for name in scenarios:
+			path, method = SCENARIOS[name]
+			url = "http://localhost:{}{}".format(port, path)
+			for level in concurrency:
+				# A fresh instance (and connection pool) for each run, so they don't affect each other.
+				wg = WebRequest.WebGetRobust(log_mode=log_mode)
+				row = {'scenario' : name, 'concurrency' : level}
+				row.update(run_scenario(wg, url, method, max(requests, level), level))
+				results.append(row)
+				print_row(row)
+	return results
+
+
+def describe():
+	try:
+		commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		commit = None
+	return {
+		'commit'   : commit,
+		'python'   : platform.python_version(),
+		'platform' : platform.platform(),
+		'time'     : time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+	}
+
+
+HEADER = "%-18s %5s %10s %9s %9s %9s %10s %10s %7s" % ("Scenario", "Conc", "Req/sec", "p50 (ms)", "p95 (ms)", "p99 (ms)", "CPU (ms)", "RSS (MB)", "Errors")
+
+
+def _ms(value):
+	return value * 1000 if value is not None else float("nan")
+
+
+def print_row(row):
+	print("%-18s %5s %10.1f %9.2f %9.2f %9.2f %10.3f %10.1f %7s" % (
+			row['scenario'],
+			row['concurrency'],
+			row['requests_sec'],
+			_ms(row['p50']),
+			_ms(row['p95']),
+			_ms(row['p99']),
+			row['cpu_per_request'] * 1000,
+			row['peak_rss_kb'] / 1024,
+			row['errors'],
+		))
+
+
+def compare(results, baseline):
+	old = {(row['scenario'], row['concurrency']) : row for row in baseline['results']}
+	print()
+	print("Compared to %s (%s):" % (baseline['meta'].get('commit'), baseline['meta'].get('time')))
+	print("%-18s %5s %12s %12s %12s" % ("Scenario", "Conc", "Req/sec", "p95", "CPU/req"))
+	for row in results:
+		prev = old.get((row['scenario'], row['concurrency']))
+		if prev is None:
+			continue
+		def change(key):
+			if not prev[key] or row[key] is None:
+				return "n/a"
+			return "%+0.1f%%" % ((row[key] / prev[key] - 1) * 100)
+		print("%-18s %5s %12s %12s %12s" % (row['scenario'], row['concurrency'], change('requests_sec'), change('p95'), change('cpu_per_request')))
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Fetch throughput/latency benchmark")
+	parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+	parser.add_argument("--concurrency", nargs="+", type=int, default=list(CONCURRENCY))
+	parser.add_argument("--requests", type=int, default=200, help="Requests per run (at least the concurrency level)")
+	parser.add_argument("--log-mode", default="verbose", choices=["verbose", "perf"])
+	parser.add_argument("--log-level", default="WARNING", help="Level the client logs at. The records are discarded, but still created")
+	parser.add_argument("--json", help="Also write the results to this file")
+	parser.add_argument("--compare", help="Results file from a previous run to compare against")
+	args = parser.parse_args()
+
+	log = logging.getLogger("Main")
+	log.setLevel(args.log_level)
+	log.addHandler(logging.NullHandler())
+	log.propagate = False
+
+	print(HEADER)
+	results = run(args.scenarios, args.concurrency, args.requests, args.log_mode)
+
+	if args.compare:
+		with open(args.compare) as fp:
+			compare(results, json.load(fp))
+
+	if args.json:
+		meta = describe()
+		meta['args'] = vars(args)
+		with open(args.json, "w") as fp:
+			json.dump({'meta' : meta, 'results' : results}, fp, indent=4)
+
+
+if __name__ == '__main__':
+	main()
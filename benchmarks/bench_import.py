@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+
+# Startup cost of `import WebRequest`, from `python -X importtime`.
+#
+# The heavy optional backends (bs4, ChromeController, selenium, cloudscraper,
+# the captcha solvers, etc...) are supposed to be imported on first use, so a
+# plain import should stay cheap. Pass `--threshold` to exit non-zero if it
+# doesn't (e.g. from CI).
+#
+# Run with `python -m benchmarks.bench_import` from the repository root.
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+
+def import_times(module="WebRequest"):
+	'''
+	Import `module` in a fresh interpreter, and return a dict of
+	module -> (self_us, cumulative_us) from the `-X importtime` output.
+	'''
+	proc = subprocess.run(
+			[sys.executable, "-X", "importtime", "-c", "import %s" % module],
+			stdout = subprocess.PIPE,
+			stderr = subprocess.PIPE,
+			cwd    = os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+			check  = True,
+		)
+
+	ret = {}
+	for line in proc.stderr.decode("utf-8", "replace").splitlines():
+		# import time:     self [us] | cumulative | imported package
+		if not line.startswith("import time:"):
+			continue
+		parts = line[len("import time:"):].split("|")
+		if len(parts) != 3 or not parts[0].strip().isdigit():
+			continue
+		ret[parts[2].strip()] = (int(parts[0]), int(parts[1]))
+	return ret
+
+
+def run(rounds=5, module="WebRequest", top=10):
+	best = None
+	for _ in range(rounds):
+		times = import_times(module)
+		if module not in times:
+			raise RuntimeError("No importtime entry for %s" % module)
+		if best is None or times[module][1] < best[module][1]:
+			best = times
+
+	slowest = sorted(best.items(), key=lambda item: item[1][1], reverse=True)
+	return {
+		'module'        : module,
+		'cumulative_ms' : best[module][1] / 1000,
+		'modules'       : len(best),
+		'slowest'       : [
+				{'module' : name, 'self_ms' : self_us / 1000, 'cumulative_ms' : cum_us / 1000}
+				for name, (self_us, cum_us) in slowest[1:top + 1]
+			],
+	}
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Import time benchmark")
+	parser.add_argument("--rounds", type=int, default=5)
+	parser.add_argument("--top", type=int, default=10, help="Number of slowest imports to list")
+	parser.add_argument("--threshold", type=float, help="Fail if the import takes longer then this many ms")
+	parser.add_argument("--json", help="Also write the results to this file")
+	args = parser.parse_args()
+
+	results = run(rounds=args.rounds, top=args.top)
+
+	print("import %s: %.1f ms (%s modules, best of %s)" % (results['module'], results['cumulative_ms'], results['modules'], args.rounds))
+	print()
+	print("%-50s %10s %12s" % ("Module", "Self (ms)", "Cumul. (ms)"))
+	for row in results['slowest']:
+		print("%-50s %10.1f %12.1f" % (row['module'], row['self_ms'], row['cumulative_ms']))
+
+	if args.json:
+		with open(args.json, "w") as fp:
+			json.dump(results, fp, indent=4)
+
+	if args.threshold is not None and results['cumulative_ms'] > args.threshold:
+		print()
+		print("Import time %.1f ms exceeds the threshold of %.1f ms!" % (results['cumulative_ms'], args.threshold))
+		sys.exit(1)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+
+# Fetch throughput against the local testing server with logging at INFO, for
+# the default ("verbose") logging mode vs the "perf" mode.
+#
+# The log output goes to a formatting handler writing to /dev/null, so the
+# cost of formatting and emitting the records is included, without the
+# terminal being the bottleneck.
+#
+# Run with `python -m benchmarks.bench_logging` from the repository root.
+
+import os
+import argparse
+import json
+import time
+import logging
+
+import WebRequest
+from tests import testing_server
+
+
+PATHS = {
+	'html' : "/",
+	'gzip' : "/compressed/gzip",
+}
+
+
+def fetch_rate(wg, url, requests, rounds):
+	best = None
+	for _ in range(rounds):
+		start = time.perf_counter()
+		for _ in range(requests):
+			wg.getpage(url)
+		elapsed = time.perf_counter() - start
+		best = elapsed if best is None else min(best, elapsed)
+	return requests / best
+
+
+def run(requests=500, rounds=3, level=logging.INFO):
+	log = logging.getLogger("Main")
+	devnull = open(os.devnull, "w")
+	handler = logging.StreamHandler(devnull)
+	handler.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+	oldLevel, oldPropagate = log.level, log.propagate
+	log.addHandler(handler)
+	log.setLevel(level)
+	log.propagate = False
+
+	results = []
+	try:
+		for mode in ("verbose", "perf"):
+			wg = WebRequest.WebGetRobust(log_mode=mode)
+			port, server, thread = testing_server.start_server(None, wg, skip_header_checks=True, threaded=True)
+			try:
+				for name, path in PATHS.items():
+					url = "http://localhost:{}{}".format(port, path)
+					# Warm up the connection pool and the per-host memos.
+					wg.getpage(url)
+					results.append({
+						'mode'         : mode,
+						'payload'      : name,
+						'requests_sec' : fetch_rate(wg, url, requests, rounds),
+					})
+			finally:
+				server.shutdown()
+				thread.join()
+	finally:
+		log.removeHandler(handler)
+		log.setLevel(oldLevel)
+		log.propagate = oldPropagate
+		devnull.close()
+
+	baseline = {row['payload'] : row['requests_sec'] for row in results if row['mode'] == "verbose"}
+	for row in results:
+		row['speedup'] = row['requests_sec'] / baseline[row['payload']]
+	return results
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Logging overhead benchmark")
+	parser.add_argument("--requests", type=int, default=500)
+	parser.add_argument("--rounds", type=int, default=3)
+	parser.add_argument("--json", help="Also write the results to this file")
+	args = parser.parse_args()
+
+	results = run(requests=args.requests, rounds=args.rounds)
+
+	print("%-10s %-10s %14s %9s" % ("Mode", "Payload", "Requests/sec", "Speedup"))
+	for row in results:
+		print("%-10s %-10s %14.1f %8.2fx" % (row['mode'], row['payload'], row['requests_sec'], row['speedup']))
+
+	if args.json:
+		with open(args.json, "w") as fp:
+			json.dump(results, fp, indent=4)
+
+
+if __name__ == '__main__':
+	main()
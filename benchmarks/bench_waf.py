@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+
+# WAF detection cost per response, for the old full-body scan vs `WafDetector`.
+#
+# Also times a single regex alternation over the same window, which is the
+# "obvious" way to do multi-pattern matching, but is much slower in CPython.
+#
+# Run with `python -m benchmarks.bench_waf` from the repository root.
+
+import re
+import argparse
+import json
+
+from WebRequest.WafDetector import WafDetector, DEFAULT_SIGNATURES
+from benchmarks.bench_codecs import best_of
+
+
+def make_html(size):
+	para = b"<p>Some perfectly ordinary page content, with no WAF in sight. Completing this is automatic.</p>\n"
+	body = para * (size // len(para) + 1)
+	return (b"<html><head><title>Page</title></head><body>" + body)[:size - len(b"</body></html>")] + b"</body></html>"
+
+
+PAYLOADS = (
+	('html-16K',  "text/html; charset=utf-8", make_html(2 ** 14)),
+	('html-1M',   "text/html; charset=utf-8", make_html(2 ** 20)),
+	('html-8M',   "text/html; charset=utf-8", make_html(2 ** 23)),
+	('binary-8M', "application/octet-stream", bytes(range(256)) * (2 ** 15)),
+)
+
+
+def legacy_check(content):
+	# What `_check_waf()` used to do: a scan of the whole body per signature, for every content type.
+	return [sig.pattern in content for sig in DEFAULT_SIGNATURES]
+
+
+def run(rounds=20, number=10):
+	detector = WafDetector()
+	alternation = re.compile(b"|".join(re.escape(sig.pattern) for sig in DEFAULT_SIGNATURES))
+
+	def per_call(func):
+		def repeat():
+			for _ in range(number):
+				func()
+		return best_of(repeat, rounds) / number
+
+	results = []
+	for name, cType, content in PAYLOADS:
+		assert detector.match(content, cType) is None
+
+		results.append({
+			'payload'  : name,
+			'size'     : len(content),
+			'legacy'   : per_call(lambda: legacy_check(content)),
+			'regex'    : per_call(lambda: alternation.search(content, 0, detector.window)),
+			'detector' : per_call(lambda: detector.match(content, cType)),
+		})
+		results[-1]['speedup'] = results[-1]['legacy'] / results[-1]['detector']
+
+	return results
+
+
+def main():
+	parser = argparse.ArgumentParser(description="WAF detection benchmark")
+	parser.add_argument("--rounds", type=int, default=20)
+	parser.add_argument("--json", help="Also write the results to this file")
+	args = parser.parse_args()
+
+	results = run(rounds=args.rounds)
+
+	print("%-12s %10s %12s %12s %12s %9s" % ("Payload", "Size", "Legacy (us)", "Regex (us)", "Detector (us)", "Speedup"))
+	for row in results:
+		print("%-12s %10s %12.1f %12.1f %12.1f %8.0fx" % (row['payload'], row['size'], row['legacy'] * 1e6, row['regex'] * 1e6, row['detector'] * 1e6, row['speedup']))
+
+	if args.json:
+		with open(args.json, "w") as fp:
+			json.dump(results, fp, indent=4)
+
+
+if __name__ == '__main__':
+	main()
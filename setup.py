@@ -21,7 +21,7 @@ setuptools.setup(
 	author_email="github@imaginaryindustries.com",
 
 	# Packages
-	packages=setuptools.find_packages(),
+	packages=setuptools.find_packages(exclude=["benchmarks", "benchmarks.*", "tests", "tests.*"]),
 	package_dir = {'WebRequest': 'WebRequest'},
 
 	# Details
@@ -0,0 +1,170 @@
+import unittest
+import asyncio
+import json
+import bs4
+from http.server import HTTPServer
+from threading import Thread
+
+import WebRequest
+from . import testing_server
+from .test_pool import KeepAliveHandler
+
+
+def run(coro):
+	loop = asyncio.new_event_loop()
+	try:
+		return loop.run_until_complete(coro)
+	finally:
+		loop.close()
+
+
+class TestAsyncFetch(unittest.TestCase):
+	def setUp(self):
+
+		self.wg = WebRequest.AsyncWebGetRobust()
+
+		# Configure mock server.
+		self.mock_server_port, self.mock_server, self.mock_server_thread = testing_server.start_server(self, self.wg)
+
+	def tearDown(self):
+		self.mock_server.shutdown()
+		self.mock_server_thread.join()
+		self.wg = None
+
+	def test_fetch_1(self):
+		page = run(self.wg.getpage("http://localhost:{}".format(self.mock_server_port)))
+		self.assertEqual(page, 'Root OK?')
+
+	def test_fetch_soup_1(self):
+		page = run(self.wg.getSoup("http://localhost:{}/html/real".format(self.mock_server_port)))
+		self.assertEqual(page, bs4.BeautifulSoup('<html><body>Root OK?</body></html>', 'lxml'))
+
+	def test_fetch_soup_2(self):
+		with self.assertRaises(WebRequest.ContentTypeError):
+			run(self.wg.getSoup("http://localhost:{}/binary_ctnt".format(self.mock_server_port)))
+
+	def test_fetch_decode_json(self):
+		page = run(self.wg.getJson("http://localhost:{}/json/valid".format(self.mock_server_port)))
+		self.assertEqual(page, {'oh': 'hai'})
+
+		page = run(self.wg.getJson("http://localhost:{}/json/no-coding".format(self.mock_server_port)))
+		self.assertEqual(page, {'oh': 'hai'})
+
+		self.wg.retryDelay = 0.01
+		with self.assertRaises(json.decoder.JSONDecodeError):
+			run(self.wg.getJson("http://localhost:{}/json/invalid".format(self.mock_server_port)))
+
+	def test_fetch_compressed(self):
+		page = run(self.wg.getpage("http://localhost:{}/compressed/gzip".format(self.mock_server_port)))
+		self.assertEqual(page, 'Root OK?')
+
+		page = run(self.wg.getpage("http://localhost:{}/compressed/deflate".format(self.mock_server_port)))
+		self.assertEqual(page, 'Root OK?')
+
+	def test_file_name_mime(self):
+		page, fn, mimet, url = run(self.wg.getFileNameMimeUrl(
+					"http://localhost:{}/filename_mime/content-disposition-quotes-spaces-2".format(self.mock_server_port)))
+		self.assertEqual(page, b'LOLWAT?')
+		self.assertEqual(fn, 'loler coaster.html')
+		self.assertEqual(mimet, 'text/plain')
+
+		page, fn, mimet = run(self.wg.getFileNameMime(
+					"http://localhost:{}/filename_mime/explicit-html-mime".format(self.mock_server_port)))
+		self.assertEqual(page, 'LOLWAT?')
+		self.assertEqual(fn, 'lolercoaster.html')
+		self.assertEqual(mimet, 'text/html')
+
+	def test_redirect_handling(self):
+		ctnt = run(self.wg.getpage("http://localhost:{}/redirect/from-1".format(self.mock_server_port)))
+		self.assertEqual(ctnt, b"Redirect-To-1")
+
+		ctnt, handle = run(self.wg.getpage("http://localhost:{}/redirect/from-2".format(self.mock_server_port), returnMultiple=True))
+		self.assertEqual(ctnt, b"Redirect-To-2")
+		self.assertEqual(handle.geturl(), "http://localhost:{}/redirect/to-2".format(self.mock_server_port))
+
+		with self.assertRaises(WebRequest.FetchFailureError):
+			run(self.wg.getpage("http://localhost:{}/redirect/bad-2".format(self.mock_server_port)))
+
+	def test_not_found(self):
+		with self.assertRaises(WebRequest.FetchFailureError) as ctx:
+			run(self.wg.getpage("http://localhost:{}/favicon.ico".format(self.mock_server_port)))
+		self.assertEqual(ctx.exception.err_code, 404)
+
+	def test_concurrent(self):
+		async def fetch_many():
+			urls = ["http://localhost:{}".format(self.mock_server_port)] * 10
+			return await asyncio.gather(*[self.wg.getpage(url) for url in urls])
+
+		self.assertEqual(run(fetch_many()), ['Root OK?'] * 10)
+
+	def test_getpages(self):
+		urls = [
+			"http://localhost:{}".format(self.mock_server_port),
+			"http://localhost:{}/compressed/deflate".format(self.mock_server_port),
+			"http://localhost:{}/favicon.ico".format(self.mock_server_port),
+		]
+
+		async def fetch_all():
+			return [tmp async for tmp in self.wg.getpages(urls * 4, concurrency=3)]
+
+		results = run(fetch_all())
+		self.assertEqual(len(results), 12)
+		results = dict(results)
+		self.assertEqual(results[urls[0]], 'Root OK?')
+		self.assertEqual(results[urls[1]], 'Root OK?')
+		self.assertIsInstance(results[urls[2]], WebRequest.FetchFailureError)
+
+	def test_cookies(self):
+		inurl_1 = "http://localhost:{}/cookie_test".format(self.mock_server_port)
+		inurl_2 = "http://localhost:{}/cookie_require".format(self.mock_server_port)
+
+		self.wg.clearCookies()
+
+		page_resp_nocook = run(self.wg.getpage(inurl_2))
+		self.assertEqual(page_resp_nocook, '<html><body>Cookie is missing</body></html>')
+
+		run(self.wg.getpage(inurl_1))
+
+		# The cookie jar is shared with the blocking interface.
+		page_resp_cook = self.wg.opener.open(inurl_2).read()
+		self.assertEqual(page_resp_cook, b'<html><body>Cookie forwarded properly!</body></html>')
+
+		page_resp_cook = run(self.wg.getpage(inurl_2))
+		self.assertEqual(page_resp_cook, '<html><body>Cookie forwarded properly!</body></html>')
+
+	def test_http_auth(self):
+		self.mock_server.shutdown()
+		self.mock_server_thread.join()
+		self.wg = None
+
+		new_port = testing_server.get_free_port()
+		wg = WebRequest.AsyncWebGetRobust(creds=[("localhost:{}".format(new_port), "lol", "wat")])
+		new_port, self.mock_server, self.mock_server_thread = testing_server.start_server(self, wg, port_override=new_port)
+
+		page = run(wg.getpage("http://localhost:{}/password/expect".format(new_port)))
+		self.assertEqual(page, b'Password Ok?')
+
+
+class TestAsyncKeepAlive(unittest.TestCase):
+	def setUp(self):
+		self.port = testing_server.get_free_port()
+		self.server = HTTPServer(('localhost', self.port), KeepAliveHandler)
+		self.server_thread = Thread(target=self.server.serve_forever, daemon=True)
+		self.server_thread.start()
+
+	def tearDown(self):
+		self.server.shutdown()
+		self.server.server_close()
+		self.server_thread.join()
+
+	def test_connection_reuse(self):
+		wg = WebRequest.AsyncWebGetRobust()
+		url = "http://localhost:{}/".format(self.port)
+
+		async def fetch():
+			pages = [await wg.getpage(url) for _ in range(3)]
+			await wg.close()
+			return pages
+
+		pages = run(fetch())
+		self.assertEqual(len(set(pages)), 1)
@@ -0,0 +1,171 @@
+import unittest
+import time
+import tempfile
+import asyncio
+import http.client
+import email.utils
+import urllib.request
+
+import WebRequest
+from WebRequest.HttpCache import HttpCache
+from WebRequest.HttpCache import parse_cache_control
+from . import testing_server
+
+
+def make_headers(**kwargs):
+	headers = http.client.HTTPMessage()
+	for key, val in kwargs.items():
+		headers[key.replace("_", "-")] = val
+	return headers
+
+
+class TestCacheControl(unittest.TestCase):
+	def test_parse(self):
+		self.assertEqual(parse_cache_control('max-age=60, no-cache, private="Set-Cookie"'),
+			{'max-age' : '60', 'no-cache' : None, 'private' : 'Set-Cookie'})
+		self.assertEqual(parse_cache_control(None), {})
+
+
+class TestHttpCache(unittest.TestCase):
+	def setUp(self):
+		self.tmpdir = tempfile.TemporaryDirectory()
+
+	def tearDown(self):
+		self.tmpdir.cleanup()
+
+	def test_freshness(self):
+		cache = HttpCache(self.tmpdir.name)
+		now = time.time()
+		date = email.utils.formatdate(now, usegmt=True)
+
+		self.assertAlmostEqual(cache._freshness(make_headers(Cache_Control="max-age=100", Date=date), now), now + 100, delta=2)
+		self.assertEqual(cache._freshness(make_headers(Cache_Control="no-cache, max-age=100"), now), 0)
+
+		expires = email.utils.formatdate(now + 50, usegmt=True)
+		self.assertAlmostEqual(cache._freshness(make_headers(Expires=expires, Date=date), now), now + 50, delta=2)
+		self.assertEqual(cache._freshness(make_headers(Expires="0", Date=date), now), 0)
+
+		# Heuristic freshness is 10% of the time since modification
+		last_mod = email.utils.formatdate(now - 1000, usegmt=True)
+		self.assertAlmostEqual(cache._freshness(make_headers(Last_Modified=last_mod, Date=date), now), now + 100, delta=2)
+
+	def test_store_serve(self):
+		cache = HttpCache(self.tmpdir.name)
+		req = urllib.request.Request("http://www.example.org/")
+		cache.store(req, 200, make_headers(Cache_Control="max-age=100", Set_Cookie="lol=wat"), b"Oh hai!")
+
+		req = cache.prepare(urllib.request.Request("http://www.example.org/"))
+		self.assertTrue(req._http_cache_fresh)
+		body, headers = cache.serve(req._http_cache_entry)
+		self.assertEqual(body, b"Oh hai!")
+		self.assertEqual(headers['Cache-Control'], "max-age=100")
+		self.assertEqual(headers['Set-Cookie'], None)
+
+		# Survives a restart.
+		cache = HttpCache(self.tmpdir.name)
+		self.assertTrue(cache.is_fresh(urllib.request.Request("http://www.example.org/")))
+
+		# But POSTs aren't cached
+		self.assertFalse(cache.is_fresh(urllib.request.Request("http://www.example.org/", data=b"wat")))
+
+	def test_vary(self):
+		cache = HttpCache(self.tmpdir.name)
+		req = urllib.request.Request("http://www.example.org/", headers={'Accept' : 'text/html'})
+		cache.store(req, 200, make_headers(Cache_Control="max-age=100", Vary="Accept"), b"Oh hai!")
+
+		self.assertTrue(cache.is_fresh(urllib.request.Request("http://www.example.org/", headers={'Accept' : 'text/html'})))
+		self.assertFalse(cache.is_fresh(urllib.request.Request("http://www.example.org/", headers={'Accept' : 'application/json'})))
+		self.assertTrue(cache.is_fresh(urllib.request.Request("http://www.example.org/"), {'accept' : 'text/html'}))
+
+	def test_lru_eviction(self):
+		cache = HttpCache(self.tmpdir.name, max_size=3000, max_entry_size=1000)
+		for idx in range(3):
+			cache.store(urllib.request.Request("http://www.example.org/%s" % idx), 200, make_headers(Cache_Control="max-age=100"), b"x" * 1000)
+
+		# Touch the first entry, so the second is the least recently used.
+		req = cache.prepare(urllib.request.Request("http://www.example.org/0"))
+		cache.serve(req._http_cache_entry)
+
+		cache.store(urllib.request.Request("http://www.example.org/3"), 200, make_headers(Cache_Control="max-age=100"), b"x" * 1000)
+		self.assertEqual(cache.stats()['evictions'], 1)
+		self.assertEqual(cache.stats()['size'], 3000)
+		self.assertTrue(cache.is_fresh(urllib.request.Request("http://www.example.org/0")))
+		self.assertFalse(cache.is_fresh(urllib.request.Request("http://www.example.org/1")))
+
+		# Too large to cache at all
+		cache.store(urllib.request.Request("http://www.example.org/big"), 200, make_headers(Cache_Control="max-age=100"), b"x" * 1001)
+		self.assertFalse(cache.is_fresh(urllib.request.Request("http://www.example.org/big")))
+
+
+class TestCachedFetch(unittest.TestCase):
+	wg_class = WebRequest.WebGetRobust
+
+	def setUp(self):
+		self.tmpdir = tempfile.TemporaryDirectory()
+		self.cache = HttpCache(self.tmpdir.name)
+		self.wg = self.wg_class(http_cache=self.cache)
+		self.mock_server_port, self.mock_server, self.mock_server_thread = testing_server.start_server(self, self.wg)
+
+	def tearDown(self):
+		self.mock_server.shutdown()
+		self.mock_server_thread.join()
+		self.wg = None
+		self.tmpdir.cleanup()
+
+	def fetch(self, path, **kwargs):
+		return self.wg.getpage("http://localhost:{}{}".format(self.mock_server_port, path), **kwargs)
+
+	def test_fresh_hit(self):
+		self.assertEqual(self.fetch("/cache/max-age"), "Cached /cache/max-age, request 1")
+		self.assertEqual(self.fetch("/cache/max-age"), "Cached /cache/max-age, request 1")
+		stats = self.wg.getHttpCacheStats()
+		self.assertEqual(stats['hits'], 1)
+		self.assertEqual(stats['misses'], 1)
+
+		# Fresh hits don't count against the per-host limits
+		sched = self.wg.getHostSchedulerStats()
+		self.assertEqual(sched["localhost:{}".format(self.mock_server_port)]['requests'], 1)
+
+	def test_revalidate(self):
+		self.assertEqual(self.fetch("/cache/etag"), "Cached /cache/etag, request 1")
+		page, handle = self.fetch("/cache/etag", returnMultiple=True)
+		self.assertEqual(page, "Cached /cache/etag, request 1")
+		self.assertEqual(handle.getcode(), 200)
+		stats = self.wg.getHttpCacheStats()
+		self.assertEqual(stats['revalidations'], 1)
+		self.assertEqual(stats['hits'], 0)
+
+	def test_no_store(self):
+		self.assertEqual(self.fetch("/cache/no-store"), "Cached /cache/no-store, request 1")
+		self.assertEqual(self.fetch("/cache/no-store"), "Cached /cache/no-store, request 2")
+		self.assertEqual(self.wg.getHttpCacheStats()['stores'], 0)
+
+	def test_compressed(self):
+		self.assertEqual(self.fetch("/cache/gzip"), "Cached /cache/gzip, request 1")
+		self.assertEqual(self.fetch("/cache/gzip"), "Cached /cache/gzip, request 1")
+		self.assertEqual(self.wg.getHttpCacheStats()['hits'], 1)
+
+	def test_chunked_deadline(self):
+		# With a deadline, the body is read incrementally (with `read1()`), which
+		# has to be captured for the cache just the same.
+		self.assertEqual(self.fetch("/cache/chunked", total_timeout=10), "Cached /cache/chunked, request 1")
+		self.assertEqual(self.fetch("/cache/chunked", total_timeout=10), "Cached /cache/chunked, request 1")
+		stats = self.wg.getHttpCacheStats()
+		self.assertEqual(stats['hits'], 1)
+		self.assertEqual(stats['size'], len(b"Cached /cache/chunked, request 1"))
+
+	def test_uncacheable(self):
+		self.assertEqual(self.fetch("/"), "Root OK?")
+		self.assertEqual(self.fetch("/"), "Root OK?")
+		self.assertEqual(self.wg.getHttpCacheStats()['stores'], 0)
+
+
+class TestAsyncCachedFetch(TestCachedFetch):
+	wg_class = WebRequest.AsyncWebGetRobust
+
+	def fetch(self, path, **kwargs):
+		loop = asyncio.new_event_loop()
+		try:
+			return loop.run_until_complete(super().fetch(path, **kwargs))
+		finally:
+			loop.close()
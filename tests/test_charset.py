@@ -0,0 +1,102 @@
+import unittest
+import codecs
+
+import WebRequest
+from WebRequest import Charset
+from . import testing_server
+
+
+class TestCharsetSniffing(unittest.TestCase):
+	def test_bom(self):
+		self.assertEqual(Charset.sniff_bom(codecs.BOM_UTF8 + b"<html>"), 'utf-8-sig')
+		self.assertEqual(Charset.sniff_bom("<html>".encode("utf-16")), 'utf-16')
+		self.assertEqual(Charset.sniff_bom("<html>".encode("utf-32")), 'utf-32')
+		self.assertEqual(Charset.sniff_bom(b"<html>"), None)
+
+	def test_declared(self):
+		self.assertEqual(Charset.sniff_declared(b'<head><meta charset="Shift_JIS"></head>'), 'shift_jis')
+		self.assertEqual(Charset.sniff_declared(b'<meta http-equiv="Content-Type" content="text/html; charset=windows-1252">'), 'cp1252')
+		self.assertEqual(Charset.sniff_declared(b'<?xml version="1.0" encoding="ISO-8859-1"?>'), 'iso8859-1')
+		self.assertEqual(Charset.sniff_declared(b'<meta charset="not-a-real-charset">'), None)
+		self.assertEqual(Charset.sniff_declared(b'<html></html>'), None)
+
+
+@unittest.skipUnless(Charset.cchardet, "cchardet not installed")
+class TestCharsetMemo(unittest.TestCase):
+	def setUp(self):
+		self.memo = Charset.CharsetMemo(sample_size=4096)
+
+	def test_declared(self):
+		page = '<html><head><meta charset="windows-1251"></head><body>Привет</body></html>'
+		self.assertEqual(self.memo.decode("a.example.org", "text/html", page.encode("cp1251")), page)
+		self.assertEqual(self.memo.stats()['declared_hits'], 1)
+		self.assertEqual(self.memo.get("a.example.org", "text/html"), 'cp1251')
+
+	def test_bad_declaration(self):
+		# Declared as utf-8, but isn't.
+		page = '<html><head><meta charset="utf-8"></head><body>%s</body></html>' % ("Привет, мир! " * 200)
+		self.assertEqual(self.memo.decode("a.example.org", "text/html", page.encode("cp1251")), page)
+		self.assertEqual(self.memo.stats()['declared_hits'], 0)
+		self.assertEqual(self.memo.stats()['detections'], 1)
+
+	def test_bom(self):
+		page = "<html><body>Grüße</body></html>"
+		self.assertEqual(self.memo.decode("a.example.org", "text/html", page.encode("utf-16")), page)
+		self.assertEqual(self.memo.stats()['bom_hits'], 1)
+		# Only that one page has a BOM, so it's not memoized.
+		self.assertEqual(self.memo.stats()['entries'], 0)
+
+	def test_memo(self):
+		page = "<html><body>%s</body></html>" % ("Привет, мир! " * 200)
+		for _ in range(3):
+			self.assertEqual(self.memo.decode("a.example.org", "text/html; foo=bar", page.encode("cp1251")), page)
+
+		stats = self.memo.stats()
+		self.assertEqual(stats['detections'], 1)
+		self.assertEqual(stats['memo_hits'], 2)
+
+		# Different content type, or different host, is detected separately.
+		self.memo.decode("a.example.org", "text/plain", page.encode("cp1251"))
+		self.memo.decode("b.example.org", "text/html", page.encode("cp1251"))
+		self.assertEqual(self.memo.stats()['detections'], 3)
+
+	def test_stale_memo(self):
+		self.memo.decode("a.example.org", "text/html", "<html><body>%s</body></html>".encode("utf-8") % ("Привет! " * 200).encode("utf-8"))
+		self.assertEqual(self.memo.get("a.example.org", "text/html"), 'utf-8')
+
+		page = "<html><body>%s</body></html>" % ("Привет, мир! " * 200)
+		self.assertEqual(self.memo.decode("a.example.org", "text/html", page.encode("cp1251")), page)
+		self.assertEqual(self.memo.stats()['memo_misses'], 1)
+		self.assertEqual(self.memo.get("a.example.org", "text/html"), 'cp1251')
+
+	def test_bounded_sample(self):
+		# ASCII for the entire sample, with the non-ASCII content after it.
+		page = "<html><body>" + ("x" * 8192) + "Grüße</body></html>"
+		self.assertEqual(self.memo.decode("a.example.org", "text/html", page.encode("utf-8")), page)
+		self.assertEqual(self.memo.get("a.example.org", "text/html"), 'utf-8')
+
+	def test_max_entries(self):
+		memo = Charset.CharsetMemo(max_entries=2)
+		for host in ("a.example.org", "b.example.org", "c.example.org"):
+			memo.decode(host, "text/html", b'<meta charset="utf-8">')
+		self.assertEqual(memo.stats()['entries'], 2)
+		self.assertEqual(memo.get("a.example.org", "text/html"), None)
+
+
+class TestCharsetFetch(unittest.TestCase):
+	def setUp(self):
+		self.wg = WebRequest.WebGetRobust()
+		self.mock_server_port, self.mock_server, self.mock_server_thread = testing_server.start_server(self, self.wg)
+
+	def tearDown(self):
+		self.mock_server.shutdown()
+		self.mock_server_thread.join()
+		self.wg = None
+
+	def test_memoized(self):
+		for _ in range(3):
+			self.assertEqual(self.wg.getpage("http://localhost:{}/".format(self.mock_server_port)), "Root OK?")
+
+		stats = self.wg.getCharsetStats()
+		self.assertEqual(stats['decodes'], 3)
+		self.assertEqual(stats['memo_hits'], 2)
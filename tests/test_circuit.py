@@ -0,0 +1,171 @@
+import unittest
+import time
+import asyncio
+
+import WebRequest
+from WebRequest.CircuitBreaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+from . import testing_server
+
+
+class TestCircuitBreaker(unittest.TestCase):
+	def setUp(self):
+		self.transitions = []
+		self.breaker = CircuitBreaker(failure_threshold=3, cooldown=0.1, max_cooldown=0.3)
+		self.breaker.add_listener(lambda netloc, old, new: self.transitions.append((netloc, old, new)))
+
+	def fail(self, url, count):
+		for _ in range(count):
+			self.breaker.check(url)
+			self.breaker.record(url, False)
+
+	def test_opens(self):
+		url = "http://www.example.org/page"
+		self.fail(url, 2)
+		self.assertEqual(self.breaker.state(url), CLOSED)
+
+		# A success resets the count
+		self.breaker.check(url)
+		self.breaker.record(url, True)
+		self.fail(url, 2)
+		self.assertEqual(self.breaker.state(url), CLOSED)
+
+		self.fail(url, 1)
+		self.assertEqual(self.breaker.state(url), OPEN)
+		with self.assertRaises(WebRequest.CircuitOpenError) as cm:
+			self.breaker.check("http://www.example.org/other")
+		self.assertTrue(0 < cm.exception.retry_in <= 0.1)
+		self.assertIsInstance(cm.exception, WebRequest.FetchFailureError)
+
+		# Other hosts are unaffected
+		self.breaker.check("http://www.example.com/")
+
+		stats = self.breaker.stats()['www.example.org']
+		self.assertEqual(stats['state'], OPEN)
+		self.assertEqual(stats['opened'], 1)
+		self.assertEqual(stats['rejected'], 1)
+		self.assertEqual(self.transitions, [('www.example.org', CLOSED, OPEN)])
+
+	def test_half_open(self):
+		url = "http://www.example.org/"
+		self.fail(url, 3)
+		time.sleep(0.15)
+		self.assertEqual(self.breaker.state(url), HALF_OPEN)
+
+		# Only one probe at a time
+		self.breaker.check(url)
+		with self.assertRaises(WebRequest.CircuitOpenError):
+			self.breaker.check(url)
+
+		self.breaker.record(url, True)
+		self.assertEqual(self.breaker.state(url), CLOSED)
+		self.breaker.check(url)
+
+		self.assertEqual([new for _, _, new in self.transitions], [OPEN, HALF_OPEN, CLOSED])
+
+	def test_failed_probe(self):
+		url = "http://www.example.org/"
+		self.fail(url, 3)
+		time.sleep(0.15)
+		self.fail(url, 1)
+		self.assertEqual(self.breaker.state(url), OPEN)
+
+		# The cooldown doubled
+		time.sleep(0.15)
+		self.assertEqual(self.breaker.state(url), OPEN)
+		time.sleep(0.1)
+		self.assertEqual(self.breaker.state(url), HALF_OPEN)
+
+	def test_neutral_probe(self):
+		url = "http://www.example.org/"
+		self.fail(url, 3)
+		time.sleep(0.15)
+		self.breaker.check(url)
+		self.breaker.record(url, None)
+
+		# Still half-open, and the next request gets to probe
+		self.assertEqual(self.breaker.state(url), HALF_OPEN)
+		self.breaker.check(url)
+
+	def test_reset(self):
+		url = "http://www.example.org/"
+		self.fail(url, 3)
+		self.breaker.reset(url)
+		self.assertEqual(self.breaker.state(url), CLOSED)
+		self.breaker.check(url)
+
+	def test_idle_eviction(self):
+		breaker = CircuitBreaker(failure_threshold=2, cooldown=60, idle_timeout=0.1)
+		for url, ok in (("http://www.example.org/", True), ("http://www.example.com/", False), ("http://www.example.com/", False)):
+			breaker.check(url)
+			breaker.record(url, ok)
+
+		time.sleep(0.15)
+		breaker.check("http://www.example.net/")
+		# Open circuits are kept.
+		self.assertEqual(set(breaker.stats()), {"www.example.com", "www.example.net"})
+		self.assertEqual(breaker.state("http://www.example.com/"), OPEN)
+
+
+class TestCircuitFetch(unittest.TestCase):
+	def setUp(self):
+		self.breaker = CircuitBreaker(failure_threshold=2, cooldown=0.3)
+		self.wg = WebRequest.WebGetRobust(circuit_breaker=self.breaker)
+		self.mock_server_port, self.mock_server, self.mock_server_thread = testing_server.start_server(self, self.wg)
+
+	def tearDown(self):
+		self.mock_server.shutdown()
+		self.mock_server_thread.join()
+		self.wg = None
+
+	def url(self, path):
+		return "http://localhost:{}{}".format(self.mock_server_port, path)
+
+	def fetch(self, path, **kwargs):
+		return self.wg.getpage(self.url(path), **kwargs)
+
+	def test_circuit(self):
+		# 404s don't count against the host
+		for _ in range(3):
+			with self.assertRaises(WebRequest.FetchFailureError):
+				self.fetch("/favicon.ico")
+		self.assertEqual(self.breaker.state(self.url("/")), CLOSED)
+
+		for _ in range(2):
+			with self.assertRaises(WebRequest.FetchFailureError):
+				self.fetch("/dead/500", retryQuantity=1)
+		self.assertEqual(self.breaker.state(self.url("/")), OPEN)
+
+		with self.assertRaises(WebRequest.CircuitOpenError):
+			self.fetch("/")
+
+		time.sleep(0.35)
+		self.assertEqual(self.fetch("/"), "Root OK?")
+		self.assertEqual(self.breaker.state(self.url("/")), CLOSED)
+		self.assertEqual(self.wg.getCircuitBreakerStats()["localhost:{}".format(self.mock_server_port)]['opened'], 1)
+
+	def test_getpages(self):
+		urls = [self.url("/dead/500"), self.url("/dead/500"), self.url("/")]
+		ret = list(self.wg.getpages(urls, concurrency=1, retryQuantity=1))
+		self.assertIsInstance(ret[-1][1], WebRequest.CircuitOpenError)
+
+
+class TestAsyncCircuitFetch(TestCircuitFetch):
+	def setUp(self):
+		self.breaker = CircuitBreaker(failure_threshold=2, cooldown=0.3)
+		self.wg = WebRequest.AsyncWebGetRobust(circuit_breaker=self.breaker)
+		self.mock_server_port, self.mock_server, self.mock_server_thread = testing_server.start_server(self, self.wg)
+		self.loop = asyncio.new_event_loop()
+
+	def tearDown(self):
+		self.loop.close()
+		super().tearDown()
+
+	def fetch(self, path, **kwargs):
+		return self.loop.run_until_complete(self.wg.getpage(self.url(path), **kwargs))
+
+	def test_getpages(self):
+		async def collect():
+			urls = [self.url("/dead/500"), self.url("/dead/500"), self.url("/")]
+			return [item async for item in self.wg.getpages(urls, concurrency=1, retryQuantity=1)]
+		ret = self.loop.run_until_complete(collect())
+		self.assertIsInstance(ret[-1][1], WebRequest.CircuitOpenError)
@@ -0,0 +1,143 @@
+import unittest
+import time
+import socket
+import asyncio
+
+import WebRequest
+from WebRequest.DnsCache import DnsCache
+from . import testing_server
+
+
+class FakeResolver(object):
+	def __init__(self):
+		self.calls = []
+
+	def __call__(self, host, port, family=0, type=0):
+		self.calls.append(host)
+		if host.endswith(".invalid"):
+			raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+		return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', ('127.0.0.1', port))]
+
+
+class TestDnsCache(unittest.TestCase):
+	def test_positive(self):
+		resolver = FakeResolver()
+		cache = DnsCache(ttl=0.1, resolver=resolver)
+		self.assertEqual(cache.resolve("www.example.org", 80)[0][4], ('127.0.0.1', 80))
+		cache.resolve("WWW.example.org", 80)
+		self.assertEqual(resolver.calls, ["www.example.org"])
+
+		time.sleep(0.15)
+		cache.resolve("www.example.org", 80)
+		self.assertEqual(len(resolver.calls), 2)
+
+		stats = cache.stats()
+		self.assertEqual(stats['hits'], 1)
+		self.assertEqual(stats['misses'], 2)
+		self.assertEqual(stats['lookups'], 3)
+
+	def test_negative(self):
+		resolver = FakeResolver()
+		cache = DnsCache(negative_ttl=60, resolver=resolver)
+		for _ in range(3):
+			with self.assertRaises(socket.gaierror):
+				cache.resolve("dead.invalid", 80)
+		self.assertEqual(resolver.calls, ["dead.invalid"])
+		self.assertEqual(cache.stats()['negative_hits'], 2)
+		self.assertEqual(cache.stats()['failures'], 1)
+
+		cache.invalidate("dead.invalid")
+		with self.assertRaises(socket.gaierror):
+			cache.resolve("dead.invalid", 80)
+		self.assertEqual(len(resolver.calls), 2)
+
+	def test_max_entries(self):
+		cache = DnsCache(max_entries=2, resolver=FakeResolver())
+		for host in ("a.example.org", "b.example.org", "c.example.org"):
+			cache.resolve(host, 80)
+		self.assertEqual(cache.stats()['entries'], 2)
+
+	def test_prefetch(self):
+		resolver = FakeResolver()
+		cache = DnsCache(resolver=resolver)
+		ret = cache.prefetch(["http://www.example.org/page", "https://www.example.com/", "dead.invalid"])
+		self.assertEqual(ret['www.example.org'], None)
+		self.assertEqual(ret['www.example.com'], None)
+		self.assertIsInstance(ret['dead.invalid'], socket.gaierror)
+
+		cache.resolve("www.example.org", 80)
+		cache.resolve("www.example.com", 443)
+		self.assertEqual(len(resolver.calls), 3)
+
+		futures = cache.prefetch(["www.example.net"], wait=False)
+		futures["www.example.net"].result()
+		cache.resolve("www.example.net", 80)
+		cache.resolve("www.example.net", 443)
+		self.assertEqual(len(resolver.calls), 4)
+
+	def test_ports(self):
+		resolver = FakeResolver()
+		cache = DnsCache(resolver=resolver)
+		self.assertEqual(cache.resolve("www.example.org", 80)[0][4], ('127.0.0.1', 80))
+		self.assertEqual(cache.resolve("www.example.org", 443)[0][4], ('127.0.0.1', 443))
+		self.assertEqual(resolver.calls, ["www.example.org"])
+
+		cache.invalidate("www.example.org", 443)
+		cache.resolve("www.example.org", 80)
+		self.assertEqual(len(resolver.calls), 2)
+
+	def test_async(self):
+		resolver = FakeResolver()
+		cache = DnsCache(resolver=resolver)
+
+		async def resolve():
+			await cache.resolve_async("www.example.org", 80)
+			return await cache.resolve_async("www.example.org", 80)
+
+		loop = asyncio.new_event_loop()
+		try:
+			self.assertEqual(loop.run_until_complete(resolve())[0][4], ('127.0.0.1', 80))
+		finally:
+			loop.close()
+		self.assertEqual(len(resolver.calls), 1)
+
+
+class TestDnsCachedFetch(unittest.TestCase):
+	def setUp(self):
+		self.resolver = FakeResolver()
+		self.dns_cache = DnsCache(resolver=self.resolver)
+
+	def fetch(self, wg, path):
+		self.mock_server_port, self.mock_server, self.mock_server_thread = testing_server.start_server(self, wg)
+		try:
+			return [wg.getpage("http://localhost:{}{}".format(self.mock_server_port, path)) for _ in range(3)]
+		finally:
+			self.mock_server.shutdown()
+			self.mock_server_thread.join()
+
+	def test_pooled(self):
+		wg = WebRequest.WebGetRobust(dns_cache=self.dns_cache)
+		self.assertEqual(self.fetch(wg, "/"), ['Root OK?'] * 3)
+		self.assertEqual(self.resolver.calls, ["localhost"])
+		self.assertEqual(wg.getDnsCacheStats()['hits'], 2)
+
+	def test_unpooled(self):
+		wg = WebRequest.WebGetRobust(dns_cache=self.dns_cache, use_pool=False)
+		self.assertEqual(self.fetch(wg, "/"), ['Root OK?'] * 3)
+		self.assertEqual(self.resolver.calls, ["localhost"])
+
+	def test_async(self):
+		wg = WebRequest.AsyncWebGetRobust(dns_cache=self.dns_cache)
+		self.mock_server_port, self.mock_server, self.mock_server_thread = testing_server.start_server(self, wg)
+
+		async def fetch():
+			return [await wg.getpage("http://localhost:{}/".format(self.mock_server_port)) for _ in range(3)]
+
+		loop = asyncio.new_event_loop()
+		try:
+			self.assertEqual(loop.run_until_complete(fetch()), ['Root OK?'] * 3)
+		finally:
+			loop.close()
+			self.mock_server.shutdown()
+			self.mock_server_thread.join()
+		self.assertEqual(self.resolver.calls, ["localhost"])
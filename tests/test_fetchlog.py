@@ -0,0 +1,90 @@
+import unittest
+import logging
+
+import WebRequest
+from WebRequest.FetchLog import FetchLogger
+from WebRequest.FetchTiming import FetchTiming
+from . import testing_server
+
+
+class TestFetchLogger(unittest.TestCase):
+	def setUp(self):
+		self.log = logging.getLogger("Main.WebRequest.TestFetchLog")
+
+	def make_timing(self, error=None, total=0.1):
+		timing = FetchTiming("http://www.example.org/", transport="urllib")
+		timing.status = 200
+		timing.attempts = 1
+		timing.error = error
+		timing.total = total
+		timing.add('download', 0.05)
+		return timing
+
+	def test_sampling(self):
+		logger = FetchLogger(self.log, sample_rate=0.25)
+		with self.assertLogs(self.log, level=logging.INFO) as logs:
+			for _ in range(8):
+				logger(self.make_timing())
+			logger(self.make_timing(error=ValueError("Oh noes!")))
+
+		self.assertEqual([record.levelno for record in logs.records], [logging.INFO, logging.INFO, logging.WARNING])
+		record = logs.records[0]
+		self.assertIsInstance(record.fetch, FetchTiming)
+		self.assertIn("Fetched http://www.example.org/: status=200 transport=urllib attempts=1", record.getMessage())
+		self.assertIn("download=0.0500", record.getMessage())
+		self.assertIn("error=ValueError('Oh noes!')", logs.records[-1].getMessage())
+
+	def test_slow(self):
+		logger = FetchLogger(self.log, sample_rate=0, slow_threshold=1)
+		with self.assertLogs(self.log, level=logging.INFO) as logs:
+			logger(self.make_timing())
+			logger(self.make_timing(total=2))
+		self.assertEqual(len(logs.records), 1)
+		self.assertEqual(logs.records[0].fetch.total, 2)
+
+
+class TestLogModes(unittest.TestCase):
+	def start(self, **kwargs):
+		self.wg = WebRequest.WebGetRobust(**kwargs)
+		self.mock_server_port, self.mock_server, self.mock_server_thread = testing_server.start_server(self, self.wg)
+
+	def tearDown(self):
+		self.mock_server.shutdown()
+		self.mock_server_thread.join()
+		self.wg = None
+
+	def fetch_logs(self, path, **kwargs):
+		with self.assertLogs("Main.WebRequest", level=logging.INFO) as logs:
+			try:
+				self.wg.getpage("http://localhost:{}{}".format(self.mock_server_port, path), **kwargs)
+			except WebRequest.FetchFailureError:
+				pass
+			# assertLogs() needs something logged.
+			self.wg.log.info("Done")
+		return [record for record in logs.records if record.name == "Main.WebRequest"][:-1]
+
+	def test_verbose(self):
+		self.start()
+		records = self.fetch_logs("/compressed/gzip", addlHeaders={"X-Test" : "Yes"})
+		messages = [record.getMessage() for record in records]
+		self.assertIn("Have additional headers: {'X-Test': 'Yes'}", messages)
+		self.assertIn("URL fully retrieved.", messages)
+		self.assertGreater(len(records), 3)
+
+	def test_perf(self):
+		self.start(log_mode="perf", log_sample_rate=1)
+		record, = self.fetch_logs("/compressed/gzip", addlHeaders={"X-Test" : "Yes"})
+		self.assertEqual(record.fetch.status, 200)
+		self.assertEqual(record.fetch.content_bytes, len(b"Root OK?"))
+
+	def test_perf_failure(self):
+		self.start(log_mode="perf", log_sample_rate=0)
+		records = self.fetch_logs("/dead/500", retryQuantity=2)
+		self.assertEqual(records[-1].levelno, logging.WARNING)
+		self.assertEqual(records[-1].fetch.attempts, 2)
+		self.assertTrue(all(not hasattr(record, "fetch") for record in records[:-1]))
+
+	def test_invalid(self):
+		with self.assertRaises(ValueError):
+			WebRequest.WebGetRobust(log_mode="loud")
+		self.start()
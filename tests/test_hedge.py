@@ -0,0 +1,94 @@
+import unittest
+import time
+import asyncio
+
+import WebRequest
+from WebRequest.HedgePolicy import HedgePolicy
+from . import testing_server
+
+
+class TestHedgePolicy(unittest.TestCase):
+	def test_fixed_delay(self):
+		policy = HedgePolicy(delay=0.5)
+		self.assertEqual(policy.hedge_delay("http://www.example.org/"), 0.5)
+		self.assertEqual(HedgePolicy(delay=0, min_delay=0.1).hedge_delay("http://www.example.org/"), 0.1)
+
+	def test_learned_delay(self):
+		policy = HedgePolicy(min_samples=10)
+		for x in range(9):
+			policy.observe("http://www.example.org/", 0.1)
+		self.assertEqual(policy.hedge_delay("http://www.example.org/"), None)
+
+		for x in range(91):
+			policy.observe("http://www.example.org/page", 0.1 if x < 85 else 5)
+		self.assertEqual(policy.hedge_delay("http://www.example.org/"), 5)
+
+		# Other hosts don't have any stats yet
+		self.assertEqual(policy.hedge_delay("http://www.example.com/"), None)
+		self.assertEqual(policy.stats()['hedge_delays'], {'www.example.org' : 5})
+
+	def test_budget(self):
+		policy = HedgePolicy(delay=1, budget=0.1)
+		allowed = 0
+		for x in range(100):
+			policy.hedge_delay("http://www.example.org/")
+			allowed += policy.try_hedge()
+		self.assertEqual(allowed, 10)
+
+		stats = policy.stats()
+		self.assertEqual(stats['requests'], 100)
+		self.assertEqual(stats['hedges'], 10)
+		self.assertEqual(stats['budget_denied'], 90)
+
+	def test_max_hosts(self):
+		policy = HedgePolicy(max_hosts=2, min_samples=1)
+		for host in ("a.example.org", "b.example.org", "c.example.org"):
+			policy.observe("http://%s/" % host, 0.1)
+		self.assertEqual(sorted(policy.stats()['hedge_delays']), ["b.example.org", "c.example.org"])
+
+
+class TestHedgedFetch(unittest.TestCase):
+	def setUp(self):
+		self.wg = WebRequest.WebGetRobust(hedge_policy=HedgePolicy(delay=0.2, budget=1))
+		self.mock_server_port, self.mock_server, self.mock_server_thread = testing_server.start_server(self, self.wg, threaded=True)
+
+	def tearDown(self):
+		self.mock_server.shutdown()
+		self.mock_server_thread.join()
+		self.wg = None
+
+	def fetch(self, path, **kwargs):
+		return self.wg.getpage("http://localhost:{}{}".format(self.mock_server_port, path), **kwargs)
+
+	def test_hedge(self):
+		start = time.monotonic()
+		self.assertEqual(self.fetch("/slow/first-request", hedge=True), "Slow OK? 2")
+		self.assertLess(time.monotonic() - start, 1.2)
+
+		stats = self.wg.getHedgeStats()
+		self.assertEqual(stats['hedges'], 1)
+		self.assertEqual(stats['hedge_wins'], 1)
+
+	def test_no_hedge(self):
+		self.assertEqual(self.fetch("/", hedge=True), "Root OK?")
+		self.assertEqual(self.fetch("/slow/first-request"), "Slow OK? 1")
+		self.assertEqual(self.wg.getHedgeStats()['hedges'], 0)
+
+	def test_budget(self):
+		self.wg.hedge_policy.budget = 0
+		self.assertEqual(self.fetch("/slow/first-request", hedge=True), "Slow OK? 1")
+		self.assertEqual(self.wg.getHedgeStats()['budget_denied'], 1)
+
+
+class TestAsyncHedgedFetch(TestHedgedFetch):
+	def setUp(self):
+		self.wg = WebRequest.AsyncWebGetRobust(hedge_policy=HedgePolicy(delay=0.2, budget=1))
+		self.mock_server_port, self.mock_server, self.mock_server_thread = testing_server.start_server(self, self.wg, threaded=True)
+		self.loop = asyncio.new_event_loop()
+
+	def tearDown(self):
+		self.loop.close()
+		super().tearDown()
+
+	def fetch(self, path, **kwargs):
+		return self.loop.run_until_complete(self.wg.getpage("http://localhost:{}{}".format(self.mock_server_port, path), **kwargs))
@@ -0,0 +1,70 @@
+import unittest
+import os
+import sys
+import json
+import subprocess
+
+from benchmarks import bench_import
+
+
+# Optional backends that must not be pulled in by a plain `import WebRequest`.
+LAZY_MODULES = (
+	"bs4",
+	"ChromeController",
+	"selenium",
+	"cloudscraper",
+	"requests",
+	"python_anticaptcha",
+	"upnpclient",
+	"socks",
+	"sockshandler",
+)
+
+CHECK_SCRIPT = '''
+import sys, json
+import WebRequest
+import WebRequest.CloudscraperMixin
+print(json.dumps([name for name in %r if name in sys.modules]))
+''' % (LAZY_MODULES, )
+
+
+def run_isolated(script):
+	proc = subprocess.run(
+			[sys.executable, "-c", script],
+			stdout = subprocess.PIPE,
+			cwd    = os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+			check  = True,
+		)
+	return json.loads(proc.stdout.decode("utf-8"))
+
+
+class TestLazyImports(unittest.TestCase):
+	def test_no_heavy_imports(self):
+		self.assertEqual(run_isolated(CHECK_SCRIPT), [])
+
+	def test_public_api(self):
+		import WebRequest
+		for name in ("WebGetRobust", "AsyncWebGetRobust", "as_soup", "AntiCaptchaSolver", "TwoCaptchaSolver",
+				"CloudFlareWrapper", "SucuriWrapper", "DomainRoutes", "WafDetector"):
+			self.assertTrue(hasattr(WebRequest, name), name)
+
+		from WebRequest import CloudscraperMixin
+		import cloudscraper
+		self.assertTrue(issubclass(CloudscraperMixin.CloudScraperWrapper, cloudscraper.CloudScraper))
+
+	def test_first_use(self):
+		# Using the feature brings the backend in.
+		loaded = run_isolated('''
+import sys, json
+import WebRequest
+soup = WebRequest.as_soup("<html><body><p>Hi</p></body></html>")
+assert soup.p.get_text() == "Hi"
+print(json.dumps([name for name in ("bs4", "selenium") if name in sys.modules]))
+''')
+		self.assertEqual(loaded, ["bs4"])
+
+	def test_bench_import(self):
+		results = bench_import.run(rounds=1, top=3)
+		self.assertEqual(results['module'], "WebRequest")
+		self.assertGreater(results['cumulative_ms'], 0)
+		self.assertEqual(len(results['slowest']), 3)
@@ -0,0 +1,120 @@
+import unittest
+import time
+import json
+import asyncio
+
+import WebRequest
+from WebRequest.ResponseMemo import ResponseMemo
+from . import testing_server
+
+
+class TestResponseMemo(unittest.TestCase):
+	def test_keys(self):
+		key_1 = ResponseMemo.make_key("page", "http://www.example.org/", {'postData' : {'b' : 1, 'a' : 2}})
+		key_2 = ResponseMemo.make_key("page", "http://www.example.org/ ", {'postData' : {'a' : 2, 'b' : 1}})
+		self.assertEqual(key_1, key_2)
+		self.assertNotEqual(key_1, ResponseMemo.make_key("page", "http://www.example.org/", {}))
+		self.assertNotEqual(ResponseMemo.make_key("page", "http://www.example.org/", {'addlHeaders' : {'Referer' : 'lol'}}),
+			ResponseMemo.make_key("page", "http://www.example.org/", {}))
+
+		self.assertEqual(ResponseMemo.make_key("page", "http://www.example.org/", {'returnMultiple' : True}), None)
+		self.assertNotEqual(ResponseMemo.make_key("page", "http://www.example.org/", {'max_decompressed_bytes' : 1000}),
+			ResponseMemo.make_key("page", "http://www.example.org/", {}))
+
+	def test_ttl(self):
+		memo = ResponseMemo(ttl=0.1)
+		memo.put("key", "value", 5)
+		self.assertEqual(memo.get("key"), (True, "value"))
+		time.sleep(0.15)
+		self.assertEqual(memo.get("key"), (False, None))
+		stats = memo.stats()
+		self.assertEqual(stats['hits'], 1)
+		self.assertEqual(stats['misses'], 1)
+		self.assertEqual(stats['expired'], 1)
+		self.assertEqual(stats['size'], 0)
+
+	def test_byte_budget(self):
+		memo = ResponseMemo(max_bytes=100)
+		memo.put("key-1", "value", 40)
+		memo.put("key-2", "value", 40)
+		memo.get("key-1")
+		memo.put("key-3", "value", 40)
+
+		self.assertEqual(memo.get("key-2"), (False, None))
+		self.assertEqual(memo.get("key-1"), (True, "value"))
+		self.assertEqual(memo.get("key-3"), (True, "value"))
+		self.assertEqual(memo.stats()['evictions'], 1)
+
+		# Oversized entries are just not stored.
+		memo.put("key-4", "value", 101)
+		self.assertEqual(memo.get("key-4"), (False, None))
+
+
+class TestMemoFetch(unittest.TestCase):
+	wg_class = WebRequest.WebGetRobust
+
+	def setUp(self):
+		self.wg = self.wg_class(response_memo=ResponseMemo(ttl=60, cache_parsed=True))
+		self.mock_server_port, self.mock_server, self.mock_server_thread = testing_server.start_server(self, self.wg)
+
+	def tearDown(self):
+		self.mock_server.shutdown()
+		self.mock_server_thread.join()
+		self.wg = None
+
+	def call(self, func, path, **kwargs):
+		return func("http://localhost:{}{}".format(self.mock_server_port, path), **kwargs)
+
+	def test_page(self):
+		# The server doesn't want this cached, but the memo is explicitly opt-in.
+		self.assertEqual(self.call(self.wg.getpage, "/cache/no-store"), "Cached /cache/no-store, request 1")
+		self.assertEqual(self.call(self.wg.getpage, "/cache/no-store"), "Cached /cache/no-store, request 1")
+		self.assertEqual(self.call(self.wg.getpage, "/cache/no-store", addlHeaders={'Referer' : 'http://www.example.org/'}), "Cached /cache/no-store, request 2")
+
+		page, _ = self.call(self.wg.getpage, "/cache/no-store", returnMultiple=True)
+		self.assertEqual(page, "Cached /cache/no-store, request 3")
+		self.assertEqual(self.wg.getResponseMemoStats()['hits'], 1)
+
+	def test_parsed(self):
+		ret_1 = self.call(self.wg.getJson, "/json/valid")
+		ret_2 = self.call(self.wg.getJson, "/json/valid")
+		self.assertEqual(ret_1, {'oh': 'hai'})
+		self.assertIs(ret_1, ret_2)
+
+		soup_1 = self.call(self.wg.getSoup, "/html/real")
+		soup_2 = self.call(self.wg.getSoup, "/html/real")
+		self.assertIs(soup_1, soup_2)
+
+	def test_size_limits(self):
+		# A body memoized without a limit isn't handed to a call with one it exceeds.
+		self.call(self.wg.getpage, "/compressed/large-gzip")
+		with self.assertRaises(WebRequest.ContentTooLargeError):
+			self.call(self.wg.getpage, "/compressed/large-gzip", max_decompressed_bytes=1000)
+		with self.assertRaises(WebRequest.ContentTooLargeError):
+			self.call(self.wg.getpage, "/compressed/large-gzip", max_content_bytes=1000)
+		self.assertEqual(self.wg.getResponseMemoStats()['hits'], 0)
+
+		self.call(self.wg.getpage, "/compressed/large-gzip")
+		self.assertEqual(self.wg.getResponseMemoStats()['hits'], 1)
+
+	def test_errors_not_memoized(self):
+		self.wg.retryDelay = 0.01
+		with self.assertRaises(json.decoder.JSONDecodeError):
+			self.call(self.wg.getJson, "/json/invalid")
+		self.assertEqual(self.wg.getResponseMemoStats()['hits'], 0)
+
+		with self.assertRaises(WebRequest.FetchFailureError):
+			self.call(self.wg.getpage, "/favicon.ico")
+		with self.assertRaises(WebRequest.FetchFailureError):
+			self.call(self.wg.getpage, "/favicon.ico")
+
+
+class TestAsyncMemoFetch(TestMemoFetch):
+	wg_class = WebRequest.AsyncWebGetRobust
+
+	def call(self, func, path, **kwargs):
+		loop = asyncio.new_event_loop()
+		try:
+			return loop.run_until_complete(super().call(func, path, **kwargs))
+		finally:
+			loop.close()
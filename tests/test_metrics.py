@@ -0,0 +1,118 @@
+import unittest
+import urllib.request
+
+import WebRequest
+from WebRequest.Metrics import MetricsRegistry
+from WebRequest.FetchTiming import FetchTiming
+from . import testing_server
+
+
+class TestMetricsRegistry(unittest.TestCase):
+	def test_counters(self):
+		metrics = MetricsRegistry()
+		metrics.inc('requests_total', host="a", status="200")
+		metrics.inc('requests_total', 2, status="200", host="a")
+		metrics.inc('requests_total', host='b"\\', status="404")
+		self.assertEqual(metrics.get('requests_total', host="a", status="200"), 3)
+
+		text = metrics.render_metrics()
+		self.assertIn("# TYPE webrequest_requests_total counter", text)
+		self.assertIn('webrequest_requests_total{host="a",status="200"} 3\n', text)
+		self.assertIn('webrequest_requests_total{host="b\\"\\\\",status="404"} 1\n', text)
+
+	def test_histograms(self):
+		metrics = MetricsRegistry(namespace="test", buckets=(0.1, 1))
+		for value in (0.05, 0.5, 0.5, 5):
+			metrics.observe('request_duration_seconds', value, transport="urllib")
+		self.assertEqual(metrics.get('request_duration_seconds', transport="urllib"), (4, 6.05))
+
+		text = metrics.render_metrics()
+		self.assertIn("# TYPE test_request_duration_seconds histogram", text)
+		self.assertIn('test_request_duration_seconds_bucket{transport="urllib",le="0.1"} 1\n', text)
+		self.assertIn('test_request_duration_seconds_bucket{transport="urllib",le="1"} 3\n', text)
+		self.assertIn('test_request_duration_seconds_bucket{transport="urllib",le="+Inf"} 4\n', text)
+		self.assertIn('test_request_duration_seconds_count{transport="urllib"} 4\n', text)
+
+	def test_observe_fetch(self):
+		metrics = MetricsRegistry()
+		timing = FetchTiming("http://www.Example.org/page", transport="urllib")
+		timing.add('download', 0.25)
+		timing.attempts = 3
+		timing.status = 200
+		timing.sent_bytes = 10
+		timing.wire_bytes = 100
+		timing.content_bytes = 400
+		timing.finish()
+		metrics.observe_fetch(timing)
+
+		self.assertEqual(metrics.get('requests_total', host="www.example.org", status="200", transport="urllib"), 1)
+		self.assertEqual(metrics.get('retries_total', host="www.example.org"), 2)
+		self.assertEqual(metrics.get('sent_bytes_total'), 10)
+		self.assertEqual(metrics.get('received_bytes_total'), 100)
+		self.assertEqual(metrics.get('decoded_bytes_total'), 400)
+		self.assertEqual(metrics.get('phase_duration_seconds', phase="download"), (1, 0.25))
+
+	def test_serve(self):
+		metrics = MetricsRegistry()
+		metrics.inc('waf_detections_total', type="CloudFlareWrapper")
+		server = metrics.serve_metrics(0, host="localhost")
+		try:
+			with urllib.request.urlopen("http://localhost:%s/metrics" % server.server_address[1]) as resp:
+				self.assertTrue(resp.headers['Content-Type'].startswith("text/plain"))
+				self.assertEqual(resp.read().decode("utf-8"), metrics.render_metrics())
+		finally:
+			server.shutdown()
+			server.server_close()
+
+
+class TestFetchMetrics(unittest.TestCase):
+	def setUp(self):
+		self.metrics = MetricsRegistry()
+		self.wg = WebRequest.WebGetRobust(metrics=self.metrics)
+		self.mock_server_port, self.mock_server, self.mock_server_thread = testing_server.start_server(self, self.wg)
+
+	def tearDown(self):
+		self.mock_server.shutdown()
+		self.mock_server_thread.join()
+		self.wg = None
+
+	def url(self, path):
+		return "http://localhost:{}{}".format(self.mock_server_port, path)
+
+	def test_fetch(self):
+		self.wg.getpage(self.url("/compressed/gzip"))
+		with self.assertRaises(WebRequest.FetchFailureError):
+			self.wg.getpage(self.url("/dead/500"), retryQuantity=1)
+
+		host = "localhost:%s" % self.mock_server_port
+		self.assertEqual(self.metrics.get('requests_total', host=host, status="200", transport="urllib"), 1)
+		self.assertEqual(self.metrics.get('requests_total', host=host, status="500", transport="urllib"), 1)
+		self.assertEqual(self.metrics.get('decoded_bytes_total'), len(b"Root OK?"))
+		self.assertEqual(self.metrics.get('request_duration_seconds', transport="urllib")[0], 2)
+
+		text = self.wg.renderMetrics()
+		self.assertIn('webrequest_phase_duration_seconds_count{phase="ttfb"} 1\n', text)
+
+	def test_waf(self):
+		calls = []
+		def step_through(url, **kwargs):
+			calls.append(url)
+			return False
+		self.wg.stepThroughJsWaf_bare_chromium = step_through
+
+		with self.assertRaises(WebRequest.FetchFailureError):
+			self.wg.getpage(self.url("/cloudflare_under_attack_shit"))
+
+		self.assertEqual(len(calls), 1)
+		self.assertEqual(self.metrics.get('waf_detections_total', type="CloudFlareWrapper"), 1)
+		self.assertEqual(self.metrics.get('chromium_step_through_total', result="failure"), 1)
+		self.assertEqual(self.metrics.get('chromium_step_through_duration_seconds')[0], 1)
+
+	def test_cookie_save(self):
+		self.wg.saveCookies()
+		self.assertEqual(self.metrics.get('cookie_save_duration_seconds')[0], 1)
+
+	def test_disabled(self):
+		wg = WebRequest.WebGetRobust()
+		self.assertEqual(wg.renderMetrics(), None)
+		self.assertEqual(wg.timing_listeners, [])
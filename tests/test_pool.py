@@ -0,0 +1,132 @@
+import unittest
+import socket
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Thread
+
+import WebRequest
+from . import testing_server
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+	protocol_version = "HTTP/1.1"
+	# The server is single-threaded, so don't let an idle keep-alive connection block it forever.
+	timeout = 5
+
+	def log_message(self, format, *args):
+		return
+
+	def do_GET(self):
+		if self.path == "/close":
+			body = b"Closing!"
+			self.send_response(200)
+			self.send_header('Connection', "close")
+		else:
+			body = ("Port %s" % self.client_address[1]).encode("ascii")
+			self.send_response(200)
+
+		self.send_header('Content-type', "text/plain")
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+
+class TestConnectionPool(unittest.TestCase):
+	def setUp(self):
+		self.port = testing_server.get_free_port()
+		self.server = HTTPServer(('localhost', self.port), KeepAliveHandler)
+		self.server_thread = Thread(target=self.server.serve_forever, daemon=True)
+		self.server_thread.start()
+
+	def tearDown(self):
+		self.server.shutdown()
+		self.server.server_close()
+		self.server_thread.join()
+
+	def test_connection_reuse(self):
+		wg = WebRequest.WebGetRobust()
+		url = "http://localhost:{}/".format(self.port)
+
+		pages = [wg.getpage(url) for _ in range(5)]
+
+		# Every request should have come in on the same client socket.
+		self.assertEqual(len(set(pages)), 1)
+
+		stats = wg.getPoolStats()
+		self.assertEqual(stats['misses'], 1)
+		self.assertEqual(stats['hits'], 4)
+		self.assertEqual(stats['idle'], 1)
+
+	def test_connection_close(self):
+		wg = WebRequest.WebGetRobust()
+
+		self.assertEqual(wg.getpage("http://localhost:{}/close".format(self.port)), "Closing!")
+		stats = wg.getPoolStats()
+		self.assertEqual(stats['idle'], 0)
+
+		wg.getpage("http://localhost:{}/".format(self.port))
+		self.assertEqual(wg.getPoolStats()['misses'], 2)
+
+	def test_max_requests_per_connection(self):
+		pool = WebRequest.ConnectionPool(max_requests_per_connection=2)
+		wg = WebRequest.WebGetRobust(conn_pool=pool)
+		url = "http://localhost:{}/".format(self.port)
+
+		pages = [wg.getpage(url) for _ in range(4)]
+		self.assertEqual(pages[0], pages[1])
+		self.assertEqual(pages[2], pages[3])
+		self.assertNotEqual(pages[1], pages[2])
+
+	def test_stale_connection_retry(self):
+		wg = WebRequest.WebGetRobust()
+		url = "http://localhost:{}/".format(self.port)
+
+		wg.getpage(url)
+
+		# Kill the idle socket out from under the pool
+		for conns in wg.connection_pool._idle.values():
+			for pconn in conns:
+				pconn.conn.sock.shutdown(socket.SHUT_RDWR)
+
+		wg.getpage(url)
+		self.assertEqual(wg.getPoolStats()['misses'], 2)
+
+	def test_shared_pool(self):
+		pool = WebRequest.ConnectionPool()
+		wg_1 = WebRequest.WebGetRobust(conn_pool=pool)
+		wg_2 = WebRequest.WebGetRobust(conn_pool=pool)
+		url = "http://localhost:{}/".format(self.port)
+
+		self.assertEqual(wg_1.getpage(url), wg_2.getpage(url))
+		self.assertEqual(pool.stats()['hits'], 1)
+
+	def test_pool_disabled(self):
+		wg = WebRequest.WebGetRobust(use_pool=False)
+		self.assertEqual(wg.getPoolStats(), None)
+		url = "http://localhost:{}/".format(self.port)
+		self.assertNotEqual(wg.getpage(url), wg.getpage(url))
+
+
+class TestPooledFetch(unittest.TestCase):
+	# The normal test server is HTTP/1.0, so none of the connections can be
+	# reused. Make sure that doesn't break anything.
+	def setUp(self):
+		self.wg = WebRequest.WebGetRobust()
+		self.mock_server_port, self.mock_server, self.mock_server_thread = testing_server.start_server(self, self.wg)
+
+	def tearDown(self):
+		self.mock_server.shutdown()
+		self.mock_server_thread.join()
+		self.wg = None
+
+	def test_non_keepalive_server(self):
+		for _ in range(3):
+			page = self.wg.getpage("http://localhost:{}".format(self.mock_server_port))
+			self.assertEqual(page, 'Root OK?')
+
+		stats = self.wg.getPoolStats()
+		self.assertEqual(stats['hits'], 0)
+		self.assertEqual(stats['idle'], 0)
+
+	def test_redirect(self):
+		ctnt = self.wg.getpage("http://localhost:{}/redirect/from-1".format(self.mock_server_port))
+		self.assertEqual(ctnt, b"Redirect-To-1")
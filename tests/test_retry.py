@@ -0,0 +1,136 @@
+import unittest
+import time
+import asyncio
+
+import WebRequest
+from WebRequest.RetryPolicy import RetryPolicy, RETRY, FAIL, THROTTLE
+from . import testing_server
+
+
+class TestRetryPolicy(unittest.TestCase):
+	def test_backoff(self):
+		policy = RetryPolicy(base_delay=1, max_delay=5)
+		for attempt, cap in ((1, 1), (2, 2), (3, 4), (4, 5), (10, 5)):
+			for _ in range(50):
+				delay = policy.backoff(attempt, 3)
+				self.assertTrue(0 <= delay <= cap, (attempt, delay))
+
+		policy = RetryPolicy(max_delay=5, jitter=False)
+		self.assertEqual([policy.backoff(attempt, 1) for attempt in range(1, 5)], [1, 2, 4, 5])
+
+	def test_attempts(self):
+		self.assertEqual(RetryPolicy().attempts(None, 3), 3)
+		self.assertEqual(RetryPolicy(max_attempts=5).attempts(None, 3), 5)
+		self.assertEqual(RetryPolicy(max_attempts=5).attempts(2, 3), 2)
+
+	def test_next_delay(self):
+		policy = RetryPolicy(base_delay=1, jitter=False)
+		started = time.monotonic()
+		self.assertEqual(policy.next_delay(1, 3, started, 3), 1)
+		self.assertEqual(policy.next_delay(2, 3, started, 3), 2)
+		# No waiting after the last attempt
+		self.assertEqual(policy.next_delay(3, 3, started, 3), None)
+
+	def test_max_elapsed(self):
+		policy = RetryPolicy(base_delay=1, max_elapsed=1.5, jitter=False)
+		started = time.monotonic()
+		self.assertEqual(policy.next_delay(1, 10, started, 3), 1)
+		self.assertEqual(policy.next_delay(2, 10, started, 3), None)
+
+		self.assertFalse(policy.exhausted(2, 10, started))
+		self.assertTrue(policy.exhausted(2, 10, started - 2))
+		self.assertTrue(policy.exhausted(11, 10, started))
+
+	def test_status_rules(self):
+		policy = RetryPolicy(status_rules={500 : FAIL, 404 : RETRY})
+		self.assertEqual(policy.action(500), FAIL)
+		self.assertEqual(policy.action(404), RETRY)
+		self.assertEqual(policy.action(410), FAIL)
+		self.assertEqual(policy.action(429), THROTTLE)
+		self.assertEqual(policy.action(502), RETRY)
+
+
+class TestRetryFetch(unittest.TestCase):
+	def setUp(self):
+		self.wg = WebRequest.WebGetRobust(retry_policy=RetryPolicy(base_delay=0.1, max_delay=0.2))
+		self.mock_server_port, self.mock_server, self.mock_server_thread = testing_server.start_server(self, self.wg)
+
+	def tearDown(self):
+		self.mock_server.shutdown()
+		self.mock_server_thread.join()
+		self.wg = None
+
+	def url(self, path):
+		return "http://localhost:{}{}".format(self.mock_server_port, path)
+
+	def test_retry(self):
+		self.assertEqual(self.wg.getpage(self.url("/flaky/500"), retryQuantity=3), "Flaky OK?")
+
+	def test_fail_fast(self):
+		# Neither a 404, or running out of attempts, should involve any waiting.
+		self.wg.retry_policy = RetryPolicy(base_delay=10)
+		start = time.monotonic()
+		with self.assertRaises(WebRequest.FetchFailureError):
+			self.wg.getpage(self.url("/favicon.ico"), retryQuantity=3)
+		with self.assertRaises(WebRequest.FetchFailureError):
+			self.wg.getpage(self.url("/flaky/500"), retryQuantity=1)
+		self.assertLess(time.monotonic() - start, 5)
+
+	def test_getpages_delay_queue(self):
+		urls = [self.url("/flaky/500"), self.url("/favicon.ico"), self.url("/")]
+		ret = dict(self.wg.getpages(urls, concurrency=1, retryQuantity=3))
+
+		self.assertEqual(ret[self.url("/flaky/500")], "Flaky OK?")
+		self.assertEqual(ret[self.url("/")], "Root OK?")
+		self.assertIsInstance(ret[self.url("/favicon.ico")], WebRequest.FetchFailureError)
+
+	def test_getpages_order(self):
+		# The failed fetch is parked, so the other urls complete before it's retried,
+		# even with only one worker.
+		self.wg.retry_policy = RetryPolicy(base_delay=0.5, jitter=False)
+		urls = [self.url("/flaky/500"), self.url("/"), self.url("/binary_ctnt")]
+		ret = [url for url, _ in self.wg.getpages(urls, concurrency=1, retryQuantity=2)]
+		self.assertEqual(ret, [self.url("/"), self.url("/binary_ctnt"), self.url("/flaky/500")])
+
+
+class TestAsyncRetryFetch(TestRetryFetch):
+	def setUp(self):
+		self.wg = WebRequest.AsyncWebGetRobust(retry_policy=RetryPolicy(base_delay=0.1, max_delay=0.2))
+		self.mock_server_port, self.mock_server, self.mock_server_thread = testing_server.start_server(self, self.wg)
+		self.loop = asyncio.new_event_loop()
+
+	def tearDown(self):
+		self.loop.close()
+		super().tearDown()
+
+	def test_retry(self):
+		ret = self.loop.run_until_complete(self.wg.getpage(self.url("/flaky/500"), retryQuantity=3))
+		self.assertEqual(ret, "Flaky OK?")
+
+	def test_fail_fast(self):
+		self.wg.retry_policy = RetryPolicy(base_delay=10)
+		start = time.monotonic()
+		with self.assertRaises(WebRequest.FetchFailureError):
+			self.loop.run_until_complete(self.wg.getpage(self.url("/favicon.ico"), retryQuantity=3))
+		with self.assertRaises(WebRequest.FetchFailureError):
+			self.loop.run_until_complete(self.wg.getpage(self.url("/flaky/500"), retryQuantity=1))
+		self.assertLess(time.monotonic() - start, 5)
+
+	def _collect(self, urls, **kwargs):
+		async def collect():
+			return [item async for item in self.wg.getpages(urls, **kwargs)]
+		return self.loop.run_until_complete(collect())
+
+	def test_getpages_delay_queue(self):
+		urls = [self.url("/flaky/500"), self.url("/favicon.ico"), self.url("/")]
+		ret = dict(self._collect(urls, concurrency=1, retryQuantity=3))
+
+		self.assertEqual(ret[self.url("/flaky/500")], "Flaky OK?")
+		self.assertEqual(ret[self.url("/")], "Root OK?")
+		self.assertIsInstance(ret[self.url("/favicon.ico")], WebRequest.FetchFailureError)
+
+	def test_getpages_order(self):
+		self.wg.retry_policy = RetryPolicy(base_delay=0.5, jitter=False)
+		urls = [self.url("/flaky/500"), self.url("/"), self.url("/binary_ctnt")]
+		ret = [url for url, _ in self._collect(urls, concurrency=1, retryQuantity=2)]
+		self.assertEqual(ret, [self.url("/"), self.url("/binary_ctnt"), self.url("/flaky/500")])
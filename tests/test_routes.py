@@ -0,0 +1,182 @@
+import unittest
+import os
+import json
+import time
+import uuid
+import tempfile
+import http.cookiejar
+
+import WebRequest
+from WebRequest.DomainRoutes import DomainRoutes, DomainPolicy, WAF_SUCURI, WAF_CLOUDFLARE, TRANSPORT_CHROMIUM
+from . import testing_server
+
+
+class TestDomainRoutes(unittest.TestCase):
+	def test_lookup(self):
+		routes = DomainRoutes({
+				"example.org"        : {"waf" : WAF_CLOUDFLARE},
+				"static.example.org" : {"rate_limit" : 5},
+				".Example.COM."      : DomainPolicy(transport=TRANSPORT_CHROMIUM),
+			})
+
+		self.assertEqual(routes.lookup("example.org").waf, WAF_CLOUDFLARE)
+		self.assertEqual(routes.lookup("www.example.org").waf, WAF_CLOUDFLARE)
+		self.assertEqual(routes.lookup("http://a.b.www.example.org:8080/page").waf, WAF_CLOUDFLARE)
+		self.assertEqual(routes.lookup("www.example.org:8080").waf, WAF_CLOUDFLARE)
+
+		# Most specific entry wins
+		self.assertEqual(routes.lookup("static.example.org").rate_limit, 5)
+		self.assertEqual(routes.lookup("img.static.example.org").waf, None)
+
+		self.assertEqual(routes.lookup("https://www.example.com/").transport, TRANSPORT_CHROMIUM)
+
+		# Only whole labels match
+		self.assertEqual(routes.lookup("notexample.org"), None)
+		self.assertEqual(routes.lookup("org"), None)
+		self.assertEqual(routes.lookup("localhost"), None)
+
+		stats = routes.stats()
+		self.assertEqual(stats['lookups'], 10)
+		self.assertEqual(stats['hits'], 7)
+		self.assertEqual(stats['domains'], 3)
+
+	def test_policy(self):
+		self.assertEqual(DomainPolicy(waf=WAF_SUCURI).cookies, ("sucuri_cloudproxy_uuid_", ))
+		self.assertEqual(DomainPolicy(waf=WAF_SUCURI, cookies=["other"]).cookies, ("other", ))
+		self.assertEqual(DomainPolicy(waf=WAF_CLOUDFLARE).cookies, ())
+		with self.assertRaises(ValueError):
+			DomainPolicy(waf="akamai")
+		with self.assertRaises(ValueError):
+			DomainPolicy(transport="carrier-pigeon")
+		with self.assertRaises(TypeError):
+			DomainRoutes({"example.org" : {"wat" : 1}})
+
+	def test_default(self):
+		routes = DomainRoutes.default()
+		self.assertEqual(routes.lookup("www.mistycloudtranslations.com").waf, WAF_SUCURI)
+
+	def test_set_remove(self):
+		routes = DomainRoutes()
+		routes.set("example.org", DomainPolicy(rate_limit=1))
+		self.assertEqual(routes.lookup("www.example.org").rate_limit, 1)
+		routes.remove("example.org")
+		self.assertEqual(routes.lookup("www.example.org"), None)
+
+
+class TestDomainRoutesFile(unittest.TestCase):
+	def setUp(self):
+		self.tmpdir = tempfile.TemporaryDirectory()
+		self.path = os.path.join(self.tmpdir.name, "routes.json")
+		self.writes = 0
+		self.write({"example.org" : {"waf" : "sucuri"}})
+
+	def tearDown(self):
+		self.tmpdir.cleanup()
+
+	def write(self, routes, raw=None):
+		with open(self.path, "w") as fp:
+			fp.write(raw if raw is not None else json.dumps(routes))
+		# Make sure the mtime changes, irrespective of the filesystem timestamp resolution.
+		self.writes += 1
+		os.utime(self.path, ns=(self.writes * 10 ** 9, self.writes * 10 ** 9))
+
+	def test_reload(self):
+		routes = DomainRoutes({"example.org" : {"rate_limit" : 1}, "example.com" : {}}, path=self.path)
+		# The file takes precedence
+		self.assertEqual(routes.lookup("example.org").waf, WAF_SUCURI)
+		self.assertEqual(routes.lookup("example.org").rate_limit, None)
+		self.assertIsNotNone(routes.lookup("example.com"))
+
+		self.write({"example.net" : {"waf" : "cloudflare"}})
+		self.assertEqual(routes.lookup("example.net"), None)
+		routes.reload()
+		self.assertEqual(routes.lookup("example.net").waf, WAF_CLOUDFLARE)
+		self.assertEqual(routes.lookup("example.org").rate_limit, 1)
+
+		# A broken file leaves the old table in place
+		self.write(None, raw="{ not json")
+		with self.assertRaises(ValueError):
+			routes.reload()
+		self.assertEqual(routes.lookup("example.net").waf, WAF_CLOUDFLARE)
+
+	def test_auto_reload(self):
+		routes = DomainRoutes(path=self.path, reload_interval=0)
+		self.assertEqual(routes.lookup("example.org").waf, WAF_SUCURI)
+
+		self.write({"example.org" : {"waf" : "cloudflare"}})
+		self.assertEqual(routes.lookup("example.org").waf, WAF_CLOUDFLARE)
+
+		self.write(None, raw="{ not json")
+		self.assertEqual(routes.lookup("example.org").waf, WAF_CLOUDFLARE)
+		self.assertEqual(routes.stats()['reloads'], 2)
+
+
+class TestRoutedFetch(unittest.TestCase):
+	def setUp(self):
+		self.routes = DomainRoutes()
+		self.wg = WebRequest.WebGetRobust(domain_routes=self.routes, cloudflare=False, auto_waf=False)
+		self.mock_server_port, self.mock_server, self.mock_server_thread = testing_server.start_server(self, self.wg)
+		self.url = "http://localhost:{}/".format(self.mock_server_port)
+		self.netloc = "localhost:{}".format(self.mock_server_port)
+
+	def tearDown(self):
+		self.mock_server.shutdown()
+		self.mock_server_thread.join()
+		self.wg = None
+
+	def test_rate_limit(self):
+		self.routes.set("localhost", DomainPolicy(rate_limit=20))
+		self.assertEqual(self.wg.getpage(self.url), "Root OK?")
+		self.assertEqual(self.wg.host_scheduler.stats()[self.netloc]['rate'], 20)
+
+		# Reloads are picked up
+		self.routes.set("localhost", DomainPolicy(rate_limit=50))
+		self.wg.getpage(self.url)
+		self.assertEqual(self.wg.host_scheduler.stats()[self.netloc]['rate'], 50)
+
+		self.routes.remove("localhost")
+		self.wg.getpage(self.url)
+		self.assertEqual(self.wg.host_scheduler.stats()[self.netloc]['rate'], self.wg.host_scheduler.rate)
+
+	def test_rate_limit_eviction(self):
+		self.wg.host_scheduler.idle_timeout = 0.1
+		self.routes.set("localhost", DomainPolicy(rate_limit=20))
+		self.wg.getpage(self.url)
+		self.assertEqual(self.wg.host_scheduler.host_limits(self.netloc), (20, None, True))
+
+		# Once the host has gone idle, the scheduler forgets it, and the limits are
+		# applied again on the next request.
+		time.sleep(0.15)
+		with self.wg.host_scheduler.slot("http://www.example.org/"):
+			pass
+		self.assertNotIn(self.netloc, self.wg.host_scheduler.stats())
+		self.assertIsNone(self.wg.host_scheduler.host_limits(self.netloc))
+
+		self.wg.getpage(self.url)
+		self.assertEqual(self.wg.host_scheduler.stats()[self.netloc]['rate'], 20)
+
+	def set_cookie(self, name, domain):
+		self.wg.cj.set_cookie(http.cookiejar.Cookie(0, name, "value", None, False,
+			domain, True, False, "/", False, False, int(time.time()) + 3600, False, None, None, {}))
+
+	def test_required_cookies(self):
+		# The cookie jar is persisted between tests, so use a cookie name no other run has set.
+		name = "route_test_%s_" % uuid.uuid4().hex
+		self.routes.set("localhost", DomainPolicy(waf=WAF_SUCURI, cookies=[name]))
+		with self.assertRaises(WebRequest.SucuriWrapper):
+			self.wg.getpage(self.url)
+
+		self.set_cookie(name + "1234", "notlocalhost")
+		with self.assertRaises(WebRequest.SucuriWrapper):
+			self.wg.getpage(self.url)
+
+		self.set_cookie(name + "1234", "localhost")
+		self.assertEqual(self.wg.getpage(self.url), "Root OK?")
+
+	def test_transport(self):
+		self.wg.getItemChromium = lambda url: ("Chromium OK?", "index.html", "text/html")
+		self.routes.set("localhost", DomainPolicy(transport=TRANSPORT_CHROMIUM))
+		self.assertEqual(self.wg.getpage(self.url), "Chromium OK?")
+
+		# Calls with extra arguments can't be rerouted
+		self.assertEqual(self.wg.getpage(self.url, addlHeaders={'Referer' : self.url}), "Root OK?")
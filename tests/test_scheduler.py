@@ -0,0 +1,151 @@
+import unittest
+import time
+import email.utils
+import threading
+
+import WebRequest
+from WebRequest import HostScheduler
+from . import testing_server
+
+
+class TestRetryAfterParse(unittest.TestCase):
+	def test_seconds(self):
+		self.assertEqual(HostScheduler.parse_retry_after("120"), 120)
+		self.assertEqual(HostScheduler.parse_retry_after(" 5 "), 5)
+
+	def test_date(self):
+		when = email.utils.formatdate(time.time() + 60, usegmt=True)
+		delay = HostScheduler.parse_retry_after(when)
+		self.assertTrue(55 < delay <= 60, delay)
+
+		when = email.utils.formatdate(time.time() - 60, usegmt=True)
+		self.assertEqual(HostScheduler.parse_retry_after(when), 0)
+
+	def test_garbage(self):
+		self.assertEqual(HostScheduler.parse_retry_after(None), None)
+		self.assertEqual(HostScheduler.parse_retry_after(""), None)
+		self.assertEqual(HostScheduler.parse_retry_after("lolwat"), None)
+
+
+class TestHostScheduler(unittest.TestCase):
+	def test_unlimited(self):
+		sched = HostScheduler.HostScheduler()
+		start = time.monotonic()
+		for _ in range(100):
+			with sched.slot("http://www.example.org/"):
+				pass
+		self.assertLess(time.monotonic() - start, 0.5)
+		self.assertEqual(sched.stats()['www.example.org']['requests'], 100)
+
+	def test_rate_limit(self):
+		sched = HostScheduler.HostScheduler(rate=20)
+		start = time.monotonic()
+		for _ in range(6):
+			with sched.slot("http://www.example.org/"):
+				pass
+		elapsed = time.monotonic() - start
+		self.assertGreater(elapsed, 0.2)
+
+		# Other hosts are unaffected
+		start = time.monotonic()
+		with sched.slot("http://www.example.com/"):
+			pass
+		self.assertLess(time.monotonic() - start, 0.05)
+
+		stats = sched.stats()
+		self.assertGreater(stats['www.example.org']['total_wait'], 0.2)
+
+	def test_max_in_flight(self):
+		sched = HostScheduler.HostScheduler(max_in_flight=2)
+		peak = []
+		active = [0]
+		lock = threading.Lock()
+
+		def worker():
+			with sched.slot("http://www.example.org/"):
+				with lock:
+					active[0] += 1
+					peak.append(active[0])
+				time.sleep(0.02)
+				with lock:
+					active[0] -= 1
+
+		threads = [threading.Thread(target=worker) for _ in range(8)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+
+		self.assertEqual(max(peak), 2)
+
+	def test_throttle_retry_after(self):
+		sched = HostScheduler.HostScheduler()
+		sched.throttle("http://www.example.org/", "0.2")
+		start = time.monotonic()
+		with sched.slot("http://www.example.org/"):
+			pass
+		self.assertGreater(time.monotonic() - start, 0.15)
+		self.assertEqual(sched.stats()['www.example.org']['throttled'], 1)
+
+	def test_throttle_backoff(self):
+		sched = HostScheduler.HostScheduler(rate=10)
+		sched.throttle("http://www.example.org/")
+		self.assertEqual(sched.stats()['www.example.org']['rate'], 5)
+
+		for _ in range(20):
+			sched.success("http://www.example.org/")
+		self.assertEqual(sched.stats()['www.example.org']['rate'], 10)
+
+	def test_default_cap(self):
+		sched = HostScheduler.HostScheduler()
+		sched.throttle("http://www.example.org/", "3600")
+		self.assertLessEqual(sched.ready_in("http://www.example.org/"), 120)
+
+	def test_idle_eviction(self):
+		sched = HostScheduler.HostScheduler(rate=100, burst=2, idle_timeout=0.1)
+		sched.set_host_limits("www.example.net", rate=50)
+		sched.set_host_limits("www.example.com", rate=40, evictable=True)
+		for host in ("www.example.org", "www.example.net", "www.example.com"):
+			with sched.slot("http://%s/" % host):
+				pass
+		busy = sched.acquire("http://www.example.info/")
+		sched.throttle("http://www.example.edu/", "60")
+
+		time.sleep(0.15)
+		with sched.slot("http://www.example.biz/"):
+			pass
+		# Idle hosts are gone, but not ones with requests in flight, or holding us off.
+		self.assertEqual(set(sched.stats()), {"www.example.info", "www.example.edu", "www.example.biz"})
+		self.assertEqual(sched.host_limits("www.example.net"), (50, None, False))
+		self.assertIsNone(sched.host_limits("www.example.com"))
+		sched.release(busy)
+
+
+class TestSchedulerFetch(unittest.TestCase):
+	def setUp(self):
+		self.wg = WebRequest.WebGetRobust()
+		self.mock_server_port, self.mock_server, self.mock_server_thread = testing_server.start_server(self, self.wg)
+
+	def tearDown(self):
+		self.mock_server.shutdown()
+		self.mock_server_thread.join()
+		self.wg = None
+
+	def test_retry_after(self):
+		start = time.monotonic()
+		page = self.wg.getpage("http://localhost:{}/rate-limit/retry-after".format(self.mock_server_port), retryQuantity=2)
+		self.assertEqual(page, 'Rate limit OK?')
+		self.assertGreater(time.monotonic() - start, 0.9)
+
+		stats = self.wg.getHostSchedulerStats()
+		self.assertEqual(stats["localhost:{}".format(self.mock_server_port)]['throttled'], 1)
+		self.assertEqual(stats["localhost:{}".format(self.mock_server_port)]['requests'], 2)
+
+	def test_retry_after_deadline(self):
+		# A long Retry-After doesn't hold the fetch past it's deadline.
+		url = "http://localhost:{}/".format(self.mock_server_port)
+		self.wg.host_scheduler.throttle(url, "60")
+		start = time.monotonic()
+		with self.assertRaises(WebRequest.FetchTimeoutError):
+			self.wg.getpage(url, total_timeout=0.5)
+		self.assertLess(time.monotonic() - start, 2)
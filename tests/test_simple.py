@@ -280,6 +280,31 @@ class TestSimpleFetch(unittest.TestCase):
 		self.assertEqual(fileN_3, 'path-only.txt')
 		self.assertEqual(mType_3, None)
 
+	def test_getpages_1(self):
+		urls = [
+			"http://localhost:{}".format(self.mock_server_port),
+			"http://localhost:{}/compressed/gzip".format(self.mock_server_port),
+			"http://localhost:{}/redirect/from-1".format(self.mock_server_port),
+			"http://localhost:{}/favicon.ico".format(self.mock_server_port),
+		]
+		results = dict(self.wg.getpages(urls * 3, concurrency=4))
+
+		self.assertEqual(results[urls[0]], 'Root OK?')
+		self.assertEqual(results[urls[1]], 'Root OK?')
+		self.assertEqual(results[urls[2]], b"Redirect-To-1")
+		self.assertIsInstance(results[urls[3]], WebRequest.FetchFailureError)
+
+	def test_getpages_2(self):
+		# The generator should consume the input lazily.
+		def url_gen():
+			for _ in range(20):
+				yield "http://localhost:{}".format(self.mock_server_port)
+
+		fetched = self.wg.getpages(url_gen(), concurrency=2, addlHeaders={"Referer" : 'http://www.example.org'})
+		url, page = next(fetched)
+		self.assertEqual(page, 'Root OK?')
+		fetched.close()
+
 	def test_get_cookies_1(self):
 		inurl_1 = "http://localhost:{}/cookie_test".format(self.mock_server_port)
 		inurl_2 = "http://localhost:{}/cookie_require".format(self.mock_server_port)
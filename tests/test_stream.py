@@ -0,0 +1,363 @@
+import unittest
+import os
+import zlib
+import gzip
+import asyncio
+import hashlib
+import tempfile
+
+import WebRequest
+from WebRequest import Decompressors
+from . import testing_server
+
+
+def feed(decoder, data, chunk=7):
+	out = [decoder.decompress(data[idx:idx+chunk]) for idx in range(0, len(data), chunk)]
+	out.append(decoder.flush())
+	return b"".join(out)
+
+
+class TestDecompressors(unittest.TestCase):
+	def test_gzip(self):
+		data = b"Oh hai! " * 1000
+		self.assertEqual(feed(Decompressors.get_decompressor("gzip"), gzip.compress(data)), data)
+
+	def test_gzip_multi_member(self):
+		data = gzip.compress(b"First member. ") + gzip.compress(b"Second member.")
+		self.assertEqual(feed(Decompressors.get_decompressor("gzip"), data), b"First member. Second member.")
+
+	def test_deflate_variants(self):
+		data = b"Oh hai! " * 1000
+
+		raw = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+		self.assertEqual(feed(Decompressors.get_decompressor("deflate"), raw.compress(data) + raw.flush()), data)
+		self.assertEqual(feed(Decompressors.get_decompressor("deflate"), zlib.compress(data)), data)
+		self.assertEqual(feed(Decompressors.get_decompressor("deflate"), gzip.compress(data)), data)
+
+		# Stream split right after the first byte
+		self.assertEqual(feed(Decompressors.get_decompressor("deflate"), zlib.compress(data), chunk=1), data)
+
+	def test_deflate_wbits_memo(self):
+		data = b"Oh hai! " * 1000
+		memo = Decompressors.DeflateWbitsMemo()
+
+		raw = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+		raw = raw.compress(data) + raw.flush()
+		self.assertEqual(memo.decompress("www.example.org", raw), data)
+		self.assertEqual(memo.decompress("www.example.org", raw), data)
+		self.assertEqual(memo.decompress("www.example.com", zlib.compress(data)), data)
+
+		stats = memo.stats()
+		self.assertEqual(stats['sniff_hits'], 2)
+		self.assertEqual(stats['memo_hits'], 1)
+		self.assertEqual(stats['fallback_attempts'], 0)
+
+		# The header sniffing gets this one wrong, but the memo doesn't.
+		self.assertEqual(memo.decompress("www.example.net", testing_server.AMBIGUOUS_DEFLATE), b"Ambiguous deflate stream OK?!")
+		self.assertEqual(memo.get("www.example.net"), -zlib.MAX_WBITS)
+		self.assertEqual(memo.decompress("www.example.net", testing_server.AMBIGUOUS_DEFLATE), b"Ambiguous deflate stream OK?!")
+
+		stats = memo.stats()
+		self.assertEqual(stats['fallbacks'], 1)
+		self.assertEqual(stats['fallback_attempts'], 1)
+		self.assertEqual(stats['memo_hits'], 2)
+
+		with self.assertRaises(zlib.error):
+			memo.decompress("www.example.org", b"Not deflated at all")
+		self.assertEqual(memo.stats()['failures'], 1)
+
+	def test_deflate_fallback(self):
+		# The header sniffing gets this one wrong, so the decoder has to fall back, wherever the chunks split.
+		for chunk in (1, 2, 7, 100):
+			self.assertEqual(feed(Decompressors.get_decompressor("deflate"), testing_server.AMBIGUOUS_DEFLATE, chunk=chunk), b"Ambiguous deflate stream OK?!")
+
+		memo = Decompressors.DeflateWbitsMemo()
+		decoder = Decompressors.DeflateDecoder(memo=memo, netloc="www.example.net")
+		self.assertEqual(feed(decoder, testing_server.AMBIGUOUS_DEFLATE), b"Ambiguous deflate stream OK?!")
+		self.assertEqual(memo.get("www.example.net"), -zlib.MAX_WBITS)
+
+		decoder = Decompressors.DeflateDecoder(memo=memo, netloc="www.example.net")
+		self.assertEqual(feed(decoder, testing_server.AMBIGUOUS_DEFLATE), b"Ambiguous deflate stream OK?!")
+		stats = memo.stats()
+		self.assertEqual(stats['fallbacks'], 1)
+		self.assertEqual(stats['memo_hits'], 1)
+
+		with self.assertRaises(WebRequest.ContentTypeError):
+			feed(Decompressors.DeflateDecoder(memo=memo), b"Not deflated at all")
+		self.assertEqual(memo.stats()['failures'], 1)
+
+	def test_identity(self):
+		self.assertEqual(feed(Decompressors.get_decompressor(None), b"Oh hai!"), b"Oh hai!")
+		self.assertEqual(feed(Decompressors.get_decompressor("identity"), b"Oh hai!"), b"Oh hai!")
+
+	def test_unknown(self):
+		with self.assertRaises(WebRequest.ContentTypeError):
+			Decompressors.get_decompressor("sdch")
+
+	@unittest.skipUnless(Decompressors.HAVE_BROTLI, "brotli not installed")
+	def test_brotli(self):
+		data = b"Oh hai! " * 1000
+		self.assertEqual(feed(Decompressors.get_decompressor("br"), testing_server.compress_body("br", data)), data)
+		with self.assertRaises(WebRequest.ContentTypeError):
+			feed(Decompressors.get_decompressor("br"), b"Not brotli at all")
+
+	@unittest.skipUnless(Decompressors.HAVE_ZSTD, "zstandard not installed")
+	def test_zstd(self):
+		data = b"Oh hai! " * 1000
+		self.assertEqual(feed(Decompressors.get_decompressor("zstd"), testing_server.compress_body("zstd", data)), data)
+
+		frames = testing_server.compress_body("zstd", b"First frame. ") + testing_server.compress_body("zstd", b"Second frame.")
+		self.assertEqual(feed(Decompressors.get_decompressor("zstd"), frames), b"First frame. Second frame.")
+
+
+class TestStreamFetch(unittest.TestCase):
+	def setUp(self):
+		self.wg = WebRequest.WebGetRobust()
+		self.mock_server_port, self.mock_server, self.mock_server_thread = testing_server.start_server(self, self.wg)
+
+	def tearDown(self):
+		self.mock_server.shutdown()
+		self.mock_server_thread.join()
+		self.wg = None
+
+	def test_stream_plain(self):
+		chunks = list(self.wg.getpage_stream("http://localhost:{}".format(self.mock_server_port)))
+		self.assertEqual(b"".join(chunks), b'Root OK?')
+
+	def test_stream_compressed(self):
+		for path in ("/compressed/gzip", "/compressed/x-gzip", "/compressed/deflate", "/compressed/unknown-coding"):
+			chunks = list(self.wg.getpage_stream("http://localhost:{}{}".format(self.mock_server_port, path)))
+			self.assertEqual(b"".join(chunks), b'Root OK?')
+			# The buffered path decodes it the same way.
+			self.assertEqual(self.wg.getpage("http://localhost:{}{}".format(self.mock_server_port, path)), 'Root OK?')
+
+	def test_deflate_memo(self):
+		url = "http://localhost:{}/compressed/deflate-ambiguous".format(self.mock_server_port)
+		for _ in range(3):
+			self.assertEqual(self.wg.getpage(url), "Ambiguous deflate stream OK?!")
+
+		stats = self.wg.getDeflateStats()
+		self.assertEqual(stats['decodes'], 3)
+		self.assertEqual(stats['fallbacks'], 1)
+		self.assertEqual(stats['memo_hits'], 2)
+
+		# The streaming decoder uses the memoized wbits too.
+		self.assertEqual(b"".join(self.wg.getpage_stream(url)), b"Ambiguous deflate stream OK?!")
+		self.assertEqual(self.wg.getDeflateStats()['memo_hits'], 3)
+
+		# And so does the size-limited path.
+		self.assertEqual(self.wg.getpage(url, max_decompressed_bytes=2 ** 20), "Ambiguous deflate stream OK?!")
+		self.assertEqual(self.wg.getDeflateStats()['memo_hits'], 4)
+
+	def test_stream_large(self):
+		for path in ("/compressed/large-gzip", "/compressed/large-deflate"):
+			progress = []
+			stream = self.wg.getpage_stream("http://localhost:{}{}".format(self.mock_server_port, path),
+				chunkSize=4096, callBack=lambda sofar, chunk, total: progress.append(sofar))
+			chunks = list(stream)
+			self.assertEqual(b"".join(chunks), testing_server.LARGE_CONTENT)
+			self.assertGreater(len(chunks), 1)
+			self.assertGreater(len(progress), 1)
+			self.assertEqual(progress, sorted(progress))
+
+	def test_stream_max_bytes(self):
+		stream = self.wg.getpage_stream("http://localhost:{}/compressed/large-gzip".format(self.mock_server_port),
+			max_bytes=100000)
+		received = []
+		with self.assertRaises(WebRequest.ContentTooLargeError) as ctx:
+			for chunk in stream:
+				received.append(chunk)
+
+		self.assertLessEqual(sum(len(tmp) for tmp in received), 100000)
+		self.assertEqual(ctx.exception.limit, 100000)
+		self.assertGreater(ctx.exception.size, 100000)
+		self.assertEqual(ctx.exception.headers['Content-Encoding'], 'gzip')
+
+	def test_stream_not_found(self):
+		with self.assertRaises(WebRequest.FetchFailureError):
+			self.wg.getpage_stream("http://localhost:{}/favicon.ico".format(self.mock_server_port))
+
+	def test_stream_bad_args(self):
+		with self.assertRaises(WebRequest.ArgumentError):
+			self.wg.getpage_stream("http://localhost:{}".format(self.mock_server_port), returnMultiple=True)
+
+	def test_chunked_read_callback(self):
+		progress = []
+		page = self.wg.getpage("http://localhost:{}/compressed/large-gzip".format(self.mock_server_port),
+			callBack=lambda sofar, chunk, total: progress.append(sofar))
+		self.assertEqual(page, testing_server.LARGE_CONTENT)
+		self.assertGreater(len(progress), 0)
+
+
+class TestSizeLimits(unittest.TestCase):
+	def setUp(self):
+		self.wg = WebRequest.WebGetRobust(max_decompressed_bytes=2 ** 22)
+		self.mock_server_port, self.mock_server, self.mock_server_thread = testing_server.start_server(self, self.wg)
+
+	def tearDown(self):
+		self.mock_server.shutdown()
+		self.mock_server_thread.join()
+		self.wg = None
+
+	def fetch(self, path, **kwargs):
+		return self.wg.getpage("http://localhost:{}{}".format(self.mock_server_port, path), **kwargs)
+
+	def test_within_limits(self):
+		self.assertEqual(self.fetch("/compressed/large-gzip", max_content_bytes=2 ** 22), testing_server.LARGE_CONTENT)
+		self.assertEqual(self.fetch("/compressed/gzip"), "Root OK?")
+		self.assertEqual(self.fetch("/compressed/x-gzip"), "Root OK?")
+
+	def test_unknown_coding(self):
+		self.assertEqual(self.fetch("/compressed/unknown-coding"), "Root OK?")
+
+	def test_content_length(self):
+		# Refused on the headers alone.
+		with self.assertRaises(WebRequest.ContentTooLargeError) as ctx:
+			self.fetch("/large-file", max_content_bytes=1000)
+		self.assertEqual(ctx.exception.limit, 1000)
+		self.assertEqual(ctx.exception.size, len(testing_server.LARGE_CONTENT))
+		self.assertEqual(ctx.exception.headers['Content-Length'], str(len(testing_server.LARGE_CONTENT)))
+
+	def test_raw_limit(self):
+		# No Content-Length, so this has to be caught while reading.
+		with self.assertRaises(WebRequest.ContentTooLargeError) as ctx:
+			self.fetch("/compressed/large-gzip", max_content_bytes=10000)
+		self.assertEqual(ctx.exception.limit, 10000)
+		self.assertGreater(ctx.exception.size, 10000)
+		self.assertEqual(ctx.exception.headers['Content-Encoding'], 'gzip')
+
+	def test_decompression_bomb(self):
+		with self.assertRaises(WebRequest.ContentTooLargeError) as ctx:
+			self.fetch("/compressed/bomb")
+		self.assertEqual(ctx.exception.limit, 2 ** 22)
+		# Aborted shortly after going over, rather then after inflating the whole thing.
+		self.assertLess(ctx.exception.size, 2 ** 23)
+
+	def test_per_call_override(self):
+		with self.assertRaises(WebRequest.ContentTooLargeError):
+			self.fetch("/compressed/large-gzip", max_decompressed_bytes=100000)
+
+		self.assertEqual(len(self.fetch("/compressed/bomb", max_decompressed_bytes=2 ** 25)), 2 ** 24)
+
+
+class TestAsyncSizeLimits(TestSizeLimits):
+	def setUp(self):
+		self.wg = WebRequest.AsyncWebGetRobust(max_decompressed_bytes=2 ** 22)
+		self.mock_server_port, self.mock_server, self.mock_server_thread = testing_server.start_server(self, self.wg)
+		self.loop = asyncio.new_event_loop()
+
+	def tearDown(self):
+		self.loop.close()
+		super().tearDown()
+
+	def fetch(self, path, **kwargs):
+		return self.loop.run_until_complete(self.wg.getpage("http://localhost:{}{}".format(self.mock_server_port, path), **kwargs))
+
+
+@unittest.skipUnless(Decompressors.HAVE_BROTLI and Decompressors.HAVE_ZSTD, "brotli/zstandard not installed")
+class TestModernEncodings(unittest.TestCase):
+	def setUp(self):
+		self.wg = WebRequest.WebGetRobust(modern_encodings=True)
+		self.mock_server_port, self.mock_server, self.mock_server_thread = testing_server.start_server(self, self.wg)
+
+	def tearDown(self):
+		self.mock_server.shutdown()
+		self.mock_server_thread.join()
+		self.wg = None
+
+	def url(self, path):
+		return "http://localhost:{}{}".format(self.mock_server_port, path)
+
+	def test_accept_encoding(self):
+		self.assertIn("br", dict(self.wg.browserHeaders)['Accept-Encoding'])
+		self.assertNotIn("sdch", dict(WebRequest.WebGetRobust().browserHeaders)['Accept-Encoding'])
+
+	def test_fetch(self):
+		for codec in ("br", "zstd"):
+			self.assertEqual(self.wg.getpage(self.url("/compressed/%s" % codec)), 'Root OK?')
+			self.assertEqual(self.wg.getpage(self.url("/compressed/large-%s" % codec)), testing_server.LARGE_CONTENT)
+
+	def test_stream(self):
+		for codec in ("br", "zstd"):
+			chunks = list(self.wg.getpage_stream(self.url("/compressed/large-%s" % codec), chunkSize=4096))
+			self.assertEqual(b"".join(chunks), testing_server.LARGE_CONTENT)
+
+	def test_error_body(self):
+		for codec in ("br", "zstd"):
+			with self.assertRaises(WebRequest.FetchFailureError) as ctx:
+				self.wg.getpage(self.url("/compressed/%s/404" % codec))
+			self.assertEqual(ctx.exception.err_code, 404)
+			self.assertEqual(ctx.exception.err_content, b"Not here!")
+
+	def test_async(self):
+		wg = WebRequest.AsyncWebGetRobust(custom_ua=self.wg.browserHeaders)
+
+		async def fetch():
+			return [await wg.getpage(self.url("/compressed/%s" % codec)) for codec in ("br", "zstd")]
+
+		loop = asyncio.new_event_loop()
+		try:
+			self.assertEqual(loop.run_until_complete(fetch()), ['Root OK?', 'Root OK?'])
+		finally:
+			loop.close()
+
+
+class TestDownloadTo(unittest.TestCase):
+	def setUp(self):
+		self.wg = WebRequest.WebGetRobust()
+		self.mock_server_port, self.mock_server, self.mock_server_thread = testing_server.start_server(self, self.wg)
+		self.tmpdir = tempfile.TemporaryDirectory()
+
+	def tearDown(self):
+		self.mock_server.shutdown()
+		self.mock_server_thread.join()
+		self.tmpdir.cleanup()
+		self.wg = None
+
+	def test_download_to_file(self):
+		target = os.path.join(self.tmpdir.name, "out.bin")
+		path, fn, mimet, url, digest = self.wg.download_to("http://localhost:{}/large-file".format(self.mock_server_port), target)
+		self.assertEqual(path, target)
+		self.assertEqual(fn, 'large-file')
+		self.assertEqual(mimet, 'application/octet-stream')
+		self.assertEqual(digest, hashlib.sha256(testing_server.LARGE_CONTENT).hexdigest())
+		with open(target, "rb") as fp:
+			self.assertEqual(fp.read(), testing_server.LARGE_CONTENT)
+		self.assertEqual(os.listdir(self.tmpdir.name), ["out.bin"])
+
+	def test_download_to_dir(self):
+		path, fn, mimet, url, digest = self.wg.download_to("http://localhost:{}/large-file/dispo".format(self.mock_server_port), self.tmpdir.name)
+		self.assertEqual(fn, 'large file.txt')
+		self.assertEqual(path, os.path.join(self.tmpdir.name, 'large file.txt'))
+		self.assertEqual(os.listdir(self.tmpdir.name), ['large file.txt'])
+
+	def test_download_compressed(self):
+		target = os.path.join(self.tmpdir.name, "out.bin")
+		_, _, _, _, digest = self.wg.download_to("http://localhost:{}/compressed/large-gzip".format(self.mock_server_port), target)
+		self.assertEqual(digest, hashlib.sha256(testing_server.LARGE_CONTENT).hexdigest())
+
+	def test_download_resume(self):
+		target = os.path.join(self.tmpdir.name, "out.bin")
+		url = "http://localhost:{}/large-file/flaky".format(self.mock_server_port)
+		with self.assertRaises(WebRequest.FetchFailureError):
+			self.wg.download_to(url, target)
+
+		self.assertFalse(os.path.exists(target))
+		partial = os.path.getsize(target + ".part")
+		self.assertGreater(partial, 0)
+
+		progress = []
+		_, _, _, _, digest = self.wg.download_to(url, target, callBack=lambda sofar, chunk, total: progress.append((sofar, total)))
+		self.assertEqual(digest, hashlib.sha256(testing_server.LARGE_CONTENT).hexdigest())
+		with open(target, "rb") as fp:
+			self.assertEqual(fp.read(), testing_server.LARGE_CONTENT)
+
+		# Only the remainder was transferred.
+		self.assertEqual(progress[-1], (len(testing_server.LARGE_CONTENT) - partial, len(testing_server.LARGE_CONTENT) - partial))
+		self.assertEqual(os.listdir(self.tmpdir.name), ["out.bin"])
+
+	def test_download_max_bytes(self):
+		target = os.path.join(self.tmpdir.name, "out.bin")
+		with self.assertRaises(WebRequest.ContentTooLargeError):
+			self.wg.download_to("http://localhost:{}/large-file".format(self.mock_server_port), target, max_bytes=1000)
+		self.assertEqual(os.listdir(self.tmpdir.name), [])
@@ -0,0 +1,151 @@
+import unittest
+import time
+import socket
+from http.server import HTTPServer
+from threading import Thread
+
+import WebRequest
+from WebRequest.Deadline import Deadline
+from . import testing_server
+from .test_async import run
+from .test_pool import KeepAliveHandler
+
+
+class TestDeadline(unittest.TestCase):
+	def test_clamp(self):
+		deadline = Deadline(10, "http://www.example.org/")
+		self.assertEqual(deadline.clamp(1), 1)
+		self.assertLessEqual(deadline.clamp(30), 10)
+		self.assertLessEqual(deadline.clamp(), 10)
+		self.assertFalse(deadline.expired())
+
+	def test_expired(self):
+		deadline = Deadline(0, "http://www.example.org/")
+		self.assertTrue(deadline.expired())
+		with self.assertRaises(WebRequest.FetchTimeoutError) as ctx:
+			deadline.clamp(5)
+		self.assertEqual(ctx.exception.url, "http://www.example.org/")
+		self.assertEqual(ctx.exception.timeout, 0)
+
+		# It's still a fetch failure, as far as older callers are concerned.
+		with self.assertRaises(WebRequest.FetchFailureError):
+			deadline.check()
+
+	def test_no_global_timeout(self):
+		before = socket.getdefaulttimeout()
+		WebRequest.WebGetRobust()
+		self.assertEqual(socket.getdefaulttimeout(), before)
+
+
+class TestTimeouts(unittest.TestCase):
+	def setUp(self):
+		self.wg = WebRequest.WebGetRobust()
+		self.mock_server_port, self.mock_server, self.mock_server_thread = testing_server.start_server(self, self.wg, threaded=True)
+
+	def tearDown(self):
+		self.mock_server.shutdown()
+		self.mock_server_thread.join()
+		self.wg = None
+
+	def url(self, path):
+		return "http://localhost:{}{}".format(self.mock_server_port, path)
+
+	def test_read_timeout(self):
+		self.wg.read_timeout = 0.5
+		with self.assertRaises(WebRequest.FetchFailureError) as ctx:
+			self.wg.getpage(self.url("/slow/headers"))
+		self.assertNotIsInstance(ctx.exception, WebRequest.FetchTimeoutError)
+
+		# The connect timeout doesn't apply once we're connected.
+		self.wg.read_timeout = 5
+		self.wg.connect_timeout = 0.5
+		self.assertEqual(self.wg.getpage(self.url("/slow/headers")), "Slow headers OK?")
+
+	def test_slow_drip(self):
+		# Every byte comes in well within the read timeout, but the whole thing takes 4 seconds.
+		start = time.monotonic()
+		with self.assertRaises(WebRequest.FetchTimeoutError):
+			self.wg.getpage(self.url("/slow/drip"), total_timeout=1)
+		self.assertLess(time.monotonic() - start, 2)
+
+		self.assertEqual(self.wg.getpage(self.url("/slow/drip"), total_timeout=10), "Drip OK?" * 5)
+
+	def test_covers_retries(self):
+		self.wg.read_timeout = 0.5
+		start = time.monotonic()
+		with self.assertRaises(WebRequest.FetchTimeoutError):
+			self.wg.getpage(self.url("/slow/headers"), retryQuantity=10, total_timeout=1.5)
+		self.assertLess(time.monotonic() - start, 2.5)
+
+	def test_covers_redirects(self):
+		self.wg.total_timeout = 1
+		start = time.monotonic()
+		with self.assertRaises(WebRequest.FetchTimeoutError):
+			self.wg.getpage(self.url("/slow/redirect"))
+		self.assertLess(time.monotonic() - start, 2)
+
+	def test_covers_waf_step_through(self):
+		calls = []
+		def slow_step_through(url):
+			calls.append(url)
+			time.sleep(1)
+			return True
+		self.wg.stepThroughCloudFlareWaf = slow_step_through
+
+		# The step-through itself can't be interrupted, but the page isn't fetched again afterwards.
+		with self.assertRaises(WebRequest.FetchTimeoutError):
+			self.wg.getpage(self.url("/cloudflare_under_attack_shit"), total_timeout=0.5)
+		self.assertEqual(calls, [self.url("/cloudflare_under_attack_shit")])
+
+
+class TestDeadlineKeepAlive(unittest.TestCase):
+	def setUp(self):
+		self.port = testing_server.get_free_port()
+		self.server = HTTPServer(('localhost', self.port), KeepAliveHandler)
+		self.server_thread = Thread(target=self.server.serve_forever, daemon=True)
+		self.server_thread.start()
+
+	def tearDown(self):
+		self.server.shutdown()
+		self.server.server_close()
+		self.server_thread.join()
+
+	def test_connection_reuse(self):
+		# Reading with a deadline still hands the connection back to the pool.
+		wg = WebRequest.WebGetRobust(total_timeout=10)
+		url = "http://localhost:{}/".format(self.port)
+
+		pages = [wg.getpage(url) for _ in range(3)]
+		self.assertEqual(len(set(pages)), 1)
+		self.assertEqual(wg.getPoolStats()['hits'], 2)
+
+
+class TestAsyncTimeouts(unittest.TestCase):
+	def setUp(self):
+		self.wg = WebRequest.AsyncWebGetRobust()
+		self.mock_server_port, self.mock_server, self.mock_server_thread = testing_server.start_server(self, self.wg, threaded=True)
+
+	def tearDown(self):
+		self.mock_server.shutdown()
+		self.mock_server_thread.join()
+		self.wg = None
+
+	def url(self, path):
+		return "http://localhost:{}{}".format(self.mock_server_port, path)
+
+	def test_slow_drip(self):
+		start = time.monotonic()
+		with self.assertRaises(WebRequest.FetchTimeoutError):
+			run(self.wg.getpage(self.url("/slow/drip"), total_timeout=1))
+		self.assertLess(time.monotonic() - start, 2)
+
+	def test_redirect(self):
+		self.wg.total_timeout = 1
+		with self.assertRaises(WebRequest.FetchTimeoutError):
+			run(self.wg.getpage(self.url("/slow/redirect")))
+
+	def test_read_timeout(self):
+		self.wg.read_timeout = 0.5
+		with self.assertRaises(WebRequest.FetchFailureError) as ctx:
+			run(self.wg.getpage(self.url("/slow/headers")))
+		self.assertNotIsInstance(ctx.exception, WebRequest.FetchTimeoutError)
@@ -0,0 +1,170 @@
+import unittest
+import os
+import time
+import tempfile
+
+import WebRequest
+from WebRequest.FetchTiming import FetchTiming
+from WebRequest.ResponseMemo import ResponseMemo
+from . import testing_server
+from .test_async import run
+
+
+class TestFetchTiming(unittest.TestCase):
+	def test_phases(self):
+		timing = FetchTiming("http://www.example.org/")
+		timing.add('download', 0.5)
+		timing.add('dns', 0.25)
+		timing.add('download', 0.5)
+		with timing.phase('parse'):
+			time.sleep(0.01)
+
+		self.assertEqual(timing.get('download'), 1.0)
+		self.assertEqual(timing.get('tls'), 0)
+		self.assertGreaterEqual(timing.get('parse'), 0.01)
+
+		timing.attempts = 3
+		timing.finish()
+		ret = timing.as_dict()
+		self.assertEqual(list(ret['phases']), ['dns', 'download', 'parse'])
+		self.assertEqual(ret['retries'], 2)
+		self.assertGreater(ret['total'], 0)
+
+
+class TestTimedFetch(unittest.TestCase):
+	def setUp(self):
+		self.timings = []
+		self.wg = WebRequest.WebGetRobust(timing_listeners=[self.timings.append])
+		self.mock_server_port, self.mock_server, self.mock_server_thread = testing_server.start_server(self, self.wg)
+
+	def tearDown(self):
+		self.mock_server.shutdown()
+		self.mock_server_thread.join()
+		self.wg = None
+
+	def url(self, path):
+		return "http://localhost:{}{}".format(self.mock_server_port, path)
+
+	def test_getpage(self):
+		page, timing = self.wg.getpage(self.url("/compressed/gzip"), returnTiming=True)
+		self.assertEqual(page, "Root OK?")
+		self.assertEqual(self.timings, [timing])
+
+		self.assertEqual(timing.transport, "urllib")
+		self.assertEqual(timing.status, 200)
+		self.assertEqual(timing.attempts, 1)
+		self.assertEqual(timing.content_bytes, len(b"Root OK?"))
+		self.assertGreater(timing.wire_bytes, 0)
+		self.assertNotEqual(timing.wire_bytes, timing.content_bytes)
+		for phase in ('dns', 'connect', 'ttfb', 'download', 'decompress', 'waf_check', 'decode'):
+			self.assertIn(phase, timing.phases)
+		self.assertNotIn('tls', timing.phases)
+		self.assertLessEqual(sum(timing.phases.values()), timing.total)
+
+	def test_stream(self):
+		stream = self.wg.getpage_stream(self.url("/compressed/large-gzip"), chunkSize=4096)
+		# Not reported until the body has been read.
+		self.assertEqual(self.timings, [])
+		self.assertEqual(b"".join(stream), testing_server.LARGE_CONTENT)
+
+		timing, = self.timings
+		self.assertEqual(timing.transport, "urllib")
+		self.assertEqual(timing.status, 200)
+		self.assertEqual(timing.content_bytes, len(testing_server.LARGE_CONTENT))
+		self.assertGreater(timing.wire_bytes, 0)
+		self.assertLess(timing.wire_bytes, timing.content_bytes)
+		self.assertIsNone(timing.error)
+
+	def test_stream_failure(self):
+		stream = self.wg.getpage_stream(self.url("/compressed/large-gzip"), max_bytes=1000)
+		with self.assertRaises(WebRequest.ContentTooLargeError):
+			list(stream)
+		timing, = self.timings
+		self.assertIsInstance(timing.error, WebRequest.ContentTooLargeError)
+
+	def test_download(self):
+		with tempfile.TemporaryDirectory() as tmpdir:
+			self.wg.download_to(self.url("/large-file"), os.path.join(tmpdir, "out.bin"))
+		timing, = self.timings
+		self.assertEqual(timing.status, 200)
+		self.assertEqual(timing.attempts, 1)
+		self.assertEqual(timing.content_bytes, len(testing_server.LARGE_CONTENT))
+		self.assertEqual(timing.wire_bytes, len(testing_server.LARGE_CONTENT))
+		self.assertIsNotNone(timing.total)
+
+	def test_return_multiple(self):
+		page, handle, timing = self.wg.getpage(self.url("/"), returnMultiple=True, returnTiming=True)
+		self.assertEqual(page, "Root OK?")
+		self.assertEqual(handle.getcode(), 200)
+		self.assertEqual(timing.status, 200)
+
+	def test_redirect(self):
+		_, timing = self.wg.getpage(self.url("/redirect/from-1"), returnTiming=True)
+		# Following the redirect isn't another attempt, but both requests are timed.
+		self.assertEqual(timing.attempts, 1)
+		self.assertGreater(timing.get('ttfb'), 0)
+
+	def test_json(self):
+		ret, timing = self.wg.getJson(self.url("/json/valid"), returnTiming=True)
+		self.assertEqual(ret, {"oh" : "hai"})
+		self.assertIn('parse', timing.phases)
+		# Only the outer call is reported.
+		self.assertEqual(self.timings, [timing])
+
+	def test_failure(self):
+		with self.assertRaises(WebRequest.FetchFailureError):
+			self.wg.getpage(self.url("/dead/500"), retryQuantity=1)
+		timing, = self.timings
+		self.assertEqual(timing.status, 500)
+		self.assertIsInstance(timing.error, WebRequest.FetchFailureError)
+		self.assertIsNotNone(timing.total)
+		self.assertEqual(timing.sent_bytes, 0)
+
+	def test_post(self):
+		# The testing server doesn't do POSTs, but the body is still sent for each attempt.
+		with self.assertRaises(WebRequest.FetchFailureError):
+			self.wg.getpage(self.url("/"), postData={"key" : "value"}, retryQuantity=2)
+		timing, = self.timings
+		self.assertEqual(timing.attempts, 2)
+		self.assertEqual(timing.sent_bytes, 2 * len(b"key=value"))
+
+	def test_listener_errors(self):
+		def broken(timing):
+			raise RuntimeError("Oh noes!")
+		self.wg.addTimingListener(broken)
+		self.assertEqual(self.wg.getpage(self.url("/")), "Root OK?")
+		self.wg.removeTimingListener(broken)
+		self.assertEqual(len(self.timings), 1)
+
+	def test_memo(self):
+		self.wg.response_memo = ResponseMemo(ttl=60)
+		self.wg.getpage(self.url("/"))
+		_, timing = self.wg.getpage(self.url("/"), returnTiming=True)
+		self.assertEqual(timing.transport, "memo")
+		self.assertEqual(timing.attempts, 0)
+
+
+class TestAsyncTimedFetch(unittest.TestCase):
+	def setUp(self):
+		self.timings = []
+		self.wg = WebRequest.AsyncWebGetRobust(timing_listeners=[self.timings.append])
+		self.mock_server_port, self.mock_server, self.mock_server_thread = testing_server.start_server(self, self.wg)
+
+	def tearDown(self):
+		self.mock_server.shutdown()
+		self.mock_server_thread.join()
+		self.wg = None
+
+	def test_getpage(self):
+		page, timing = run(self.wg.getpage("http://localhost:{}/compressed/gzip".format(self.mock_server_port), returnTiming=True))
+		self.assertEqual(page, "Root OK?")
+		self.assertEqual(self.timings, [timing])
+		self.assertEqual(timing.transport, "asyncio")
+		self.assertEqual(timing.status, 200)
+		for phase in ('dns', 'connect', 'ttfb', 'download', 'decompress', 'decode'):
+			self.assertIn(phase, timing.phases)
+
+	def test_json(self):
+		ret, timing = run(self.wg.getJson("http://localhost:{}/json/valid".format(self.mock_server_port), returnTiming=True))
+		self.assertEqual(ret, {"oh" : "hai"})
+		self.assertIn('parse', timing.phases)
@@ -0,0 +1,168 @@
+import unittest
+import threading
+
+import WebRequest
+from WebRequest.Tracing import MemoryTracer, NullTracer, Tracer, current_span
+from . import testing_server
+from .test_async import run
+
+
+class FakeTab(object):
+	def __init__(self):
+		self.cookies = []
+
+	def clear_cookies(self):
+		pass
+
+	def update_headers(self, headers):
+		pass
+
+	def set_cookie(self, cookie):
+		self.cookies.append(cookie)
+
+	def get_cookies(self):
+		return self.cookies
+
+
+class TestTracer(unittest.TestCase):
+	def test_tree(self):
+		tracer = MemoryTracer()
+		with tracer.span("outer", url="a") as outer:
+			with tracer.span("inner"):
+				pass
+			span = tracer.start_span("manual")
+			self.assertIs(current_span(), span)
+			tracer.end_span(span)
+			outer.set_attribute("done", True)
+		self.assertIsNone(current_span())
+
+		root, = tracer.roots()
+		self.assertEqual(root.name, "outer")
+		self.assertEqual(root.attributes, {"url" : "a", "done" : True})
+		self.assertEqual([span.name for span in tracer.children(root)], ["inner", "manual"])
+		self.assertGreaterEqual(root.duration, 0)
+		self.assertEqual(tracer.render_tree().split("\n")[1].split()[0], "inner")
+
+	def test_errors(self):
+		tracer = MemoryTracer()
+		with self.assertRaises(ValueError):
+			with tracer.span("broken"):
+				raise ValueError("Oh noes!")
+		span, = tracer.find("broken")
+		self.assertIsInstance(span.error, ValueError)
+
+	def test_threads(self):
+		tracer = MemoryTracer()
+		def other():
+			with tracer.span("other"):
+				pass
+		with tracer.span("outer"):
+			thread = threading.Thread(target=other)
+			thread.start()
+			thread.join()
+		# Spans in other threads don't nest under ours.
+		self.assertEqual(len(tracer.roots()), 2)
+		self.assertIsNone(tracer.find("other")[0].parent)
+
+	def test_broken_backend(self):
+		class Broken(Tracer):
+			def on_start(self, span):
+				raise RuntimeError("Oh noes!")
+		with Broken().span("fine") as span:
+			span.set_attribute("still", "fine")
+
+	def test_null(self):
+		tracer = NullTracer()
+		with tracer.span("nothing", url="a") as span:
+			span.set_attribute("status", 200)
+			self.assertIsNone(current_span())
+		tracer.end_span(tracer.start_span("nothing"))
+
+
+class TestTracedFetch(unittest.TestCase):
+	def setUp(self):
+		self.tracer = MemoryTracer()
+		self.wg = WebRequest.WebGetRobust(tracer=self.tracer)
+		self.mock_server_port, self.mock_server, self.mock_server_thread = testing_server.start_server(self, self.wg)
+
+	def tearDown(self):
+		self.mock_server.shutdown()
+		self.mock_server_thread.join()
+		self.wg = None
+
+	def url(self, path):
+		return "http://127.0.0.1:{}{}".format(self.mock_server_port, path)
+
+	def test_getpage(self):
+		self.wg.getpage(self.url("/"))
+		root, = self.tracer.roots()
+		self.assertEqual(root.name, "getpage")
+		self.assertEqual(root.attributes['status'], 200)
+		request, = self.tracer.children(root)
+		self.assertEqual(request.name, "request")
+		self.assertEqual(request.attributes, {"url" : self.url("/"), "attempt" : 1, "status" : 200})
+
+	def test_retries(self):
+		with self.assertRaises(WebRequest.FetchFailureError):
+			self.wg.getpage(self.url("/dead/500"), retryQuantity=2)
+		root, = self.tracer.roots()
+		self.assertIsInstance(root.error, WebRequest.FetchFailureError)
+		requests = self.tracer.children(root)
+		self.assertEqual([span.attributes['attempt'] for span in requests], [1, 2])
+		for span in requests:
+			self.assertEqual(span.attributes['status'], 500)
+			self.assertIsNotNone(span.error)
+
+	def test_waf_step_through(self):
+		def step_through(url, **kwargs):
+			# Stand in for chromium, getting the clearance cookie set.
+			tab = FakeTab()
+			self.wg._syncIntoChromium(tab)
+			self.wg.getpage(self.url("/cdn-cgi/l/chk_jschl?jschl_vc=427c2b1cd4fba29608ee81b200e94bfa&pass=1543827239.915-44n9IE20mS&jschl_answer=9.66734594"))
+			self.wg._syncOutOfChromium(tab)
+			return True
+		self.wg.stepThroughJsWaf_bare_chromium = step_through
+
+		page = self.wg.getpage(self.url("/cloudflare_under_attack_shit"))
+		self.assertIn("CF Redirected OK?", page)
+
+		root, = self.tracer.roots()
+		self.assertEqual(root.name, "getpage")
+		first, step, second = self.tracer.children(root)
+		self.assertEqual(first.name, "request")
+		self.assertIsInstance(first.error, WebRequest.CloudFlareWrapper)
+		self.assertEqual(step.name, "waf_step_through")
+		self.assertEqual(step.attributes['stepped'], True)
+		self.assertEqual([span.name for span in self.tracer.children(step)], ["chromium_cookie_sync_in", "getpage", "chromium_cookie_sync_out"])
+		self.assertEqual(second.name, "request")
+		self.assertEqual(second.attributes['status'], 200)
+
+
+class TestAsyncTracedFetch(unittest.TestCase):
+	def setUp(self):
+		self.tracer = MemoryTracer()
+		self.wg = WebRequest.AsyncWebGetRobust(tracer=self.tracer)
+		self.mock_server_port, self.mock_server, self.mock_server_thread = testing_server.start_server(self, self.wg)
+
+	def tearDown(self):
+		self.mock_server.shutdown()
+		self.mock_server_thread.join()
+		self.wg = None
+
+	def test_waf_step_through(self):
+		def step_through(url, **kwargs):
+			with self.wg.tracer.span("chromium_step_through"):
+				return False
+		self.wg.stepThroughJsWaf_bare_chromium = step_through
+
+		with self.assertRaises(WebRequest.FetchFailureError):
+			run(self.wg.getpage("http://127.0.0.1:{}/cloudflare_under_attack_shit".format(self.mock_server_port)))
+
+		root, = self.tracer.roots()
+		self.assertEqual(root.name, "getpage")
+		step, = self.tracer.find("waf_step_through")
+		self.assertIs(step.parent, root)
+		self.assertEqual(step.attributes['stepped'], False)
+		# The step-through is run in the executor, but is still part of the tree.
+		chromium, = self.tracer.find("chromium_step_through")
+		self.assertIs(chromium.parent, step)
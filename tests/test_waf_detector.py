@@ -0,0 +1,78 @@
+import unittest
+import re
+import os.path
+
+import WebRequest
+from WebRequest.WafDetector import WafDetector, DEFAULT_SIGNATURES
+from . import testing_server
+
+
+def load_garbage(fname):
+	with open(os.path.join(os.path.dirname(__file__), "waf_garbage", fname), "rb") as fp:
+		return fp.read()
+
+
+class TestWafDetector(unittest.TestCase):
+	def setUp(self):
+		self.detector = WafDetector()
+
+	def test_known_pages(self):
+		with self.assertRaises(WebRequest.CloudFlareWrapper):
+			self.detector.check(load_garbage("cf_js_challenge_03_12_2018.html"), "http://www.example.org/", "text/html")
+		with self.assertRaises(WebRequest.SucuriWrapper):
+			self.detector.check(load_garbage("sucuri_garbage.html"), "http://www.example.org/")
+
+		self.detector.check(b"<html><body>Nothing to see here</body></html>", "http://www.example.org/", "text/html")
+		self.assertEqual(self.detector.stats(), {
+				'checks'  : 3,
+				'skipped' : 0,
+				'matches' : {'cloudflare-js-challenge' : 1, 'sucuri' : 1},
+			})
+
+	def test_skip_non_html(self):
+		page = load_garbage("sucuri_garbage.html")
+		self.assertEqual(self.detector.match(page, "application/octet-stream"), None)
+		self.assertEqual(self.detector.match(page, "image/jpeg"), None)
+		self.assertEqual(self.detector.match(page, "application/xhtml+xml").name, "sucuri")
+		self.assertEqual(self.detector.stats()['skipped'], 2)
+
+	def test_window(self):
+		page = b"<html><body>" + b"x" * 1000 + b"sucuri_cloudproxy_js=" + b"</body></html>"
+		self.assertEqual(WafDetector(window=1000).match(page), None)
+		self.assertEqual(WafDetector(window=2000).match(page).name, "sucuri")
+
+	def test_custom_signatures(self):
+		self.detector.add_signature("some-vendor", re.compile(rb"<title>Checking your browser \(\d+\)</title>"))
+		with self.assertRaises(WebRequest.GarbageSiteWrapper) as ctx:
+			self.detector.check(b"<html><head><title>Checking your browser (5)</title>", "http://www.example.org/")
+		self.assertEqual(ctx.exception.url, "http://www.example.org/")
+
+		# Replacing, and removing
+		self.detector.add_signature("sucuri", b"something else entirely", WebRequest.SucuriWrapper)
+		self.assertEqual(self.detector.match(load_garbage("sucuri_garbage.html")), None)
+		self.detector.remove_signature("some-vendor")
+		self.assertEqual([sig.name for sig in self.detector.signatures], [sig.name for sig in DEFAULT_SIGNATURES[1:]] + ["sucuri"])
+
+
+class TestWafDetectorFetch(unittest.TestCase):
+	def setUp(self):
+		self.wg = WebRequest.WebGetRobust()
+		self.mock_server_port, self.mock_server, self.mock_server_thread = testing_server.start_server(self, self.wg)
+
+	def tearDown(self):
+		self.mock_server.shutdown()
+		self.mock_server_thread.join()
+		self.wg = None
+
+	def test_custom_signature(self):
+		url = "http://localhost:{}/".format(self.mock_server_port)
+		self.assertEqual(self.wg.getpage(url), "Root OK?")
+
+		self.wg.waf_detector.add_signature("root", b"Root OK?")
+		with self.assertRaises(WebRequest.GarbageSiteWrapper):
+			self.wg.getpage(url)
+		self.assertEqual(self.wg.getWafStats()['matches'], {'root' : 1})
+
+	def test_binary_skipped(self):
+		self.wg.getpage("http://localhost:{}/large-file".format(self.mock_server_port))
+		self.assertEqual(self.wg.getWafStats()['skipped'], 1)
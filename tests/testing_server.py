@@ -9,14 +9,34 @@ import zlib
 import gzip
 import time
 import datetime
+import functools
 from http import cookies
+
+try:
+	import brotli
+except ImportError:
+	brotli = None
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
 from http.server import BaseHTTPRequestHandler
 from http.server import HTTPServer
+from http.server import ThreadingHTTPServer
 from threading import Thread
 
 import WebRequest
 
 
+# Compressible, but not trivially so.
+# A raw deflate stream (a stored block, then an empty final block) whose first
+# two bytes happen to also be a valid zlib header.
+AMBIGUOUS_DEFLATE = bytes([0x08, 29, 0x00, 0xe2, 0xff]) + b"Ambiguous deflate stream OK?!" + bytes([0x01, 0x00, 0x00, 0xff, 0xff])
+
+LARGE_CONTENT = b"".join(b"Line %08d of the large content!\n" % idx for idx in range(2 ** 16))
+
+
 def capture_expected_headers(expected_headers, test_context, is_chromium=False, is_selenium_garbage_chromium=False, is_annoying_pjs=False, skip_header_checks=False):
 
 	# print("Capturing expected headers:")
@@ -36,6 +56,12 @@ def capture_expected_headers(expected_headers, test_context, is_chromium=False,
 	sucuri_reqs_2 = 0
 	sucuri_reqs_3 = 0
 
+	retry_after_reqs = 0
+	flaky_reqs = 0
+	slow_reqs = 0
+	cache_reqs = {}
+	large_file_reqs = 0
+
 	class MockServerRequestHandler(BaseHTTPRequestHandler):
 
 
@@ -133,13 +159,140 @@ def capture_expected_headers(expected_headers, test_context, is_chromium=False,
 				t1 = cobj.compress(inb) + cobj.flush()
 				self.wfile.write(t1)
 
-			elif self.path == "/compressed/gzip":
+			elif self.path == "/compressed/deflate-ambiguous":
 				self.send_response(200)
-				self.send_header('Content-Encoding', 'gzip')
+				self.send_header('Content-Encoding', 'deflate')
+				self.send_header('Content-type', "text/html")
+				self.end_headers()
+				self.wfile.write(AMBIGUOUS_DEFLATE)
+
+			elif self.path == "/compressed/unknown-coding":
+				# Not a content coding at all, so it's treated as uncompressed.
+				self.send_response(200)
+				self.send_header('Content-Encoding', 'UTF-8')
+				self.send_header('Content-type', "text/html")
+				self.end_headers()
+				self.wfile.write(b"Root OK?")
+
+			elif self.path in ("/compressed/gzip", "/compressed/x-gzip"):
+				self.send_response(200)
+				self.send_header('Content-Encoding', self.path.split("/")[-1])
 				self.send_header('Content-type', "text/html")
 				self.end_headers()
 				self.wfile.write(gzip.compress(b"Root OK?"))
 
+			elif self.path in ("/compressed/br", "/compressed/zstd", "/compressed/large-br", "/compressed/large-zstd"):
+				codec = self.path.split("-")[-1].split("/")[-1]
+				body = LARGE_CONTENT if "large" in self.path else b"Root OK?"
+				self.send_response(200)
+				self.send_header('Content-Encoding', codec)
+				self.send_header('Content-type', "application/octet-stream" if "large" in self.path else "text/html")
+				self.end_headers()
+				self.wfile.write(compress_body(codec, body))
+
+			elif self.path in ("/compressed/br/404", "/compressed/zstd/404"):
+				codec = self.path.split("/")[2]
+				self.send_response(404)
+				self.send_header('Content-Encoding', codec)
+				self.send_header('Content-type', "text/html")
+				self.end_headers()
+				self.wfile.write(compress_body(codec, b"Not here!"))
+
+			elif self.path == "/compressed/large-gzip":
+				self.send_response(200)
+				self.send_header('Content-Encoding', 'gzip')
+				self.send_header('Content-type', "application/octet-stream")
+				self.end_headers()
+				self.wfile.write(compress_body('gzip', LARGE_CONTENT))
+
+			elif self.path == "/compressed/large-deflate":
+				# Zlib-wrapped, rather then the raw deflate stream above.
+				self.send_response(200)
+				self.send_header('Content-Encoding', 'deflate')
+				self.send_header('Content-type', "application/octet-stream")
+				self.end_headers()
+				self.wfile.write(compress_body('deflate', LARGE_CONTENT))
+
+			elif self.path == "/compressed/bomb":
+				# Tiny on the wire, but 16 MB once inflated.
+				self.send_response(200)
+				self.send_header('Content-Encoding', 'gzip')
+				self.send_header('Content-type', "text/html")
+				self.end_headers()
+				self.wfile.write(compress_body('gzip', b"\x00" * 2 ** 24))
+
+			elif self.path in ("/large-file", "/large-file/flaky", "/large-file/dispo"):
+				# Supports resuming with `Range`/`If-Range`. The first request
+				# to the flaky path gets cut off half way through.
+				nonlocal large_file_reqs
+				large_file_reqs += 1
+
+				etag = '"large-content-1"'
+				start = 0
+				rng = self.headers.get('Range')
+				if rng and self.headers.get('If-Range') == etag:
+					start = int(rng.split("=")[1].split("-")[0])
+
+				if start >= len(LARGE_CONTENT):
+					self.send_response(416)
+					self.send_header('Content-Range', "bytes */%s" % len(LARGE_CONTENT))
+					self.end_headers()
+					return
+
+				body = LARGE_CONTENT[start:]
+				self.send_response(206 if start else 200)
+				self.send_header('Content-type', "application/octet-stream")
+				self.send_header('ETag', etag)
+				self.send_header('Content-Length', str(len(body)))
+				if start:
+					self.send_header('Content-Range', "bytes %s-%s/%s" % (start, len(LARGE_CONTENT) - 1, len(LARGE_CONTENT)))
+				if self.path == "/large-file/dispo":
+					self.send_header('Content-Disposition', 'attachment; filename="large file.txt"')
+				self.end_headers()
+
+				if self.path == "/large-file/flaky" and large_file_reqs == 1:
+					body = body[:len(body) // 2]
+				self.wfile.write(body)
+
+			elif self.path.startswith("/cache/"):
+				# Cacheable responses. Counts the requests that actually get here.
+				nonlocal cache_reqs
+				cache_reqs[self.path] = cache_reqs.get(self.path, 0) + 1
+				etag = '"cache-etag-1"'
+
+				if self.path == "/cache/etag" and self.headers.get('If-None-Match') == etag:
+					self.send_response(304)
+					self.send_header('ETag', etag)
+					self.end_headers()
+					return
+
+				self.send_response(200)
+				self.send_header('Content-type', "text/html")
+				if self.path == "/cache/max-age":
+					self.send_header('Cache-Control', "max-age=3600")
+				elif self.path == "/cache/etag":
+					self.send_header('Cache-Control', "no-cache")
+					self.send_header('ETag', etag)
+				elif self.path == "/cache/no-store":
+					self.send_header('Cache-Control', "no-store, max-age=3600")
+				elif self.path == "/cache/gzip":
+					self.send_header('Cache-Control', "max-age=3600")
+					self.send_header('Content-Encoding', 'gzip')
+				elif self.path == "/cache/chunked":
+					self.send_header('Cache-Control', "max-age=3600")
+					self.send_header('Transfer-Encoding', "chunked")
+				self.end_headers()
+
+				body = ("Cached %s, request %s" % (self.path, cache_reqs[self.path])).encode("utf-8")
+				if self.path == "/cache/gzip":
+					body = gzip.compress(body)
+				if self.path == "/cache/chunked":
+					for chunk in (body[:10], body[10:]):
+						self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+					self.wfile.write(b"0\r\n\r\n")
+				else:
+					self.wfile.write(body)
+
 			elif self.path == "/json/invalid":
 				self.send_response(200)
 				self.send_header('Content-type', "text/html")
@@ -297,6 +450,83 @@ def capture_expected_headers(expected_headers, test_context, is_chromium=False,
 				self.end_headers()
 				self.wfile.write(b"Binary!\x00\x01\x02\x03")
 
+			elif self.path == "/slow/first-request":
+				# The first request stalls before sending anything.
+				nonlocal slow_reqs
+				slow_reqs += 1
+				this_req = slow_reqs
+				if this_req == 1:
+					time.sleep(1.5)
+				self.send_response(200)
+				self.send_header('Content-type', "text/html")
+				self.end_headers()
+				self.wfile.write(("Slow OK? %s" % this_req).encode("utf-8"))
+
+			elif self.path == "/slow/headers":
+				# Stalls before sending anything, every time.
+				time.sleep(2)
+				self.send_response(200)
+				self.send_header('Content-type', "text/html")
+				self.end_headers()
+				self.wfile.write(b"Slow headers OK?")
+
+			elif self.path == "/slow/drip":
+				# Sends the body a byte at a time, well inside any sane read timeout.
+				body = b"Drip OK?" * 5
+				self.send_response(200)
+				self.send_header('Content-type', "text/html")
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				try:
+					for idx in range(len(body)):
+						self.wfile.write(body[idx:idx+1])
+						self.wfile.flush()
+						time.sleep(0.1)
+				except (BrokenPipeError, ConnectionResetError):
+					pass
+
+			elif self.path == "/slow/redirect":
+				self.send_response(302)
+				self.send_header('location', "/slow/headers")
+				self.end_headers()
+
+			elif self.path == "/dead/500":
+				self.send_response(500)
+				self.send_header('Content-type', "text/html")
+				self.end_headers()
+				self.wfile.write(b"Dead!")
+
+			elif self.path == "/flaky/500":
+				# Server error on the first request, OK afterwards.
+				nonlocal flaky_reqs
+				flaky_reqs += 1
+				if flaky_reqs == 1:
+					self.send_response(500)
+					self.send_header('Content-type', "text/html")
+					self.end_headers()
+					self.wfile.write(b"Oops!")
+				else:
+					self.send_response(200)
+					self.send_header('Content-type', "text/html")
+					self.end_headers()
+					self.wfile.write(b"Flaky OK?")
+
+			elif self.path == "/rate-limit/retry-after":
+				# Rate limited on the first request, OK afterwards.
+				nonlocal retry_after_reqs
+				retry_after_reqs += 1
+				if retry_after_reqs == 1:
+					self.send_response(429)
+					self.send_header('Retry-After', "1")
+					self.send_header('Content-type', "text/html")
+					self.end_headers()
+					self.wfile.write(b"Slow down!")
+				else:
+					self.send_response(200)
+					self.send_header('Content-type', "text/html")
+					self.end_headers()
+					self.wfile.write(b"Rate limit OK?")
+
 			elif self.path == "/binary_ctnt":
 				self.send_response(200)
 				self.send_header('Content-type', "image/jpeg")
@@ -562,13 +792,27 @@ def get_free_port():
 	return port
 
 
+@functools.lru_cache(maxsize=32)
+def compress_body(codec, data):
+	if codec == "br":
+		return brotli.compress(data)
+	if codec == "zstd":
+		return zstandard.ZstdCompressor().compress(data)
+	if codec == "gzip":
+		return gzip.compress(data)
+	if codec == "deflate":
+		return zlib.compress(data)
+	return data
+
+
 def start_server(assertion_class,
 			from_wg,
 			port_override                = None,
 			is_chromium                  = None,
 			is_selenium_garbage_chromium = False,
 			is_annoying_pjs              = False,
-			skip_header_checks           = False
+			skip_header_checks           = False,
+			threaded                     = False
 		):
 
 	# Configure mock server.
@@ -594,7 +838,8 @@ def start_server(assertion_class,
 
 	for x in range(retries + 1):
 		try:
-			mock_server = HTTPServer(('0.0.0.0', mock_server_port), captured_server)
+			server_class = ThreadingHTTPServer if threaded else HTTPServer
+			mock_server = server_class(('0.0.0.0', mock_server_port), captured_server)
 			break
 		except OSError:
 			time.sleep(0.2)